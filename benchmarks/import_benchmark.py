@@ -0,0 +1,203 @@
+"""Import time and memory regression check of pumpwood_miscellaneous.
+
+Each case imports a module (and optionally runs a statement) in a fresh
+interpreter, measuring the wall time, the cumulative import time reported
+by `-X importtime` and the RSS of the process. Cases also list modules
+that must not be loaded, ex.: importing `pumpwood_miscellaneous.storage`
+must not import the SDK of any cloud provider. Results are written as
+JSON and compared with `--baseline` like the storage benchmark.
+
+Example:
+    PYTHONPATH=src python benchmarks/import_benchmark.py
+    PYTHONPATH=src python benchmarks/import_benchmark.py \\
+        --baseline imports.json --threshold 0.3
+"""
+import os
+import sys
+import json
+import platform
+import argparse
+import datetime
+import statistics
+import subprocess
+
+
+HEAVY_MODULES = (
+    'boto3', 'botocore', 'google.cloud.storage', 'google.resumable_media',
+    'azure.storage.blob', 'pandas', 'numpy', 'pyarrow')
+"""Modules that are loaded only by the code paths that need them."""
+IMPORT_CASES = [
+    {
+        'name': 'storage',
+        'statement': 'import pumpwood_miscellaneous.storage',
+        'forbidden': HEAVY_MODULES},
+    {
+        'name': 'storage_connectors',
+        'statement': 'import pumpwood_miscellaneous.storage_connectors',
+        'forbidden': HEAVY_MODULES},
+    {
+        'name': 'storage_local',
+        'statement': (
+            'import tempfile\n'
+            'from pumpwood_miscellaneous.storage import PumpWoodStorage\n'
+            'PumpWoodStorage(storage_type="local", '
+            'folder_path=tempfile.gettempdir())'),
+        'forbidden': HEAVY_MODULES},
+    {
+        'name': 'storage_aws_s3',
+        'statement': (
+            'from pumpwood_miscellaneous.storage import PumpWoodStorage\n'
+            'PumpWoodStorage(storage_type="aws_s3", bucket_name="bucket")'),
+        'forbidden': (
+            'google.cloud.storage', 'azure.storage.blob', 'pandas')},
+    {
+        'name': 'query',
+        'statement': 'import pumpwood_miscellaneous.query',
+        'forbidden': ('pandas', 'numpy')},
+]
+"""Import cases, statement is run at a fresh interpreter."""
+
+_CASE_SCRIPT = """
+import os, sys, json, time
+start = time.perf_counter()
+exec({statement!r})
+seconds = time.perf_counter() - start
+rss = None
+try:
+    with open('/proc/self/statm') as file:
+        rss = int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+except OSError:
+    pass
+print(json.dumps({{
+    'seconds': seconds, 'rss_bytes': rss,
+    'loaded': [x for x in {forbidden!r} if x in sys.modules]}}))
+"""
+
+
+def _import_time(stderr: str) -> float:
+    """Return cumulative seconds of top level imports of -X importtime."""
+    total = 0
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line.split('|')
+        # Top level modules are not indented
+        if len(parts) == 3 and not parts[2].startswith('  '):
+            try:
+                total += int(parts[1])
+            except ValueError:
+                pass
+    return total / 1e6
+
+
+def run_case(case: dict, repeat: int) -> dict:
+    """Run import case `repeat` times at fresh interpreters.
+
+    Returns:
+        Dictionary with median seconds, import seconds and RSS, the
+        forbidden modules that were loaded and the error if the
+        statement failed.
+    """
+    script = _CASE_SCRIPT.format(
+        statement=case['statement'], forbidden=tuple(case['forbidden']))
+    runs = []
+    for _ in range(repeat):
+        process = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', script],
+            capture_output=True, text=True, env=os.environ.copy())
+        if process.returncode != 0:
+            return {
+                'name': case['name'], 'statement': case['statement'],
+                'error': process.stderr.strip().splitlines()[-1]}
+        result = json.loads(process.stdout.strip().splitlines()[-1])
+        result['import_seconds'] = _import_time(process.stderr)
+        runs.append(result)
+
+    rss = [x['rss_bytes'] for x in runs if x['rss_bytes'] is not None]
+    return {
+        'name': case['name'], 'statement': case['statement'],
+        'seconds': statistics.median(x['seconds'] for x in runs),
+        'import_seconds': statistics.median(
+            x['import_seconds'] for x in runs),
+        'rss_bytes': statistics.median(rss) if rss else None,
+        'forbidden_loaded': runs[0]['loaded']}
+
+
+def compare_results(results: dict, baseline: dict,
+                    threshold: float) -> list:
+    """Return cases slower or larger than baseline by threshold."""
+    baseline_cases = {x['name']: x for x in baseline['results']}
+    regressions = []
+    for case in results['results']:
+        old_case = baseline_cases.get(case['name'])
+        if old_case is None or 'error' in case or 'error' in old_case:
+            continue
+        for metric in ('seconds', 'rss_bytes'):
+            old_value, new_value = old_case[metric], case[metric]
+            if old_value and new_value is not None and \
+                    new_value > old_value * (1 + threshold):
+                regressions.append({
+                    'name': case['name'], 'metric': metric,
+                    'baseline': old_value, 'value': new_value,
+                    'change': new_value / old_value - 1})
+    return regressions
+
+
+def main(argv: list = None) -> int:
+    """Run import cases and write JSON results.
+
+    Returns:
+        Exit code, 1 if a forbidden module was loaded or regressions were
+        found at baseline comparison.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '--cases', nargs='+', choices=[x['name'] for x in IMPORT_CASES],
+        default=[x['name'] for x in IMPORT_CASES])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='JSON output file, default stdout')
+    parser.add_argument(
+        '--baseline', help='JSON results of a previous run to compare')
+    parser.add_argument('--threshold', type=float, default=0.3)
+    args = parser.parse_args(argv)
+
+    results = {
+        'created_at': datetime.datetime.now(
+            datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': []}
+    exit_code = 0
+    for case in IMPORT_CASES:
+        if case['name'] not in args.cases:
+            continue
+        result = run_case(case, repeat=args.repeat)
+        results['results'].append(result)
+        if 'error' in result:
+            print('{name}: error {error}'.format(**result), file=sys.stderr)
+            continue
+        print('{name}: {seconds:.3f}s imports {import_seconds:.3f}s '
+              'forbidden loaded {forbidden_loaded}'.format(**result),
+              file=sys.stderr)
+        if result['forbidden_loaded']:
+            exit_code = 1
+
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        results['regressions'] = compare_results(
+            results, baseline, threshold=args.threshold)
+        if results['regressions']:
+            exit_code = 1
+
+    output = json.dumps(results, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, 'w') as file:
+            file.write(output)
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
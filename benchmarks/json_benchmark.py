@@ -0,0 +1,180 @@
+"""Benchmark of the JSON codecs of SQLAlchemyPostGres.
+
+Serializes and parses representative rows of JSON/JSONB columns (nested
+dictionaries with NaN, numpy arrays, datetimes, pandas timestamps and
+geometries) with simplejson `PumpWoodJSONEncoder`, `pumpJsonDump` and the
+codecs of `pumpwood_miscellaneous.json_codec`, reporting rows per second
+as JSON. The output of `json_serializer` is checked to parse to the same
+value as `pumpJsonDump`.
+
+Example:
+    PYTHONPATH=src python benchmarks/json_benchmark.py --rows 20000
+    PYTHONPATH=src python benchmarks/json_benchmark.py \\
+        --baseline json.json --threshold 0.2
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import datetime
+import platform
+import statistics
+import simplejson
+import numpy as np
+import pandas as pd
+from shapely.geometry import Point, Polygon
+from pumpwood_communication.serializers import (
+    pumpJsonDump, PumpWoodJSONEncoder)
+from pumpwood_miscellaneous.json_codec import (
+    json_serializer, json_deserializer)
+
+
+def make_rows(n_rows: int, seed: int = 0) -> list:
+    """Create JSON column values similar to Pumpwood model payloads."""
+    rng = random.Random(seed)
+    start = datetime.datetime(2024, 1, 1)
+    rows = []
+    for i in range(n_rows):
+        lat, lon = rng.uniform(-30, 0), rng.uniform(-60, -30)
+        rows.append({
+            'id': i,
+            'description': 'row {} description with ação'.format(i),
+            'created_at': start + datetime.timedelta(minutes=i),
+            'reference_date': pd.Timestamp(start.date()),
+            'value': float('nan') if i % 10 == 0 else rng.random(),
+            'tags': ['tag_{}'.format(rng.randint(0, 50)) for _ in range(5)],
+            'series': np.array([rng.random() for _ in range(24)]),
+            'counts': np.arange(12, dtype=np.int64),
+            'location': Point(lon, lat),
+            'area': Polygon([
+                (lon, lat), (lon + 1, lat), (lon + 1, lat + 1),
+                (lon, lat)]),
+            'extra_info': {
+                'source': 'benchmark', 'version': rng.randint(1, 9),
+                'nested': {'a': [1, 2, 3], 'b': None,
+                           'c': np.float64(rng.random())}},
+        })
+    return rows
+
+
+def _simplejson_dumps(obj) -> str:
+    return simplejson.dumps(obj, cls=PumpWoodJSONEncoder, ignore_nan=True)
+
+
+SERIALIZERS = {
+    'simplejson_encoder': _simplejson_dumps,
+    'pumpJsonDump': pumpJsonDump,
+    'json_serializer': json_serializer,
+}
+"""Serializers compared by the benchmark."""
+DESERIALIZERS = {
+    'json.loads': json.loads,
+    'json_deserializer': json_deserializer,
+}
+"""Deserializers compared by the benchmark."""
+
+
+def _measure(function, values: list, repeat: int) -> float:
+    """Return median seconds of applying function to all values."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for value in values:
+            function(value)
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+def check_semantics(rows: list) -> list:
+    """Return indexes of rows where json_serializer differs pumpJsonDump."""
+    return [
+        i for i, row in enumerate(rows)
+        if json.loads(json_serializer(row)) != json.loads(pumpJsonDump(row))]
+
+
+def run(n_rows: int, repeat: int) -> list:
+    """Run serializers and deserializers over n_rows rows."""
+    rows = make_rows(n_rows)
+    serialized = [json_serializer(x) for x in rows]
+    results = []
+    for name, function in SERIALIZERS.items():
+        seconds = _measure(function, rows, repeat)
+        results.append({
+            'name': name, 'operation': 'serialize', 'seconds': seconds,
+            'rows_per_second': n_rows / seconds})
+    for name, function in DESERIALIZERS.items():
+        seconds = _measure(function, serialized, repeat)
+        results.append({
+            'name': name, 'operation': 'deserialize', 'seconds': seconds,
+            'rows_per_second': n_rows / seconds})
+    return results
+
+
+def compare_results(results: dict, baseline: dict,
+                    threshold: float) -> list:
+    """Return cases slower than baseline by more than threshold."""
+    baseline_cases = {
+        (x['name'], x['operation']): x for x in baseline['results']}
+    regressions = []
+    for case in results['results']:
+        old_case = baseline_cases.get((case['name'], case['operation']))
+        if old_case is None:
+            continue
+        change = case['rows_per_second'] / old_case['rows_per_second'] - 1
+        if change < -threshold:
+            regressions.append({
+                'name': case['name'], 'operation': case['operation'],
+                'baseline': old_case['rows_per_second'],
+                'value': case['rows_per_second'], 'change': change})
+    return regressions
+
+
+def main(argv: list = None) -> int:
+    """Run benchmark and write JSON results.
+
+    Returns:
+        Exit code, 1 if outputs differ from pumpJsonDump or regressions
+        were found at baseline comparison.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='JSON output file, default stdout')
+    parser.add_argument(
+        '--baseline', help='JSON results of a previous run to compare')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    results = {
+        'created_at': datetime.datetime.now(
+            datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'rows': args.rows,
+        'semantic_differences': check_semantics(make_rows(1000)),
+        'results': run(n_rows=args.rows, repeat=args.repeat)}
+    for case in results['results']:
+        print('{operation} {name}: {rows_per_second:.0f} rows/s'.format(
+            **case), file=sys.stderr)
+    exit_code = 1 if results['semantic_differences'] else 0
+
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        results['regressions'] = compare_results(
+            results, baseline, threshold=args.threshold)
+        if results['regressions']:
+            exit_code = 1
+
+    output = json.dumps(results, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, 'w') as file:
+            file.write(output)
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
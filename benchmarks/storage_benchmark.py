@@ -0,0 +1,520 @@
+"""Throughput benchmark of PumpWoodStorage backends.
+
+Measures write_file, write_file_stream (by chunk size), read_file,
+get_read_file_iterator, list_files and append (`if_exists='append'`)
+reporting MB/s, provider requests by operation and peak RSS of each case.
+Results are written as JSON to be compared between releases with
+`--baseline`.
+
+Backends:
+- local: Temporary folder.
+- memory: In-memory bucket, `--latency-profile` adds the latency and
+  bandwidth presets of the cloud providers.
+- aws_s3: In-process moto (`moto` package) or a moto-server/MinIO set by
+  `AWS_ENDPOINT_URL`.
+- google_bucket: fake-gcs-server set by `STORAGE_EMULATOR_HOST`.
+- azure_storage: Azurite set by `AZURE_STORAGE_CONNECTION_STRING`.
+
+Example:
+    PYTHONPATH=src python benchmarks/storage_benchmark.py \\
+        --backends local memory aws_s3 --output results.json
+    PYTHONPATH=src python benchmarks/storage_benchmark.py \\
+        --quick --baseline results.json
+"""
+import io
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import argparse
+import platform
+import datetime
+import tempfile
+import threading
+import contextlib
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from pumpwood_miscellaneous.storage import PumpWoodStorage
+from pumpwood_miscellaneous.metrics import Instrumentation
+from pumpwood_miscellaneous.storage_connectors.memory import (
+    StorageLatencyProfile)
+
+
+BACKENDS = (
+    'local', 'memory', 'aws_s3', 'google_bucket', 'azure_storage')
+"""Backends that can be benchmarked."""
+BENCHMARKS = (
+    'write_file', 'write_file_stream', 'read_file', 'get_read_file_iterator',
+    'list_files', 'append')
+"""Benchmark cases."""
+MB = 1024 * 1024
+RESULT_FORMAT_VERSION = 1
+"""Version of the JSON output format."""
+
+
+class PeakRSSSampler():
+    """Sample the resident memory of the process to get its peak.
+
+    Uses /proc/self/statm on Linux, other systems report the peak of the
+    process (`ru_maxrss`) that is not reset between cases.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._page_size = os.sysconf('SC_PAGE_SIZE') \
+            if hasattr(os, 'sysconf') else 4096
+
+    def current(self) -> int:
+        """Return current resident memory in bytes."""
+        try:
+            with open('/proc/self/statm') as file:
+                return int(file.read().split()[1]) * self._page_size
+        except (OSError, ValueError, IndexError):
+            import resource
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # ru_maxrss is in bytes on macOS and KB on Linux
+            return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.current())
+
+    def __enter__(self):
+        self.peak = self.current()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+
+
+@contextlib.contextmanager
+def backend_storage(backend: str, latency_profile: str = None):
+    """Create an instrumented storage of the backend.
+
+    Yields:
+        Tuple (storage, instrumentation, skip_reason), storage is None if
+        the backend is not available.
+    """
+    instrumentation = Instrumentation(prometheus=False, opentelemetry=False)
+    bucket_name = 'pumpwood-benchmark-{}'.format(uuid.uuid4().hex[:8])
+    if backend == 'local':
+        folder_path = tempfile.mkdtemp(prefix='pumpwood-benchmark-')
+        try:
+            yield PumpWoodStorage(
+                storage_type='local', folder_path=folder_path,
+                instrumentation=instrumentation), instrumentation, None
+        finally:
+            shutil.rmtree(folder_path, ignore_errors=True)
+
+    elif backend == 'memory':
+        profile = None
+        if latency_profile is not None:
+            profile = StorageLatencyProfile.from_preset(latency_profile)
+        yield PumpWoodStorage(
+            storage_type='memory', bucket_name=bucket_name, profile=profile,
+            instrumentation=instrumentation), instrumentation, None
+
+    elif backend == 'aws_s3':
+        import boto3
+        mock = contextlib.nullcontext()
+        if not os.environ.get('AWS_ENDPOINT_URL'):
+            try:
+                from moto import mock_aws
+            except ImportError:
+                yield None, None, 'moto is not installed and ' \
+                    'AWS_ENDPOINT_URL is not set'
+                return
+            os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+            os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+            os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+            mock = mock_aws()
+        with mock:
+            boto3.client('s3').create_bucket(Bucket=bucket_name)
+            yield PumpWoodStorage(
+                storage_type='aws_s3', bucket_name=bucket_name,
+                instrumentation=instrumentation), instrumentation, None
+
+    elif backend == 'google_bucket':
+        if not os.environ.get('STORAGE_EMULATOR_HOST'):
+            yield None, None, 'STORAGE_EMULATOR_HOST is not set'
+            return
+        from google.cloud import storage
+        from google.auth.credentials import AnonymousCredentials
+        storage.Client(
+            credentials=AnonymousCredentials(), project='benchmark')\
+            .create_bucket(bucket_name)
+        yield PumpWoodStorage(
+            storage_type='google_bucket', bucket_name=bucket_name,
+            instrumentation=instrumentation), instrumentation, None
+
+    elif backend == 'azure_storage':
+        connection_string = os.environ.get('AZURE_STORAGE_CONNECTION_STRING')
+        if not connection_string:
+            yield None, None, 'AZURE_STORAGE_CONNECTION_STRING is not set'
+            return
+        from azure.storage.blob import BlobServiceClient
+        BlobServiceClient.from_connection_string(connection_string)\
+            .create_container(bucket_name)
+        yield PumpWoodStorage(
+            storage_type='azure_storage', bucket_name=bucket_name,
+            instrumentation=instrumentation), instrumentation, None
+
+    else:
+        yield None, None, 'backend {} not implemented'.format(backend)
+
+
+class StorageBenchmark():
+    """Run the benchmark cases on a storage."""
+
+    def __init__(self, storage: PumpWoodStorage,
+                 instrumentation: Instrumentation, backend: str,
+                 parameters: dict):
+        self.storage = storage
+        self.backend = backend
+        self.parameters = parameters
+        self._requests = instrumentation.counter(
+            'storage_requests_total', 'Requests to the storage provider',
+            labelnames=('backend', 'api_call'))
+        self._data = os.urandom(parameters['file_size'])
+        # Local storage does not send requests
+        self.count_requests = hasattr(
+            storage._connector, 'add_request_hook')
+
+    def _request_counts(self) -> dict:
+        return {
+            key[1]: value['sum']
+            for key, value in self._requests.values().items()}
+
+    def _write(self, file_path: str, data: bytes, if_exists='overwrite'):
+        folder, file_name = file_path.rsplit('/', 1)
+        self.storage.write_file(
+            file_path=folder, file_name=file_name, data=data,
+            if_exists=if_exists, content_type='application/octet-stream',
+            safe_filename=False)
+
+    def measure(self, name: str, function, case_parameters: dict = None,
+                setup=None) -> dict:
+        """Run function `repeat` times and return the result of the case.
+
+        Args:
+            name (str):
+                Benchmark name.
+            function:
+                Function returning a tuple (operations, bytes).
+            case_parameters (dict):
+                Parameters of the case added to the result.
+            setup:
+                Function called before each run, it is not timed.
+        """
+        durations = []
+        requests = {}
+        with PeakRSSSampler() as sampler:
+            for _ in range(self.parameters['repeat']):
+                if setup is not None:
+                    setup()
+                requests_before = self._request_counts()
+                start = time.perf_counter()
+                operations, n_bytes = function()
+                durations.append(time.perf_counter() - start)
+                for key, value in self._request_counts().items():
+                    requests[key] = requests.get(key, 0) + \
+                        value - requests_before.get(key, 0)
+
+        total_operations = operations * len(durations)
+        requests = {key: value for key, value in requests.items() if value}
+        seconds = statistics.median(durations)
+        requests_per_operation = None
+        if self.count_requests:
+            requests_per_operation = \
+                sum(requests.values()) / total_operations
+        return {
+            'backend': self.backend, 'benchmark': name,
+            'parameters': case_parameters or {},
+            'operations': operations, 'bytes': n_bytes,
+            'seconds': seconds,
+            'mb_per_s': n_bytes / MB / seconds if seconds else None,
+            'operations_per_s': operations / seconds if seconds else None,
+            'requests_per_operation': requests_per_operation,
+            'requests': {
+                key: value / total_operations
+                for key, value in sorted(requests.items())},
+            'peak_rss_bytes': sampler.peak}
+
+    def bench_write_file(self) -> list:
+        """Write `operations` files of `file_size` bytes."""
+        operations = self.parameters['operations']
+
+        def run():
+            for i in range(operations):
+                self._write('write_file/{}.bin'.format(i), self._data)
+            return operations, operations * len(self._data)
+        return [self.measure(
+            'write_file', run, {'file_size': len(self._data)})]
+
+    def bench_write_file_stream(self) -> list:
+        """Stream `stream_size` bytes for each chunk size."""
+        stream_size = self.parameters['stream_size']
+        results = []
+        for chunk_size in self.parameters['chunk_sizes']:
+            def run(chunk_size=chunk_size):
+                stream = _RepeatStream(self._data, stream_size)
+                self.storage.write_file_stream(
+                    file_path='write_file_stream', file_name='stream.bin',
+                    data_stream=stream, chunk_size=chunk_size,
+                    safe_filename=False)
+                return 1, stream_size
+            results.append(self.measure(
+                'write_file_stream', run, {
+                    'stream_size': stream_size, 'chunk_size': chunk_size}))
+        return results
+
+    def _prepare_read(self):
+        self.storage.write_file_stream(
+            file_path='read', file_name='data.bin',
+            data_stream=_RepeatStream(
+                self._data, self.parameters['stream_size']),
+            chunk_size=8 * MB, safe_filename=False)
+        return 'read/data.bin'
+
+    def bench_read_file(self) -> list:
+        """Read a file of `stream_size` bytes."""
+        file_path = self._prepare_read()
+
+        def run():
+            data = self.storage.read_file(file_path)['data']
+            return 1, len(data)
+        return [self.measure(
+            'read_file', run,
+            {'file_size': self.parameters['stream_size']})]
+
+    def bench_get_read_file_iterator(self) -> list:
+        """Iterate over a file of `stream_size` bytes."""
+        file_path = self._prepare_read()
+
+        def run():
+            n_bytes = 0
+            for chunk in self.storage.get_read_file_iterator(file_path):
+                n_bytes += len(chunk)
+            return 1, n_bytes
+        return [self.measure(
+            'get_read_file_iterator', run,
+            {'file_size': self.parameters['stream_size']})]
+
+    def bench_list_files(self) -> list:
+        """List a prefix with `list_keys` files."""
+        list_keys = self.parameters['list_keys']
+        with ThreadPoolExecutor(max_workers=32) as executor:
+            list(executor.map(
+                lambda i: self._write(
+                    'list_files/{:07d}.bin'.format(i), b'0'),
+                range(list_keys)))
+
+        def run():
+            files = self.storage.list_files(
+                'list_files/', update_file_path=False)
+            return 1, len(files)
+        result = self.measure('list_files', run, {'keys': list_keys})
+        # Listed keys are reported instead of bytes
+        result['keys_per_s'] = result.pop('mb_per_s') * MB \
+            if result['mb_per_s'] else None
+        result['keys'] = result.pop('bytes')
+        return [result]
+
+    def bench_append(self) -> list:
+        """Append `append_size` bytes `appends` times to the same file."""
+        appends = self.parameters['appends']
+        data = self._data[:self.parameters['append_size']]
+
+        def setup():
+            self._write('append/data.bin', b'')
+
+        def run():
+            for _ in range(appends):
+                self._write('append/data.bin', data, if_exists='append')
+            return appends, appends * len(data)
+        return [self.measure(
+            'append', run, {
+                'appends': appends, 'append_size': len(data)},
+            setup=setup)]
+
+    def run(self, benchmarks: list) -> list:
+        """Run the benchmarks and return their results."""
+        results = []
+        for name in benchmarks:
+            results.extend(getattr(self, 'bench_' + name)())
+        return results
+
+
+class _RepeatStream(io.RawIOBase):
+    """Readable stream of `size` bytes repeating data."""
+
+    def __init__(self, data: bytes, size: int):
+        self._data = memoryview(data)
+        self._size = size
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        remaining = self._size - self._position
+        if remaining <= 0:
+            return 0
+        offset = self._position % len(self._data)
+        n_bytes = min(len(buffer), remaining, len(self._data) - offset)
+        buffer[:n_bytes] = self._data[offset:offset + n_bytes]
+        self._position += n_bytes
+        return n_bytes
+
+
+def compare_results(results: dict, baseline: dict,
+                    threshold: float) -> list:
+    """Return cases slower than baseline by more than threshold.
+
+    Cases are matched by backend, benchmark and parameters. Cases
+    are compared by seconds and requests_per_operation.
+    """
+    def case_key(case):
+        return (
+            case['backend'], case['benchmark'],
+            json.dumps(case['parameters'], sort_keys=True))
+
+    baseline_cases = {case_key(x): x for x in baseline['results']}
+    regressions = []
+    for case in results['results']:
+        old_case = baseline_cases.get(case_key(case))
+        if old_case is None:
+            continue
+        for metric in ('seconds', 'requests_per_operation'):
+            old_value, new_value = old_case[metric], case[metric]
+            if old_value and new_value is not None and \
+                    new_value > old_value * (1 + threshold):
+                regressions.append({
+                    'backend': case['backend'],
+                    'benchmark': case['benchmark'],
+                    'parameters': case['parameters'], 'metric': metric,
+                    'baseline': old_value, 'value': new_value,
+                    'change': new_value / old_value - 1})
+    return regressions
+
+
+def _package_version() -> str:
+    version_path = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        'VERSION')
+    try:
+        with open(version_path) as file:
+            return file.read().strip().split('=')[-1]
+    except OSError:
+        return None
+
+
+def parse_args(argv: list = None):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '--backends', nargs='+', default=['local', 'memory', 'aws_s3'],
+        choices=BACKENDS)
+    parser.add_argument(
+        '--benchmarks', nargs='+', default=list(BENCHMARKS),
+        choices=BENCHMARKS)
+    parser.add_argument(
+        '--latency-profile', choices=list(StorageLatencyProfile.PRESETS),
+        help='Latency preset applied to the memory backend')
+    parser.add_argument('--file-size', type=int, default=4 * MB)
+    parser.add_argument('--operations', type=int, default=10)
+    parser.add_argument('--stream-size', type=int, default=64 * MB)
+    parser.add_argument(
+        '--chunk-sizes', type=int, nargs='+',
+        default=[256 * 1024, MB, 5 * MB, 8 * MB, 16 * MB])
+    parser.add_argument('--list-keys', type=int, default=100000)
+    parser.add_argument('--appends', type=int, default=50)
+    parser.add_argument('--append-size', type=int, default=64 * 1024)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument(
+        '--quick', action='store_true',
+        help='Small sizes to check the benchmark itself')
+    parser.add_argument('--output', help='JSON output file, default stdout')
+    parser.add_argument(
+        '--baseline', help='JSON results of a previous run to compare')
+    parser.add_argument(
+        '--threshold', type=float, default=0.2,
+        help='Relative change reported as regression')
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.file_size, args.operations = 256 * 1024, 3
+        args.stream_size, args.chunk_sizes = 8 * MB, [MB, 5 * MB]
+        args.list_keys, args.appends, args.repeat = 1000, 10, 1
+    return args
+
+
+def main(argv: list = None) -> int:
+    """Run benchmarks and write JSON results.
+
+    Returns:
+        Exit code, 1 if regressions were found at baseline comparison.
+    """
+    args = parse_args(argv)
+    parameters = {
+        'file_size': args.file_size, 'operations': args.operations,
+        'stream_size': args.stream_size, 'chunk_sizes': args.chunk_sizes,
+        'list_keys': args.list_keys, 'appends': args.appends,
+        'append_size': args.append_size, 'repeat': args.repeat,
+        'latency_profile': args.latency_profile}
+    results = {
+        'format_version': RESULT_FORMAT_VERSION,
+        'package_version': _package_version(),
+        'created_at': datetime.datetime.now(
+            datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'parameters': parameters, 'skipped': {}, 'results': []}
+
+    for backend in args.backends:
+        with backend_storage(backend, args.latency_profile) as \
+                (storage, instrumentation, skip_reason):
+            if storage is None:
+                results['skipped'][backend] = skip_reason
+                print('skip {}: {}'.format(backend, skip_reason),
+                      file=sys.stderr)
+                continue
+            benchmark = StorageBenchmark(
+                storage=storage, instrumentation=instrumentation,
+                backend=backend, parameters=parameters)
+            for name in args.benchmarks:
+                for case in benchmark.run([name]):
+                    results['results'].append(case)
+                    print('{backend} {benchmark} {parameters}: '
+                          '{seconds:.4f}s {requests_per_operation} '
+                          'req/op'.format(**case), file=sys.stderr)
+
+    exit_code = 0
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        results['regressions'] = compare_results(
+            results, baseline, threshold=args.threshold)
+        exit_code = 1 if results['regressions'] else 0
+
+    output = json.dumps(results, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, 'w') as file:
+            file.write(output)
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
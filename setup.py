@@ -33,9 +33,16 @@ setuptools.setup(
         "Werkzeug>=3.1.3",
         "pika>=1.3.2",
         "GeoAlchemy2>=0.9.3",
-        "Flask-SQLAlchemy>=2.3.2",
+        "Flask-SQLAlchemy>=3.0",
         "Flask>=1.1.4",
     ],
+    extras_require={
+        "compression": ["zstandard>=0.21", "lz4>=4.0"],
+        "dataframe": ["pyarrow>=12.0"],
+        "prometheus": ["prometheus-client>=0.16"],
+        "opentelemetry": ["opentelemetry-api>=1.20"],
+        "query_cache": ["diskcache>=5.0"],
+    },
     packages=setuptools.find_packages(where="src"),
     python_requires=">=3.6",
 )
@@ -0,0 +1,600 @@
+"""Bulk loading and updating of FlaskPumpWoodBaseModel models.
+
+`bulk_insert` writes a DataFrame, a list of dictionaries or an iterator
+of dictionaries with PostgreSQL `COPY FROM STDIN` in batches, so memory
+use depends only on the batch size. Upserts copy each batch to a
+temporary staging table and run `INSERT ... SELECT ... ON CONFLICT` on the
+primary key (composite primary keys included).
+
+Values are converted as the ORM would do: JSON columns are serialized by
+`json_codec.json_serializer` (pumpJsonDump semantics), NaN/NaT are NULL,
+numpy scalars are converted to python and geometries are written as
+EWKT with the SRID of the column.
+
+COPY is used with psycopg2, psycopg (3) and pg8000, the binary format
+only with psycopg 3. Other databases (ex.: SQLite at tests) use batched
+`executemany` inserts with `ON CONFLICT` when supported.
+
+`bulk_update` updates rows with different values per row using
+`UPDATE ... FROM (VALUES ...)` statements on PostgreSQL and batched
+`executemany` updates on other databases.
+
+Both invalidate the table at the query caches (`query_cache`), COPY
+statements are not seen by the session events.
+"""
+import io
+import uuid
+import math
+import datetime
+import itertools
+import sqlalchemy as sa
+import sqlalchemy.orm
+from typing import Iterable, Iterator, List, Union
+from sqlalchemy.dialects import postgresql, sqlite
+from pumpwood_communication import exceptions
+from pumpwood_miscellaneous.json_codec import (
+    json_serializer, json_deserializer)
+from pumpwood_miscellaneous.query_cache import invalidate_tables
+
+
+COPY_FORMATS = ('csv', 'binary')
+"""Formats of COPY FROM STDIN."""
+IF_EXISTS = ('fail', 'overwrite', 'skip')
+"""Behaviour on rows with primary keys already at the table: raise error,
+update the row (upsert) or keep the existing row."""
+DEFAULT_BATCH_SIZE = 10000
+"""Rows of each COPY statement."""
+DEFAULT_UPDATE_BATCH_SIZE = 5000
+"""Rows of each UPDATE ... FROM VALUES statement."""
+MAX_BIND_PARAMETERS = 32767
+"""Maximum bind parameters of a statement (PostgreSQL limit is 65535)."""
+SESSION_TYPES = (sa.orm.Session, sa.orm.scoped_session)
+"""Sessions accepted instead of connections (Flask-SQLAlchemy db.session
+is a scoped session)."""
+
+
+def _get_table(model) -> sa.Table:
+    """Return the table of a model or table."""
+    if isinstance(model, sa.Table):
+        return model
+    return model.__table__
+
+
+def _get_connection(session, model):
+    """Return the connection of the session for model writes."""
+    if not isinstance(session, SESSION_TYPES):
+        return session
+    if isinstance(model, sa.Table):
+        return session.connection()
+    return session.connection(bind_arguments={'mapper': model})
+
+
+def _invalidate_cache(session, table: sa.Table):
+    """Invalidate table at query caches, again at commit of sessions."""
+    invalidate_tables(
+        [table], session=session
+        if isinstance(session, SESSION_TYPES) else None)
+
+
+def _iter_rows(data) -> tuple:
+    """Return the columns and an iterator over the rows as tuples.
+
+    Columns of lists and iterators of dictionaries are the keys of the
+    first row, missing keys of other rows are NULL.
+
+    Raises:
+        PumpWoodWrongParameters:
+            If a row has keys that are not at the first row, they would
+            be silently dropped.
+    """
+    if hasattr(data, 'itertuples'):
+        return (
+            [str(x) for x in data.columns],
+            data.itertuples(index=False, name=None))
+
+    iterator = iter(data)
+    first_row = next(iterator, None)
+    if first_row is None:
+        return [], iter([])
+    columns = list(first_row.keys())
+    column_set = set(columns)
+
+    def rows():
+        for row in itertools.chain([first_row], iterator):
+            extra_keys = row.keys() - column_set
+            if extra_keys:
+                msg = (
+                    "Row columns {} are not at the first row columns "
+                    "{}").format(sorted(extra_keys), columns)
+                raise exceptions.PumpWoodWrongParameters(msg)
+            yield tuple(row.get(column) for column in columns)
+    return columns, rows()
+
+
+def _batches(rows: Iterator[tuple], batch_size: int) -> Iterator[list]:
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def _is_null(value) -> bool:
+    """Check if value is None, NaN or NaT."""
+    if value is None:
+        return True
+    if isinstance(value, float):
+        return math.isnan(value)
+    # pandas NaT and numpy nan/NaT
+    try:
+        return bool(value != value)
+    except (TypeError, ValueError):
+        return False
+
+
+def _python_value(value, is_json: bool):
+    """Convert numpy/pandas scalars and NaN to python values.
+
+    JSON values are converted to the python objects of their
+    pumpJsonDump serialization, independent of the engine serializer.
+    """
+    if is_json:
+        return None if value is None else json_deserializer(
+            json_serializer(value))
+    if _is_null(value):
+        return None
+    if type(value).__module__ == 'numpy':
+        # Scalars to python values and arrays to lists
+        return value.tolist()
+    to_pydatetime = getattr(value, 'to_pydatetime', None)
+    if to_pydatetime is not None:
+        return to_pydatetime()
+    return value
+
+
+class _ColumnConverter():
+    """Convert values of a column to COPY text."""
+
+    def __init__(self, column: sa.Column):
+        self.column = column
+        self.is_json = isinstance(column.type, sa.JSON)
+        self.srid = getattr(column.type, 'srid', None)
+        self.is_geometry = hasattr(column.type, 'geometry_type')
+        self.is_array = isinstance(column.type, sa.ARRAY)
+        self.type_oid = None
+
+    def to_text(self, value) -> str:
+        """Return text of value, None for NULL."""
+        if self.is_json:
+            return None if value is None else json_serializer(value)
+        value = _python_value(value, is_json=False)
+        if value is None:
+            return None
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+        if isinstance(value, (datetime.datetime, datetime.date,
+                              datetime.time)):
+            return value.isoformat()
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return '\\x' + bytes(value).hex()
+        if self.is_array and isinstance(value, (list, tuple)):
+            return '{' + ','.join(
+                'NULL' if _is_null(x) else '"' + str(x).replace(
+                    '\\', '\\\\').replace('"', '\\"') + '"'
+                for x in value) + '}'
+        if self.is_geometry and hasattr(value, 'wkt'):
+            if self.srid is not None and 0 < self.srid:
+                return 'SRID={};{}'.format(self.srid, value.wkt)
+            return value.wkt
+        return str(value)
+
+    def to_binary(self, value):
+        """Return value to be adapted by psycopg binary dumpers."""
+        if self.is_geometry:
+            msg = (
+                "binary COPY does not support geometry column [{}], "
+                "use copy_format='csv'").format(self.column.name)
+            raise exceptions.PumpWoodNotImplementedError(msg)
+        if self.is_json:
+            if value is None:
+                return None
+            from psycopg.types.json import Json, Jsonb
+            wrapper = Jsonb if isinstance(
+                self.column.type, postgresql.JSONB) else Json
+            return wrapper(value, dumps=json_serializer)
+        return _python_value(value, is_json=False)
+
+
+def _csv_batch(batch: list, converters: list) -> bytes:
+    """Return CSV of the batch, NULL as unquoted empty values.
+
+    All other values are quoted, so empty strings are not NULL.
+    """
+    lines = []
+    for row in batch:
+        fields = []
+        for converter, value in zip(converters, row):
+            text = converter.to_text(value)
+            fields.append(
+                '' if text is None
+                else '"' + text.replace('"', '""') + '"')
+        lines.append(','.join(fields))
+    lines.append('')
+    return '\n'.join(lines).encode('utf-8')
+
+
+def _copy_sql(connection, table: sa.Table, columns: List[str],
+              copy_format: str) -> str:
+    preparer = connection.dialect.identifier_preparer
+    return 'COPY {table} ({columns}) FROM STDIN WITH (FORMAT {format})'\
+        .format(
+            table=preparer.format_table(table),
+            columns=', '.join(preparer.quote(x) for x in columns),
+            format=copy_format)
+
+
+def _copy_batch(connection, table: sa.Table, columns: List[str],
+                converters: list, batch: list, copy_format: str):
+    """Run COPY FROM STDIN of batch at the DBAPI connection."""
+    sql = _copy_sql(connection, table, columns, copy_format)
+    driver = connection.dialect.driver
+    dbapi_connection = connection.connection.dbapi_connection
+    cursor = dbapi_connection.cursor()
+    try:
+        if driver == 'psycopg':
+            if copy_format == 'binary':
+                # Types must be fetched before starting COPY
+                from psycopg.types import TypeInfo
+                for converter in converters:
+                    if converter.type_oid is None:
+                        converter.type_oid = TypeInfo.fetch(
+                            dbapi_connection, converter.column.type.compile(
+                                dialect=connection.dialect)).oid
+            with cursor.copy(sql) as copy:
+                if copy_format == 'binary':
+                    copy.set_types([x.type_oid for x in converters])
+                    for row in batch:
+                        copy.write_row([
+                            c.to_binary(v)
+                            for c, v in zip(converters, row)])
+                else:
+                    copy.write(_csv_batch(batch, converters))
+        elif copy_format == 'binary':
+            msg = "binary COPY is implemented only for psycopg (3)"
+            raise exceptions.PumpWoodNotImplementedError(msg)
+        elif driver == 'psycopg2':
+            cursor.copy_expert(sql, io.BytesIO(
+                _csv_batch(batch, converters)))
+        elif driver == 'pg8000':
+            cursor.execute(sql, stream=io.BytesIO(
+                _csv_batch(batch, converters)))
+        else:
+            msg = "COPY is not implemented for driver [{}]".format(driver)
+            raise exceptions.PumpWoodNotImplementedError(msg)
+    finally:
+        cursor.close()
+
+
+def _create_staging_table(connection, table: sa.Table,
+                          columns: List[str]) -> sa.Table:
+    """Create a temporary table with the columns to be loaded."""
+    name = 'pumpwood_staging_{}'.format(uuid.uuid4().hex[:16])
+    staging = sa.Table(
+        name, sa.MetaData(),
+        *[sa.Column(x, table.c[x].type) for x in columns],
+        prefixes=['TEMPORARY'], postgresql_on_commit='DROP')
+    staging.create(connection)
+    return staging
+
+
+def _upsert_statement(dialect_insert, table: sa.Table, columns: List[str],
+                      if_exists: str, update_columns: List[str],
+                      source=None):
+    """Build INSERT ... ON CONFLICT of the primary key."""
+    statement = dialect_insert(table)
+    if source is not None:
+        statement = statement.from_select(
+            columns, sa.select(*[source.c[x] for x in columns]))
+    if if_exists == 'fail':
+        return statement
+
+    primary_keys = [x.name for x in table.primary_key.columns]
+    missing_keys = set(primary_keys) - set(columns)
+    if missing_keys:
+        msg = (
+            "Primary key columns {} are required with if_exists [{}]")\
+            .format(sorted(missing_keys), if_exists)
+        raise exceptions.PumpWoodWrongParameters(msg)
+
+    if if_exists == 'skip':
+        return statement.on_conflict_do_nothing(index_elements=primary_keys)
+    if update_columns is None:
+        update_columns = [x for x in columns if x not in primary_keys]
+    if not update_columns:
+        return statement.on_conflict_do_nothing(index_elements=primary_keys)
+    return statement.on_conflict_do_update(
+        index_elements=primary_keys,
+        set_={x: statement.excluded[x] for x in update_columns})
+
+
+def _postgres_bulk_insert(connection, table, columns, rows, if_exists,
+                          update_columns, batch_size, copy_format) -> int:
+    converters = [_ColumnConverter(table.c[x]) for x in columns]
+    staging = None
+    n_rows = 0
+    for batch in _batches(rows, batch_size):
+        if if_exists == 'fail':
+            _copy_batch(
+                connection, table, columns, converters, batch, copy_format)
+            n_rows += len(batch)
+            continue
+
+        if staging is None:
+            staging = _create_staging_table(connection, table, columns)
+            statement = _upsert_statement(
+                postgresql.insert, table, columns, if_exists,
+                update_columns, source=staging)
+        _copy_batch(
+            connection, staging, columns, converters, batch, copy_format)
+        n_rows += connection.execute(statement).rowcount
+        connection.execute(sa.text(
+            'TRUNCATE ' +
+            connection.dialect.identifier_preparer.format_table(staging)))
+
+    # On errors the staging table is dropped by the transaction rollback
+    if staging is not None:
+        staging.drop(connection)
+    return n_rows
+
+
+def _executemany_bulk_insert(connection, table, columns, rows, if_exists,
+                             update_columns, batch_size) -> int:
+    if connection.dialect.name == 'sqlite':
+        statement = _upsert_statement(
+            sqlite.insert, table, columns, if_exists, update_columns)
+    elif if_exists == 'fail':
+        statement = sa.insert(table)
+    else:
+        msg = "if_exists [{}] is not implemented for dialect [{}]".format(
+            if_exists, connection.dialect.name)
+        raise exceptions.PumpWoodNotImplementedError(msg)
+
+    is_json = [isinstance(table.c[x].type, sa.JSON) for x in columns]
+    n_rows = 0
+    for batch in _batches(rows, batch_size):
+        parameters = [
+            {c: _python_value(v, j)
+             for c, v, j in zip(columns, row, is_json)}
+            for row in batch]
+        result = connection.execute(statement, parameters)
+        n_rows += len(batch) if if_exists == 'fail' else result.rowcount
+    return n_rows
+
+
+def bulk_insert(session, model, data: Union[Iterable[dict], 'pd.DataFrame'],
+                if_exists: str = 'fail', update_columns: List[str] = None,
+                batch_size: int = DEFAULT_BATCH_SIZE,
+                copy_format: str = 'csv') -> int:
+    """Insert rows of data at the table of model.
+
+    The rows are written at the session transaction, the caller must
+    commit it. ORM objects of the session are not updated.
+
+    Args:
+        session:
+            SQLAlchemy session (ex.: `db.session`) or connection.
+        model:
+            FlaskPumpWoodBaseModel subclass or table.
+        data (Union[Iterable[dict], pd.DataFrame]):
+            DataFrame, list or iterator of dictionaries. Columns are the
+            DataFrame columns or the keys of the first dictionary.
+        if_exists (str):
+            'fail' to raise error on existing primary keys, 'overwrite'
+            to update existing rows and 'skip' to keep existing rows.
+            The primary key columns must be at data for 'overwrite' and
+            'skip', and may not repeat at the same batch.
+        update_columns (List[str]):
+            Columns updated on existing rows with 'overwrite', default
+            all columns of data except the primary keys.
+        batch_size (int):
+            Rows of each COPY (or executemany) statement.
+        copy_format (str):
+            'csv' or 'binary' (psycopg 3 only) COPY format.
+
+    Returns:
+        Number of rows inserted or updated.
+
+    Raises:
+        PumpWoodWrongParameters:
+            If if_exists or copy_format are not valid, data has columns
+            that are not at the table or primary keys are missing for
+            upserts.
+        PumpWoodNotImplementedError:
+            If the driver does not implement COPY or the dialect does not
+            implement ON CONFLICT.
+    """
+    if if_exists not in IF_EXISTS:
+        msg = "if_exists [{}] not valid, use {}".format(if_exists, IF_EXISTS)
+        raise exceptions.PumpWoodWrongParameters(msg)
+    if copy_format not in COPY_FORMATS:
+        msg = "copy_format [{}] not valid, use {}".format(
+            copy_format, COPY_FORMATS)
+        raise exceptions.PumpWoodWrongParameters(msg)
+
+    table = _get_table(model)
+    columns, rows = _iter_rows(data)
+    if not columns:
+        return 0
+    unknown_columns = set(columns) - set(table.c.keys())
+    if unknown_columns:
+        msg = "Columns {} are not at table [{}]".format(
+            sorted(unknown_columns), table.name)
+        raise exceptions.PumpWoodWrongParameters(msg)
+
+    connection = _get_connection(session, model)
+    if connection.dialect.name == 'postgresql':
+        n_rows = _postgres_bulk_insert(
+            connection=connection, table=table, columns=columns, rows=rows,
+            if_exists=if_exists, update_columns=update_columns,
+            batch_size=batch_size, copy_format=copy_format)
+    else:
+        n_rows = _executemany_bulk_insert(
+            connection=connection, table=table, columns=columns, rows=rows,
+            if_exists=if_exists, update_columns=update_columns,
+            batch_size=batch_size)
+    _invalidate_cache(session, table)
+    return n_rows
+
+
+def _decode_pk(row: dict, primary_keys: List[str]) -> dict:
+    """Replace `pk` of row by its primary key columns.
+
+    Composite primary keys are decoded with CompositePkBase64Converter
+    like `query.open_composite_pk`.
+    """
+    if 'pk' not in row or 'pk' in primary_keys:
+        return row
+    row = dict(row)
+    pk = row.pop('pk')
+    if len(primary_keys) == 1:
+        row[primary_keys[0]] = pk
+    else:
+        # serializers import pandas, numpy and shapely
+        from pumpwood_communication.serializers import (
+            CompositePkBase64Converter)
+        row.update(CompositePkBase64Converter.load(pk))
+    return row
+
+
+def _iter_update_rows(data, primary_keys: List[str]) -> tuple:
+    """Return the columns and the rows of update data as tuples.
+
+    Columns are the primary keys followed by the updated columns.
+    """
+    if hasattr(data, 'itertuples'):
+        data_columns = [str(x) for x in data.columns]
+        data = (
+            dict(zip(data_columns, row))
+            for row in data.itertuples(index=False, name=None))
+    iterator = (_decode_pk(row, primary_keys) for row in data)
+    first_row = next(iterator, None)
+    if first_row is None:
+        return [], iter([])
+
+    missing_keys = set(primary_keys) - set(first_row.keys())
+    if missing_keys:
+        msg = "Primary key columns {} or pk are required".format(
+            sorted(missing_keys))
+        raise exceptions.PumpWoodWrongParameters(msg)
+    columns = primary_keys + [
+        x for x in first_row.keys() if x not in primary_keys]
+    column_set = set(columns)
+
+    def rows():
+        for row in itertools.chain([first_row], iterator):
+            if row.keys() != column_set:
+                msg = (
+                    "All rows must have the same columns {}, "
+                    "row columns {}").format(columns, list(row.keys()))
+                raise exceptions.PumpWoodWrongParameters(msg)
+            yield tuple(row[x] for x in columns)
+    return columns, rows()
+
+
+def _postgres_bulk_update(connection, table, columns, primary_keys, rows,
+                          batch_size) -> int:
+    is_json = [isinstance(table.c[x].type, sa.JSON) for x in columns]
+    # None of JSON columns is NULL like at COPY
+    value_columns = [
+        sa.column(x, type(table.c[x].type)(none_as_null=True) if j
+                  else table.c[x].type)
+        for x, j in zip(columns, is_json)]
+    n_rows = 0
+    for batch in _batches(rows, batch_size):
+        values = sa.values(*value_columns, name='pumpwood_values').data([
+            tuple(_python_value(v, j) for v, j in zip(row, is_json))
+            for row in batch])
+        # VALUES columns are typed by the first row, cast to the columns
+        statement = sa.update(table).values({
+            x: sa.cast(values.c[x], table.c[x].type)
+            for x in columns if x not in primary_keys})
+        for x in primary_keys:
+            statement = statement.where(
+                table.c[x] == sa.cast(values.c[x], table.c[x].type))
+        n_rows += connection.execute(statement).rowcount
+    return n_rows
+
+
+def _executemany_bulk_update(connection, table, columns, primary_keys,
+                             rows, batch_size) -> int:
+    statement = sa.update(table).values({
+        x: sa.bindparam('value_' + x)
+        for x in columns if x not in primary_keys})
+    for x in primary_keys:
+        statement = statement.where(
+            table.c[x] == sa.bindparam('value_' + x))
+    is_json = [isinstance(table.c[x].type, sa.JSON) for x in columns]
+    n_rows = 0
+    for batch in _batches(rows, batch_size):
+        parameters = [
+            {'value_' + c: _python_value(v, j)
+             for c, v, j in zip(columns, row, is_json)}
+            for row in batch]
+        n_rows += connection.execute(statement, parameters).rowcount
+    return n_rows
+
+
+def bulk_update(session, model, data: Union[Iterable[dict], 'pd.DataFrame'],
+                batch_size: int = DEFAULT_UPDATE_BATCH_SIZE) -> int:
+    """Update rows of model with different values per row.
+
+    The rows are updated at the session transaction, the caller must
+    commit it. ORM objects of the session are not updated.
+
+    Args:
+        session:
+            SQLAlchemy session (ex.: `db.session`) or connection.
+        model:
+            FlaskPumpWoodBaseModel subclass or table.
+        data (Union[Iterable[dict], pd.DataFrame]):
+            Rows with `pk` (composite primary keys as base64 like the
+            Pumpwood API) or the primary key columns and the values of
+            the columns to be updated. All rows must have the columns of
+            the first row.
+        batch_size (int):
+            Rows of each UPDATE statement, it is reduced to keep the bind
+            parameters below MAX_BIND_PARAMETERS.
+
+    Returns:
+        Number of rows updated.
+
+    Raises:
+        PumpWoodWrongParameters:
+            If rows have columns that are not at the table, have no
+            primary key or have different columns.
+    """
+    table = _get_table(model)
+    primary_keys = [x.name for x in table.primary_key.columns]
+    columns, rows = _iter_update_rows(data, primary_keys)
+    if not columns:
+        return 0
+    unknown_columns = set(columns) - set(table.c.keys())
+    if unknown_columns:
+        msg = "Columns {} are not at table [{}]".format(
+            sorted(unknown_columns), table.name)
+        raise exceptions.PumpWoodWrongParameters(msg)
+    if len(columns) == len(primary_keys):
+        return 0
+
+    batch_size = max(1, min(batch_size, MAX_BIND_PARAMETERS // len(columns)))
+    connection = _get_connection(session, model)
+    if connection.dialect.name == 'postgresql':
+        n_rows = _postgres_bulk_update(
+            connection=connection, table=table, columns=columns,
+            primary_keys=primary_keys, rows=rows, batch_size=batch_size)
+    else:
+        n_rows = _executemany_bulk_update(
+            connection=connection, table=table, columns=columns,
+            primary_keys=primary_keys, rows=rows, batch_size=batch_size)
+    _invalidate_cache(session, table)
+    return n_rows
@@ -1,8 +1,21 @@
 # -*- coding: utf-8 -*-
 """Database helper functions module."""
+import logging
+from weakref import WeakKeyDictionary
 from sqlalchemy import MetaData
+from sqlalchemy.exc import DBAPIError
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
-from pumpwood_communication.serializers import pumpJsonDump
+from pumpwood_miscellaneous.replicas import (
+    ReplicaRouter, RoutingSession, PINNED_INFO_KEY)
+from pumpwood_miscellaneous.pool import (
+    PoolHealthChecker, get_pool_preset, apply_pool_preset)
+from pumpwood_miscellaneous.json_codec import get_json_codec
+from pumpwood_miscellaneous.metrics import Instrumentation
+from pumpwood_miscellaneous.sql_instrumentation import SQLInstrumentation
+
+
+logger = logging.getLogger(__name__)
 
 
 def build_engine_string(dialect: str, database: str, driver: str = None,
@@ -61,17 +74,197 @@ def build_engine_string(dialect: str, database: str, driver: str = None,
     return temp_string
 
 
+class PumpWoodSession(RoutingSession):
+    """Session of SQLAlchemyPostGres.
+
+    Reads are routed to the read replicas and statements that fail
+    because the connection was lost are retried once with a new
+    connection if they are the first statement of the transaction, so no
+    work of the transaction is lost.
+    """
+
+    def execute(self, statement, *args, **kwargs):
+        """Execute statement retrying on lost connections."""
+        if self.in_transaction():
+            return super().execute(statement, *args, **kwargs)
+        try:
+            return super().execute(statement, *args, **kwargs)
+        except DBAPIError as e:
+            if not e.connection_invalidated:
+                raise
+            logger.info("Retrying statement on lost connection: %s", e)
+            self.rollback()
+            return super().execute(statement, *args, **kwargs)
+
+
 class SQLAlchemyPostGres(SQLAlchemy):
-    """Inicialize SQLAlchemy with a few tricks for PostGres."""
+    """Inicialize SQLAlchemy with a few tricks for PostGres.
+
+    Read replicas may be set with `replica_uris` argument or
+    `SQLALCHEMY_REPLICA_URIS` app config, SELECT statements of the default
+    bind are sent to the healthy replicas until the session writes, after
+    that the session uses the primary (read your writes).
+
+    Pool options are set by a preset of `pool.POOL_PRESETS`, with
+    `pool_preset` argument or `SQLALCHEMY_POOL_PRESET` app config. The
+    default `pre_ping` pings connections at each checkout, other presets
+    check idle connections at a background thread. Options set at
+    `SQLALCHEMY_ENGINE_OPTIONS` take precedence over the preset.
+
+    With `instrumentation` the statements of all engines are recorded by
+    `sql_instrumentation.SQLInstrumentation` (latency, rows, pool wait,
+    checkouts and sampled EXPLAIN of slow queries).
+    """
 
-    def __init__(self, *args, **kwargs):
-        """__init__."""
+    def __init__(self, *args, replica_uris: list = None,
+                 replica_selection: str = 'round_robin',
+                 replica_health_check_interval: float = 10,
+                 pool_preset: str = 'pre_ping',
+                 pool_health_check_interval: float = None,
+                 json_codec: str = 'pumpwood',
+                 instrumentation: Instrumentation | bool = None,
+                 slow_query_threshold: float = 1.0,
+                 explain_sample_rate: float = 0.1, **kwargs):
+        """__init__.
+
+        Args:
+            *args:
+                Flask-SQLAlchemy arguments.
+            replica_uris (list):
+                Engine strings of the read replicas, they use the same
+                engine options of the primary. `SQLALCHEMY_REPLICA_URIS`
+                app config is used if set.
+            replica_selection (str):
+                Strategy to choose a replica for each read,
+                'round_robin' or 'least_latency'.
+            replica_health_check_interval (float):
+                Seconds between the background health checks of the
+                replicas, ejected replicas return to routing after a
+                successful check.
+            pool_preset (str):
+                Name of the pool preset ('pre_ping', 'web', 'worker',
+                'pgbouncer_transaction').
+            pool_health_check_interval (float):
+                Seconds between background checks of idle connections,
+                default is the interval of the preset.
+            json_codec (str):
+                JSON codec of JSON columns, 'pumpwood' (pumpJsonDump and
+                driver json.loads) or 'orjson' (pumpJsonDump and orjson).
+                `SQLALCHEMY_JSON_CODEC` app config is used if set.
+            instrumentation (Instrumentation | True):
+                Record metrics and spans of the SQL statements, True
+                uses the shared `get_default_instrumentation()`.
+            slow_query_threshold (float):
+                Seconds above which a statement is logged as slow query,
+                None to not capture slow queries.
+            explain_sample_rate (float):
+                Fraction of slow SELECT statements explained, 0 to
+                disable. Only queries of `sqlalchemy_kward_query` are
+                explained with EXPLAIN (ANALYZE, BUFFERS).
+            **kwargs:
+                Flask-SQLAlchemy keyword arguments.
+        """
         # Inject schema-aware metadata if not explicitly set
         kwargs.setdefault('metadata', MetaData(schema="public"))
+        session_options = kwargs.setdefault('session_options', {})
+        session_options.setdefault('class_', PumpWoodSession)
+        self._replica_uris = replica_uris
+        self._replica_selection = replica_selection
+        self._replica_health_check_interval = replica_health_check_interval
+        self._pool_preset = pool_preset
+        self._pool_health_check_interval = pool_health_check_interval
+        self._json_codec = json_codec
+        self._app_primary_options = WeakKeyDictionary()
+        self._app_replica_routers = WeakKeyDictionary()
+        self._app_pool_checkers = WeakKeyDictionary()
+        self.sql_instrumentation = None
+        if instrumentation is not None and instrumentation is not False:
+            self.sql_instrumentation = SQLInstrumentation(
+                instrumentation=(
+                    None if instrumentation is True else instrumentation),
+                slow_query_threshold=slow_query_threshold,
+                explain_sample_rate=explain_sample_rate)
         super().__init__(*args, **kwargs)
 
-    def apply_driver_hacks(self, app, info, options):
-        """Adjust connection to pre-ping and used Pumpwood Json."""
-        options.update({
-            "pool_pre_ping": True, "json_serializer": pumpJsonDump})
-        super(SQLAlchemyPostGres, self).apply_driver_hacks(app, info, options)
+    def init_app(self, app):
+        """Initialize app creating the engines of the read replicas."""
+        for checker in self._app_pool_checkers.pop(app, []):
+            checker.stop()
+        super().init_app(app)
+        router = self._app_replica_routers.pop(app, None)
+        if router is not None:
+            router.dispose()
+
+        replica_uris = app.config.setdefault(
+            'SQLALCHEMY_REPLICA_URIS', self._replica_uris) or []
+        engines = {}
+        for i, uri in enumerate(replica_uris):
+            options = dict(self._app_primary_options[app], url=uri)
+            self._apply_driver_defaults(options, app)
+            name = 'replica_{}'.format(i)
+            engines[name] = self._make_engine(name, options, app)
+        if engines:
+            self._app_replica_routers[app] = ReplicaRouter(
+                engines=engines, selection=self._replica_selection,
+                health_check_interval=self._replica_health_check_interval)
+
+    def _get_pool_preset(self, app) -> dict:
+        preset = get_pool_preset(app.config.setdefault(
+            'SQLALCHEMY_POOL_PRESET', self._pool_preset))
+        if self._pool_health_check_interval is not None:
+            preset['health_check_interval'] = \
+                self._pool_health_check_interval
+        return preset
+
+    def _apply_driver_defaults(self, options, app):
+        """Apply pool preset and JSON codec to engine options."""
+        super()._apply_driver_defaults(options, app)
+        codec = get_json_codec(app.config.setdefault(
+            'SQLALCHEMY_JSON_CODEC', self._json_codec))
+        for key, value in codec.items():
+            options.setdefault(key, value)
+        apply_pool_preset(options, self._get_pool_preset(app))
+
+    def _make_engine(self, bind_key, options, app):
+        # Keep primary options to create the replica engines
+        if bind_key is None:
+            self._app_primary_options[app] = dict(options)
+        engine = super()._make_engine(bind_key, options, app)
+        interval = self._get_pool_preset(app)['health_check_interval']
+        if interval:
+            self._app_pool_checkers.setdefault(app, []).append(
+                PoolHealthChecker(engine=engine, interval=interval))
+        if self.sql_instrumentation is not None:
+            self.sql_instrumentation.attach(
+                engine, name='default' if bind_key is None else bind_key)
+        return engine
+
+    def get_replica_router(self) -> ReplicaRouter:
+        """Return the replica router of current app, None if no replicas."""
+        return self._app_replica_routers.get(
+            current_app._get_current_object())
+
+    def use_primary(self):
+        """Send the following statements of the current session to primary.
+
+        The session is removed at the end of the request, so only the
+        current request is affected.
+        """
+        self.session.info[PINNED_INFO_KEY] = True
+
+    def replica_status(self) -> list:
+        """Return the health and latency of the read replicas."""
+        router = self.get_replica_router()
+        return [] if router is None else router.status()
+
+    def check_pools(self) -> list:
+        """Check idle connections of all engines of current app now."""
+        checkers = self._app_pool_checkers.get(
+            current_app._get_current_object(), [])
+        return [x.check() for x in checkers]
+
+    def slow_queries(self) -> list:
+        """Return the last slow queries, empty if not instrumented."""
+        if self.sql_instrumentation is None:
+            return []
+        return self.sql_instrumentation.slow_queries()
@@ -0,0 +1,218 @@
+"""Indexes used by the text search operators of SqlalchemyQueryMisc.
+
+`unaccent` is STABLE (it depends on the search path of the dictionary),
+so it can not be used at expression indexes. `pumpwood_unaccent` is an
+IMMUTABLE wrapper with the dictionary schema fixed. An extension is
+installed in a single schema of the database, so a single wrapper is
+created in a configurable schema (`UNACCENT_SCHEMA` by default) for the
+indexes of all tables. Set `SqlalchemyQueryMisc.unaccent_function` to
+`unaccent_function_name(schema)` after creating it so `unaccent_*`
+operators match the expression indexes.
+
+Indexes created for each searchable column:
+- `<table>_<column>_trgm`: GIN trigram index of the column, used by
+  `icontains`, `istartswith`, `iendswith` and similarity operators.
+- `<table>_<column>_unaccent_trgm`: GIN trigram index of
+  `pumpwood_unaccent(lower(column))`, used by `unaccent_icontains`,
+  `unaccent_istartswith` and `unaccent_iendswith`.
+- `<table>_<column>_unaccent`: B-tree index of the same expression, used
+  by `unaccent_iexact`.
+
+Date part filters (`year`, `year` + `month`) are rewritten as ranges by
+`SqlalchemyQueryMisc`, they use the plain B-tree index of the column.
+"""
+import hashlib
+import sqlalchemy as sa
+from typing import List
+from sqlalchemy.dialects import postgresql
+from pumpwood_communication import exceptions
+
+
+UNACCENT_FUNCTION = 'pumpwood_unaccent'
+"""Name of the IMMUTABLE unaccent wrapper."""
+UNACCENT_SCHEMA = 'public'
+"""Default schema of the unaccent wrapper."""
+MAX_IDENTIFIER_LENGTH = 63
+"""Maximum length of PostgreSQL identifiers."""
+
+
+def unaccent_function_name(schema: str = UNACCENT_SCHEMA) -> str:
+    """Return schema qualified name of the unaccent wrapper.
+
+    Used as `SqlalchemyQueryMisc.unaccent_function`, so queries call the
+    same function of the expression indexes.
+
+    Args:
+        schema (str):
+            Schema of the wrapper.
+    """
+    return '{}.{}'.format(schema, UNACCENT_FUNCTION)
+
+
+def unaccent_function_statements(schema: str = UNACCENT_SCHEMA
+                                 ) -> List[str]:
+    """Return statements creating unaccent extension and its wrapper.
+
+    The extension is created at schema if it is not installed. The
+    wrapper is created at schema calling the function and dictionary of
+    the schema where the extension is installed, that may differ if it
+    was installed before.
+
+    Args:
+        schema (str):
+            Schema of the wrapper and of the extension, if it is not
+            installed.
+    """
+    preparer = postgresql.dialect().identifier_preparer
+    schema_literal = "'{}'".format(schema.replace("'", "''"))
+    return [
+        "CREATE EXTENSION IF NOT EXISTS unaccent SCHEMA {schema}".format(
+            schema=preparer.quote_schema(schema)),
+        "DO $do$ DECLARE extension_schema text; BEGIN "
+        "SELECT quote_ident(n.nspname) INTO extension_schema "
+        "FROM pg_extension e "
+        "JOIN pg_namespace n ON n.oid = e.extnamespace "
+        "WHERE e.extname = 'unaccent'; "
+        "EXECUTE format("
+        "'CREATE OR REPLACE FUNCTION %I.{function}(text) "
+        "RETURNS text LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT AS "
+        "$f$ SELECT %s.unaccent(%L::regdictionary, $1) $f$', "
+        "{schema}, extension_schema, "
+        "extension_schema || '.unaccent'); "
+        "END $do$".format(
+            schema=schema_literal, function=UNACCENT_FUNCTION)]
+
+
+def get_searchable_columns(model) -> List[str]:
+    """Return searchable columns of model.
+
+    `__searchable_columns__` attribute of the model if set, otherwise the
+    String/Text columns that are not primary keys.
+    """
+    searchable_columns = getattr(model, '__searchable_columns__', None)
+    if searchable_columns is not None:
+        return list(searchable_columns)
+    return [
+        column.name for column in model.__table__.columns
+        if isinstance(column.type, sa.String) and not column.primary_key]
+
+
+def _index_name(table_name: str, column_name: str, suffix: str) -> str:
+    name = '{}_{}_{}'.format(table_name, column_name, suffix)
+    if MAX_IDENTIFIER_LENGTH < len(name):
+        digest = hashlib.md5(name.encode('utf-8')).hexdigest()[:8]
+        name = '{}_{}'.format(
+            name[:MAX_IDENTIFIER_LENGTH - len(digest) - 1], digest)
+    return name
+
+
+def search_index_statements(model, columns: List[str] = None,
+                            unaccent: bool = True,
+                            concurrently: bool = False,
+                            create_extensions: bool = True,
+                            unaccent_schema: str = UNACCENT_SCHEMA
+                            ) -> List[str]:
+    """Return statements creating the search indexes of a model.
+
+    Args:
+        model:
+            SQLAlchemy model.
+        columns (List[str]):
+            Columns to be indexed, default is `get_searchable_columns`.
+        unaccent (bool):
+            Create the unaccent expression indexes (needs
+            `pumpwood_unaccent`, see `unaccent_function_statements`).
+        concurrently (bool):
+            Create indexes with CONCURRENTLY, statements must run outside
+            a transaction (autocommit).
+        create_extensions (bool):
+            Add `CREATE EXTENSION IF NOT EXISTS pg_trgm`.
+        unaccent_schema (str):
+            Schema of `pumpwood_unaccent`.
+
+    Returns:
+        List of SQL statements, usable at migrations.
+
+    Raises:
+        PumpWoodWrongParameters:
+            If a column is not at the model table.
+    """
+    table = model.__table__
+    columns = get_searchable_columns(model) if columns is None else columns
+    unknown_columns = set(columns) - set(table.c.keys())
+    if unknown_columns:
+        msg = "Columns {} are not at table [{}]".format(
+            sorted(unknown_columns), table.name)
+        raise exceptions.PumpWoodWrongParameters(msg)
+
+    preparer = postgresql.dialect().identifier_preparer
+    table_sql = preparer.format_table(table)
+    concurrently_sql = 'CONCURRENTLY ' if concurrently else ''
+    template = "CREATE INDEX {concurrently}IF NOT EXISTS {name} " + \
+        "ON {table} USING {method} ({expression})"
+
+    statements = []
+    if create_extensions:
+        statements.append("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for column_name in columns:
+        column_sql = preparer.quote(table.c[column_name].name)
+        unaccent_sql = "{schema}.{function}(lower({column}))".format(
+            schema=preparer.quote_schema(unaccent_schema),
+            function=UNACCENT_FUNCTION, column=column_sql)
+        indexes = [('trgm', 'gin', column_sql + ' gin_trgm_ops')]
+        if unaccent:
+            indexes.extend([
+                ('unaccent_trgm', 'gin', unaccent_sql + ' gin_trgm_ops'),
+                ('unaccent', 'btree', unaccent_sql)])
+        for suffix, method, expression in indexes:
+            statements.append(template.format(
+                concurrently=concurrently_sql,
+                name=preparer.quote(
+                    _index_name(table.name, column_name, suffix)),
+                table=table_sql, method=method, expression=expression))
+    return statements
+
+
+def create_search_indexes(connection, model, columns: List[str] = None,
+                          unaccent: bool = True,
+                          concurrently: bool = False,
+                          unaccent_schema: str = UNACCENT_SCHEMA
+                          ) -> List[str]:
+    """Create the unaccent wrapper and the search indexes of a model.
+
+    Args:
+        connection:
+            SQLAlchemy connection or session of a PostgreSQL database, with
+            `concurrently` it must be at autocommit isolation level.
+        model:
+            SQLAlchemy model.
+        columns (List[str]):
+            Columns to be indexed, default is `get_searchable_columns`.
+        unaccent (bool):
+            Create `pumpwood_unaccent` and the unaccent indexes.
+        concurrently (bool):
+            Create indexes without locking writes of the table.
+        unaccent_schema (str):
+            Schema of `pumpwood_unaccent`, the same for all tables.
+
+    Returns:
+        List of SQL statements executed.
+
+    Example:
+        >>> with db.engine.connect() as connection:
+        >>>     create_search_indexes(
+        >>>         connection.execution_options(
+        >>>             isolation_level='AUTOCOMMIT'),
+        >>>         DescriptionAttribute, concurrently=True)
+        >>> SqlalchemyQueryMisc.unaccent_function = unaccent_function_name()
+    """
+    statements = []
+    if unaccent:
+        statements.extend(unaccent_function_statements(
+            schema=unaccent_schema))
+    statements.extend(search_index_statements(
+        model, columns=columns, unaccent=unaccent,
+        concurrently=concurrently, unaccent_schema=unaccent_schema))
+    for statement in statements:
+        connection.execute(sa.text(statement))
+    return statements
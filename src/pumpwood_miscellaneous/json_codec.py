@@ -0,0 +1,65 @@
+"""JSON codecs of SQLAlchemy engines.
+
+SQLAlchemy passes the output of `json_serializer` to the driver, so it
+must be a string (bytes are sent as bytea by psycopg). `json_serializer`
+is `pumpJsonDump` (orjson with Pumpwood default encoder) decoded to str,
+so NaN, numpy, pandas, datetime and geometry objects are serialized the
+same way as at the Pumpwood APIs. Objects that orjson does not serialize
+(ex.: integers above 64 bits) fall back to simplejson with
+`PumpWoodJSONEncoder`.
+
+`json_deserializer` parses JSON/JSONB columns with orjson, falling back to
+stdlib json for NaN/Infinity literals and integers above 64 bits. The
+PostgreSQL dialects register it at the driver (psycopg2, psycopg).
+
+Codecs (`JSON_CODECS`):
+- `pumpwood`: Pumpwood serializer and the driver deserializer.
+- `orjson`: Pumpwood serializer and orjson deserializer.
+"""
+import json
+import orjson
+import simplejson
+from pumpwood_communication import exceptions
+from pumpwood_communication.serializers import (
+    pumpJsonDump, PumpWoodJSONEncoder)
+
+
+def json_serializer(obj) -> str:
+    """Serialize obj with pumpJsonDump returning a string."""
+    try:
+        return pumpJsonDump(obj).decode('utf-8')
+    except TypeError:
+        return simplejson.dumps(
+            obj, cls=PumpWoodJSONEncoder, ignore_nan=True)
+
+
+def json_deserializer(value):
+    """Parse JSON with orjson falling back to stdlib json."""
+    try:
+        return orjson.loads(value)
+    except orjson.JSONDecodeError:
+        return json.loads(value)
+
+
+JSON_CODECS = {
+    'pumpwood': {'json_serializer': json_serializer},
+    'orjson': {
+        'json_serializer': json_serializer,
+        'json_deserializer': json_deserializer},
+}
+"""Engine options of each JSON codec."""
+
+
+def get_json_codec(name: str) -> dict:
+    """Return the engine options of the JSON codec.
+
+    Raises:
+        PumpWoodNotImplementedError:
+            If codec is not at JSON_CODECS.
+    """
+    codec = JSON_CODECS.get(name)
+    if codec is None:
+        msg = "json codec [{}] not implemented, use {}".format(
+            name, list(JSON_CODECS.keys()))
+        raise exceptions.PumpWoodNotImplementedError(msg)
+    return dict(codec)
@@ -0,0 +1,312 @@
+"""Metrics and tracing used to instrument Pumpwood components.
+
+`Instrumentation` keeps an in-memory aggregate of each metric and, when
+the libraries are installed, exports them as Prometheus metrics
+(`prometheus_client`) and OpenTelemetry spans (`opentelemetry-api`).
+Components are instrumented only when an `Instrumentation` object is
+passed to them, nothing is recorded otherwise. `instrumentation=True`
+uses the shared `get_default_instrumentation()`.
+
+Prometheus collectors are registered once by registry and name, so
+`Instrumentation` objects using the same registry share them.
+"""
+import time
+import threading
+import importlib
+import contextlib
+from pumpwood_communication import exceptions
+
+
+DEFAULT_LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+    10.0, 30.0, 60.0)
+"""Buckets of the latency histograms in seconds."""
+DEFAULT_SIZE_BUCKETS = (
+    1, 10, 100, 1000, 10000, 100000, 1000000)
+"""Buckets of histograms of number of rows or items."""
+
+
+_prometheus_collectors = {}
+_prometheus_lock = threading.Lock()
+_default_instrumentation = None
+_default_lock = threading.Lock()
+
+
+def _import_optional(module_name: str):
+    """Import module returning None if it is not installed."""
+    try:
+        return importlib.import_module(module_name)
+    except ImportError:
+        return None
+
+
+class Metric():
+    """Counter or histogram with labels.
+
+    Values are aggregated in memory by labels (count, sum and max) and
+    forwarded to the Prometheus metric if it is set.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple,
+                 kind: str, prometheus_metric=None):
+        """__init__.
+
+        Args:
+            name (str):
+                Name of the metric.
+            documentation (str):
+                Description of the metric.
+            labelnames (tuple):
+                Names of the labels.
+            kind (str):
+                'counter' or 'histogram'.
+            prometheus_metric:
+                Prometheus metric to forward the values.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+        self._prometheus_metric = prometheus_metric
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _record(self, value: float, labels: dict):
+        key = tuple(str(labels.get(x, '')) for x in self.labelnames)
+        with self._lock:
+            aggregate = self._values.get(key)
+            if aggregate is None:
+                aggregate = self._values[key] = {
+                    'count': 0, 'sum': 0.0, 'max': value}
+            aggregate['count'] += 1
+            aggregate['sum'] += value
+            aggregate['max'] = max(aggregate['max'], value)
+        return key
+
+    def inc(self, value: float = 1, **labels):
+        """Increment counter."""
+        key = self._record(value, labels)
+        if self._prometheus_metric is not None:
+            self._prometheus_metric.labels(*key).inc(value)
+
+    def observe(self, value: float, **labels):
+        """Observe a value of the histogram."""
+        key = self._record(value, labels)
+        if self._prometheus_metric is not None:
+            self._prometheus_metric.labels(*key).observe(value)
+
+    def values(self) -> dict:
+        """Return aggregates by labels.
+
+        Returns:
+            Dictionary with a tuple of label values as key and a dictionary
+            with count, sum and max as value. The value of counters is the
+            sum.
+        """
+        with self._lock:
+            return {key: dict(value) for key, value in self._values.items()}
+
+    def total(self, **labels) -> float:
+        """Return the sum of the values matching labels."""
+        positions = [
+            (self.labelnames.index(name), str(value))
+            for name, value in labels.items()]
+        return sum(
+            value['sum'] for key, value in self.values().items()
+            if all(key[i] == x for i, x in positions))
+
+
+class Instrumentation():
+    """Create metrics and spans exported to Prometheus and OpenTelemetry."""
+
+    def __init__(self, namespace: str = 'pumpwood', prometheus: bool = True,
+                 prometheus_registry=None, opentelemetry: bool = True,
+                 latency_buckets: tuple = DEFAULT_LATENCY_BUCKETS):
+        """__init__.
+
+        Args:
+            namespace (str):
+                Prefix of the metric names.
+            prometheus (bool):
+                Export metrics to Prometheus if `prometheus_client` is
+                installed.
+            prometheus_registry:
+                Prometheus registry, default is the global registry.
+            opentelemetry (bool):
+                Create OpenTelemetry spans if `opentelemetry-api` is
+                installed, spans are exported by the SDK configured by the
+                application.
+            latency_buckets (tuple):
+                Buckets of the latency histograms.
+        """
+        self.namespace = namespace
+        self.latency_buckets = latency_buckets
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+        self._prometheus = None
+        if prometheus:
+            self._prometheus = _import_optional('prometheus_client')
+        self._prometheus_registry = prometheus_registry
+
+        self._tracer = None
+        if opentelemetry:
+            trace = _import_optional('opentelemetry.trace')
+            if trace is not None:
+                self._tracer = trace.get_tracer('pumpwood_miscellaneous')
+
+    def _metric(self, name: str, documentation: str, labelnames: tuple,
+                kind: str, buckets: tuple = None) -> Metric:
+        full_name = '{}_{}'.format(self.namespace, name)
+        with self._lock:
+            metric = self._metrics.get(full_name)
+            if metric is not None:
+                if metric.kind != kind or \
+                        metric.labelnames != tuple(labelnames):
+                    msg = "Metric {} already created with other kind or " \
+                        "labels".format(full_name)
+                    raise exceptions.PumpWoodWrongParameters(msg)
+                return metric
+
+            prometheus_metric = None
+            if self._prometheus is not None:
+                prometheus_metric = self._prometheus_collector(
+                    full_name, documentation, labelnames, kind,
+                    buckets=buckets)
+            metric = self._metrics[full_name] = Metric(
+                name=full_name, documentation=documentation,
+                labelnames=labelnames, kind=kind,
+                prometheus_metric=prometheus_metric)
+            return metric
+
+    def _prometheus_collector(self, full_name: str, documentation: str,
+                              labelnames: tuple, kind: str,
+                              buckets: tuple = None):
+        """Return the Prometheus collector of registry, created once.
+
+        Registering the same name twice at a registry raises an error,
+        collectors are cached by registry and name.
+        """
+        registry = self._prometheus_registry
+        if registry is None:
+            registry = self._prometheus.REGISTRY
+        key = (id(registry), full_name)
+        with _prometheus_lock:
+            cached = _prometheus_collectors.get(key)
+            if cached is not None and cached[0] is registry:
+                _, cached_kind, cached_labelnames, collector = cached
+                if cached_kind != kind or \
+                        cached_labelnames != tuple(labelnames):
+                    msg = "Prometheus metric {} already registered with " \
+                        "other kind or labels".format(full_name)
+                    raise exceptions.PumpWoodWrongParameters(msg)
+                return collector
+
+            kwargs = {'registry': registry}
+            if kind == 'histogram':
+                kwargs['buckets'] = self.latency_buckets \
+                    if buckets is None else buckets
+                metric_class = self._prometheus.Histogram
+            else:
+                metric_class = self._prometheus.Counter
+            collector = metric_class(
+                full_name, documentation, labelnames=labelnames, **kwargs)
+            _prometheus_collectors[key] = (
+                registry, kind, tuple(labelnames), collector)
+            return collector
+
+    def counter(self, name: str, documentation: str,
+                labelnames: tuple = ()) -> Metric:
+        """Return the counter with name, it is created if needed."""
+        return self._metric(name, documentation, labelnames, 'counter')
+
+    def histogram(self, name: str, documentation: str,
+                  labelnames: tuple = (), buckets: tuple = None) -> Metric:
+        """Return the histogram with name, it is created if needed.
+
+        Buckets default to the latency buckets.
+        """
+        return self._metric(
+            name, documentation, labelnames, 'histogram', buckets=buckets)
+
+    @contextlib.contextmanager
+    def span(self, name: str, attributes: dict = None):
+        """Open an OpenTelemetry span, it does nothing if not available.
+
+        Yields the span (None if OpenTelemetry is not available), errors
+        are recorded at the span.
+        """
+        if self._tracer is None:
+            yield None
+            return
+        with self._tracer.start_as_current_span(
+                name, attributes=attributes) as span:
+            yield span
+
+    def record_span(self, name: str, start_time: int, end_time: int,
+                    attributes: dict = None, error: BaseException = None):
+        """Record a finished OpenTelemetry span, child of current span.
+
+        Used when the start and the end are at different callbacks (ex.:
+        SQLAlchemy events). Times are `time.time_ns()` values.
+        """
+        if self._tracer is None:
+            return
+        span = self._tracer.start_span(
+            name, start_time=start_time, attributes=attributes)
+        if error is not None:
+            span.record_exception(error)
+        span.end(end_time=end_time)
+
+    @contextlib.contextmanager
+    def timer(self, histogram: Metric, span_name: str = None,
+              attributes: dict = None, **labels):
+        """Observe the duration of the block at histogram.
+
+        A 'status' label is added with 'ok' or the name of the error
+        raised by the block if it is one of the histogram labels.
+        """
+        start = time.perf_counter()
+        status = 'ok'
+        try:
+            if span_name is None:
+                yield None
+            else:
+                with self.span(span_name, attributes=attributes) as span:
+                    yield span
+        except BaseException as e:
+            status = type(e).__name__
+            raise
+        finally:
+            if 'status' in histogram.labelnames:
+                labels['status'] = status
+            histogram.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self) -> dict:
+        """Return the aggregated values of all metrics.
+
+        Returns:
+            Dictionary by metric name with a list of dictionaries with
+            label values, count, sum and max.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        snapshot = {}
+        for metric in metrics:
+            snapshot[metric.name] = [
+                {**dict(zip(metric.labelnames, key)), **value}
+                for key, value in metric.values().items()]
+        return snapshot
+
+
+def get_default_instrumentation() -> Instrumentation:
+    """Return the shared Instrumentation used by `instrumentation=True`.
+
+    It is created on first call with default parameters (`pumpwood`
+    namespace and Prometheus global registry).
+    """
+    global _default_instrumentation
+    with _default_lock:
+        if _default_instrumentation is None:
+            _default_instrumentation = Instrumentation()
+        return _default_instrumentation
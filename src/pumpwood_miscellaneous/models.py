@@ -1,13 +1,172 @@
 """Functions and classes for flask/SQLAlchemy models."""
+import os
+import threading
+import sqlalchemy as sa
+from typing import List
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy import Column, BigInteger
+from pumpwood_communication import exceptions
+
+
+_ALLOCATORS_LOCK = threading.Lock()
+
+
+class IdAllocator():
+    """Reserve blocks of ids of a model and hand them out in process.
+
+    Ids are reserved from the sequence of the id column with
+    `SELECT nextval(seq) FROM generate_series(1, block_size)`, a single
+    round trip for a block. The increment of the sequence is not changed,
+    so other writers keep using the column default. Ids are unique but
+    may not be contiguous, unused ids of a block are lost when the
+    process ends.
+
+    On databases without sequences (SQLite at tests) blocks start after
+    the maximum id of the table, they are unique only inside the process.
+    """
+
+    def __init__(self, model, block_size: int = 1000,
+                 sequence_name: str = None):
+        """__init__.
+
+        Args:
+            model:
+                SQLAlchemy model with `id` column.
+            block_size (int):
+                Number of ids reserved at each database round trip.
+            sequence_name (str):
+                Sequence of id column, default is found with
+                `pg_get_serial_sequence`.
+        """
+        if block_size < 1:
+            msg = "block_size must be greater than 0: {}".format(block_size)
+            raise exceptions.PumpWoodWrongParameters(msg)
+        self.model = model
+        self.block_size = block_size
+        self.sequence_name = sequence_name
+        self._ids = []
+        self._last_id = 0
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def _get_sequence_name(self, session, dialect) -> str:
+        if self.sequence_name is None:
+            table_name = dialect.identifier_preparer.format_table(
+                self.model.__table__)
+            self.sequence_name = session.execute(
+                sa.text("SELECT pg_get_serial_sequence(:table, 'id')"),
+                {'table': table_name}).scalar()
+            if self.sequence_name is None:
+                msg = "Table [{}] id column has no sequence".format(
+                    table_name)
+                raise exceptions.PumpWoodNotImplementedError(msg)
+        return self.sequence_name
+
+    def _fetch_ids(self, session, n: int) -> List[int]:
+        """Reserve n ids at the database."""
+        dialect = session.get_bind(mapper=self.model).dialect
+        if dialect.name == 'postgresql':
+            # Text statements are sent to the primary by RoutingSession
+            result = session.execute(
+                sa.text(
+                    "SELECT nextval(:sequence) "
+                    "FROM generate_series(1, :n)"),
+                {'sequence': self._get_sequence_name(session, dialect),
+                 'n': n})
+            return [x[0] for x in result]
+
+        max_id = session.execute(
+            sa.select(sa.func.max(self.model.__table__.c.id))).scalar() or 0
+        start = max(max_id, self._last_id) + 1
+        self._last_id = start + n - 1
+        return list(range(start, start + n))
+
+    def allocate(self, session, n: int = 1) -> List[int]:
+        """Return n ids reserved for the model.
+
+        Args:
+            session:
+                SQLAlchemy session used to reserve a new block.
+            n (int):
+                Number of ids.
+
+        Returns:
+            List of n unique ids.
+        """
+        with self._lock:
+            # Blocks inherited from the parent process would be duplicated
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._ids = []
+            if len(self._ids) < n:
+                self._ids.extend(self._fetch_ids(
+                    session, max(self.block_size, n - len(self._ids))))
+            ids, self._ids = self._ids[:n], self._ids[n:]
+            return ids
+
+    def next_id(self, session) -> int:
+        """Return one id reserved for the model."""
+        return self.allocate(session, n=1)[0]
+
+    def assign_ids(self, session, objects: list) -> list:
+        """Set ids of objects or dictionaries that have no id.
+
+        Args:
+            session:
+                SQLAlchemy session used to reserve a new block.
+            objects (list):
+                Model objects or dictionaries of rows.
+
+        Returns:
+            The objects with ids.
+        """
+        def get_id(obj):
+            return obj.get('id') if isinstance(obj, dict) else obj.id
+
+        missing = [x for x in objects if get_id(x) is None]
+        for obj, new_id in zip(missing, self.allocate(session, len(missing))):
+            if isinstance(obj, dict):
+                obj['id'] = new_id
+            else:
+                obj.id = new_id
+        return objects
 
 
 class FlaskPumpWoodBaseModel(DeclarativeBase):
     """Flask Sqlalchemy Database Connection.
 
     - adds a id column for all models
+    - ids may be reserved in blocks with `allocate_ids` to insert
+      related objects with ids known before the insert
     """
 
     id = Column(BigInteger, primary_key=True, autoincrement=True)
     '''All tables must have primary id'''
+
+    __id_block_size__ = 1000
+    '''Number of ids reserved at each round trip by allocate_ids'''
+
+    @classmethod
+    def get_id_allocator(cls) -> IdAllocator:
+        """Return the id allocator of the model."""
+        # Stored at the class dict, subclasses have their own allocators
+        with _ALLOCATORS_LOCK:
+            allocator = cls.__dict__.get('_id_allocator')
+            if allocator is None:
+                allocator = IdAllocator(
+                    cls, block_size=cls.__id_block_size__)
+                cls._id_allocator = allocator
+            return allocator
+
+    @classmethod
+    def allocate_ids(cls, session, n: int = 1) -> List[int]:
+        """Return n ids reserved for the model.
+
+        Example:
+            >>> ids = Parent.allocate_ids(db.session, n=len(parents))
+            >>> for parent, parent_id in zip(parents, ids):
+            >>>     parent['id'] = parent_id
+            >>>     for child in parent.pop('children'):
+            >>>         child['parent_id'] = parent_id
+        """
+        return cls.get_id_allocator().allocate(session, n=n)
@@ -0,0 +1,204 @@
+"""Connection pool presets and background health checks.
+
+`pool_pre_ping` runs a `SELECT 1` at every checkout of a connection, on
+short requests it is a large part of the latency. The presets other than
+`pre_ping` disable it: idle connections are validated periodically by a
+`PoolHealthChecker` thread and statements that fail because the
+connection was lost are retried by `SQLAlchemyPostGres` sessions when
+they are the first statement of the transaction.
+
+Presets (`POOL_PRESETS`):
+- `pre_ping`: Pre ping at each checkout, no background checks.
+- `web`: Pool for API workers with many short requests.
+- `worker`: Small pool for background workers with long transactions.
+- `pgbouncer_transaction`: Small pool with short recycle for PgBouncer
+  at transaction mode, server side prepared statements are disabled
+  because statements of a session may run at different servers.
+"""
+import logging
+import threading
+import sqlalchemy as sa
+from pumpwood_communication import exceptions
+
+
+logger = logging.getLogger(__name__)
+
+POOL_PRESETS = {
+    'pre_ping': {
+        'engine_options': {'pool_pre_ping': True},
+        'health_check_interval': None,
+        'disable_prepared_statements': False},
+    'web': {
+        'engine_options': {
+            'pool_pre_ping': False, 'pool_size': 10, 'max_overflow': 20,
+            'pool_recycle': 1800, 'pool_timeout': 10},
+        'health_check_interval': 30,
+        'disable_prepared_statements': False},
+    'worker': {
+        'engine_options': {
+            'pool_pre_ping': False, 'pool_size': 2, 'max_overflow': 2,
+            'pool_recycle': 3600, 'pool_timeout': 60},
+        'health_check_interval': 60,
+        'disable_prepared_statements': False},
+    'pgbouncer_transaction': {
+        'engine_options': {
+            'pool_pre_ping': False, 'pool_size': 5, 'max_overflow': 10,
+            'pool_recycle': 300, 'pool_timeout': 10},
+        'health_check_interval': 30,
+        'disable_prepared_statements': True},
+}
+"""Engine options, health check interval and prepared statement option
+of each pool preset."""
+QUEUE_POOL_OPTIONS = (
+    'pool_size', 'max_overflow', 'pool_timeout', 'pool_use_lifo')
+"""Options valid only for queue pools (not SQLite memory pools)."""
+
+
+def get_pool_preset(name: str) -> dict:
+    """Return a copy of the pool preset.
+
+    Raises:
+        PumpWoodNotImplementedError:
+            If preset is not at POOL_PRESETS.
+    """
+    preset = POOL_PRESETS.get(name)
+    if preset is None:
+        msg = "pool preset [{}] not implemented, use {}".format(
+            name, list(POOL_PRESETS.keys()))
+        raise exceptions.PumpWoodNotImplementedError(msg)
+    return {
+        **preset, 'engine_options': dict(preset['engine_options'])}
+
+
+def apply_pool_preset(options: dict, preset: dict):
+    """Set the engine options of the preset that are not set at options.
+
+    Args:
+        options (dict):
+            Engine options with `url`, changed in place.
+        preset (dict):
+            Preset returned by `get_pool_preset`.
+    """
+    poolclass = options.get('poolclass')
+    queue_pool = poolclass is None or issubclass(poolclass, sa.pool.QueuePool)
+    for key, value in preset['engine_options'].items():
+        if key in QUEUE_POOL_OPTIONS and not queue_pool:
+            continue
+        options.setdefault(key, value)
+    if preset['disable_prepared_statements']:
+        disable_prepared_statements(options)
+
+
+def disable_prepared_statements(options: dict):
+    """Disable server side prepared statements of the driver of url.
+
+    psycopg (3) prepares statements after 5 executions and asyncpg caches
+    prepared statements, both break at PgBouncer transaction mode.
+    psycopg2 and pg8000 do not use server side prepared statements.
+    """
+    url = sa.engine.make_url(options['url'])
+    connect_args = dict(options.get('connect_args', {}))
+    if url.drivername == 'postgresql+psycopg':
+        connect_args.setdefault('prepare_threshold', None)
+    elif url.drivername == 'postgresql+asyncpg':
+        connect_args.setdefault('statement_cache_size', 0)
+        connect_args.setdefault('prepared_statement_cache_size', 0)
+    options['connect_args'] = connect_args
+
+
+class PoolHealthChecker():
+    """Validate the idle connections of an engine pool periodically.
+
+    The thread is started at the first checkout of the pool, so it runs
+    at the process (worker) that uses the engine even if the app was
+    created before forking.
+    """
+
+    def __init__(self, engine: sa.engine.Engine, interval: float = 30):
+        """__init__.
+
+        Args:
+            engine (sa.engine.Engine):
+                Engine with the pool to be checked.
+            interval (float):
+                Seconds between checks.
+        """
+        self.engine = engine
+        self.interval = interval
+        self.checks = 0
+        self.invalidated = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        sa.event.listen(engine, 'checkout', self._on_checkout)
+
+    def _on_checkout(self, dbapi_connection, connection_record,
+                     connection_proxy):
+        if self._thread is None or not self._thread.is_alive():
+            self.start()
+
+    def check(self) -> dict:
+        """Ping the idle connections, invalidating the broken ones.
+
+        Connections are checked out one at a time, so requests are not
+        left without idle connections while they are pinged. Queue pools
+        return the oldest idle connection first (FIFO), each one is
+        checked once; with `pool_use_lifo` only the most recently used is
+        checked and `pool_recycle` renews the others.
+
+        Returns:
+            Dictionary with number of connections `checked` and
+            `invalidated`.
+        """
+        pool = self.engine.pool
+        n_idle = pool.checkedin() if hasattr(pool, 'checkedin') else 0
+        checked = []
+        invalidated = 0
+        for _ in range(n_idle):
+            # Do not open new connections if requests took the idle ones
+            if pool.checkedin() == 0:
+                break
+            connection = pool.connect()
+            try:
+                dbapi_connection = connection.dbapi_connection
+                if any(x is dbapi_connection for x in checked):
+                    break
+                checked.append(dbapi_connection)
+                try:
+                    self.engine.dialect.do_ping(dbapi_connection)
+                except Exception as e:
+                    logger.info("Invalidating broken connection: %s", e)
+                    connection.invalidate(e)
+                    invalidated += 1
+            finally:
+                connection.close()
+        self.checks += 1
+        self.invalidated += invalidated
+        return {'checked': len(checked), 'invalidated': invalidated}
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.exception("Error checking connection pool: %s", e)
+
+    def start(self):
+        """Start the health check thread if it is not running."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, daemon=True,
+                name='pumpwood-pool-health')
+            self._thread.start()
+
+    def stop(self):
+        """Stop the health check thread and the checks of new checkouts."""
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        if sa.event.contains(self.engine, 'checkout', self._on_checkout):
+            sa.event.remove(self.engine, 'checkout', self._on_checkout)
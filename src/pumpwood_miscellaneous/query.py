@@ -1,13 +1,17 @@
 """Build sqlalchemy queries from filter_dict, exclude_dict and order_by."""
 import copy
-import numpy as np
-import pandas as pd
+import datetime
 from sqlalchemy.sql import operators
 from sqlalchemy import func
 from sqlalchemy import inspect
 from sqlalchemy import desc
+from sqlalchemy import and_
+from sqlalchemy import Date, DateTime
 from pumpwood_communication.exceptions import PumpWoodQueryException
-from pumpwood_communication.serializers import CompositePkBase64Converter
+
+
+DATE_PART_OPERATORS = ('year', 'month', 'day')
+"""Operators of date parts rewritten as ranges when possible."""
 
 
 def open_composite_pk(query_dict: dict, is_filter: bool) -> dict:
@@ -33,6 +37,7 @@ def open_composite_pk(query_dict: dict, is_filter: bool) -> dict:
 
     def convert_np(obj):
         """Help to treat numpy types that are not converted by SQLAlchemy."""
+        import numpy as np
         if isinstance(obj, np.generic):
             return obj.item()
         else:
@@ -53,6 +58,10 @@ def open_composite_pk(query_dict: dict, is_filter: bool) -> dict:
     for key in query_dict_keys:
         count_pk_filters = 0
         if "pk" in key:
+            # serializers import pandas, numpy and shapely, they are loaded
+            # only by queries using composite primary keys
+            from pumpwood_communication.serializers import (
+                CompositePkBase64Converter)
             if key == "pk":
                 if is_filter:
                     open_composite = CompositePkBase64Converter.load(
@@ -67,6 +76,7 @@ def open_composite_pk(query_dict: dict, is_filter: bool) -> dict:
                 del new_query_dict["pk"]
 
             elif key == "pk__in":
+                import pandas as pd
                 if is_filter:
                     open_composite = pd.DataFrame(
                             pd.Series(new_query_dict["pk__in"]).apply(
@@ -110,9 +120,66 @@ def open_composite_pk(query_dict: dict, is_filter: bool) -> dict:
     return new_query_dict
 
 
+def date_part_range(column, year, month=None, day=None):
+    """Return a half open range of the date parts or None if not possible.
+
+    `year=2024, month=2` returns `column >= 2024-02-01 AND
+    column < 2024-03-01`, that can use B-tree indexes of the column unlike
+    `extract`. None is returned if column is not a Date/DateTime column or
+    the parts are not a valid date.
+    """
+    if isinstance(column.type, DateTime):
+        is_datetime = True
+    elif isinstance(column.type, Date):
+        is_datetime = False
+    else:
+        return None
+    try:
+        year = int(year)
+        month = None if month is None else int(month)
+        day = None if day is None else int(day)
+        start = datetime.date(year, month or 1, day or 1)
+        if day is not None:
+            end = start + datetime.timedelta(days=1)
+        elif month is not None:
+            end = datetime.date(year + month // 12, month % 12 + 1, 1)
+        else:
+            end = datetime.date(year + 1, 1, 1)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    if is_datetime:
+        start = datetime.datetime.combine(start, datetime.time())
+        end = datetime.datetime.combine(end, datetime.time())
+    return and_(column >= start, column < end)
+
+
+def _year_operation(column, value):
+    clause = date_part_range(column, value)
+    if clause is None:
+        return func.extract('year', column) == value
+    return clause
+
+
+def _unaccent(value):
+    # Schema qualified names are rendered as schema.function
+    function = func
+    for name in SqlalchemyQueryMisc.unaccent_function.split('.'):
+        function = getattr(function, name)
+    return function(value)
+
+
 class SqlalchemyQueryMisc():
     """Class to help building queries with dictionary of list."""
 
+    query_cache = None
+    """Default QueryCache of cached_kward_query, None disables cache."""
+    unaccent_function = 'unaccent'
+    """SQL function of unaccent_* operators, it may be schema qualified.
+    Set `indexes.unaccent_function_name(schema)` after creating the
+    wrapper with `indexes.create_search_indexes` (or the statements of
+    `indexes.unaccent_function_statements`) so its expression indexes are
+    used."""
+
     _underscore_operators = {
         'eq': lambda c, x: operators.eq(c, x),
         'gt': lambda c, x: operators.gt(c, x),
@@ -125,33 +192,29 @@ class SqlalchemyQueryMisc():
         'icontains': lambda c, x: c.ilike('%' + x.replace('%', '%%') + '%'),
         "unaccent_icontains":
             lambda c, x: operators.contains_op(
-                func.unaccent(func.lower(c)),
-                func.unaccent(x.lower())),
+                _unaccent(func.lower(c)), _unaccent(x.lower())),
 
         'exact': lambda c, x: operators.eq(c, x),
         'iexact': lambda c, x: operators.ilike_op(c, x),
         "unaccent_iexact":
-            lambda c, x: operators.operators.eq(
-                func.unaccent(c),
-                x.lower()),
+            lambda c, x: operators.eq(
+                _unaccent(func.lower(c)), _unaccent(x.lower())),
 
         'startswith': lambda c, x: operators.startswith_op(c, x),
         'istartswith': lambda c, x: c.ilike(x.replace('%', '%%') + '%'),
         'unaccent_istartswith':
             lambda c, x: operators.startswith_op(
-                func.unaccent(func.lower(c)),
-                func.unaccent(x.replace('%', '%%') + '%')),
+                _unaccent(func.lower(c)), _unaccent(x.lower())),
 
         'endswith': lambda c, x: operators.endswith_op(c, x),
         'iendswith': lambda c, x: c.ilike('%' + x.replace('%', '%%')),
         'unaccent_iendswith':
             lambda c, x: operators.endswith_op(
-                func.unaccent(func.lower(c)),
-                func.unaccent(x.lower())),
+                _unaccent(func.lower(c)), _unaccent(x.lower())),
 
         'isnull': lambda c, x: x and c is not None or c is None,
         'range': lambda c, x: operators.between_op(c, x),
-        'year': lambda c, x: func.extract('year', c) == x,
+        'year': _year_operation,
         'month': lambda c, x: func.extract('month', c) == x,
         'day': lambda c, x: func.extract('day', c) == x,
         "json_contained_by": lambda c, x: c.contained_by(x),
@@ -334,20 +397,68 @@ class SqlalchemyQueryMisc():
                     columns_values_filter.append(
                         {'column': column[json_key].astext,
                          'operation': cls._underscore_operators[operation_key],
+                         'operation_key': operation_key,
                          'value': value})
                 else:
                     columns_values_filter.append(
                         {'column': column,
                          'operation': cls._underscore_operators[operation_key],
+                         'operation_key': operation_key,
                          'value': value})
 
         return {'models': join_models, 'columns': columns_values_filter}
 
+    @classmethod
+    def merge_date_parts(cls, columns_values_filter: list) -> list:
+        """Merge year/month/day filters of a column into a range filter.
+
+        Only `year`, `year + month` and `year + month + day` of the same
+        column are merged, month or day alone can not be a single range
+        and are kept as `extract`. Must not be used with exclude filters,
+        each exclude entry is negated on its own.
+
+        Args:
+            columns_values_filter (list):
+                'columns' of get_related_models_and_columns.
+
+        Returns:
+            list: Entries with the merged date parts.
+        """
+        parts_by_column = {}
+        for i, entry in enumerate(columns_values_filter):
+            if entry.get('operation_key') in DATE_PART_OPERATORS:
+                parts_by_column.setdefault(id(entry['column']), {})[
+                    entry['operation_key']] = i
+
+        merged = {}
+        removed = set()
+        for parts in parts_by_column.values():
+            if len(parts) == 1 or 'year' not in parts or \
+                    ('day' in parts and 'month' not in parts):
+                continue
+            column = columns_values_filter[parts['year']]['column']
+            value = {
+                key: columns_values_filter[i]['value']
+                for key, i in parts.items()}
+            if date_part_range(column, **value) is None:
+                continue
+            merged[parts['year']] = {
+                'column': column,
+                'operation': lambda c, x: date_part_range(c, **x),
+                'operation_key': 'date_range', 'value': value}
+            removed.update(parts.values())
+
+        return [
+            merged.get(i, entry)
+            for i, entry in enumerate(columns_values_filter)
+            if i in merged or i not in removed]
+
     @classmethod
     def sqlalchemy_kward_query(cls, object_model,
                                filter_dict: None | dict = None,
                                exclude_dict: None | dict = None,
-                               order_by: None | list[str] = None,):
+                               order_by: None | list[str] = None,
+                               use_primary: bool = False):
         """Build SQLAlchemy engine string according to database parameters.
 
         Args:
@@ -359,9 +470,15 @@ class SqlalchemyQueryMisc():
                 Dictionary to be used in excluding.
             order_by (list):
                 Dictionary to be used as ordering.
+            use_primary (bool):
+                Run the query at the primary even if read replicas are
+                set at SQLAlchemyPostGres.
 
         Returns:
             sqlalquemy.query: Returns an sqlalchemy with filters applied.
+            Model name and filter keys are set as execution options
+            `pumpwood_model` and `pumpwood_filter_keys` for the SQL
+            instrumentation.
 
         Examples:
         >>> query = SqlalchemyQueryMisc.sqlalchemy_kward_query(
@@ -403,12 +520,17 @@ class SqlalchemyQueryMisc():
             order_query['models'])
 
         # Join models for filters
-        q = object_model.query
+        q = object_model.query.execution_options(
+            pumpwood_model=object_model.__name__,
+            pumpwood_filter_keys=tuple(sorted(
+                set(filter_dict) | set(exclude_dict))))
+        if use_primary:
+            q = q.execution_options(use_primary=True)
         for join_models in models:
             q = q.join(join_models[0], join_models[1])
 
-        # Filter clauses
-        for fil in filter_query['columns']:
+        # Filter clauses, date parts merged into ranges that use indexes
+        for fil in cls.merge_date_parts(filter_query['columns']):
             q = q.filter(fil['operation'](fil['column'], fil['value']))
         # Exclude clauses
         for excl in exclude_query['columns']:
@@ -417,3 +539,59 @@ class SqlalchemyQueryMisc():
         for ord in order_query['columns']:
             q = q.order_by(ord['operation'](ord['column']))
         return q
+
+    @classmethod
+    def cached_kward_query(cls, object_model,
+                           filter_dict: None | dict = None,
+                           exclude_dict: None | dict = None,
+                           order_by: None | list[str] = None,
+                           limit: None | int = None,
+                           offset: None | int = None,
+                           cache=None, ttl: None | float = None,
+                           use_primary: bool = False) -> list:
+        """Run sqlalchemy_kward_query returning cached results if any.
+
+        Args:
+            object_model:
+                SQLAlchemy declarative model used on query.
+            filter_dict (dict):
+                Dictionary to be used in filtering.
+            exclude_dict (dict):
+                Dictionary to be used in excluding.
+            order_by (list):
+                Dictionary to be used as ordering.
+            limit (int):
+                Maximum number of results.
+            offset (int):
+                Number of results to skip.
+            cache (QueryCache):
+                Cache of results, default is `query_cache` attribute. If
+                both are None the query is not cached.
+            ttl (float):
+                Seconds to keep the results, default is the cache ttl.
+            use_primary (bool):
+                Run the query at the primary, results are not cached
+                since it is used to read the data just written.
+
+        Returns:
+            list: Results of the query.
+        """
+        q = cls.sqlalchemy_kward_query(
+            object_model=object_model, filter_dict=filter_dict,
+            exclude_dict=exclude_dict, order_by=order_by,
+            use_primary=use_primary)
+        if limit is not None:
+            q = q.limit(limit)
+        if offset is not None:
+            q = q.offset(offset)
+
+        cache = cls.query_cache if cache is None else cache
+        if cache is None or use_primary:
+            return q.all()
+
+        from pumpwood_miscellaneous.query_cache import canonical_query
+        description = canonical_query(
+            filter_dict=filter_dict, exclude_dict=exclude_dict,
+            order_by=order_by, limit=limit, offset=offset)
+        return cache.get_or_run(
+            q, object_model=object_model, description=description, ttl=ttl)
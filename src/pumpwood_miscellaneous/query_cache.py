@@ -0,0 +1,421 @@
+"""Result cache of sqlalchemy_kward_query with table level invalidation.
+
+Results are cached by model and a canonical description of the query
+(filter, exclude, order, limit and offset). Each table has a version
+counter at the store, the versions of the tables used by the query are
+part of the cache key, so a write to a table invalidates all cached
+queries that use it without scanning the cache. Old entries are removed
+by LRU or TTL.
+
+Table versions are incremented at session `after_flush`,
+`after_bulk_update`, `after_bulk_delete` and ORM insert/update/delete
+statements and again at `after_commit`/`after_rollback`, so queries of
+other transactions cached between the flush and the end of the
+transaction are also invalidated. Sessions with uncommitted writes do not
+use the cache. Writes that do not use a session (other services, raw SQL)
+are not seen, use TTLs compatible with them or call `invalidate_tables`.
+
+Stores:
+- `memory`: In process LRU, invalidations are seen only by the process.
+- `diskcache`: `diskcache.Cache` at a directory shared by the processes
+  of the host (package `diskcache`, extra `query_cache`).
+"""
+import os
+import json
+import time
+import pickle
+import hashlib
+import weakref
+import importlib
+import threading
+import collections
+import sqlalchemy as sa
+import sqlalchemy.orm
+from pumpwood_communication import exceptions
+
+
+DEFAULT_TTL = 300
+"""Default seconds that a result is kept at cache."""
+SESSION_TABLES_KEY = 'pumpwood_query_cache_tables'
+"""Session info key with the tables written by the transaction."""
+QUERY_CACHE_STORES = ('memory', 'diskcache')
+"""Stores implemented."""
+
+_CACHES = weakref.WeakSet()
+_EVENTS_LOCK = threading.Lock()
+_events_registered = False
+
+
+def _canonical_value(key: str, value):
+    """Return value with lists of `__in` filters sorted."""
+    if isinstance(value, (set, frozenset, tuple)):
+        value = list(value)
+    if key.endswith('__in') and isinstance(value, list):
+        try:
+            return sorted(value)
+        except TypeError:
+            return sorted(value, key=repr)
+    return value
+
+
+def _json_default(obj):
+    # Type is kept so numpy 3 and string '3' are not the same key
+    return [type(obj).__name__, str(obj)]
+
+
+def canonical_query(filter_dict: dict = None, exclude_dict: dict = None,
+                    order_by: list = None, limit: int = None,
+                    offset: int = None) -> dict:
+    """Return a canonical description of a sqlalchemy_kward_query.
+
+    Keys of filter and exclude dictionaries are sorted by the JSON dump of
+    the description and the values of `__in` filters are sorted, order_by
+    order is kept.
+    """
+    return {
+        'filter': {
+            key: _canonical_value(key, value)
+            for key, value in (filter_dict or {}).items()},
+        'exclude': {
+            key: _canonical_value(key, value)
+            for key, value in (exclude_dict or {}).items()},
+        'order_by': list(order_by or []),
+        'limit': limit, 'offset': offset}
+
+
+def _table_names(obj) -> list:
+    """Return names of tables of a table, mapper or mapped class."""
+    if isinstance(obj, sa.Table):
+        return [obj.fullname]
+    mapper = sa.inspect(obj, raiseerr=False)
+    mapper = getattr(mapper, 'mapper', mapper)
+    if mapper is None or not hasattr(mapper, 'tables'):
+        return []
+    return [table.fullname for table in mapper.tables]
+
+
+def _names(tables: list) -> set:
+    """Return names of tables given by name, table or model."""
+    names = set()
+    for table in tables:
+        names.update(
+            [table] if isinstance(table, str) else _table_names(table))
+    return names
+
+
+def get_query_tables(query) -> list:
+    """Return sorted names of the tables used by a query."""
+    tables = set()
+    for table in sa.sql.util.find_tables(
+            query.statement, include_aliases=True):
+        table = getattr(table, 'element', table)
+        if isinstance(table, sa.Table):
+            tables.add(table.fullname)
+    return sorted(tables)
+
+
+class _MemoryStore():
+    """In process LRU of pickled results with TTL."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl: float):
+        expires_at = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while self.max_entries < len(self._entries):
+                self._entries.popitem(last=False)
+
+    def get_versions(self, tables: list) -> list:
+        with self._lock:
+            return [self._versions.get(x, 0) for x in tables]
+
+    def incr_versions(self, tables: list):
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class _DiskStore():
+    """diskcache store shared by processes using the same directory."""
+
+    def __init__(self, directory: str, size_limit: int):
+        try:
+            diskcache = importlib.import_module('diskcache')
+        except ImportError:
+            msg = (
+                "Query cache store 'diskcache' needs package 'diskcache' "
+                "to be installed")
+            raise exceptions.PumpWoodNotImplementedError(msg)
+        if directory is None:
+            msg = "Query cache store 'diskcache' needs a directory"
+            raise exceptions.PumpWoodWrongParameters(msg)
+        self._cache = diskcache.Cache(
+            directory, size_limit=size_limit,
+            eviction_policy='least-recently-used')
+        # Versions are never evicted, an evicted version would be reset
+        # and old entries would be valid again
+        self._versions = diskcache.Cache(
+            os.path.join(directory, 'versions'), eviction_policy='none')
+
+    def get(self, key: str):
+        return self._cache.get(key)
+
+    def set(self, key: str, value: bytes, ttl: float):
+        self._cache.set(key, value, expire=ttl)
+
+    def get_versions(self, tables: list) -> list:
+        return [self._versions.get(x, 0) for x in tables]
+
+    def incr_versions(self, tables: list):
+        for table in tables:
+            self._versions.incr(table, default=0)
+
+    def clear(self):
+        self._cache.clear()
+
+    def __len__(self):
+        return len(self._cache)
+
+
+class QueryCache():
+    """Cache of query results invalidated by writes to their tables.
+
+    Results are pickled at the store and merged into the session of the
+    query without loading (`session.merge(obj, load=False)`), so cached
+    objects are never shared between sessions.
+
+    Example:
+        >>> SqlalchemyQueryMisc.query_cache = QueryCache(ttl=600)
+        >>> results = SqlalchemyQueryMisc.cached_kward_query(
+                object_model=DescriptionAttribute,
+                filter_dict={'dimension__in': ['a', 'b']})
+    """
+
+    def __init__(self, store: str = 'memory', ttl: float = DEFAULT_TTL,
+                 max_entries: int = 1024, directory: str = None,
+                 size_limit: int = 2 ** 30):
+        """__init__.
+
+        Args:
+            store (str):
+                Store of the results, one of `QUERY_CACHE_STORES`.
+            ttl (float):
+                Default seconds that a result is kept, None to keep
+                until evicted or invalidated.
+            max_entries (int):
+                Maximum number of results of `memory` store.
+            directory (str):
+                Directory of `diskcache` store.
+            size_limit (int):
+                Maximum size in bytes of `diskcache` store.
+
+        Raises:
+            PumpWoodNotImplementedError:
+                If store is not at QUERY_CACHE_STORES or diskcache is not
+                installed.
+        """
+        if store == 'memory':
+            self.store = _MemoryStore(max_entries=max_entries)
+        elif store == 'diskcache':
+            self.store = _DiskStore(
+                directory=directory, size_limit=size_limit)
+        else:
+            msg = "query cache store [{}] not implemented, use {}".format(
+                store, list(QUERY_CACHE_STORES))
+            raise exceptions.PumpWoodNotImplementedError(msg)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        _register_events()
+        _CACHES.add(self)
+
+    def make_key(self, object_model, description: dict,
+                 tables: list) -> str:
+        """Return the key of a query with current versions of tables."""
+        key_data = {
+            'model': '{}.{}'.format(
+                object_model.__module__, object_model.__qualname__),
+            'query': description,
+            'tables': tables,
+            'versions': self.store.get_versions(tables)}
+        dump = json.dumps(key_data, sort_keys=True, default=_json_default)
+        return hashlib.sha256(dump.encode('utf-8')).hexdigest()
+
+    def get_or_run(self, query, object_model, description: dict,
+                   ttl: float = None) -> list:
+        """Return cached results of query or run and cache it.
+
+        Args:
+            query:
+                SQLAlchemy query of object_model.
+            object_model:
+                SQLAlchemy model of the query.
+            description (dict):
+                Canonical description of the query (`canonical_query`).
+            ttl (float):
+                Seconds to keep the results, default is the cache ttl.
+
+        Returns:
+            List of query results.
+        """
+        # Transactions with uncommitted writes must not read or store
+        # results, other sessions would see the dirty rows
+        session = query.session
+        if _has_writes(session):
+            return query.all()
+
+        # Versions are read before the query, results of a query that
+        # runs concurrently to a write are stored with old versions
+        key = self.make_key(
+            object_model, description, get_query_tables(query))
+        cached = self.store.get(key)
+        if cached is not None:
+            self.hits += 1
+            return [
+                session.merge(x, load=False)
+                if hasattr(x, '_sa_instance_state') else x
+                for x in pickle.loads(cached)]
+
+        self.misses += 1
+        results = query.all()
+        # Query may have autoflushed pending objects
+        if _has_writes(session):
+            return results
+        self.store.set(
+            key, pickle.dumps(results, protocol=pickle.HIGHEST_PROTOCOL),
+            self.ttl if ttl is None else ttl)
+        return results
+
+    def invalidate(self, tables: list):
+        """Invalidate cached results of queries using the tables.
+
+        Args:
+            tables (list):
+                Names of tables (`schema.table`), tables or models.
+        """
+        names = _names(tables)
+        if names:
+            self.store.incr_versions(sorted(names))
+            self.invalidations += 1
+
+    def clear(self):
+        """Remove all cached results."""
+        self.store.clear()
+
+    def stats(self) -> dict:
+        """Return hits, misses, invalidations and number of entries."""
+        return {
+            'hits': self.hits, 'misses': self.misses,
+            'invalidations': self.invalidations,
+            'entries': len(self.store)}
+
+
+def invalidate_tables(tables: list, session=None):
+    """Invalidate the tables at all query caches.
+
+    Args:
+        tables (list):
+            Names of tables, tables or models.
+        session:
+            Session of the write, tables are invalidated again when it
+            commits.
+    """
+    names = _names(tables)
+    if not names:
+        return
+    if session is not None:
+        session.info.setdefault(SESSION_TABLES_KEY, set()).update(names)
+    for cache in list(_CACHES):
+        cache.invalidate(names)
+
+
+def _has_writes(session) -> bool:
+    """Return True if the session has uncommitted or pending writes."""
+    return bool(
+        session.info.get(SESSION_TABLES_KEY) or session.new or
+        session.dirty or session.deleted)
+
+
+def _flushed_tables(session) -> set:
+    tables = set()
+    for obj in list(session.new) + list(session.dirty) + \
+            list(session.deleted):
+        mapper = sa.inspect(obj).mapper
+        tables.update(x.fullname for x in mapper.tables)
+        for relationship in mapper.relationships:
+            if relationship.secondary is not None:
+                tables.update(_table_names(relationship.secondary))
+    return tables
+
+
+def _after_flush(session, flush_context):
+    # new, dirty and deleted still have the pre-flush state
+    invalidate_tables(_flushed_tables(session), session=session)
+
+
+def _after_bulk(bulk_context):
+    invalidate_tables(
+        _table_names(bulk_context.mapper), session=bulk_context.session)
+
+
+def _do_orm_execute(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or \
+            orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, 'table', None)
+        if table is not None:
+            invalidate_tables(
+                _table_names(table), session=orm_execute_state.session)
+
+
+def _after_commit(session):
+    tables = session.info.pop(SESSION_TABLES_KEY, None)
+    if tables:
+        for cache in list(_CACHES):
+            cache.invalidate(tables)
+
+
+def _after_rollback(session):
+    # Results cached after the flush may have the rolled back rows
+    _after_commit(session)
+
+
+def _register_events():
+    """Listen to writes of all sessions, once per process."""
+    global _events_registered
+    with _EVENTS_LOCK:
+        if _events_registered:
+            return
+        session_class = sa.orm.Session
+        sa.event.listen(session_class, 'after_flush', _after_flush)
+        sa.event.listen(session_class, 'after_bulk_update', _after_bulk)
+        sa.event.listen(session_class, 'after_bulk_delete', _after_bulk)
+        sa.event.listen(session_class, 'do_orm_execute', _do_orm_execute)
+        sa.event.listen(session_class, 'after_commit', _after_commit)
+        sa.event.listen(session_class, 'after_rollback', _after_rollback)
+        _events_registered = True
@@ -0,0 +1,240 @@
+"""Read replica routing of SQLAlchemyPostGres sessions.
+
+`ReplicaRouter` holds the engines of the read replicas and chooses one of
+the healthy replicas for each read (round robin or least latency). The
+replicas are checked periodically by a background thread with a
+`SELECT 1`, replicas that fail a check or a statement are ejected until
+a health check succeeds again.
+
+`RoutingSession` sends the SELECT statements of the default bind to the
+replicas. After a write (flush, insert, update, delete or text statement)
+the session is pinned to the primary, so the rest of the request reads
+its own writes. Flask-SQLAlchemy removes the session at the end of the
+request (app context), so the next request is routed again.
+
+Queries may be forced to the primary with the `use_primary` execution
+option or with `SQLAlchemyPostGres.use_primary()`.
+"""
+import time
+import logging
+import threading
+import sqlalchemy as sa
+from flask_sqlalchemy.session import Session
+from pumpwood_communication import exceptions
+
+
+logger = logging.getLogger(__name__)
+
+USE_PRIMARY_OPTION = 'use_primary'
+"""Execution option that forces a statement to the primary."""
+PINNED_INFO_KEY = 'pumpwood_use_primary'
+"""Session info key set when the session is pinned to the primary."""
+REPLICA_SELECTIONS = ('round_robin', 'least_latency')
+"""Strategies to choose a replica for each read."""
+
+
+class _Replica():
+    """State of a replica engine."""
+
+    def __init__(self, name: str, engine: sa.engine.Engine):
+        self.name = name
+        self.engine = engine
+        self.healthy = True
+        self.latency = None
+        self.failures = 0
+        self.ejected_at = None
+        self.last_error = None
+
+    def to_dict(self) -> dict:
+        return {
+            'name': self.name, 'healthy': self.healthy,
+            'latency': self.latency, 'failures': self.failures,
+            'ejected_at': self.ejected_at, 'last_error': self.last_error}
+
+
+class ReplicaRouter():
+    """Choose healthy read replicas and check their health."""
+
+    def __init__(self, engines: dict, selection: str = 'round_robin',
+                 health_check_interval: float = 10,
+                 latency_smoothing: float = 0.3):
+        """__init__.
+
+        Args:
+            engines (dict):
+                Replica engines by name.
+            selection (str):
+                'round_robin' or 'least_latency', least latency uses the
+                smoothed latency of the health checks.
+            health_check_interval (float):
+                Seconds between health checks of the replicas, the
+                background thread is not started if None or 0.
+            latency_smoothing (float):
+                Weight of the last health check latency at the smoothed
+                latency.
+        """
+        if selection not in REPLICA_SELECTIONS:
+            msg = "replica selection [{}] not implemented, use {}".format(
+                selection, REPLICA_SELECTIONS)
+            raise exceptions.PumpWoodNotImplementedError(msg)
+        self.selection = selection
+        self.health_check_interval = health_check_interval
+        self.latency_smoothing = latency_smoothing
+        self.replicas = [
+            _Replica(name=name, engine=engine)
+            for name, engine in engines.items()]
+        self._lock = threading.Lock()
+        self._next = 0
+        self._stop = threading.Event()
+        self._thread = None
+        for replica in self.replicas:
+            sa.event.listen(
+                replica.engine, 'handle_error',
+                self._make_error_listener(replica))
+
+    def _make_error_listener(self, replica: _Replica):
+        def handle_error(context):
+            if context.is_disconnect or isinstance(
+                    context.sqlalchemy_exception, sa.exc.OperationalError):
+                self.eject(replica, context.original_exception)
+        return handle_error
+
+    def healthy_replicas(self) -> list:
+        """Return the replicas that are not ejected."""
+        return [x for x in self.replicas if x.healthy]
+
+    def choose(self) -> sa.engine.Engine:
+        """Return the engine of a healthy replica, None if all are ejected.
+
+        The health check thread is started at the first call, so it runs
+        at the process (worker) that uses the replicas.
+        """
+        self.start()
+        with self._lock:
+            healthy = self.healthy_replicas()
+            if not healthy:
+                return None
+            if self.selection == 'least_latency':
+                return min(
+                    healthy, key=lambda x: (
+                        float('inf') if x.latency is None
+                        else x.latency)).engine
+            replica = healthy[self._next % len(healthy)]
+            self._next += 1
+            return replica.engine
+
+    def eject(self, replica: _Replica, error: Exception = None):
+        """Remove replica from routing until a health check succeeds."""
+        with self._lock:
+            if replica.healthy:
+                logger.warning(
+                    "Ejecting read replica [%s]: %s", replica.name, error)
+            replica.healthy = False
+            replica.failures += 1
+            replica.ejected_at = time.time()
+            replica.last_error = None if error is None else str(error)
+
+    def check_replica(self, replica: _Replica) -> bool:
+        """Run a `SELECT 1` at replica, updating its health and latency."""
+        start = time.perf_counter()
+        try:
+            with replica.engine.connect() as connection:
+                connection.execute(sa.text('SELECT 1'))
+        except Exception as e:
+            self.eject(replica, e)
+            return False
+
+        latency = time.perf_counter() - start
+        with self._lock:
+            if not replica.healthy:
+                logger.info("Read replica [%s] is healthy", replica.name)
+            replica.healthy = True
+            replica.ejected_at = None
+            replica.latency = latency if replica.latency is None else (
+                self.latency_smoothing * latency +
+                (1 - self.latency_smoothing) * replica.latency)
+        return True
+
+    def check_replicas(self) -> list:
+        """Check all replicas, returning their state."""
+        for replica in self.replicas:
+            self.check_replica(replica)
+        return self.status()
+
+    def status(self) -> list:
+        """Return the state of the replicas."""
+        with self._lock:
+            return [x.to_dict() for x in self.replicas]
+
+    def _run_health_checks(self):
+        while not self._stop.wait(self.health_check_interval):
+            try:
+                self.check_replicas()
+            except Exception as e:
+                logger.exception("Error checking read replicas: %s", e)
+
+    def start(self):
+        """Start the health check thread if it is not running."""
+        thread = self._thread
+        if not self.health_check_interval or (
+                thread is not None and thread.is_alive()):
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run_health_checks, daemon=True,
+                name='pumpwood-replica-health')
+            self._thread.start()
+
+    def stop(self):
+        """Stop the health check thread."""
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def dispose(self):
+        """Stop health checks and dispose the replica engines."""
+        self.stop()
+        for replica in self.replicas:
+            replica.engine.dispose()
+
+
+def _is_read(clause) -> bool:
+    """Check if statement is a SELECT without FOR UPDATE."""
+    return (
+        clause is not None and getattr(clause, 'is_select', False) and
+        getattr(clause, '_for_update_arg', None) is None)
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session routing reads to the read replicas."""
+
+    def pin_primary(self):
+        """Send all following statements of the session to the primary."""
+        self.info[PINNED_INFO_KEY] = True
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        """Return the primary or a replica engine for the statement.
+
+        Only statements of the default bind are routed, binds of other
+        bind keys are returned as they are.
+        """
+        engine = super().get_bind(
+            mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is not None or self.info.get(PINNED_INFO_KEY):
+            return engine
+
+        router = self._db.get_replica_router()
+        if router is None or engine is not self._db.engines.get(None):
+            return engine
+        if not _is_read(clause):
+            # Writes pin the session for read your writes
+            self.pin_primary()
+            return engine
+        if clause.get_execution_options().get(USE_PRIMARY_OPTION):
+            return engine
+        return router.choose() or engine
+
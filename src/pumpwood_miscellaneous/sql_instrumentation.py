@@ -0,0 +1,287 @@
+"""Instrumentation of SQL statements of SQLAlchemy engines.
+
+`SQLInstrumentation` listens to the events of the engines of
+`SQLAlchemyPostGres` recording the latency and the rows of each
+statement, the time to get a connection from the pool and the checkouts.
+Statements of `sqlalchemy_kward_query` have the execution options
+`pumpwood_model` and `pumpwood_filter_keys`, used as label and span
+attributes (filter values are never recorded).
+
+Statements slower than the threshold are kept at `slow_queries` and
+logged. A sample of the slow SELECT statements of PostgreSQL engines is
+explained at a background thread using another connection of the pool,
+one at a time, so the plan is captured without adding latency to the
+request. Only statements of `sqlalchemy_kward_query` (with
+`pumpwood_model`) without locking clauses are explained with
+`EXPLAIN (ANALYZE, BUFFERS)`, which runs the query again; other SELECT
+statements may have side effects (nextval, advisory locks, pg_notify) and
+get a plain `EXPLAIN`. Keep the sample rate low at busy databases.
+
+Metrics (with `pumpwood` namespace):
+- `pumpwood_sql_statement_seconds`: Histogram by engine, operation, model
+  and status.
+- `pumpwood_sql_statement_rows`: Histogram of rows returned or affected
+  by engine, operation and model.
+- `pumpwood_sql_pool_wait_seconds`: Histogram of the time to get a
+  connection from the pool (waiting or opening it) by engine.
+- `pumpwood_sql_pool_checkouts_total`: Counter by engine.
+- `pumpwood_sql_slow_queries_total`: Counter by engine and model.
+"""
+import re
+import time
+import random
+import logging
+import datetime
+import threading
+import collections
+import sqlalchemy as sa
+from pumpwood_communication import exceptions
+from pumpwood_miscellaneous.metrics import (
+    Instrumentation, DEFAULT_SIZE_BUCKETS, get_default_instrumentation)
+
+
+logger = logging.getLogger(__name__)
+
+MODEL_OPTION = 'pumpwood_model'
+"""Execution option with the model name of the statement."""
+FILTER_KEYS_OPTION = 'pumpwood_filter_keys'
+"""Execution option with the filter and exclude keys of the statement."""
+SKIP_OPTION = 'pumpwood_skip_instrumentation'
+"""Execution option to not instrument the statements of a connection."""
+OPERATIONS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'COPY')
+"""Operations used as label, others are labeled 'OTHER'."""
+
+_START_KEY = 'pumpwood_statement_start'
+_LOCKING_CLAUSE = re.compile(
+    r'\bFOR\s+(UPDATE|NO\s+KEY\s+UPDATE|SHARE|KEY\s+SHARE)\b',
+    re.IGNORECASE)
+
+
+def _get_operation(statement: str) -> str:
+    words = statement.lstrip(' (\n\t').split(None, 1)
+    operation = words[0].upper() if words else ''
+    return operation if operation in OPERATIONS else 'OTHER'
+
+
+class SQLInstrumentation():
+    """Record metrics, spans and slow queries of SQLAlchemy engines."""
+
+    def __init__(self, instrumentation: Instrumentation = None,
+                 slow_query_threshold: float = 1.0,
+                 explain_sample_rate: float = 0.1,
+                 explain_timeout: float = 30,
+                 max_slow_queries: int = 100):
+        """__init__.
+
+        Args:
+            instrumentation (Instrumentation):
+                Instrumentation used to create the metrics, default is
+                the shared `get_default_instrumentation()`.
+            slow_query_threshold (float):
+                Seconds above which a statement is a slow query, None to
+                not capture slow queries.
+            explain_sample_rate (float):
+                Fraction of the slow SELECT statements of PostgreSQL that
+                are explained, 0 to disable EXPLAIN.
+            explain_timeout (float):
+                Statement timeout in seconds of EXPLAIN.
+            max_slow_queries (int):
+                Number of the last slow queries kept.
+        """
+        if not 0 <= explain_sample_rate <= 1:
+            msg = "explain_sample_rate must be between 0 and 1: {}".format(
+                explain_sample_rate)
+            raise exceptions.PumpWoodWrongParameters(msg)
+        if instrumentation is None:
+            instrumentation = get_default_instrumentation()
+        self.instrumentation = instrumentation
+        self.slow_query_threshold = slow_query_threshold
+        self.explain_sample_rate = explain_sample_rate
+        self.explain_timeout = explain_timeout
+        self._slow_queries = collections.deque(maxlen=max_slow_queries)
+        self._explain_lock = threading.Lock()
+
+        self.statement_seconds = instrumentation.histogram(
+            'sql_statement_seconds', 'Latency of SQL statements',
+            ('engine', 'operation', 'model', 'status'))
+        self.statement_rows = instrumentation.histogram(
+            'sql_statement_rows',
+            'Rows returned or affected by SQL statements',
+            ('engine', 'operation', 'model'), buckets=DEFAULT_SIZE_BUCKETS)
+        self.pool_wait_seconds = instrumentation.histogram(
+            'sql_pool_wait_seconds',
+            'Time to get a connection from the pool', ('engine', ))
+        self.pool_checkouts = instrumentation.counter(
+            'sql_pool_checkouts_total', 'Checkouts of pool connections',
+            ('engine', ))
+        self.slow_query_count = instrumentation.counter(
+            'sql_slow_queries_total', 'Statements slower than threshold',
+            ('engine', 'model'))
+
+    def attach(self, engine: sa.engine.Engine, name: str = 'default'):
+        """Listen to the statements and the pool of the engine.
+
+        Args:
+            engine (sa.engine.Engine):
+                Engine to be instrumented.
+            name (str):
+                Name of the engine used as label.
+        """
+        def before_cursor_execute(conn, cursor, statement, parameters,
+                                  context, executemany):
+            if not conn.get_execution_options().get(SKIP_OPTION):
+                conn.info.setdefault(_START_KEY, []).append(
+                    (time.perf_counter(), time.time_ns()))
+
+        def after_cursor_execute(conn, cursor, statement, parameters,
+                                 context, executemany):
+            if conn.get_execution_options().get(SKIP_OPTION):
+                return
+            starts = conn.info.get(_START_KEY)
+            if starts:
+                self._record(
+                    engine=engine, name=name, start=starts.pop(),
+                    statement=statement, parameters=parameters,
+                    context=context, executemany=executemany,
+                    rowcount=cursor.rowcount)
+
+        def handle_error(exception_context):
+            conn = exception_context.connection
+            if conn is None or conn.get_execution_options().get(SKIP_OPTION):
+                return
+            starts = conn.info.get(_START_KEY)
+            if starts and exception_context.statement is not None:
+                self._record(
+                    engine=engine, name=name, start=starts.pop(),
+                    statement=exception_context.statement,
+                    parameters=exception_context.parameters,
+                    context=exception_context.execution_context,
+                    executemany=False, rowcount=-1,
+                    error=exception_context.original_exception)
+
+        def checkout(dbapi_connection, connection_record, connection_proxy):
+            self.pool_checkouts.inc(engine=name)
+            # Engine.dispose replaces the pool
+            self._wrap_pool(engine.pool, name)
+
+        sa.event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        sa.event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+        sa.event.listen(engine, 'handle_error', handle_error)
+        sa.event.listen(engine, 'checkout', checkout)
+        self._wrap_pool(engine.pool, name)
+
+    def _wrap_pool(self, pool, name: str):
+        """Time pool.connect, used by the engine to get connections."""
+        if getattr(pool, '_pumpwood_instrumented', False):
+            return
+        connect = pool.connect
+
+        def timed_connect():
+            start = time.perf_counter()
+            try:
+                return connect()
+            finally:
+                self.pool_wait_seconds.observe(
+                    time.perf_counter() - start, engine=name)
+
+        pool.connect = timed_connect
+        pool._pumpwood_instrumented = True
+
+    def _record(self, engine, name: str, start: tuple, statement: str,
+                parameters, context, executemany: bool, rowcount: int,
+                error: BaseException = None):
+        duration = time.perf_counter() - start[0]
+        options = {} if context is None else context.execution_options
+        model = options.get(MODEL_OPTION, '')
+        filter_keys = options.get(FILTER_KEYS_OPTION, ())
+        operation = _get_operation(statement)
+        status = 'ok' if error is None else type(error).__name__
+
+        self.statement_seconds.observe(
+            duration, engine=name, operation=operation, model=model,
+            status=status)
+        if error is None and rowcount is not None and 0 <= rowcount:
+            self.statement_rows.observe(
+                rowcount, engine=name, operation=operation, model=model)
+        attributes = {
+            'db.system': engine.dialect.name, 'db.statement': statement,
+            'db.operation': operation, 'pumpwood.engine': name}
+        if model:
+            attributes['pumpwood.model'] = model
+            attributes['pumpwood.filter_keys'] = list(filter_keys)
+        self.instrumentation.record_span(
+            'sql ' + operation, start_time=start[1],
+            end_time=start[1] + int(duration * 1e9),
+            attributes=attributes, error=error)
+
+        if error is None and self.slow_query_threshold is not None and \
+                self.slow_query_threshold <= duration:
+            self._slow_query(
+                engine=engine, name=name, statement=statement,
+                parameters=parameters, duration=duration, model=model,
+                filter_keys=filter_keys, rowcount=rowcount,
+                explain=(
+                    not executemany and operation == 'SELECT' and
+                    not options.get('stream_results')))
+
+    def _slow_query(self, engine, name: str, statement: str, parameters,
+                    duration: float, model: str, filter_keys: tuple,
+                    rowcount: int, explain: bool):
+        self.slow_query_count.inc(engine=name, model=model)
+        record = {
+            'created_at': datetime.datetime.now(
+                datetime.timezone.utc).isoformat(),
+            'engine': name, 'model': model,
+            'filter_keys': list(filter_keys), 'statement': statement,
+            'seconds': duration, 'rows': rowcount, 'plan': None,
+            'analyzed': False}
+        self._slow_queries.append(record)
+        logger.warning(
+            "Slow query %.3fs engine=%s model=%s filter_keys=%s: %s",
+            duration, name, model, list(filter_keys), statement)
+
+        explain = explain and engine.dialect.name == 'postgresql' and \
+            random.random() < self.explain_sample_rate
+        # ANALYZE executes the statement again, only for queries built by
+        # sqlalchemy_kward_query that do not lock rows
+        analyze = bool(model) and _LOCKING_CLAUSE.search(statement) is None
+        # One EXPLAIN at a time, others are not sampled
+        if explain and self._explain_lock.acquire(blocking=False):
+            thread = threading.Thread(
+                target=self._explain, daemon=True,
+                name='pumpwood-sql-explain',
+                args=(engine, record, statement, parameters, analyze))
+            thread.start()
+
+    def _explain(self, engine, record: dict, statement: str, parameters,
+                 analyze: bool):
+        """Run EXPLAIN of statement storing the plan at record."""
+        options = 'ANALYZE, BUFFERS, FORMAT JSON' if analyze \
+            else 'FORMAT JSON'
+        try:
+            with engine.connect() as conn:
+                conn = conn.execution_options(**{SKIP_OPTION: True})
+                conn.exec_driver_sql(
+                    "SET LOCAL statement_timeout = {:d}".format(
+                        int(self.explain_timeout * 1000)))
+                plan = conn.exec_driver_sql(
+                    "EXPLAIN ({}) {}".format(options, statement),
+                    parameters).scalar()
+                conn.rollback()
+            record['plan'] = plan
+            record['analyzed'] = analyze
+            logger.info("Plan of slow query: %s\n%s", statement, plan)
+        except Exception as e:
+            logger.info("Error explaining slow query: %s", e)
+        finally:
+            self._explain_lock.release()
+
+    def slow_queries(self) -> list:
+        """Return the last slow queries, with plan if explained.
+
+        Returns:
+            List of dictionaries with created_at, engine, model,
+            filter_keys, statement, seconds, rows, plan and analyzed
+            (plan of EXPLAIN ANALYZE).
+        """
+        return [dict(x) for x in self._slow_queries]
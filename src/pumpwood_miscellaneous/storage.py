@@ -2,15 +2,64 @@
 import io
 import datetime
 import os
+import importlib
+from typing import Iterator, List
 from werkzeug.utils import secure_filename
-from pumpwood_miscellaneous.storage_connectors.google import (
-    PumpWoodGoogleBucket)
-from pumpwood_miscellaneous.storage_connectors.local import (
-    PumpWoodLocalBucket)
-from pumpwood_miscellaneous.storage_connectors.aws import (
-    PumpWoodAwsS3)
-from pumpwood_miscellaneous.storage_connectors.azure import (
-    PumpWoodAzureStorage)
+from pumpwood_communication import exceptions
+from pumpwood_miscellaneous.storage_connectors._policy import (
+    PolicyBucket, StoragePolicy)
+from pumpwood_miscellaneous.storage_connectors._cas import (
+    ContentAddressedBucket)
+from pumpwood_miscellaneous.storage_connectors._compression import (
+    CompressedBucket)
+from pumpwood_miscellaneous.storage_connectors import _dataframe
+from pumpwood_miscellaneous.storage_connectors._file import open_file
+from pumpwood_miscellaneous.storage_connectors._signed_url import (
+    TokenUrlSigner, create_signed_url_blueprint)
+from pumpwood_miscellaneous.storage_connectors._sync import StorageSync
+from pumpwood_miscellaneous.storage_connectors._checkpoint import (
+    UploadCheckpointStore, DEFAULT_CHECKPOINT_PATH)
+from pumpwood_miscellaneous.storage_connectors._instrumentation import (
+    InstrumentedBucket)
+from pumpwood_miscellaneous.metrics import get_default_instrumentation
+
+
+STORAGE_CONNECTORS = {
+    'google_bucket': (
+        'pumpwood_miscellaneous.storage_connectors.google',
+        'PumpWoodGoogleBucket'),
+    'aws_s3': (
+        'pumpwood_miscellaneous.storage_connectors.aws', 'PumpWoodAwsS3'),
+    'azure_storage': (
+        'pumpwood_miscellaneous.storage_connectors.azure',
+        'PumpWoodAzureStorage'),
+    'local': (
+        'pumpwood_miscellaneous.storage_connectors.local',
+        'PumpWoodLocalBucket'),
+    'memory': (
+        'pumpwood_miscellaneous.storage_connectors.memory',
+        'PumpWoodMemoryBucket'),
+}
+"""Module and class of the connector of each storage_type, connectors
+are imported only when used so the SDKs of other providers are not
+loaded."""
+
+
+def get_connector_class(storage_type: str):
+    """Import and return the connector class of storage_type.
+
+    Args:
+        storage_type (str):
+            Key of STORAGE_CONNECTORS.
+
+    Raises:
+        Exception('Storage {storage_type} not implemented'):
+            If storage_type is not at STORAGE_CONNECTORS.
+    """
+    if storage_type not in STORAGE_CONNECTORS:
+        raise Exception('Storage %s not implemented' % storage_type)
+    module_name, class_name = STORAGE_CONNECTORS[storage_type]
+    return getattr(importlib.import_module(module_name), class_name)
 
 
 def allowed_extension(filename, allowed_extensions,
@@ -36,26 +85,107 @@ class PumpWoodStorage():
     'Storage object'
     base_path = None
     'Path to be added to begin of the file'
+    checkpoint_store = None
+    'Store of the resumable upload checkpoints'
+    url_signer = None
+    'Signer of token URLs for storages without presigned URLs'
 
     def __init__(self, storage_type: str = None, base_path: str = None, *args,
                  **kwargs):
-        """Start the PumpWood storage class."""
+        """Start the PumpWood storage class.
+
+        Args:
+            storage_type (str):
+                Storage backend, 'google_bucket', 'aws_s3', 'azure_storage',
+                'local' or 'memory'.
+            base_path (str):
+                Path to be added to begin of the files.
+            *args:
+                Not used.
+            **kwargs:
+                Backend arguments (bucket_name, folder_path, use_mmap,
+                profile) and storage options:
+                - **retry_policy (StoragePolicy | dict | True):** Retry,
+                    timeout and hedging policy applied to each storage
+                    request, a dict is used as StoragePolicy arguments
+                    and True uses the default policy, retries of the SDK
+                    are disabled. Default None keeps the SDK behavior.
+                - **content_addressed (bool):** Store file content once by
+                    SHA256 digest and write logical files as pointers,
+                    default False.
+                - **cas_prefix (str):** Path used to store content
+                    addressed blobs, default '.pumpwood-cas'.
+                - **compression (str):** Compress files with 'zstd', 'gzip'
+                    or 'lz4' codec, default None (no compression).
+                - **compression_level (int):** Compression level, default
+                    is the codec default.
+                - **compression_min_size (int):** Files smaller than this
+                    are not compressed on write_file, default 1024 bytes.
+                - **upload_checkpoint_path (str):** Folder used to save
+                    checkpoints of resumable uploads, default to a folder
+                    at system temporary directory. It is created on the
+                    first resumable upload.
+                - **url_secret_key (str):** Secret used to sign token URLs
+                    of storages without presigned URLs (local, memory).
+                - **url_base (str):** URL where the blueprint of
+                    `create_url_blueprint` is registered.
+                - **instrumentation (Instrumentation | True):** Record
+                    latency, bytes, provider requests and cache metrics
+                    of the storage operations, True uses the shared
+                    `get_default_instrumentation()`. Default None
+                    does not instrument the storage.
+        """
         if storage_type is not None:
             self.base_path = base_path
-            if storage_type == 'google_bucket':
-                self.storage_object = PumpWoodGoogleBucket(
-                    bucket_name=kwargs['bucket_name'])
-            elif storage_type == 'aws_s3':
-                self.storage_object = PumpWoodAwsS3(
-                    bucket_name=kwargs['bucket_name'])
-            elif storage_type == 'azure_storage':
-                self.storage_object = PumpWoodAzureStorage(
-                    bucket_name=kwargs['bucket_name'])
-            elif storage_type == 'local':
-                self.storage_object = PumpWoodLocalBucket(
-                    folder_path=kwargs['folder_path'])
+            self._storage_key = '{}:{}'.format(
+                storage_type,
+                kwargs.get('bucket_name', kwargs.get('folder_path')))
+            # Checkpoint store is created on first resumable upload
+            self.checkpoint_store = None
+            self._checkpoint_path = kwargs.get(
+                'upload_checkpoint_path', DEFAULT_CHECKPOINT_PATH)
+            connector_class = get_connector_class(storage_type)
+            if storage_type == 'local':
+                self.storage_object = connector_class(
+                    folder_path=kwargs['folder_path'],
+                    use_mmap=kwargs.get('use_mmap', False))
+            elif storage_type == 'memory':
+                self.storage_object = connector_class(
+                    bucket_name=kwargs.get('bucket_name', 'default'),
+                    profile=kwargs.get('profile'))
             else:
-                raise Exception('Storage %s not implemented' % storage_type)
+                # Requests are retried by the policy, not by the SDK
+                self.storage_object = connector_class(
+                    bucket_name=kwargs['bucket_name'],
+                    sdk_retries=kwargs.get('retry_policy') is None)
+            self._connector = self.storage_object
+            if kwargs.get('url_secret_key') is not None:
+                self.url_signer = TokenUrlSigner(
+                    secret_key=kwargs['url_secret_key'],
+                    base_url=kwargs['url_base'])
+
+            if kwargs.get('retry_policy') is not None:
+                self.storage_object = PolicyBucket(
+                    storage_object=self.storage_object,
+                    policy=StoragePolicy.from_value(kwargs['retry_policy']))
+            if kwargs.get('content_addressed', False):
+                self.storage_object = ContentAddressedBucket(
+                    storage_object=self.storage_object,
+                    prefix=kwargs.get('cas_prefix', '.pumpwood-cas'))
+            if kwargs.get('compression') is not None:
+                self.storage_object = CompressedBucket(
+                    storage_object=self.storage_object,
+                    codec=kwargs['compression'],
+                    level=kwargs.get('compression_level'),
+                    min_size=kwargs.get('compression_min_size', 1024))
+            if kwargs.get('instrumentation') is not None:
+                instrumentation = kwargs['instrumentation']
+                if instrumentation is True:
+                    instrumentation = get_default_instrumentation()
+                self.storage_object = InstrumentedBucket(
+                    storage_object=self.storage_object,
+                    backend=storage_type, instrumentation=instrumentation,
+                    connector=self._connector)
 
     def init(self, storage_type: str, base_path: str = None, *args, **kwargs):
         """Start the PumpWood storage class object."""
@@ -97,8 +227,8 @@ class PumpWoodStorage():
             List of all files under path (sub-folders).
         """
         if update_file_path:
-            updated_path = self._update_file_path(path)
-        return self.storage_object.list_files(path=updated_path)
+            path = self._update_file_path(path)
+        return self.storage_object.list_files(path=path)
 
     def write_file(self, file_path: str, file_name: str, data: bytes,
                    unique_name: bool = False, if_exists: str = 'fail',
@@ -156,9 +286,11 @@ class PumpWoodStorage():
 
     def write_file_stream(self, file_path: str, file_name: str,
                           data_stream: io.BytesIO, unique_name: bool = False,
-                          chunk_size: int = 1024 * 1024,
+                          chunk_size: int = None,
                           update_file_path: bool = True,
-                          safe_filename: bool = True) -> dict:
+                          safe_filename: bool = True,
+                          content_type: str = 'application/octet-stream',
+                          resumable: bool = False) -> dict:
         """Write file as a streaming process to storage.
 
         Args:
@@ -172,13 +304,34 @@ class PumpWoodStorage():
                 If date time will be used as sufix to make name
                 unique.
             chunk_size (str):
-                Chuck size of the streaming.
+                Chuck size of the streaming. Default None starts at the
+                minimum size of the provider (S3 5Mb parts, GCS 256Kb)
+                and grows with the measured throughput, chunk buffers
+                of all transfers share the process memory budget (see
+                storage_connectors._chunking.STORAGE_MEMORY_BUDGET).
             safe_filename (bool):
                 If the filename should be added with a safe prefix do avoid
                 colision name.
             update_file_path (bool):
                 To update the file path with the default path setting usually a
                 base folder for all files.
+            content_type (str):
+                Mime-type of the content.
+            resumable (bool):
+                Save upload progress at a local checkpoint after each
+                confirmed chunk. If the upload is interrupted, calling
+                this function again with the same file path and a stream
+                from the beginning skips the chunks already uploaded.
+                unique_name must be False to resume uploads.
+
+        Returns:
+            dict: With file_path, bytes_uploaded and hash (base64 MD5
+                calculated while streaming) keys.
+
+        Raises:
+            PumpWoodDataLoadingException:
+                If a resumed stream differs from the interrupted upload,
+                the checkpoint is removed and the upload must be restarted.
         """
         if update_file_path:
             file_path = self._update_file_path(file_path)
@@ -186,9 +339,18 @@ class PumpWoodStorage():
             file_name = self._create_safe_filename(
                 file_name=file_name, unique_name=unique_name)
         file_path = os.path.join(file_path, file_name)
+
+        checkpoint = None
+        if resumable:
+            if self.checkpoint_store is None:
+                self.checkpoint_store = UploadCheckpointStore(
+                    folder_path=self._checkpoint_path)
+            checkpoint = self.checkpoint_store.checkpoint(
+                key='{}:{}'.format(self._storage_key, file_path))
         return self.storage_object.write_file_stream(
             file_path=file_path, data_stream=data_stream,
-            chunk_size=chunk_size)
+            chunk_size=chunk_size, content_type=content_type,
+            checkpoint=checkpoint)
 
     def delete_file(self, file_path: str):
         """Delete a file from storage.
@@ -239,6 +401,29 @@ class PumpWoodStorage():
         """
         return self.storage_object.read_file(file_path=file_path)
 
+    def copy_file(self, source_file_path: str, destination_file_path: str,
+                  if_exists: str = 'fail') -> str:
+        """Copy a file inside the storage without downloading it.
+
+        Cloud storages use server side copy, local storage uses
+        `copy_file_range`.
+
+        Args:
+            source_file_path (str):
+                Path of the file to be copied.
+            destination_file_path (str):
+                Path of the copy.
+            if_exists (str):
+                'fail' to raise error if destination exists or 'overwrite'.
+
+        Returns:
+            str: Destination file path.
+        """
+        return self.storage_object.copy_file(
+            source_file_path=source_file_path,
+            destination_file_path=destination_file_path,
+            if_exists=if_exists)
+
     def download_to_file(self, file_path: str, file_obj):
         """Download cloud file to a file like object.
 
@@ -253,14 +438,16 @@ class PumpWoodStorage():
         self.storage_object.download_to_file(
             file_path=file_path, file_obj=file_obj)
 
-    def get_read_file_iterator(self, file_path):
+    def get_read_file_iterator(self, file_path, **kwargs):
         """Get an iterator to download file by chunks.
 
         Args:
             file_path(str): File path.
 
         Kwargs:
-            No Kwargs.
+            chunk_size (int): Chunk size in bytes.
+            decompress (bool): If False compressed files are returned
+                without decompression, only for storages with compression.
 
         Returns:
             iterator: To loop over file chunks.
@@ -275,7 +462,249 @@ class PumpWoodStorage():
             >>> test.read_file('chubaca_eh_legal.txt')
 
         """
-        return self.storage_object.get_read_file_iterator(file_path=file_path)
+        return self.storage_object.get_read_file_iterator(
+            file_path=file_path, **kwargs)
+
+    def get_content_encoding(self, file_path: str) -> str:
+        """Return HTTP content-coding of the stored file bytes.
+
+        Used to pass compressed bytes straight to clients that accept
+        the encoding, `get_read_file_iterator(decompress=False)`.
+
+        Args:
+            file_path (str): File path.
+        Returns:
+            str: 'identity' if file is not compressed, 'gzip' or 'zstd'.
+                None if codec is not an HTTP content-coding (lz4).
+        """
+        if not hasattr(self.storage_object, 'get_content_encoding'):
+            return 'identity'
+        return self.storage_object.get_content_encoding(file_path=file_path)
+
+    def _check_url_support(self, method: str):
+        """Raise error if storage has no presigned URLs or signer."""
+        has_native = hasattr(self._connector, method)
+        if not has_native and self.url_signer is None:
+            msg = (
+                "Storage {} does not have presigned URLs, set "
+                "url_secret_key and url_base to use token URLs").format(
+                    type(self._connector).__name__)
+            raise exceptions.PumpWoodNotImplementedError(msg)
+        return has_native
+
+    def get_download_url(self, file_path: str, expires_in: int = 3600,
+                         file_name: str = None) -> str:
+        """Return a time limited URL to download the file directly.
+
+        Clients download from the bucket (S3 presigned URL, GCS V4 signed
+        URL, Azure SAS) without using the workers. Local and memory
+        storages use token URLs served by `create_url_blueprint`.
+
+        Args:
+            file_path (str):
+                File path.
+            expires_in (int):
+                Seconds until the URL expires.
+            file_name (str):
+                If set, file is downloaded as attachment with this name,
+                not used on token URLs.
+
+        Returns:
+            str: Download URL.
+
+        Raises:
+            PumpWoodNotImplementedError:
+                If storage has no presigned URLs and url_secret_key was not
+                set, or if the file is compressed.
+        """
+        if self._check_url_support('get_download_url'):
+            return self.storage_object.get_download_url(
+                file_path=file_path, expires_in=expires_in,
+                file_name=file_name)
+        return self.url_signer.get_download_url(
+            file_path=file_path, expires_in=expires_in)
+
+    def get_upload_url(self, file_path: str, file_name: str,
+                       expires_in: int = 3600,
+                       content_type: str = 'application/octet-stream',
+                       parts: int = None, unique_name: bool = False,
+                       update_file_path: bool = True,
+                       safe_filename: bool = True) -> dict:
+        """Return time limited URLs to upload a file directly.
+
+        Args:
+            file_path (str):
+                Path to be used on file.
+            file_name (str):
+                Name of the file.
+            expires_in (int):
+                Seconds until the URLs expire.
+            content_type (str):
+                Mime-type of the content.
+            parts (int):
+                Start a multipart upload with this number of parts, S3
+                returns a URL for each part, GCS a resumable session URL
+                and Azure a URL for block uploads. Not used on token URLs.
+            unique_name (bool):
+                If date time will be used as sufix to make name unique.
+            update_file_path (bool):
+                To update the file path with the default path setting.
+            safe_filename (bool):
+                If the filename should be added with a safe prefix.
+
+        Returns:
+            dict: With file_path, upload_type ('single', 'multipart',
+                'resumable' or 'block'), method, url or part_urls,
+                upload_id (S3 multipart) and the headers the client must
+                send.
+
+        Raises:
+            PumpWoodNotImplementedError:
+                If storage has no presigned URLs and url_secret_key was not
+                set, or if storage is content addressed.
+        """
+        if update_file_path:
+            file_path = self._update_file_path(file_path)
+        if safe_filename:
+            file_name = self._create_safe_filename(
+                file_name=file_name, unique_name=unique_name)
+        file_path = os.path.join(file_path, file_name)
+
+        if self._check_url_support('get_upload_url'):
+            return self.storage_object.get_upload_url(
+                file_path=file_path, expires_in=expires_in,
+                content_type=content_type, parts=parts)
+        return self.url_signer.get_upload_url(
+            file_path=file_path, expires_in=expires_in,
+            content_type=content_type)
+
+    def complete_upload(self, file_path: str, upload_id: str = None,
+                        parts: List[dict] = None) -> str:
+        """Complete a direct upload.
+
+        Only S3 multipart uploads must be completed, other uploads are
+        finished by the client requests and it just returns file_path.
+
+        Args:
+            file_path (str):
+                File path returned by `get_upload_url`.
+            upload_id (str):
+                Upload id returned by `get_upload_url`.
+            parts (List[dict]):
+                List of dictionaries with part_number and etag of the
+                uploaded parts.
+
+        Returns:
+            str: File path.
+        """
+        if upload_id is None or \
+                not hasattr(self._connector, 'complete_upload'):
+            return file_path
+        return self.storage_object.complete_upload(
+            file_path=file_path, upload_id=upload_id, parts=parts)
+
+    def create_url_blueprint(self, name: str = 'pumpwood_storage_url',
+                             chunk_size: int = 1024 * 1024):
+        """Create the Flask blueprint serving the token URLs.
+
+        It must be registered at the path of url_base:
+
+        ```
+        app.register_blueprint(
+            storage.create_url_blueprint(), url_prefix='/storage-url')
+        ```
+
+        Raises:
+            PumpWoodNotImplementedError:
+                If url_secret_key was not set.
+        """
+        if self.url_signer is None:
+            msg = "url_secret_key must be set to create token URLs"
+            raise exceptions.PumpWoodNotImplementedError(msg)
+        return create_signed_url_blueprint(
+            storage=self, signer=self.url_signer, name=name,
+            chunk_size=chunk_size)
+
+    def sync(self, local_dir: str, prefix: str, direction: str,
+             compare: str = 'size_mtime', delete: bool = False,
+             exclude: List[str] = None, max_workers: int = 8,
+             chunk_size: int = None, dry_run: bool = False,
+             update_file_path: bool = True) -> dict:
+        """Mirror a local folder at a storage prefix or the opposite.
+
+        Only new and changed files are transferred. A manifest with the
+        size, modification time and MD5 of the files is kept at the
+        prefix by upload syncs.
+
+        Args:
+            local_dir (str):
+                Local folder.
+            prefix (str):
+                Storage prefix.
+            direction (str):
+                'upload' (local folder to storage) or 'download' (storage
+                to local folder).
+            compare (str):
+                'size_mtime' transfers files with different size or newer
+                source, 'hash' transfers files with different size or MD5.
+            delete (bool):
+                Delete destination files that are not at the source.
+            exclude (List[str]):
+                fnmatch patterns of relative paths to be ignored.
+            max_workers (int):
+                Number of parallel transfers.
+            chunk_size (int):
+                Chunk size of the transfers, default None adapts it to
+                the throughput.
+            dry_run (bool):
+                Only report the changes.
+            update_file_path (bool):
+                To update the prefix with the default path setting usually
+                a base folder for all files.
+
+        Returns:
+            dict: Summary with uploaded, downloaded and deleted relative
+                paths, number of skipped files, bytes_transferred and
+                errors by relative path.
+
+        Raises:
+            PumpWoodWrongParameters:
+                If direction or compare are not valid.
+        """
+        if update_file_path:
+            prefix = self._update_file_path(prefix)
+        storage_sync = StorageSync(
+            storage_object=self.storage_object, local_dir=local_dir,
+            prefix=prefix, compare=compare, delete=delete, exclude=exclude,
+            max_workers=max_workers, chunk_size=chunk_size, dry_run=dry_run)
+        return storage_sync.sync(direction=direction)
+
+    def collect_garbage(self, dry_run: bool = False) -> List[str]:
+        """Delete content addressed blobs that are not referenced.
+
+        Deleting or overwriting files of a `content_addressed` storage
+        removes only their references, blobs are deleted by this pass.
+
+        Args:
+            dry_run (bool):
+                Only return the digests that would be deleted.
+
+        Returns:
+            List of the digests of deleted blobs.
+
+        Raises:
+            PumpWoodNotImplementedError:
+                If storage is not content addressed.
+        """
+        layer = self.storage_object
+        while layer is not None and \
+                not isinstance(layer, ContentAddressedBucket):
+            layer = getattr(layer, 'storage_object', None)
+        if layer is None:
+            msg = "Garbage collection is only available for " \
+                "content_addressed storages"
+            raise exceptions.PumpWoodNotImplementedError(msg)
+        return layer.collect_garbage(dry_run=dry_run)
 
     def _create_safe_filename(self, file_name: str,
                               unique_name: bool = False) -> str:
@@ -307,17 +736,183 @@ class PumpWoodStorage():
             date = datetime.datetime.utcnow().strftime("%Y-%m-%d-%H%M%S")
             return "{0}___{1}".format(date, file_name)
 
-    def get_file_hash(self, file_path: str):
+    def get_file_hash(self, file_path: str, algorithm: str = 'md5') -> str:
         """Return file hash calculated at cloud storage provider.
 
+        Hashes are calculated while uploading and validated by the
+        provider, they are returned base64 encoded using a single metadata
+        request.
+
         Args:
             file_path (str): File path.
-        Kwargs:
-            No Kwargs.
+            algorithm (str): Hash algorithm, 'md5' (all backends), 'sha256'
+                (files written with pumpwood) or 'crc32c' (Google).
         Returns:
             str: Hash of the file.
         Raises:
-            Exception("file_path {file_path} does not exist")
+            PumpWoodObjectDoesNotExist:
+                If file is not found on storage.
+            PumpWoodNotImplementedError:
+                If hash is not available for the file.
+        """
+        return self.storage_object.get_file_hash(
+            file_path=file_path, algorithm=algorithm)
+
+    def get_file_metadata(self, file_path: str) -> dict:
+        """Return file size, content type, hashes and metadata.
+
+        Args:
+            file_path (str): File path.
+        Returns:
+            dict: With keys size, content_type, hash (base64 MD5), hashes,
+                metadata and updated_at.
+        Raises:
+            PumpWoodObjectDoesNotExist:
+                If file is not found on storage.
+        """
+        return self.storage_object.get_file_metadata(file_path=file_path)
+
+    def read_file_range(self, file_path: str, offset: int,
+                        length: int) -> bytes:
+        """Read a byte range of a file with a single request.
+
+        Args:
+            file_path (str): File path.
+            offset (int): Position of the first byte.
+            length (int): Number of bytes to be read.
+        Returns:
+            bytes: Content of the range, it is shorter than length if the
+                range goes beyond the end of the file.
+        Raises:
+            PumpWoodObjectDoesNotExist:
+                If file is not found on storage.
+            PumpWoodNotImplementedError:
+                If file is stored compressed.
+        """
+        return self.storage_object.read_file_range(
+            file_path=file_path, offset=offset, length=length)
+
+    def open(self, file_path: str, mode: str = 'rb', buffering: int = -1,
+             encoding: str = None, block_size: int = 1024 * 1024,
+             cache_blocks: int = 16, max_read_ahead: int = 8):
+        """Open a file for random access reading with ranged requests.
+
+        The returned object is seekable and can be used by libraries
+        that read parts of files (zipfile, tarfile, pyarrow, h5py). Data
+        is read by blocks kept in a LRU cache, sequential reads fetch
+        more blocks ahead on each request.
+
+        Args:
+            file_path (str): File path.
+            mode (str): 'rb' for binary or 'r' for text.
+            buffering (int): 0 to return the unbuffered raw reader, -1
+                to buffer with block size or the size of the buffer.
+            encoding (str): Encoding for text mode.
+            block_size (int): Size of the blocks read from storage.
+            cache_blocks (int): Number of blocks kept in cache.
+            max_read_ahead (int): Maximum number of blocks fetched at once
+                on sequential reads.
+        Returns:
+            io.BufferedReader, io.TextIOWrapper on text mode or
+            StorageRawReader (io.RawIOBase) if buffering is 0.
+        Raises:
+            PumpWoodObjectDoesNotExist:
                 If file is not found on storage.
+            PumpWoodNotImplementedError:
+                If mode is not a read mode or file is stored compressed.
+        Example:
+            >>> with storage.open('files/data.zip') as file:
+            >>>     names = zipfile.ZipFile(file).namelist()
+        """
+        return open_file(
+            self.storage_object, file_path=file_path, mode=mode,
+            buffering=buffering, encoding=encoding, block_size=block_size,
+            cache_blocks=cache_blocks, max_read_ahead=max_read_ahead)
+
+    def write_dataframe(self, file_path: str, file_name: str, data,
+                        file_format: str = None, unique_name: bool = False,
+                        chunk_size: int = 1024 * 1024,
+                        update_file_path: bool = True,
+                        safe_filename: bool = True,
+                        **writer_kwargs) -> dict:
+        """Stream a DataFrame to storage as Parquet or Arrow IPC file.
+
+        Args:
+            file_path (str):
+                Path to be used on file.
+            file_name (str):
+                Name of the file.
+            data:
+                A pandas DataFrame, a pyarrow Table or an iterable of them
+                with the same schema.
+            file_format (str):
+                'parquet', 'feather' or 'arrow', inferred from file
+                extension if not set.
+            unique_name (str):
+                If date time will be used as sufix to make name
+                unique.
+            chunk_size (str):
+                Chuck size of the streaming.
+            update_file_path (bool):
+                To update the file path with the default path setting.
+            safe_filename (bool):
+                If the filename should be added with a safe prefix do avoid
+                colision name.
+            **writer_kwargs:
+                Arguments passed to pyarrow writer, ex.: compression and
+                row_group_size for parquet.
+
+        Returns:
+            dict: Same as `write_file_stream`.
+        """
+        if update_file_path:
+            file_path = self._update_file_path(file_path)
+        if safe_filename:
+            file_name = self._create_safe_filename(
+                file_name=file_name, unique_name=unique_name)
+        file_path = os.path.join(file_path, file_name)
+        return _dataframe.write_dataframe(
+            self.storage_object, file_path=file_path, data=data,
+            file_format=file_format, chunk_size=chunk_size, **writer_kwargs)
+
+    def read_dataframe(self, file_path: str, columns: List[str] = None,
+                       filters=None, file_format: str = None):
+        """Read a Parquet or Arrow IPC file as pandas DataFrame.
+
+        Only the needed byte ranges are downloaded, the file footer,
+        the projected columns and row groups that may match the filters.
+
+        Args:
+            file_path (str): File path.
+            columns (List[str]): Columns to be read.
+            filters: Pyarrow expression or list of tuples as
+                pandas.read_parquet filters, ex.: `[('year', '>=', 2020)]`.
+            file_format (str): 'parquet', 'feather' or 'arrow', inferred
+                from file extension if not set.
+        Returns:
+            pandas.DataFrame: File data.
+        """
+        return _dataframe.read_dataframe(
+            self.storage_object, file_path=file_path, columns=columns,
+            filters=filters, file_format=file_format)
+
+    def iter_dataframe(self, file_path: str, columns: List[str] = None,
+                       filters=None, file_format: str = None,
+                       batch_size: int = 128 * 1024) -> Iterator:
+        """Iterate over a Parquet or Arrow IPC file by record batches.
+
+        Files larger than memory can be processed, only one batch is
+        loaded at a time.
+
+        Args:
+            file_path (str): File path.
+            columns (List[str]): Columns to be read.
+            filters: Same as `read_dataframe`.
+            file_format (str): 'parquet', 'feather' or 'arrow'.
+            batch_size (int): Maximum number of rows of each DataFrame.
+        Returns:
+            Iterator[pandas.DataFrame]: Batches of the file.
         """
-        return self.storage_object.get_file_hash(file_path=file_path)
+        return _dataframe.iter_dataframe(
+            self.storage_object, file_path=file_path, columns=columns,
+            filters=filters, file_format=file_format, batch_size=batch_size)
@@ -0,0 +1,415 @@
+"""PumpWood asyncio Storage Module.
+
+Async counterpart of `pumpwood_miscellaneous.storage.PumpWoodStorage`.
+Backends with a native asyncio SDK are called directly, the others are
+called on a bounded thread pool. All operations are limited by a
+per-bucket semaphore so thousands of concurrent requests are queued
+instead of spawning thousands of threads.
+"""
+import asyncio
+import importlib
+import os
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator
+from pumpwood_miscellaneous.storage import PumpWoodStorage
+
+
+_NATIVE_ASYNC_CONNECTORS = {
+    'azure_storage': (
+        'pumpwood_miscellaneous.storage_connectors.azure_async',
+        'PumpWoodAzureStorageAsync', 'aiohttp'),
+}
+"""Storage types with native asyncio connectors, it maps to connector
+module, class and the package needed as async transport."""
+
+_bucket_limiters = weakref.WeakKeyDictionary()
+"""Semaphores by event loop and bucket, shared by all async storage
+objects of the same process."""
+
+
+def get_bucket_limiter(bucket_key: str, limit: int) -> asyncio.Semaphore:
+    """Return the semaphore that limits concurrency for a bucket.
+
+    Semaphores are created by running event loop, storage objects pointing
+    to the same bucket will share the same limiter.
+
+    Args:
+        bucket_key (str):
+            Key identifying the bucket, storage type and bucket name.
+        limit (int):
+            Maximum number of concurrent operations, it is used only
+            when the limiter is created.
+
+    Returns:
+        Semaphore associated with bucket on running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    loop_limiters = _bucket_limiters.setdefault(loop, {})
+    limiter = loop_limiters.get(bucket_key)
+    if limiter is None:
+        limiter = asyncio.Semaphore(limit)
+        loop_limiters[bucket_key] = limiter
+    return limiter
+
+
+class AsyncIterableReader():
+    """Expose an async bytes iterable as a blocking file-like object.
+
+    It is used to pass async streams (ex.: an aiohttp request body) to
+    connectors that run on executor threads. Chunks are pulled from
+    the event loop on demand, so there is no buffering beyond the
+    requested read size.
+    """
+
+    def __init__(self, async_iterable, loop: asyncio.AbstractEventLoop):
+        """__init__.
+
+        Args:
+            async_iterable:
+                Async iterable returning bytes.
+            loop (asyncio.AbstractEventLoop):
+                Event loop running the async iterable.
+        """
+        self._iterator = async_iterable.__aiter__()
+        self._loop = loop
+        self._buffer = bytearray()
+        self._finished = False
+        self.bytes_position = 0
+
+    async def _next_chunk(self):
+        try:
+            return await self._iterator.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    def read(self, size: int = -1) -> bytes:
+        """Read up to size bytes from the async iterable."""
+        while not self._finished and (size < 0 or len(self._buffer) < size):
+            future = asyncio.run_coroutine_threadsafe(
+                self._next_chunk(), self._loop)
+            chunk = future.result()
+            if chunk is None:
+                self._finished = True
+            else:
+                self._buffer.extend(chunk)
+
+        size = len(self._buffer) if size < 0 else size
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self.bytes_position += len(data)
+        return data
+
+    def tell(self) -> int:
+        """Return the number of bytes read."""
+        return self.bytes_position
+
+
+class PumpWoodAsyncStorage():
+    """Class to save midia files at PumpWood using asyncio."""
+
+    def __init__(self, storage_type: str = None, base_path: str = None,
+                 max_concurrency: int = 64, max_workers: int = 16,
+                 native_async: bool = True, *args, **kwargs):
+        """Start the PumpWood async storage class.
+
+        Args:
+            storage_type (str):
+                Type of the storage, same options of PumpWoodStorage.
+            base_path (str):
+                Path to be added to begin of the file.
+            max_concurrency (int):
+                Maximum number of concurrent operations on the bucket.
+            max_workers (int):
+                Number of threads used by backends without native async
+                support.
+            native_async (bool):
+                Use native asyncio connectors when they are available, if
+                False all backends will run on the thread pool. Storages
+                with compression, content addressing or retry policy use the
+                thread pool.
+            *args:
+                Other positional arguments passed to PumpWoodStorage.
+            **kwargs:
+                Other arguments passed to PumpWoodStorage, like
+                bucket_name and folder_path.
+        """
+        self._storage = PumpWoodStorage(
+            storage_type, base_path, *args, **kwargs)
+        self._max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix='pumpwood-storage')
+        self._bucket_key = "{storage_type}:{bucket}".format(
+            storage_type=storage_type,
+            bucket=kwargs.get('bucket_name', kwargs.get('folder_path')))
+
+        self._native_object = None
+        native_spec = _NATIVE_ASYNC_CONNECTORS.get(storage_type)
+        # Native connectors do not apply storage layers
+        has_layers = kwargs.get('content_addressed', False) or \
+            kwargs.get('compression') is not None or \
+            kwargs.get('retry_policy') is not None or \
+            kwargs.get('instrumentation') is not None
+        if native_async and not has_layers and native_spec is not None:
+            module_name, class_name, transport = native_spec
+            try:
+                importlib.import_module(transport)
+            except ImportError:
+                native_spec = None
+            if native_spec is not None:
+                module = importlib.import_module(module_name)
+                self._native_object = getattr(module, class_name)(
+                    bucket_name=kwargs['bucket_name'])
+
+    async def __aenter__(self):
+        """Enter async context."""
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        """Exit async context closing clients and executor."""
+        await self.close()
+
+    async def close(self):
+        """Close native clients and shutdown thread pool."""
+        if self._native_object is not None:
+            await self._native_object.close()
+        self._executor.shutdown(wait=False)
+
+    def _limiter(self) -> asyncio.Semaphore:
+        return get_bucket_limiter(self._bucket_key, self._max_concurrency)
+
+    async def _run(self, function, *args, **kwargs):
+        """Run a blocking function on the bounded thread pool."""
+        loop = asyncio.get_running_loop()
+        async with self._limiter():
+            return await loop.run_in_executor(
+                self._executor, lambda: function(*args, **kwargs))
+
+    async def _iterate(self, iterator) -> AsyncIterator:
+        """Consume a blocking iterator on the bounded thread pool."""
+        sentinel = object()
+        iterator = iter(iterator)
+        while True:
+            item = await self._run(next, iterator, sentinel)
+            if item is sentinel:
+                break
+            yield item
+
+    async def _iterate_native(self, iterator) -> AsyncIterator:
+        """Consume a native async iterator holding the limiter per item.
+
+        The limiter is released while the consumer handles each item,
+        so a slow consumer does not block other requests to the bucket.
+        Pages and chunks are fetched by the provider inside `__anext__`.
+        """
+        iterator = iterator.__aiter__()
+        try:
+            while True:
+                async with self._limiter():
+                    try:
+                        item = await iterator.__anext__()
+                    except StopAsyncIteration:
+                        break
+                yield item
+        finally:
+            aclose = getattr(iterator, 'aclose', None)
+            if aclose is not None:
+                await aclose()
+
+    def _build_file_path(self, file_path: str, file_name: str,
+                         unique_name: bool, update_file_path: bool,
+                         safe_filename: bool) -> str:
+        if update_file_path:
+            file_path = self._storage._update_file_path(file_path)
+        if safe_filename:
+            file_name = self._storage._create_safe_filename(
+                file_name=file_name, unique_name=unique_name)
+        return os.path.join(file_path, file_name)
+
+    async def check_file_exists(self, file_path: str) -> bool:
+        """Check if file exists.
+
+        Args:
+            file_path (str):
+                Path to file in storage.
+
+        Return:
+            Return a boolean value checking if the file exists on storage.
+        """
+        if self._native_object is not None:
+            async with self._limiter():
+                return await self._native_object.check_file_exists(
+                    file_path=file_path)
+        return await self._run(
+            self._storage.check_file_exists, file_path=file_path)
+
+    async def list_files(self, path: str = "",
+                         update_file_path: bool = True) -> AsyncIterator[str]:
+        """List file at storage path.
+
+        Args:
+            path (str):
+                Path of the storage to list files.
+            update_file_path (bool):
+                If update path to add base directory.
+
+        Return [AsyncIterator[str]]:
+            Async iterator over all files under path (sub-folders).
+        """
+        if self._native_object is not None:
+            if update_file_path:
+                path = self._storage._update_file_path(path)
+            async for file_name in self._iterate_native(
+                    self._native_object.list_files(path=path)):
+                yield file_name
+        else:
+            file_list = await self._run(
+                self._storage.list_files, path=path,
+                update_file_path=update_file_path)
+            for file_name in file_list:
+                yield file_name
+
+    async def write_file(self, file_path: str, file_name: str, data: bytes,
+                         unique_name: bool = False, if_exists: str = 'fail',
+                         content_type='text/plain',
+                         update_file_path: bool = True,
+                         safe_filename: bool = True) -> str:
+        """Write a file to the storage.
+
+        Same arguments of `PumpWoodStorage.write_file`.
+
+        Returns:
+            str: File name that was written.
+        """
+        if self._native_object is not None:
+            file_path = self._build_file_path(
+                file_path=file_path, file_name=file_name,
+                unique_name=unique_name, update_file_path=update_file_path,
+                safe_filename=safe_filename)
+            async with self._limiter():
+                return await self._native_object.write_file(
+                    file_path=file_path, data=data, if_exists=if_exists,
+                    content_type=content_type)
+        return await self._run(
+            self._storage.write_file, file_path=file_path,
+            file_name=file_name, data=data, unique_name=unique_name,
+            if_exists=if_exists, content_type=content_type,
+            update_file_path=update_file_path,
+            safe_filename=safe_filename)
+
+    async def write_file_stream(self, file_path: str, file_name: str,
+                                data_stream, unique_name: bool = False,
+                                chunk_size: int = None,
+                                update_file_path: bool = True,
+                                safe_filename: bool = True) -> dict:
+        """Write file as a streaming process to storage.
+
+        Args:
+            file_path (str):
+                Path to be used on file.
+            file_name (str):
+                Name of the file.
+            data_stream:
+                A file like object or an async iterable of bytes.
+            unique_name (str):
+                If date time will be used as sufix to make name
+                unique.
+            chunk_size (str):
+                Chuck size of the streaming, default None adapts it to the
+                throughput.
+            safe_filename (bool):
+                If the filename should be added with a safe prefix do avoid
+                colision name.
+            update_file_path (bool):
+                To update the file path with the default path setting usually a
+                base folder for all files.
+
+        Returns:
+            Return the file path used to save data ("file_path" key) and the
+            total of bytes that were transmited.
+        """
+        if self._native_object is not None:
+            full_path = self._build_file_path(
+                file_path=file_path, file_name=file_name,
+                unique_name=unique_name, update_file_path=update_file_path,
+                safe_filename=safe_filename)
+            async with self._limiter():
+                return await self._native_object.write_file_stream(
+                    file_path=full_path, data_stream=data_stream,
+                    chunk_size=chunk_size)
+
+        if hasattr(data_stream, '__aiter__'):
+            data_stream = AsyncIterableReader(
+                data_stream, loop=asyncio.get_running_loop())
+        return await self._run(
+            self._storage.write_file_stream, file_path=file_path,
+            file_name=file_name, data_stream=data_stream,
+            unique_name=unique_name, chunk_size=chunk_size,
+            update_file_path=update_file_path,
+            safe_filename=safe_filename)
+
+    async def delete_file(self, file_path: str) -> bool:
+        """Delete a file from storage.
+
+        Args:
+            file_path(str): Path which will be used to save files at storage
+
+        Returns:
+            boolean: Only returns True
+        """
+        if self._native_object is not None:
+            async with self._limiter():
+                return await self._native_object.delete_file(
+                    file_path=file_path)
+        return await self._run(
+            self._storage.delete_file, file_path=file_path)
+
+    async def read_file(self, file_path: str) -> dict:
+        """Read a file from storage.
+
+        Args:
+            file_path(str): File path.
+
+        Returns:
+            dict: File content at data key and content_type.
+        """
+        if self._native_object is not None:
+            async with self._limiter():
+                return await self._native_object.read_file(
+                    file_path=file_path)
+        return await self._run(
+            self._storage.read_file, file_path=file_path)
+
+    async def get_read_file_iterator(self, file_path: str
+                                     ) -> AsyncIterator[bytes]:
+        """Get an async iterator to download file by chunks.
+
+        Args:
+            file_path(str): File path.
+
+        Returns:
+            AsyncIterator[bytes]: To loop over file chunks.
+        """
+        if self._native_object is not None:
+            async for chunk in self._iterate_native(
+                    self._native_object.get_read_file_iterator(
+                        file_path=file_path)):
+                yield chunk
+        else:
+            iterator = await self._run(
+                self._storage.get_read_file_iterator, file_path=file_path)
+            async for chunk in self._iterate(iterator):
+                yield chunk
+
+    async def get_file_hash(self, file_path: str) -> str:
+        """Return file hash calculated at cloud storage provider.
+
+        Args:
+            file_path (str): File path.
+
+        Returns:
+            str: Hash of the file.
+        """
+        return await self._run(
+            self._storage.get_file_hash, file_path=file_path)
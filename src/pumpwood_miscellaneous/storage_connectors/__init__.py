@@ -1,8 +1,32 @@
-"""Module to make a standard to connect with different storages."""
-from .aws import PumpWoodAwsS3
-from .azure import PumpWoodAzureStorage
-from .google import PumpWoodGoogleBucket
-
-__all__ = [
-    PumpWoodAwsS3, PumpWoodAzureStorage, PumpWoodGoogleBucket,
-]
+"""Module to make a standard to connect with different storages.
+
+Connector classes are imported on first access, so the SDK of a cloud
+provider (boto3, google-cloud-storage, azure-storage-blob) is loaded only
+by services that use it.
+"""
+import importlib
+
+_LAZY_ATTRIBUTES = {
+    'PumpWoodAwsS3': '.aws',
+    'PumpWoodAzureStorage': '.azure',
+    'PumpWoodGoogleBucket': '.google',
+    'PumpWoodLocalBucket': '.local',
+    'PumpWoodMemoryBucket': '.memory',
+    'StorageLatencyProfile': '.memory',
+}
+
+__all__ = list(_LAZY_ATTRIBUTES.keys())
+
+
+def __getattr__(name: str):
+    module_name = _LAZY_ATTRIBUTES.get(name)
+    if module_name is None:
+        raise AttributeError(
+            "module {!r} has no attribute {!r}".format(__name__, name))
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,397 @@
+"""Content addressed deduplicating layer over storage connectors.
+
+File content is stored once under its SHA256 digest and logical file
+paths are small JSON pointers to it. Each pointer has a reference marker
+under the digest, written before the blob is checked or uploaded.
+
+Layout at the bucket:
+- `{prefix}/blobs/{digest[:2]}/{digest}`: File content.
+- `{prefix}/refs/{digest}/{sha256(file_path)}`: Reference markers, the
+  content is the logical file path.
+- `{file_path}`: Pointer to the blob.
+
+Deleting or overwriting a file removes only its reference, blobs without
+references are removed by `ContentAddressedBucket.collect_garbage`.
+Object storages do not have atomic reference counting: references are
+listed again after a blob is deleted and a reference created meanwhile
+is logged, the next write of that content uploads the blob again.
+"""
+import io
+import json
+import logging
+import base64
+import hashlib
+import tempfile
+from typing import Iterator, List
+from pumpwood_communication import exceptions
+from ._general import FlaskStreamUploadWrapper, StreamHasher
+from ._file import open_raw_reader
+from ._chunking import DEFAULT_READ_SIZE
+
+
+POINTER_MAX_SIZE = 4096
+"""Files larger than this are never treated as pointers."""
+POINTER_MAGIC = b'{"pumpwood_cas":'
+"""Beginning of pointer files content."""
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+"""Streams larger than this are spooled to disk while hashed."""
+
+logger = logging.getLogger(__name__)
+
+
+class ContentAddressedBucket():
+    """Wraps a storage connector deduplicating files by content."""
+
+    def __init__(self, storage_object, prefix: str = '.pumpwood-cas'):
+        """__init__.
+
+        Args:
+            storage_object:
+                Storage connector used to save pointers and blobs.
+            prefix (str):
+                Path at the bucket used to store blobs and references.
+        """
+        self.storage_object = storage_object
+        self.prefix = prefix.rstrip('/')
+
+    def _blob_path(self, digest: str) -> str:
+        return "{prefix}/blobs/{short}/{digest}".format(
+            prefix=self.prefix, short=digest[:2], digest=digest)
+
+    def _refs_path(self, digest: str) -> str:
+        return "{prefix}/refs/{digest}/".format(
+            prefix=self.prefix, digest=digest)
+
+    def _ref_path(self, digest: str, file_path: str) -> str:
+        path_hash = hashlib.sha256(file_path.encode('utf-8')).hexdigest()
+        return self._refs_path(digest) + path_hash
+
+    def _get_pointer(self, file_path: str) -> dict:
+        """Return pointer of file_path or None if it is not a pointer.
+
+        Raises:
+            PumpWoodObjectDoesNotExist:
+                If file_path does not exist.
+        """
+        file_metadata = self.storage_object.get_file_metadata(
+            file_path=file_path)
+        if POINTER_MAX_SIZE < file_metadata['size']:
+            return None
+        data = bytes(self.storage_object.read_file(
+            file_path=file_path)['data'])
+        if not data.startswith(POINTER_MAGIC):
+            return None
+        return json.loads(data)
+
+    def _resolve(self, file_path: str) -> str:
+        """Return the path where content of file_path is stored."""
+        pointer = self._get_pointer(file_path)
+        if pointer is None:
+            return file_path
+        return self._blob_path(pointer['digest'])
+
+    def _check_destination(self, file_path: str, if_exists: str) -> dict:
+        """Check if file_path can be written, return its current pointer.
+
+        Raises:
+            PumpWoodForbidden:
+                If file exists and `if_exists='fail'`.
+        """
+        if if_exists == 'fail':
+            if self.storage_object.check_file_exists(file_path=file_path):
+                msg = 'There is a file with same name on bucket'
+                raise exceptions.PumpWoodForbidden(msg)
+            return None
+        try:
+            return self._get_pointer(file_path)
+        except exceptions.PumpWoodObjectDoesNotExist:
+            return None
+
+    def _write_ref(self, digest: str, file_path: str):
+        """Write reference of file_path, before the blob is checked.
+
+        A blob seen by a writer is always referenced, so garbage
+        collection does not remove it.
+        """
+        self.storage_object.write_file(
+            file_path=self._ref_path(digest, file_path),
+            data=file_path.encode('utf-8'), if_exists='overwrite')
+
+    def _write_pointer(self, file_path: str, digests: dict, size: int,
+                       content_type: str, old_pointer: dict = None,
+                       metadata: dict = None):
+        """Write the pointer, releasing previous content."""
+        digest = base64_to_hex(digests['sha256'])
+        pointer = {
+            'pumpwood_cas': 1, 'digest': digest, 'size': size,
+            'content_type': content_type, 'hashes': digests,
+            'metadata': metadata or {}}
+        self.storage_object.write_file(
+            file_path=file_path, data=json.dumps(pointer).encode('utf-8'),
+            if_exists='overwrite', content_type='application/json')
+
+        if old_pointer is not None and old_pointer['digest'] != digest:
+            self._release(old_pointer['digest'], file_path)
+
+    def _release(self, digest: str, file_path: str):
+        """Remove reference of file_path, blob is kept for collection."""
+        try:
+            self.storage_object.delete_file(
+                file_path=self._ref_path(digest, file_path))
+        except exceptions.PumpWoodObjectDoesNotExist:
+            pass
+
+    def collect_garbage(self, dry_run: bool = False) -> List[str]:
+        """Delete blobs without references.
+
+        References are listed again after each blob is deleted, a
+        reference written meanwhile by a concurrent write of the same
+        content is logged since its pointer has no blob until that content
+        is written again. Run it when the bucket has few writes.
+
+        Args:
+            dry_run (bool):
+                Only return the digests that would be deleted.
+
+        Returns:
+            List of the digests of deleted blobs.
+        """
+        blobs_prefix = "{prefix}/blobs/".format(prefix=self.prefix)
+        deleted = []
+        for blob_path in self.storage_object.list_files(path=blobs_prefix):
+            digest = blob_path.rsplit('/', 1)[-1]
+            refs_path = self._refs_path(digest)
+            if self.storage_object.list_files(path=refs_path):
+                continue
+            deleted.append(digest)
+            if dry_run:
+                continue
+            self.storage_object.delete_file(file_path=blob_path)
+            referenced = self.storage_object.list_files(path=refs_path)
+            if referenced:
+                logger.warning(
+                    "Blob %s was referenced while it was deleted, it will "
+                    "be uploaded again by the next write of the content of "
+                    "%s", digest, referenced)
+        return deleted
+
+    def check_file_exists(self, file_path: str) -> bool:
+        """Check if file exists."""
+        return self.storage_object.check_file_exists(file_path=file_path)
+
+    def list_files(self, path: str = "") -> List[str]:
+        """List files at storage path, blobs and references are hidden."""
+        return [
+            x for x in self.storage_object.list_files(path=path)
+            if not x.startswith(self.prefix + '/')]
+
+    def write_file(self, file_path: str, data: bytes, if_exists: str = 'fail',
+                   content_type='text/plain', metadata: dict = None) -> str:
+        """Write file content once by digest and a pointer at file_path.
+
+        If content is already on storage only the pointer is written.
+
+        Args:
+            file_path (str):
+                Path to save the file.
+            data (str):
+                File content in bytes.
+            if_exists (str):
+                if_exists must be in 'overwrite', 'overwrite_streaming',
+                'append_breakline', 'append' or 'fail'.
+            content_type (str):
+                Mime-type of the content.
+            metadata (dict):
+                User metadata, it is stored at the pointer.
+
+        Returns:
+            A string with bucket path.
+        """
+        old_pointer = self._check_destination(file_path, if_exists)
+        if if_exists in ['append_breakline', 'append'] and \
+                self.storage_object.check_file_exists(file_path=file_path):
+            old_data = bytes(self.read_file(file_path=file_path)['data'])
+            old_data = old_data + b'\n' \
+                if if_exists == 'append_breakline' else old_data
+            data = old_data + data
+
+        digests = StreamHasher.hash_bytes(data).digests()
+        digest = base64_to_hex(digests['sha256'])
+        self._write_ref(digest, file_path)
+        blob_path = self._blob_path(digest)
+        if not self.storage_object.check_file_exists(file_path=blob_path):
+            self.storage_object.write_file(
+                file_path=blob_path, data=data, if_exists='overwrite',
+                content_type=content_type)
+        self._write_pointer(
+            file_path=file_path, digests=digests, size=len(data),
+            content_type=content_type, old_pointer=old_pointer,
+            metadata=metadata)
+        return file_path
+
+    def write_file_stream(self, file_path: str, data_stream: io.BytesIO,
+                          chunk_size: int = None,
+                          metadata: dict = None,
+                          content_type: str = 'application/octet-stream',
+                          checkpoint=None) -> dict:
+        """Write stream content once by digest and a pointer at file_path.
+
+        Stream is hashed while spooled to a temporary file, it is
+        uploaded only if content is not already on storage.
+
+        Args:
+            file_path (str):
+                Path to save the stream.
+            data_stream (io.BytesIO):
+                Data stream.
+            chunk_size (int):
+                Size of the chuck to be transmited, None to adapt it to
+                the throughput.
+            metadata (dict):
+                User metadata, it is stored at the pointer.
+            content_type (str):
+                Mime-type of the content.
+            checkpoint (UploadCheckpoint):
+                Checkpoint of the content upload, content is spooled
+                before upload so the stream is read again on resume.
+
+        Returns:
+            Return the file path used to save data ("file_path" key), the
+            total of bytes of the file and the base64 MD5 hash of the data
+            ("hash" key).
+        """
+        old_pointer = self._check_destination(file_path, 'overwrite')
+        hasher = StreamHasher()
+        stream = FlaskStreamUploadWrapper(data_stream, hasher=hasher)
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as spool:
+            read_size = chunk_size or DEFAULT_READ_SIZE
+            for chunk in iter(lambda: stream.read(read_size), b''):
+                spool.write(chunk)
+            spool.seek(0)
+
+            digests = hasher.digests()
+            digest = base64_to_hex(digests['sha256'])
+            self._write_ref(digest, file_path)
+            blob_path = self._blob_path(digest)
+            if not self.storage_object.check_file_exists(
+                    file_path=blob_path):
+                self.storage_object.write_file_stream(
+                    file_path=blob_path, data_stream=spool,
+                    chunk_size=chunk_size, content_type=content_type,
+                    checkpoint=checkpoint)
+        self._write_pointer(
+            file_path=file_path, digests=digests,
+            size=stream.bytes_position,
+            content_type=content_type, old_pointer=old_pointer,
+            metadata=metadata)
+        return {
+            "file_path": file_path, "bytes_uploaded": stream.bytes_position,
+            "hash": digests['md5']}
+
+    def read_file(self, file_path: str) -> dict:
+        """Read file content following the pointer."""
+        pointer = self._get_pointer(file_path)
+        if pointer is None:
+            return self.storage_object.read_file(file_path=file_path)
+        data = self.storage_object.read_file(
+            file_path=self._blob_path(pointer['digest']))['data']
+        return {'data': data, 'content_type': pointer['content_type']}
+
+    def get_read_file_iterator(self, file_path: str,
+                               **kwargs) -> Iterator[bytes]:
+        """Return an iterator over the file content."""
+        return self.storage_object.get_read_file_iterator(
+            file_path=self._resolve(file_path), **kwargs)
+
+    def read_file_range(self, file_path: str, offset: int,
+                        length: int) -> bytes:
+        """Read a byte range of the file content."""
+        return self.storage_object.read_file_range(
+            file_path=self._resolve(file_path), offset=offset, length=length)
+
+    def open_raw_reader(self, file_path: str, **kwargs):
+        """Return a raw reader over the blob, pointer is resolved once."""
+        return open_raw_reader(
+            self.storage_object, file_path=self._resolve(file_path),
+            **kwargs)
+
+    def download_to_file(self, file_path: str, file_obj):
+        """Download file content to a file like object."""
+        return self.storage_object.download_to_file(
+            file_path=self._resolve(file_path), file_obj=file_obj)
+
+    def delete_file(self, file_path: str) -> bool:
+        """Delete the pointer and its reference."""
+        pointer = self._get_pointer(file_path)
+        self.storage_object.delete_file(file_path=file_path)
+        if pointer is not None:
+            self._release(pointer['digest'], file_path)
+        return True
+
+    def copy_file(self, source_file_path: str, destination_file_path: str,
+                  if_exists: str = 'fail') -> str:
+        """Copy a file writing only a new pointer."""
+        pointer = self._get_pointer(source_file_path)
+        if pointer is None:
+            return self.storage_object.copy_file(
+                source_file_path=source_file_path,
+                destination_file_path=destination_file_path,
+                if_exists=if_exists)
+        old_pointer = self._check_destination(
+            destination_file_path, if_exists)
+        self._write_ref(pointer['digest'], destination_file_path)
+        self._write_pointer(
+            file_path=destination_file_path, digests=pointer['hashes'],
+            size=pointer['size'], content_type=pointer['content_type'],
+            old_pointer=old_pointer, metadata=pointer.get('metadata'))
+        return destination_file_path
+
+    def get_file_metadata(self, file_path: str) -> dict:
+        """Return metadata of the file content."""
+        pointer = self._get_pointer(file_path)
+        if pointer is None:
+            return self.storage_object.get_file_metadata(file_path=file_path)
+        file_metadata = self.storage_object.get_file_metadata(
+            file_path=self._blob_path(pointer['digest']))
+        file_metadata['content_type'] = pointer['content_type']
+        file_metadata['hash'] = pointer['hashes']['md5']
+        file_metadata['hashes'] = dict(pointer['hashes'])
+        file_metadata['metadata'] = dict(pointer.get('metadata', {}))
+        return file_metadata
+
+    def get_file_hash(self, file_path: str, algorithm: str = 'md5') -> str:
+        """Return hash stored at the pointer."""
+        pointer = self._get_pointer(file_path)
+        if pointer is None:
+            return self.storage_object.get_file_hash(
+                file_path=file_path, algorithm=algorithm)
+        file_hash = pointer['hashes'].get(algorithm)
+        if file_hash is None:
+            msg = "Hash {} is not available for file {}".format(
+                algorithm, file_path)
+            raise exceptions.PumpWoodNotImplementedError(msg)
+        return file_hash
+
+    def get_download_url(self, file_path: str, **kwargs) -> str:
+        """Return a presigned URL of the blob of the pointer."""
+        return self.storage_object.get_download_url(
+            file_path=self._resolve(file_path), **kwargs)
+
+    def get_upload_url(self, file_path: str, **kwargs) -> dict:
+        """Direct uploads are not available for content addressed storage.
+
+        Raises:
+            PumpWoodNotImplementedError:
+                Content is not known before upload, it can not be stored
+                by its digest.
+        """
+        msg = (
+            "Presigned uploads are not available with content addressed "
+            "storage, upload file {} using write_file_stream").format(
+                file_path)
+        raise exceptions.PumpWoodNotImplementedError(msg)
+
+
+def base64_to_hex(digest: str) -> str:
+    """Convert a base64 digest to hexadecimal."""
+    return base64.b64decode(digest).hex()
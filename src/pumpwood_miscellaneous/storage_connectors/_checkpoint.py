@@ -0,0 +1,149 @@
+"""Local checkpoint store for resumable uploads.
+
+Connectors save the upload session state (S3 upload id and completed
+parts, GCS session URI, Azure staged blocks, local temporary file) after
+each confirmed chunk. If the upload is interrupted, a new upload with the
+same checkpoint key resumes from the last confirmed chunk, even after a
+process restart.
+
+The data stream of the resumed upload must start from the beginning, the
+bytes already uploaded are read (not sent) to update file hashes and to
+check that data did not change.
+"""
+import os
+import json
+import time
+import hashlib
+import tempfile
+from pumpwood_communication import exceptions
+
+
+DEFAULT_CHECKPOINT_PATH = os.path.join(
+    tempfile.gettempdir(), 'pumpwood-upload-checkpoints')
+"""Default folder used to store upload checkpoints."""
+DEFAULT_MAX_AGE = 6 * 24 * 3600
+"""Checkpoints older than this (seconds) are ignored, Azure discards
+uncommitted blocks after 7 days."""
+
+
+class UploadCheckpoint():
+    """Persisted state of an upload session."""
+
+    def __init__(self, store, key: str, state: dict = None):
+        """__init__.
+
+        Args:
+            store (UploadCheckpointStore):
+                Store used to persist the checkpoint.
+            key (str):
+                Key of the upload.
+            state (dict):
+                State loaded from the store, empty dict if new upload.
+        """
+        self._store = store
+        self.key = key
+        self.state = state or {}
+
+    def save(self):
+        """Persist current state."""
+        self._store.save(self.key, self.state)
+
+    def clear(self):
+        """Remove checkpoint, upload was finished or aborted."""
+        self.state = {}
+        self._store.delete(self.key)
+
+
+class UploadCheckpointStore():
+    """Store upload checkpoints as JSON files in a local folder."""
+
+    def __init__(self, folder_path: str = DEFAULT_CHECKPOINT_PATH,
+                 max_age: int = DEFAULT_MAX_AGE):
+        """__init__.
+
+        Args:
+            folder_path (str):
+                Folder to store the checkpoints, it is created if it does
+                not exist.
+            max_age (int):
+                Checkpoints older than max_age seconds are ignored.
+        """
+        self.folder_path = folder_path
+        self.max_age = max_age
+        os.makedirs(folder_path, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        key_hash = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.folder_path, key_hash + '.json')
+
+    def checkpoint(self, key: str) -> UploadCheckpoint:
+        """Return the checkpoint of the upload key.
+
+        Args:
+            key (str):
+                Key of the upload, usually storage, bucket and file path.
+
+        Returns:
+            Checkpoint with the state of a previous interrupted upload or
+            an empty state.
+        """
+        path = self._path(key)
+        state = None
+        try:
+            with open(path, 'r') as file:
+                checkpoint_data = json.load(file)
+            is_valid = (
+                checkpoint_data.get('key') == key and
+                time.time() - checkpoint_data['saved_at'] < self.max_age)
+            if is_valid:
+                state = checkpoint_data['state']
+        except (OSError, ValueError, KeyError):
+            state = None
+        return UploadCheckpoint(store=self, key=key, state=state)
+
+    def save(self, key: str, state: dict):
+        """Save state atomically, it is flushed to disk before return."""
+        path = self._path(key)
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'w') as file:
+            json.dump({
+                'key': key, 'saved_at': time.time(), 'state': state}, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, path)
+
+    def delete(self, key: str):
+        """Remove checkpoint of key."""
+        path = self._path(key)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def read_exact(stream, size: int) -> bytes:
+    """Read size bytes from stream, less only at the end of the stream."""
+    data = bytearray()
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            break
+        data.extend(chunk)
+    return bytes(data)
+
+
+def check_resumed_chunk(checkpoint: UploadCheckpoint, data: bytes,
+                        expected_md5: str):
+    """Check that data of an uploaded chunk did not change.
+
+    Raises:
+        PumpWoodDataLoadingException:
+            If data differs from the uploaded one, checkpoint is removed
+            so the next try starts a new upload.
+    """
+    md5_hash = hashlib.md5(data).hexdigest()
+    if md5_hash != expected_md5:
+        checkpoint.clear()
+        msg = (
+            "Data stream differs from the interrupted upload '{key}', "
+            "checkpoint was removed, upload must be restarted").format(
+                key=checkpoint.key)
+        raise exceptions.PumpWoodDataLoadingException(msg)
@@ -0,0 +1,261 @@
+"""Adaptive chunk sizing of streamed transfers.
+
+Streams are transferred in chunks that start at the minimum valid size of
+the provider (GCS 256Kb multiples, S3 5Mb parts) and grow with the
+measured throughput, targeting `TARGET_CHUNK_SECONDS` per chunk. When the
+content length is known the first chunk is large enough to respect the
+limit of parts of the provider.
+
+Chunk buffers are reserved at a `MemoryBudget` shared by all transfers of
+the process (`STORAGE_MEMORY_BUDGET`), many concurrent uploads use
+smaller chunks or wait instead of exhausting memory.
+"""
+import os
+import time
+import threading
+import contextlib
+from typing import Iterator
+from pumpwood_communication import exceptions
+from ._checkpoint import read_exact
+
+
+TARGET_CHUNK_SECONDS = 1.0
+"""Target duration of the transfer of each chunk."""
+DEFAULT_MEMORY_BUDGET = 256 * 1024 ** 2
+"""Default bytes of chunk buffers for all transfers of the process."""
+DEFAULT_READ_SIZE = 1024 ** 2
+"""Read size of storage layers when chunk size is adaptive (None)."""
+CHUNK_RULES = {
+    'aws_s3': {
+        'minimum': 5 * 1024 ** 2, 'multiple': 1,
+        'maximum': 64 * 1024 ** 2, 'max_parts': 10000},
+    'google_bucket': {
+        'minimum': 256 * 1024, 'multiple': 256 * 1024,
+        'maximum': 64 * 1024 ** 2, 'max_parts': None},
+    'azure_storage': {
+        'minimum': 1024 ** 2, 'multiple': 1,
+        'maximum': 64 * 1024 ** 2, 'max_parts': 50000},
+    'local': {
+        'minimum': 256 * 1024, 'multiple': 1,
+        'maximum': 16 * 1024 ** 2, 'max_parts': None},
+    'memory': {
+        'minimum': 256 * 1024, 'multiple': 1,
+        'maximum': 16 * 1024 ** 2, 'max_parts': None},
+}
+"""Minimum, multiple and maximum chunk sizes and the limit of parts of
+each provider."""
+
+
+class MemoryBudget():
+    """Bytes of transfer buffers shared by the threads of the process."""
+
+    def __init__(self, max_bytes: int):
+        """__init__.
+
+        Args:
+            max_bytes (int):
+                Maximum bytes reserved at the same time.
+        """
+        self.max_bytes = max_bytes
+        self.in_use = 0
+        self._condition = threading.Condition()
+
+    def resize(self, max_bytes: int):
+        """Change the maximum bytes of the budget."""
+        with self._condition:
+            self.max_bytes = max_bytes
+            self._condition.notify_all()
+
+    def acquire(self, n_bytes: int, minimum: int = None) -> int:
+        """Reserve up to n_bytes, waiting until minimum is available.
+
+        A reservation larger than the budget is granted when nothing else
+        is reserved, so a single transfer never waits forever.
+
+        Args:
+            n_bytes (int):
+                Bytes requested.
+            minimum (int):
+                Minimum bytes to be reserved, default is n_bytes.
+
+        Returns:
+            Bytes reserved, between minimum and n_bytes.
+        """
+        minimum = n_bytes if minimum is None else min(minimum, n_bytes)
+        with self._condition:
+            while self.in_use and \
+                    self.max_bytes - self.in_use < minimum:
+                self._condition.wait()
+            granted = max(minimum, min(n_bytes, self.max_bytes - self.in_use))
+            self.in_use += granted
+            return granted
+
+    def release(self, n_bytes: int):
+        """Release bytes reserved by acquire."""
+        with self._condition:
+            self.in_use = max(0, self.in_use - n_bytes)
+            self._condition.notify_all()
+
+
+STORAGE_MEMORY_BUDGET = MemoryBudget(DEFAULT_MEMORY_BUDGET)
+"""Budget shared by the storage transfers of the process."""
+
+
+def stream_length(stream) -> int:
+    """Return remaining bytes of the stream, None if it is not known.
+
+    Seekable streams, files and Werkzeug limited streams (Flask request
+    stream with Content-Length) are supported.
+    """
+    limit = getattr(stream, 'limit', None)
+    if isinstance(limit, int):
+        return max(0, limit - getattr(stream, '_pos', 0))
+    try:
+        if stream.seekable():
+            position = stream.tell()
+            end = stream.seek(0, os.SEEK_END)
+            stream.seek(position)
+            return end - position
+    except (AttributeError, OSError, ValueError):
+        pass
+    try:
+        file_stat = os.fstat(stream.fileno())
+        return max(0, file_stat.st_size - stream.tell())
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+class AdaptiveChunkSizer():
+    """Chunk sizes of a transfer adapted to its throughput.
+
+    Each chunk doubles at most the previous size, it is the size that
+    would take `target_seconds` at the throughput of the last chunk.
+    """
+
+    def __init__(self, minimum: int, multiple: int = 1,
+                 maximum: int = 64 * 1024 ** 2, max_parts: int = None,
+                 content_length: int = None, chunk_size: int = None,
+                 target_seconds: float = TARGET_CHUNK_SECONDS,
+                 budget: MemoryBudget = None):
+        """__init__.
+
+        Args:
+            minimum (int):
+                Minimum chunk size.
+            multiple (int):
+                Chunk sizes are multiples of this value.
+            maximum (int):
+                Maximum chunk size of adaptive transfers.
+            max_parts (int):
+                Maximum number of parts of the provider, used with
+                content_length to set the first chunk size.
+            content_length (int):
+                Bytes of the transfer if known.
+            chunk_size (int):
+                Fixed chunk size, it is rounded to the provider rules and
+                does not adapt. None for adaptive sizing.
+            target_seconds (float):
+                Target duration of each chunk.
+            budget (MemoryBudget):
+                Memory budget of the chunk buffers, default
+                STORAGE_MEMORY_BUDGET.
+        """
+        if minimum % multiple:
+            msg = "minimum chunk size must be multiple of {}".format(
+                multiple)
+            raise exceptions.PumpWoodWrongParameters(msg)
+        self.minimum = minimum
+        self.multiple = multiple
+        self.target_seconds = target_seconds
+        self.budget = budget or STORAGE_MEMORY_BUDGET
+        self.adaptive = chunk_size is None
+
+        size = minimum if chunk_size is None else chunk_size
+        if content_length and max_parts:
+            size = max(size, -(-content_length // max_parts))
+        self.size = self._round(size)
+        self.maximum = max(self._round(maximum), self.size)
+
+    @classmethod
+    def for_provider(cls, provider: str, chunk_size: int = None,
+                     content_length: int = None, **kwargs):
+        """Create a sizer with the chunk rules of the provider.
+
+        Args:
+            provider (str):
+                Key of CHUNK_RULES ('aws_s3', 'google_bucket', ...).
+            chunk_size (int):
+                Fixed chunk size, None for adaptive sizing.
+            content_length (int):
+                Bytes of the transfer if known.
+            **kwargs:
+                Other AdaptiveChunkSizer arguments.
+        """
+        return cls(
+            chunk_size=chunk_size, content_length=content_length,
+            **{**CHUNK_RULES[provider], **kwargs})
+
+    def _round(self, size: int) -> int:
+        """Round size down to multiple and up to minimum."""
+        return max(self.minimum, size - size % self.multiple)
+
+    def record(self, n_bytes: int, seconds: float):
+        """Update the chunk size with the throughput of a chunk."""
+        if not self.adaptive or n_bytes < self.size or seconds <= 0:
+            return
+        target = int(n_bytes / seconds * self.target_seconds)
+        self.size = min(self.maximum, self._round(
+            min(max(target, self.size // 2), self.size * 2)))
+
+    @contextlib.contextmanager
+    def chunk(self):
+        """Reserve the next chunk at the budget and measure its transfer.
+
+        Yields the chunk size, it may be smaller than the adaptive size
+        (but not than the minimum) if the budget is short.
+        """
+        reserved = self.budget.acquire(self.size, minimum=self.minimum)
+        size = self._round(min(reserved, self.size))
+        start = time.perf_counter()
+        try:
+            yield size
+        finally:
+            self.budget.release(reserved)
+        self.record(size, time.perf_counter() - start)
+
+    def reserve_concurrency(self, chunk_size: int, max_concurrency: int
+                            ) -> int:
+        """Reserve buffers of parallel parts at the budget.
+
+        Used by SDK managed transfers that read parts concurrently.
+
+        Returns:
+            Number of parts that may be in memory at the same time, the
+            reservation must be released with `release_concurrency`.
+        """
+        reserved = self.budget.acquire(
+            chunk_size * max_concurrency, minimum=chunk_size)
+        self._concurrency_reserved = reserved
+        return max(1, reserved // chunk_size)
+
+    def release_concurrency(self):
+        """Release the reservation of `reserve_concurrency`."""
+        self.budget.release(getattr(self, '_concurrency_reserved', 0))
+        self._concurrency_reserved = 0
+
+
+def iter_chunks(stream, sizer: AdaptiveChunkSizer) -> Iterator[bytes]:
+    """Read stream in chunks with the sizes of sizer.
+
+    The chunk buffer stays reserved while it is processed by the caller
+    and the time until the next chunk is requested is used as the
+    transfer time of the chunk.
+    """
+    while True:
+        with sizer.chunk() as size:
+            data = read_exact(stream, size)
+            if not data:
+                return
+            yield data
+            if len(data) < size:
+                return
@@ -0,0 +1,535 @@
+"""Transparent compression layer over storage connectors.
+
+Files are compressed while written and decompressed while read, the codec
+is recorded at object metadata (`pumpwood_codec`) so files written with
+compression are decoded automatically and files written without it are
+returned as they are.
+
+Codecs produce concatenable frames, appends compress only the new content
+as a new frame. Hashes returned by the storage refer to the stored
+(compressed) bytes, same as the checksums validated by the providers.
+
+'zstd' needs `zstandard` package and 'lz4' needs `lz4` package, they are
+imported only when used.
+"""
+import io
+import zlib
+import importlib
+from typing import Iterator, List
+from pumpwood_communication import exceptions
+from ._general import metadata_value
+from ._file import open_raw_reader
+from ._chunking import DEFAULT_READ_SIZE
+
+
+CODEC_METADATA_KEY = 'pumpwood_codec'
+"""Object metadata key used to record the compression codec."""
+
+INCOMPRESSIBLE_CONTENT_TYPES = (
+    'image/', 'video/', 'audio/', 'application/zip', 'application/gzip',
+    'application/x-gzip', 'application/zstd', 'application/x-7z-compressed',
+    'application/x-bzip2', 'application/vnd.apache.parquet',
+    'application/vnd.apache.arrow.file')
+"""Content type prefixes stored without compression, data that is already
+compressed or columnar files read by ranges."""
+
+
+class _LZ4Compressor():
+    """Adapt lz4 frame compressor to zlib compressobj interface."""
+
+    def __init__(self, compressor):
+        self._compressor = compressor
+        self._header = compressor.begin()
+
+    def compress(self, data: bytes) -> bytes:
+        header, self._header = self._header, b''
+        return header + self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        header, self._header = self._header, b''
+        return header + self._compressor.flush()
+
+
+def _import_codec_module(module_name: str, codec: str):
+    """Import codec package raising PumpWood error if not installed."""
+    try:
+        return importlib.import_module(module_name)
+    except ImportError:
+        msg = (
+            "Compression codec '{codec}' needs package '{package}' to be "
+            "installed").format(codec=codec, package=module_name.split('.')[0])
+        raise exceptions.PumpWoodNotImplementedError(msg)
+
+
+class Codec():
+    """Compression codec with streaming compressors and decompressors."""
+
+    def __init__(self, name: str, content_encoding: str,
+                 default_level: int):
+        """__init__.
+
+        Args:
+            name (str):
+                Name of the codec recorded at object metadata.
+            content_encoding (str):
+                HTTP content-coding of the compressed data, None if the
+                codec is not a registered content-coding.
+            default_level (int):
+                Compression level used if not set.
+        """
+        self.name = name
+        self.content_encoding = content_encoding
+        self.default_level = default_level
+
+    def compressor(self, level: int = None):
+        """Return an object with `compress` and `flush` methods."""
+        level = self.default_level if level is None else level
+        if self.name == 'gzip':
+            return zlib.compressobj(level, zlib.DEFLATED, 31)
+        elif self.name == 'zstd':
+            zstandard = _import_codec_module('zstandard', self.name)
+            return zstandard.ZstdCompressor(level=level).compressobj()
+        else:
+            lz4_frame = _import_codec_module('lz4.frame', self.name)
+            return _LZ4Compressor(
+                lz4_frame.LZ4FrameCompressor(compression_level=level))
+
+    def decompressor(self):
+        """Return a decompressor with `decompress`, `eof`, `unused_data`."""
+        if self.name == 'gzip':
+            return zlib.decompressobj(31)
+        elif self.name == 'zstd':
+            zstandard = _import_codec_module('zstandard', self.name)
+            return zstandard.ZstdDecompressor().decompressobj()
+        else:
+            lz4_frame = _import_codec_module('lz4.frame', self.name)
+            return lz4_frame.LZ4FrameDecompressor()
+
+    def compress(self, data: bytes, level: int = None) -> bytes:
+        """Compress data as a single frame."""
+        compressor = self.compressor(level=level)
+        return compressor.compress(data) + compressor.flush()
+
+
+CODECS = {
+    'gzip': Codec(name='gzip', content_encoding='gzip', default_level=6),
+    'zstd': Codec(name='zstd', content_encoding='zstd', default_level=3),
+    'lz4': Codec(name='lz4', content_encoding=None, default_level=0),
+}
+"""Available compression codecs by name."""
+
+
+def get_codec(name: str) -> Codec:
+    """Return codec by name.
+
+    Raises:
+        PumpWoodNotImplementedError:
+            If codec is not implemented.
+    """
+    codec = CODECS.get(name)
+    if codec is None:
+        msg = "Compression codec '{name}' not implemented, use {codecs}"\
+            .format(name=name, codecs=list(CODECS.keys()))
+        raise exceptions.PumpWoodNotImplementedError(msg)
+    return codec
+
+
+class StreamDecompressor():
+    """Decompress a stream of concatenated frames incrementally."""
+
+    def __init__(self, codec: Codec):
+        """__init__.
+
+        Args:
+            codec (Codec):
+                Codec used to compress the stream.
+        """
+        self._codec = codec
+        self._decompressor = codec.decompressor()
+        self._frame_started = False
+
+    def decompress(self, data: bytes) -> bytes:
+        """Return decompressed data available for the chunk."""
+        output = []
+        while data:
+            self._frame_started = True
+            output.append(self._decompressor.decompress(data))
+            if not self._decompressor.eof:
+                break
+            data = self._decompressor.unused_data
+            self._decompressor = self._codec.decompressor()
+            self._frame_started = False
+        return b''.join(output)
+
+    def finish(self):
+        """Check that the stream did not end in the middle of a frame.
+
+        Raises:
+            PumpWoodDataLoadingException:
+                If compressed data is truncated.
+        """
+        if self._frame_started:
+            msg = "Compressed data ({codec}) is truncated".format(
+                codec=self._codec.name)
+            raise exceptions.PumpWoodDataLoadingException(msg)
+
+
+def decompress_iterator(iterator, codec: Codec) -> Iterator[bytes]:
+    """Decompress an iterator of compressed chunks."""
+    decompressor = StreamDecompressor(codec)
+    for chunk in iterator:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    decompressor.finish()
+
+
+class CompressingStream():
+    """File like object that compresses data read from a stream."""
+
+    def __init__(self, data_stream, codec: Codec, level: int = None,
+                 chunk_size: int = DEFAULT_READ_SIZE):
+        """__init__.
+
+        Args:
+            data_stream:
+                Stream with uncompressed data, it must have a read method.
+            codec (Codec):
+                Compression codec.
+            level (int):
+                Compression level.
+            chunk_size (int):
+                Size of the chunks read from data_stream.
+        """
+        self._stream = data_stream
+        self._compressor = codec.compressor(level=level)
+        self._chunk_size = chunk_size or DEFAULT_READ_SIZE
+        self._buffer = bytearray()
+        self._finished = False
+        self.bytes_read = 0
+        self.bytes_position = 0
+
+    def read(self, size: int = -1) -> bytes:
+        """Read up to size bytes of compressed data."""
+        while not self._finished and (size < 0 or len(self._buffer) < size):
+            chunk = self._stream.read(self._chunk_size)
+            if not chunk:
+                self._buffer.extend(self._compressor.flush())
+                self._finished = True
+            else:
+                self.bytes_read += len(chunk)
+                self._buffer.extend(self._compressor.compress(chunk))
+
+        size = len(self._buffer) if size < 0 else size
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self.bytes_position += len(data)
+        return data
+
+    def tell(self) -> int:
+        """Return number of compressed bytes read."""
+        return self.bytes_position
+
+
+class DecompressingWriter():
+    """File like object that writes decompressed data to file_obj.
+
+    Storage connectors close the file object at the end of the download,
+    the decompression is checked and file_obj is closed at `close`.
+    """
+
+    def __init__(self, file_obj, codec: Codec):
+        """__init__.
+
+        Args:
+            file_obj:
+                File like object that will receive decompressed data.
+            codec (Codec):
+                Codec used to compress the data.
+        """
+        self._file_obj = file_obj
+        self._decompressor = StreamDecompressor(codec)
+        self.closed = False
+
+    def write(self, data: bytes) -> int:
+        """Decompress data and write it to file_obj."""
+        self._file_obj.write(self._decompressor.decompress(data))
+        return len(data)
+
+    def close(self):
+        """Check decompression and close file_obj."""
+        if self.closed:
+            return
+        self.closed = True
+        self._decompressor.finish()
+        self._file_obj.close()
+
+
+class CompressedBucket():
+    """Wraps a storage connector compressing files content."""
+
+    def __init__(self, storage_object, codec: str = 'zstd',
+                 level: int = None, min_size: int = 1024):
+        """__init__.
+
+        Args:
+            storage_object:
+                Storage connector used to store the compressed files.
+            codec (str):
+                Compression codec, 'zstd', 'gzip' or 'lz4'.
+            level (int):
+                Compression level, if not set codec default level is used.
+            min_size (int):
+                Files smaller than this (bytes) are stored without
+                compression on `write_file`.
+        """
+        self.storage_object = storage_object
+        self.codec = get_codec(codec)
+        self.level = level
+        self.min_size = min_size
+
+    def _codec_metadata(self, codec: Codec) -> dict:
+        return {CODEC_METADATA_KEY: codec.name}
+
+    def _get_codec(self, file_path: str) -> Codec:
+        """Return the codec of the file or None if not compressed."""
+        file_metadata = self.storage_object.get_file_metadata(
+            file_path=file_path)
+        codec_name = metadata_value(
+            file_metadata['metadata'], CODEC_METADATA_KEY)
+        if codec_name is None:
+            return None
+        return get_codec(codec_name)
+
+    def check_file_exists(self, file_path: str) -> bool:
+        """Check if file exists."""
+        return self.storage_object.check_file_exists(file_path=file_path)
+
+    def list_files(self, path: str = "") -> List[str]:
+        """List files at storage path."""
+        return self.storage_object.list_files(path=path)
+
+    def write_file(self, file_path: str, data: bytes, if_exists: str = 'fail',
+                   content_type='text/plain', metadata: dict = None) -> str:
+        """Compress data and write it to storage.
+
+        Appends compress the new content with the codec of the existing
+        file and append it as a new frame, old content is not
+        decompressed.
+
+        Args:
+            file_path (str):
+                Path to save the file.
+            data (str):
+                File content in bytes.
+            if_exists (str):
+                if_exists must be in 'overwrite', 'overwrite_streaming',
+                'append_breakline', 'append' or 'fail'.
+            content_type (str):
+                Mime-type of the content, already compressed content types
+                are not compressed.
+            metadata (dict):
+                User metadata to be stored with the object.
+
+        Returns:
+            A string with bucket path.
+        """
+        codec = self.codec
+        if len(data) < self.min_size or \
+                content_type.startswith(INCOMPRESSIBLE_CONTENT_TYPES):
+            codec = None
+
+        if if_exists in ['append_breakline', 'append'] and \
+                self.storage_object.check_file_exists(file_path=file_path):
+            codec = self._get_codec(file_path)
+            if if_exists == 'append_breakline':
+                data = b'\n' + data
+            if_exists = 'append'
+
+        metadata = dict(metadata or {})
+        if codec is not None:
+            data = codec.compress(data, level=self.level)
+            metadata.update(self._codec_metadata(codec))
+        return self.storage_object.write_file(
+            file_path=file_path, data=data, if_exists=if_exists,
+            content_type=content_type, metadata=metadata)
+
+    def write_file_stream(self, file_path: str, data_stream: io.BytesIO,
+                          chunk_size: int = None,
+                          metadata: dict = None,
+                          content_type: str = 'application/octet-stream',
+                          checkpoint=None) -> dict:
+        """Compress the stream while it is uploaded.
+
+        Args:
+            file_path (str):
+                Path to save the stream.
+            data_stream (io.BytesIO):
+                Data stream.
+            chunk_size (int):
+                Size of the chuck to be transmited, None to adapt it to
+                the throughput.
+            metadata (dict):
+                User metadata to be stored with the object.
+            content_type (str):
+                Mime-type of the content, already compressed content types
+                are not compressed.
+            checkpoint (UploadCheckpoint):
+                Checkpoint of a resumable upload, compression is
+                deterministic so resumed compressed streams match the
+                uploaded chunks.
+
+        Returns:
+            Return the file path used to save data ("file_path" key), the
+            total of uncompressed bytes read from stream
+            ("bytes_uploaded"), the compressed bytes stored
+            ("bytes_compressed") and the base64 MD5 hash of the stored
+            data ("hash" key).
+        """
+        if content_type.startswith(INCOMPRESSIBLE_CONTENT_TYPES):
+            return self.storage_object.write_file_stream(
+                file_path=file_path, data_stream=data_stream,
+                chunk_size=chunk_size, metadata=metadata,
+                content_type=content_type, checkpoint=checkpoint)
+
+        stream = CompressingStream(
+            data_stream=data_stream, codec=self.codec, level=self.level,
+            chunk_size=chunk_size)
+        metadata = {**(metadata or {}), **self._codec_metadata(self.codec)}
+        results = self.storage_object.write_file_stream(
+            file_path=file_path, data_stream=stream, chunk_size=chunk_size,
+            metadata=metadata, content_type=content_type,
+            checkpoint=checkpoint)
+        results['bytes_uploaded'] = stream.bytes_read
+        results['bytes_compressed'] = stream.bytes_position
+        return results
+
+    def read_file(self, file_path: str) -> dict:
+        """Read and decompress file content."""
+        codec = self._get_codec(file_path)
+        file_data = self.storage_object.read_file(file_path=file_path)
+        if codec is not None:
+            decompressor = StreamDecompressor(codec)
+            data = decompressor.decompress(bytes(file_data['data']))
+            decompressor.finish()
+            file_data['data'] = data
+        return file_data
+
+    def get_read_file_iterator(self, file_path: str,
+                               chunk_size: int = 1024 * 1024,
+                               decompress: bool = True) -> Iterator[bytes]:
+        """Return an iterator over file content.
+
+        Args:
+            file_path (str):
+                Storage path.
+            chunk_size (int):
+                Size of compressed chunks read from storage.
+            decompress (bool):
+                If False compressed bytes are returned, they can be sent
+                to clients that accept the codec content-coding, see
+                `get_content_encoding`.
+        """
+        codec = self._get_codec(file_path) if decompress else None
+        iterator = self.storage_object.get_read_file_iterator(
+            file_path=file_path, chunk_size=chunk_size)
+        if codec is None:
+            return iterator
+        return decompress_iterator(iterator, codec)
+
+    def _check_not_compressed(self, file_path: str):
+        """Raise error if file is compressed.
+
+        Raises:
+            PumpWoodNotImplementedError:
+                Compressed files do not support random access.
+        """
+        if self._get_codec(file_path) is not None:
+            msg = (
+                "File {} is compressed, random access is not "
+                "available").format(file_path)
+            raise exceptions.PumpWoodNotImplementedError(msg)
+
+    def read_file_range(self, file_path: str, offset: int,
+                        length: int) -> bytes:
+        """Read a byte range of a file stored without compression."""
+        self._check_not_compressed(file_path)
+        return self.storage_object.read_file_range(
+            file_path=file_path, offset=offset, length=length)
+
+    def open_raw_reader(self, file_path: str, **kwargs):
+        """Return a raw reader of a file stored without compression."""
+        self._check_not_compressed(file_path)
+        return open_raw_reader(
+            self.storage_object, file_path=file_path, **kwargs)
+
+    def get_content_encoding(self, file_path: str) -> str:
+        """Return HTTP content-coding of the stored bytes.
+
+        Returns:
+            'identity' for files stored without compression, the
+            content-coding of the codec ('gzip', 'zstd') or None if the
+            codec is not an HTTP content-coding.
+        """
+        codec = self._get_codec(file_path)
+        if codec is None:
+            return 'identity'
+        return codec.content_encoding
+
+    def download_to_file(self, file_path: str, file_obj):
+        """Download and decompress file content to a file like object."""
+        codec = self._get_codec(file_path)
+        if codec is None:
+            return self.storage_object.download_to_file(
+                file_path=file_path, file_obj=file_obj)
+        writer = DecompressingWriter(file_obj, codec)
+        self.storage_object.download_to_file(
+            file_path=file_path, file_obj=writer)
+        writer.close()
+
+    def delete_file(self, file_path: str) -> bool:
+        """Delete file from storage."""
+        return self.storage_object.delete_file(file_path=file_path)
+
+    def copy_file(self, source_file_path: str, destination_file_path: str,
+                  if_exists: str = 'fail') -> str:
+        """Copy compressed file, metadata is kept by connectors."""
+        return self.storage_object.copy_file(
+            source_file_path=source_file_path,
+            destination_file_path=destination_file_path,
+            if_exists=if_exists)
+
+    def get_file_metadata(self, file_path: str) -> dict:
+        """Return metadata of the stored file, size is compressed size."""
+        return self.storage_object.get_file_metadata(file_path=file_path)
+
+    def get_file_hash(self, file_path: str, algorithm: str = 'md5') -> str:
+        """Return hash of the stored (compressed) file."""
+        return self.storage_object.get_file_hash(
+            file_path=file_path, algorithm=algorithm)
+
+    def get_download_url(self, file_path: str, **kwargs) -> str:
+        """Return a presigned URL of a file stored without compression.
+
+        Raises:
+            PumpWoodNotImplementedError:
+                Compressed files must be served by `get_read_file_iterator`
+                the client would receive the compressed data.
+        """
+        if self._get_codec(file_path) is not None:
+            msg = (
+                "File {} is compressed, it can not be downloaded with a "
+                "presigned URL").format(file_path)
+            raise exceptions.PumpWoodNotImplementedError(msg)
+        return self.storage_object.get_download_url(
+            file_path=file_path, **kwargs)
+
+    def get_upload_url(self, file_path: str, **kwargs) -> dict:
+        """Return presigned upload URLs, files are stored uncompressed."""
+        return self.storage_object.get_upload_url(
+            file_path=file_path, **kwargs)
+
+    def complete_upload(self, file_path: str, **kwargs) -> str:
+        """Complete a multipart presigned upload."""
+        return self.storage_object.complete_upload(
+            file_path=file_path, **kwargs)
@@ -0,0 +1,332 @@
+"""Columnar DataFrame read and write over storage connectors.
+
+DataFrames are written as Parquet or Arrow IPC (Feather V2) files streamed
+to the storage while they are serialized. Reads use ranged requests, only
+the file footer, the projected columns and the row groups that may match
+the filters are fetched.
+
+`pyarrow` is imported only when these functions are used.
+"""
+import queue
+import itertools
+import threading
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List
+from pumpwood_communication import exceptions
+from ._file import open_file
+
+
+DATAFRAME_FORMATS = {
+    'parquet': 'application/vnd.apache.parquet',
+    'feather': 'application/vnd.apache.arrow.file',
+    'arrow': 'application/vnd.apache.arrow.file',
+}
+"""Content type of the files by DataFrame format."""
+
+FORMAT_EXTENSIONS = {
+    '.parquet': 'parquet', '.pq': 'parquet', '.feather': 'feather',
+    '.arrow': 'arrow', '.ipc': 'arrow',
+}
+"""DataFrame format inferred from file extension."""
+
+READ_BLOCK_SIZE = 256 * 1024
+"""Block size of the reader, column chunks are read on contiguous
+blocks with a single request."""
+
+
+def _import_pyarrow():
+    """Import pyarrow modules raising PumpWood error if not installed."""
+    try:
+        return (
+            importlib.import_module('pyarrow'),
+            importlib.import_module('pyarrow.dataset'),
+            importlib.import_module('pyarrow.parquet'))
+    except ImportError:
+        msg = "DataFrame storage functions need pyarrow to be installed"
+        raise exceptions.PumpWoodNotImplementedError(msg)
+
+
+def get_dataframe_format(file_path: str, file_format: str = None) -> str:
+    """Return file format, inferring it from extension if not set.
+
+    Raises:
+        PumpWoodNotImplementedError:
+            If format is not implemented.
+    """
+    if file_format is None:
+        extension = '.' + file_path.rsplit('.', 1)[-1].lower() \
+            if '.' in file_path else ''
+        file_format = FORMAT_EXTENSIONS.get(extension, 'parquet')
+    if file_format not in DATAFRAME_FORMATS:
+        msg = "DataFrame format '{}' not implemented, use {}".format(
+            file_format, list(DATAFRAME_FORMATS.keys()))
+        raise exceptions.PumpWoodNotImplementedError(msg)
+    return file_format
+
+
+class _PipeStream():
+    """Pass data written by one thread to a reader on another thread.
+
+    Writes are grouped in chunks of chunk_size, at most max_chunks are
+    kept in memory and writers wait for the reader.
+    """
+
+    _EOF = object()
+
+    def __init__(self, chunk_size: int = 1024 * 1024, max_chunks: int = 4):
+        self._queue = queue.Queue(maxsize=max_chunks)
+        self._chunk_size = chunk_size
+        self._write_buffer = bytearray()
+        self._read_buffer = bytearray()
+        self._reader_done = threading.Event()
+        self._finished = False
+        self._finished_writing = False
+        self.closed = False
+        self.bytes_written = 0
+
+    def _put(self, item):
+        while not self._reader_done.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        msg = "Upload of the stream was interrupted"
+        raise exceptions.PumpWoodException(msg)
+
+    # Writer side
+    def write(self, data) -> int:
+        self._write_buffer.extend(data)
+        self.bytes_written += len(data)
+        if self._chunk_size <= len(self._write_buffer):
+            self._put(bytes(self._write_buffer))
+            self._write_buffer.clear()
+        return len(data)
+
+    def tell(self) -> int:
+        return self.bytes_written
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """Close writer side, stream is finished only by `finish`."""
+        self.closed = True
+
+    def finish(self, error: Exception = None):
+        """Finish the stream, reader will raise error if it is set."""
+        if self._finished_writing:
+            return
+        self._finished_writing = True
+        if error is None and self._write_buffer:
+            self._put(bytes(self._write_buffer))
+        self._put(self._EOF if error is None else error)
+
+    # Reader side
+    def read(self, size: int = -1) -> bytes:
+        while not self._finished and (
+                size < 0 or len(self._read_buffer) < size):
+            item = self._queue.get()
+            if item is self._EOF:
+                self._finished = True
+            elif isinstance(item, BaseException):
+                self._finished = True
+                raise item
+            else:
+                self._read_buffer.extend(item)
+
+        size = len(self._read_buffer) if size < 0 else size
+        data = bytes(self._read_buffer[:size])
+        del self._read_buffer[:size]
+        return data
+
+    def reader_done(self):
+        """Signal writers that reader will not consume the stream."""
+        self._reader_done.set()
+
+
+def _iter_tables(pa, data) -> Iterator:
+    """Convert data to an iterator of pyarrow tables."""
+    if isinstance(data, (pa.Table, pa.RecordBatch)):
+        data = [data]
+    elif not isinstance(data, (list, tuple)) and \
+            not hasattr(data, '__next__'):
+        data = [data]
+    for part in data:
+        if isinstance(part, pa.Table):
+            yield part
+        elif isinstance(part, pa.RecordBatch):
+            yield pa.Table.from_batches([part])
+        else:
+            yield pa.Table.from_pandas(part)
+
+
+def write_dataframe(storage_object, file_path: str, data,
+                    file_format: str = None, chunk_size: int = 1024 * 1024,
+                    **writer_kwargs) -> dict:
+    """Stream a DataFrame to storage as a columnar file.
+
+    Serialization and upload run at the same time, the file is not
+    fully kept in memory or on disk.
+
+    Args:
+        storage_object:
+            Storage connector.
+        file_path (str):
+            Path of the file at the storage.
+        data:
+            A pandas DataFrame, a pyarrow Table or an iterable of them
+            (ex.: a generator of DataFrames larger than memory). All
+            parts must have the same schema as the first one.
+        file_format (str):
+            'parquet', 'feather' or 'arrow', if not set it is inferred from
+            file extension and default to 'parquet'.
+        chunk_size (int):
+            Size of the chunks sent to storage.
+        **writer_kwargs:
+            Arguments passed to `pyarrow.parquet.ParquetWriter` (ex.:
+            compression, row_group_size is used at write_table) or
+            `pyarrow.ipc.IpcWriteOptions` for arrow formats.
+
+    Returns:
+        Results of the storage `write_file_stream`.
+
+    Raises:
+        PumpWoodWrongParameters:
+            If data is empty.
+    """
+    pa, _, pq = _import_pyarrow()
+    file_format = get_dataframe_format(file_path, file_format)
+    row_group_size = writer_kwargs.pop('row_group_size', None)
+
+    tables = _iter_tables(pa, data)
+    first_table = next(tables, None)
+    if first_table is None:
+        msg = "No data to be written at file {}".format(file_path)
+        raise exceptions.PumpWoodWrongParameters(msg)
+
+    pipe = _PipeStream(chunk_size=chunk_size)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        def upload():
+            try:
+                return storage_object.write_file_stream(
+                    file_path=file_path, data_stream=pipe,
+                    chunk_size=chunk_size,
+                    content_type=DATAFRAME_FORMATS[file_format])
+            finally:
+                pipe.reader_done()
+        upload_future = executor.submit(upload)
+
+        try:
+            sink = pa.PythonFile(pipe, mode='w')
+            if file_format == 'parquet':
+                writer = pq.ParquetWriter(
+                    sink, schema=first_table.schema, **writer_kwargs)
+            else:
+                writer = pa.ipc.new_file(
+                    sink, schema=first_table.schema,
+                    options=pa.ipc.IpcWriteOptions(**writer_kwargs))
+            with writer:
+                for table in itertools.chain([first_table], tables):
+                    if file_format == 'parquet':
+                        writer.write_table(table, row_group_size)
+                    else:
+                        writer.write_table(table)
+        except BaseException as e:
+            try:
+                pipe.finish(error=e)
+            except exceptions.PumpWoodException:
+                # Upload has already stopped
+                pass
+            if upload_future.exception() is not None:
+                raise upload_future.exception() from e
+            raise
+        pipe.finish()
+        return upload_future.result()
+
+
+def _make_fragment(storage_object, file_path: str, file_format: str):
+    """Return a pyarrow dataset fragment reading file with ranged reads."""
+    pa, ds, _ = _import_pyarrow()
+    file_format = get_dataframe_format(file_path, file_format)
+    source = pa.PythonFile(open_file(
+        storage_object, file_path=file_path, buffering=0,
+        block_size=READ_BLOCK_SIZE, cache_blocks=64), mode='r')
+    if file_format == 'parquet':
+        return ds.ParquetFileFormat().make_fragment(source)
+    return ds.IpcFileFormat().make_fragment(source)
+
+
+def _filters_to_expression(filters):
+    """Convert DNF filters (list of tuples) to pyarrow expression."""
+    if filters is None or not isinstance(filters, (list, tuple)):
+        return filters
+    _, _, pq = _import_pyarrow()
+    return pq.filters_to_expression(filters)
+
+
+def read_dataframe(storage_object, file_path: str,
+                   columns: List[str] = None, filters=None,
+                   file_format: str = None):
+    """Read a columnar file from storage as a pandas DataFrame.
+
+    Args:
+        storage_object:
+            Storage connector.
+        file_path (str):
+            Path of the file at the storage.
+        columns (List[str]):
+            Columns to be read, other columns are not downloaded.
+        filters:
+            Rows filter as pyarrow expression or list of tuples
+            (ex.: `[('year', '>=', 2020)]`, same as pandas.read_parquet).
+            Parquet row groups that do not match the statistics of
+            the filter are not downloaded.
+        file_format (str):
+            'parquet', 'feather' or 'arrow', inferred from extension if
+            not set.
+
+    Returns:
+        pandas.DataFrame with file data.
+    """
+    fragment = _make_fragment(storage_object, file_path, file_format)
+    table = fragment.to_table(
+        columns=columns, filter=_filters_to_expression(filters))
+    return table.to_pandas()
+
+
+def iter_dataframe(storage_object, file_path: str,
+                   columns: List[str] = None, filters=None,
+                   file_format: str = None,
+                   batch_size: int = 128 * 1024) -> Iterator:
+    """Iterate over a columnar file as pandas DataFrame batches.
+
+    Only one batch is kept in memory, it can be used to process files
+    larger than memory. Arguments are the same as `read_dataframe`.
+
+    Args:
+        storage_object:
+            Storage connector.
+        file_path (str):
+            Path of the file at the storage.
+        columns (List[str]):
+            Columns to be read.
+        filters:
+            Rows filter as pyarrow expression or list of tuples.
+        file_format (str):
+            'parquet', 'feather' or 'arrow'.
+        batch_size (int):
+            Maximum number of rows of each batch.
+
+    Returns:
+        Iterator of pandas.DataFrame.
+    """
+    fragment = _make_fragment(storage_object, file_path, file_format)
+    batches = fragment.to_batches(
+        columns=columns, filter=_filters_to_expression(filters),
+        batch_size=batch_size, use_threads=False)
+    for batch in batches:
+        if batch.num_rows:
+            yield batch.to_pandas()
+
@@ -0,0 +1,254 @@
+"""File like objects over storage objects using ranged reads.
+
+Reads are made by fixed size blocks kept in a LRU cache, contiguous
+missing blocks are fetched with a single ranged request. When the file
+is read sequentially the number of blocks fetched ahead doubles up to
+`max_read_ahead`, random access reads fetch only the needed blocks.
+"""
+import io
+import collections
+from pumpwood_communication import exceptions
+
+
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+"""Size of the blocks read from storage."""
+DEFAULT_CACHE_BLOCKS = 16
+"""Number of blocks kept in cache by each reader."""
+DEFAULT_MAX_READ_AHEAD = 8
+"""Maximum number of blocks fetched at once on sequential reads."""
+
+
+class StorageRawReader(io.RawIOBase):
+    """Seekable raw reader over a storage object with a block cache."""
+
+    def __init__(self, storage_object, file_path: str, size: int,
+                 block_size: int = DEFAULT_BLOCK_SIZE,
+                 cache_blocks: int = DEFAULT_CACHE_BLOCKS,
+                 max_read_ahead: int = DEFAULT_MAX_READ_AHEAD,
+                 on_close=None):
+        """__init__.
+
+        Args:
+            storage_object:
+                Storage connector with `read_file_range` method.
+            file_path (str):
+                Path of the file at the storage.
+            size (int):
+                Size of the file in bytes.
+            block_size (int):
+                Size of the blocks read from storage.
+            cache_blocks (int):
+                Number of blocks kept in cache.
+            max_read_ahead (int):
+                Maximum number of blocks fetched in a request when file is
+                read sequentially, it is limited to half of cache_blocks.
+            on_close:
+                Function called with the reader when it is closed, used to
+                collect the reader statistics.
+        """
+        super().__init__()
+        self._storage_object = storage_object
+        self.name = file_path
+        self.size = size
+        self.block_size = block_size
+        self.cache_blocks = max(cache_blocks, 1)
+        self.max_read_ahead = max(
+            1, min(max_read_ahead, self.cache_blocks // 2))
+        self._position = 0
+        self._cache = collections.OrderedDict()
+        self._last_block = None
+        self._read_ahead = 1
+        self._on_close = on_close
+
+        # Statistics of the reader
+        self.requests = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError("Invalid whence ({})".format(whence))
+        if position < 0:
+            raise ValueError("Negative seek position {}".format(position))
+        self._position = position
+        return position
+
+    def _read_range(self, offset: int, length: int) -> bytes:
+        self.requests += 1
+        return self._storage_object.read_file_range(
+            file_path=self.name, offset=offset, length=length)
+
+    def _cache_block(self, block: int, data: bytes):
+        self._cache[block] = data
+        while self.cache_blocks < len(self._cache):
+            self._cache.popitem(last=False)
+
+    def _get_blocks(self, first: int, last: int) -> bytes:
+        """Return data of blocks first to last fetching the missing ones."""
+        # Sequential reads increase read-ahead, random reads reset it
+        if self._last_block is not None and \
+                first in (self._last_block, self._last_block + 1):
+            self._read_ahead = min(self._read_ahead * 2, self.max_read_ahead)
+        else:
+            self._read_ahead = 1
+        self._last_block = last
+        n_blocks = -(-self.size // self.block_size)
+
+        blocks = {}
+        block = first
+        while block <= last:
+            cached = self._cache.get(block)
+            if cached is not None:
+                self.cache_hits += 1
+                self._cache.move_to_end(block)
+                blocks[block] = cached
+                block += 1
+                continue
+
+            # Fetch contiguous missing blocks with one request, adding
+            # read-ahead blocks after the last requested one
+            self.cache_misses += 1
+            run_end = block
+            read_ahead_end = min(
+                max(last, block + self._read_ahead - 1), n_blocks - 1)
+            while run_end < read_ahead_end and \
+                    (run_end + 1) not in self._cache:
+                run_end += 1
+            offset = block * self.block_size
+            data = self._read_range(
+                offset, (run_end + 1) * self.block_size - offset)
+            for i in range(block, run_end + 1):
+                start = (i - block) * self.block_size
+                block_data = data[start:start + self.block_size]
+                self._cache_block(i, block_data)
+                if i <= last:
+                    blocks[i] = block_data
+            block = run_end + 1
+        return b''.join(blocks[i] for i in range(first, last + 1))
+
+    def readinto(self, buffer) -> int:
+        length = min(len(buffer), self.size - self._position)
+        if length <= 0:
+            return 0
+
+        first = self._position // self.block_size
+        last = (self._position + length - 1) // self.block_size
+        if self.cache_blocks < last - first + 1:
+            # Reads larger than the cache are not cached
+            data = self._read_range(self._position, length)
+        else:
+            start = self._position - first * self.block_size
+            data = self._get_blocks(first, last)[start:start + length]
+        n_bytes = len(data)
+        buffer[:n_bytes] = data
+        self._position += n_bytes
+        return n_bytes
+
+    def readall(self) -> bytes:
+        """Read until the end of file with a single request."""
+        length = self.size - self._position
+        if length <= 0:
+            return b''
+        data = self._read_range(self._position, length)
+        self._position += len(data)
+        return data
+
+    def close(self):
+        if not self.closed and self._on_close is not None:
+            self._on_close(self)
+        self._cache.clear()
+        super().close()
+
+
+def open_raw_reader(storage_object, file_path: str,
+                    **kwargs) -> StorageRawReader:
+    """Return a raw reader for file_path at storage_object.
+
+    Storage layers that change how content is stored implement
+    `open_raw_reader` themselves.
+
+    Args:
+        storage_object:
+            Storage connector.
+        file_path (str):
+            Path of the file at the storage.
+        **kwargs:
+            Arguments passed to StorageRawReader, block_size,
+            cache_blocks, max_read_ahead and on_close.
+
+    Raises:
+        PumpWoodObjectDoesNotExist:
+            If file is not found on storage.
+        PumpWoodNotImplementedError:
+            If storage does not support ranged reads.
+    """
+    if hasattr(storage_object, 'open_raw_reader'):
+        return storage_object.open_raw_reader(file_path=file_path, **kwargs)
+    if not hasattr(storage_object, 'read_file_range'):
+        msg = "Storage {} does not support ranged reads".format(
+            type(storage_object).__name__)
+        raise exceptions.PumpWoodNotImplementedError(msg)
+    size = storage_object.get_file_metadata(file_path=file_path)['size']
+    return StorageRawReader(
+        storage_object=storage_object, file_path=file_path, size=size,
+        **kwargs)
+
+
+def open_file(storage_object, file_path: str, mode: str = 'rb',
+              buffering: int = -1, encoding: str = None, **kwargs):
+    """Open a file at storage for random access reading.
+
+    Args:
+        storage_object:
+            Storage connector.
+        file_path (str):
+            Path of the file at the storage.
+        mode (str):
+            'rb' for binary or 'r' for text reading.
+        buffering (int):
+            0 to return the raw reader (binary mode only), otherwise the
+            size of the buffer, -1 to use the block size.
+        encoding (str):
+            Encoding used on text mode.
+        **kwargs:
+            Arguments passed to StorageRawReader, block_size,
+            cache_blocks and max_read_ahead.
+
+    Returns:
+        StorageRawReader if buffering is 0, io.BufferedReader for binary
+        mode and io.TextIOWrapper for text mode.
+
+    Raises:
+        PumpWoodNotImplementedError:
+            If mode is not 'rb' or 'r'.
+    """
+    if mode not in ('rb', 'r', 'rt'):
+        msg = "Storage files can only be opened for reading, mode 'rb' or " \
+            "'r', not '{}'".format(mode)
+        raise exceptions.PumpWoodNotImplementedError(msg)
+    raw_reader = open_raw_reader(storage_object, file_path, **kwargs)
+    if buffering == 0:
+        if mode != 'rb':
+            raise ValueError("can't have unbuffered text I/O")
+        return raw_reader
+
+    buffer_size = raw_reader.block_size if buffering < 0 else buffering
+    buffered_reader = io.BufferedReader(raw_reader, buffer_size=buffer_size)
+    if mode == 'rb':
+        return buffered_reader
+    return io.TextIOWrapper(buffered_reader, encoding=encoding)
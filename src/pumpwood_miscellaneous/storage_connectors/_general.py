@@ -1,16 +1,139 @@
 """Define general functions and class to interact with storage clients"""
+import base64
+import hashlib
+from typing import Iterable, Dict
+from pumpwood_communication import exceptions
+
+try:
+    import google_crc32c
+except ImportError:
+    google_crc32c = None
+
+
+HASH_METADATA_KEYS = {
+    'md5': 'pumpwood_md5',
+    'sha256': 'pumpwood_sha256',
+    'crc32c': 'pumpwood_crc32c',
+}
+"""Object metadata keys used to store the hashes calculated on upload."""
+
+
+class StreamHasher():
+    """Calculate hashes incrementally while data is streamed.
+
+    Digests are returned base64 encoded, the same format used by cloud
+    providers on Content-MD5, x-goog-hash and x-amz-checksum headers.
+    """
+
+    def __init__(self, algorithms: Iterable[str] = ('md5', 'sha256')):
+        """__init__.
+
+        Args:
+            algorithms (Iterable[str]):
+                Hash algorithms, 'md5', 'sha256' and 'crc32c'. 'crc32c'
+                needs google-crc32c package and is ignored if it is not
+                installed.
+        """
+        self._hashers = {}
+        for algorithm in algorithms:
+            if algorithm == 'crc32c':
+                if google_crc32c is not None:
+                    self._hashers[algorithm] = google_crc32c.Checksum()
+            else:
+                self._hashers[algorithm] = hashlib.new(algorithm)
+
+    def update(self, data: bytes):
+        """Update hashes with a chunk of data."""
+        for hasher in self._hashers.values():
+            hasher.update(data)
+
+    def digests(self) -> Dict[str, str]:
+        """Return base64 encoded digests by algorithm."""
+        return {
+            algorithm: base64.b64encode(hasher.digest()).decode('utf-8')
+            for algorithm, hasher in self._hashers.items()}
+
+    def metadata(self) -> Dict[str, str]:
+        """Return digests as object metadata."""
+        return {
+            HASH_METADATA_KEYS[algorithm]: digest
+            for algorithm, digest in self.digests().items()}
+
+    @classmethod
+    def hash_bytes(cls, data: bytes,
+                   algorithms: Iterable[str] = ('md5', 'sha256')):
+        """Return a StreamHasher updated with data."""
+        hasher = cls(algorithms=algorithms)
+        hasher.update(data)
+        return hasher
+
+
+def hash_from_metadata(metadata: dict, algorithm: str = 'md5') -> str:
+    """Get hash stored on object metadata at upload.
+
+    Args:
+        metadata (dict):
+            Object metadata.
+        algorithm (str):
+            Hash algorithm.
+
+    Returns:
+        Base64 digest or None if not found.
+
+    Raises:
+        PumpWoodNotImplementedError:
+            If algorithm is not at HASH_METADATA_KEYS.
+    """
+    metadata_key = HASH_METADATA_KEYS.get(algorithm)
+    if metadata_key is None:
+        msg = "Hash algorithm [{}] not implemented, use {}".format(
+            algorithm, list(HASH_METADATA_KEYS.keys()))
+        raise exceptions.PumpWoodNotImplementedError(msg)
+    return metadata_value(metadata, metadata_key)
+
+
+def metadata_value(metadata: dict, key: str) -> str:
+    """Get a value from object metadata returned by providers.
+
+    Args:
+        metadata (dict):
+            Object metadata.
+        key (str):
+            Metadata key, lower case with underscores.
+
+    Returns:
+        Metadata value or None if not found.
+    """
+    if metadata is None:
+        return None
+    # Some providers and proxies change "_" to "-" on metadata headers
+    normalized = {
+        name.lower().replace('-', '_'): value
+        for name, value in metadata.items()}
+    return normalized.get(key)
 
 
 class FlaskStreamUploadWrapper():
     """Wraps flask stream response to behave like a file object."""
 
-    def __init__(self, flask_stream):
+    def __init__(self, flask_stream, hasher: StreamHasher = None):
+        """__init__.
+
+        Args:
+            flask_stream:
+                Stream with read method.
+            hasher (StreamHasher):
+                If set, it will be updated with data read from stream.
+        """
         self.bytes_position = 0
         self.stream = flask_stream
+        self.hasher = hasher
 
-    def read(self, chunk_size: int) -> bytes:
+    def read(self, chunk_size: int = -1) -> bytes:
         data = self.stream.read(chunk_size)
         self.bytes_position += len(data)
+        if self.hasher is not None:
+            self.hasher.update(data)
         return data
 
     def tell(self) -> int:
@@ -0,0 +1,246 @@
+"""Instrumentation layer of storage operations.
+
+`InstrumentedBucket` is the outermost storage layer, it records for each
+storage operation the latency, the status, the bytes read or written and
+an OpenTelemetry span. The requests of the provider API are counted by
+hooks at the connector (ex.: S3 HeadObject, GetObject), making redundant
+requests of the storage layers visible. Block cache statistics of the
+random access readers are recorded when they are closed.
+
+Metrics (with `pumpwood` namespace):
+- `pumpwood_storage_operation_seconds`: Histogram by backend, operation
+  and status.
+- `pumpwood_storage_bytes_total`: Counter by backend, operation and
+  direction ('read' or 'write').
+- `pumpwood_storage_requests_total`: Counter by backend and api_call.
+- `pumpwood_storage_cache_total`: Counter by backend and result ('hit'
+  or 'miss').
+"""
+import os
+import io
+from typing import Iterator, List
+from pumpwood_miscellaneous.metrics import Instrumentation
+from ._file import StorageRawReader, open_raw_reader
+
+
+class _CountingFile():
+    """Proxy of a writable file counting the bytes written."""
+
+    def __init__(self, file_obj):
+        self._file_obj = file_obj
+        self._start = self._tell()
+        self._end = None
+        self.bytes_written = 0
+
+    def _tell(self):
+        try:
+            return self._file_obj.tell()
+        except (AttributeError, OSError, ValueError):
+            return None
+
+    def write(self, data) -> int:
+        n_bytes = self._file_obj.write(data)
+        self.bytes_written += len(data) if n_bytes is None else n_bytes
+        return n_bytes
+
+    def close(self):
+        self._end = self._tell()
+        return self._file_obj.close()
+
+    def __getattr__(self, name):
+        return getattr(self._file_obj, name)
+
+    def get_bytes(self) -> int:
+        """Bytes written by write or by the file descriptor."""
+        end = self._tell() if self._end is None else self._end
+        if self._start is None or end is None:
+            return self.bytes_written
+        return max(self.bytes_written, end - self._start)
+
+
+class InstrumentedBucket():
+    """Wraps a storage object recording metrics of each operation."""
+
+    def __init__(self, storage_object, backend: str,
+                 instrumentation: Instrumentation, connector=None):
+        """__init__.
+
+        Args:
+            storage_object:
+                Storage object with its layers.
+            backend (str):
+                Name of the backend used as label (storage_type).
+            instrumentation (Instrumentation):
+                Instrumentation used to create the metrics.
+            connector:
+                Connector of the provider, if it has `add_request_hook`
+                the provider requests are counted.
+        """
+        self.storage_object = storage_object
+        self.backend = backend
+        self.instrumentation = instrumentation
+        self._latency = instrumentation.histogram(
+            'storage_operation_seconds', 'Latency of storage operations',
+            labelnames=('backend', 'operation', 'status'))
+        self._bytes = instrumentation.counter(
+            'storage_bytes_total', 'Bytes read and written on storage',
+            labelnames=('backend', 'operation', 'direction'))
+        self._requests = instrumentation.counter(
+            'storage_requests_total', 'Requests to the storage provider',
+            labelnames=('backend', 'api_call'))
+        self._cache = instrumentation.counter(
+            'storage_cache_total', 'Block cache lookups of storage readers',
+            labelnames=('backend', 'result'))
+        if connector is not None and hasattr(connector, 'add_request_hook'):
+            connector.add_request_hook(self._count_request)
+
+    def __getattr__(self, name):
+        # Methods that are not instrumented (ex.: get_content_encoding)
+        return getattr(self.storage_object, name)
+
+    def _count_request(self, api_call: str):
+        self._requests.inc(backend=self.backend, api_call=api_call)
+
+    def _count_bytes(self, operation: str, direction: str, n_bytes: int):
+        if n_bytes:
+            self._bytes.inc(
+                n_bytes, backend=self.backend, operation=operation,
+                direction=direction)
+
+    def _record_reader(self, reader: StorageRawReader):
+        if reader.cache_hits:
+            self._cache.inc(
+                reader.cache_hits, backend=self.backend, result='hit')
+        if reader.cache_misses:
+            self._cache.inc(
+                reader.cache_misses, backend=self.backend, result='miss')
+
+    def _timer(self, operation: str, file_path: str = None):
+        attributes = {'storage.backend': self.backend}
+        if file_path is not None:
+            attributes['storage.file_path'] = file_path
+        return self.instrumentation.timer(
+            self._latency, span_name='storage.' + operation,
+            attributes=attributes, backend=self.backend,
+            operation=operation)
+
+    def check_file_exists(self, file_path: str) -> bool:
+        """Check if file exists."""
+        with self._timer('check_file_exists', file_path):
+            return self.storage_object.check_file_exists(file_path=file_path)
+
+    def list_files(self, path: str = "") -> List[str]:
+        """List files at path."""
+        with self._timer('list_files', path):
+            return self.storage_object.list_files(path=path)
+
+    def write_file(self, file_path: str, data: bytes, if_exists: str = 'fail',
+                   content_type: str = 'application/octet-stream',
+                   **kwargs) -> str:
+        """Write file."""
+        with self._timer('write_file', file_path):
+            result = self.storage_object.write_file(
+                file_path=file_path, data=data, if_exists=if_exists,
+                content_type=content_type, **kwargs)
+        self._count_bytes('write_file', 'write', len(data))
+        return result
+
+    def write_file_stream(self, file_path: str, data_stream: io.BytesIO,
+                          chunk_size: int = None, **kwargs) -> dict:
+        """Write stream."""
+        with self._timer('write_file_stream', file_path):
+            result = self.storage_object.write_file_stream(
+                file_path=file_path, data_stream=data_stream,
+                chunk_size=chunk_size, **kwargs)
+        self._count_bytes(
+            'write_file_stream', 'write', result.get('bytes_uploaded'))
+        return result
+
+    def _count_iterator(self, iterator) -> Iterator[bytes]:
+        n_bytes = 0
+        try:
+            for chunk in iterator:
+                n_bytes += len(chunk)
+                yield chunk
+        finally:
+            self._count_bytes('get_read_file_iterator', 'read', n_bytes)
+
+    def get_read_file_iterator(self, file_path: str, **kwargs):
+        """Return an iterator over file content.
+
+        Iterators with `fileno` (local files sent with sendfile) are
+        returned as they are and counted by the file size.
+        """
+        with self._timer('get_read_file_iterator', file_path):
+            iterator = self.storage_object.get_read_file_iterator(
+                file_path=file_path, **kwargs)
+        if hasattr(iterator, 'fileno'):
+            try:
+                file_size = os.fstat(iterator.fileno()).st_size
+            except (OSError, ValueError, AttributeError):
+                # Streams with fileno attribute but no file descriptor
+                return self._count_iterator(iterator)
+            self._count_bytes('get_read_file_iterator', 'read', file_size)
+            return iterator
+        return self._count_iterator(iterator)
+
+    def read_file(self, file_path: str) -> dict:
+        """Read file content."""
+        with self._timer('read_file', file_path):
+            result = self.storage_object.read_file(file_path=file_path)
+        self._count_bytes('read_file', 'read', len(result['data']))
+        return result
+
+    def read_file_range(self, file_path: str, offset: int,
+                        length: int) -> bytes:
+        """Read a byte range of the file."""
+        with self._timer('read_file_range', file_path):
+            data = self.storage_object.read_file_range(
+                file_path=file_path, offset=offset, length=length)
+        self._count_bytes('read_file_range', 'read', len(data))
+        return data
+
+    def open_raw_reader(self, file_path: str, **kwargs):
+        """Return a random access reader recording its cache statistics."""
+        kwargs['on_close'] = self._record_reader
+        if hasattr(self.storage_object, 'open_raw_reader'):
+            return open_raw_reader(
+                self.storage_object, file_path=file_path, **kwargs)
+        size = self.get_file_metadata(file_path=file_path)['size']
+        return StorageRawReader(
+            storage_object=self, file_path=file_path, size=size, **kwargs)
+
+    def download_to_file(self, file_path: str, file_obj):
+        """Download file to a file like object."""
+        counting_file = _CountingFile(file_obj)
+        with self._timer('download_to_file', file_path):
+            result = self.storage_object.download_to_file(
+                file_path=file_path, file_obj=counting_file)
+        self._count_bytes(
+            'download_to_file', 'read', counting_file.get_bytes())
+        return result
+
+    def delete_file(self, file_path: str) -> bool:
+        """Delete file."""
+        with self._timer('delete_file', file_path):
+            return self.storage_object.delete_file(file_path=file_path)
+
+    def copy_file(self, source_file_path: str, destination_file_path: str,
+                  if_exists: str = 'fail') -> str:
+        """Copy file."""
+        with self._timer('copy_file', source_file_path):
+            return self.storage_object.copy_file(
+                source_file_path=source_file_path,
+                destination_file_path=destination_file_path,
+                if_exists=if_exists)
+
+    def get_file_metadata(self, file_path: str) -> dict:
+        """Return file metadata."""
+        with self._timer('get_file_metadata', file_path):
+            return self.storage_object.get_file_metadata(file_path=file_path)
+
+    def get_file_hash(self, file_path: str, algorithm: str = 'md5') -> str:
+        """Return file hash."""
+        with self._timer('get_file_hash', file_path):
+            return self.storage_object.get_file_hash(
+                file_path=file_path, algorithm=algorithm)
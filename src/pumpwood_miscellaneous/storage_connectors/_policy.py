@@ -0,0 +1,481 @@
+"""Retry, timeout and hedged request policy over storage connectors.
+
+Each SDK has its own default retry behavior, `PolicyBucket` applies the
+same policy to every connector method:
+- Transient errors (connection errors, timeouts, throttling and 5xx
+  responses) are retried with exponential backoff and full jitter.
+- Only idempotent operations are retried: reads, deletes, overwrites and
+  streams that can be rewound.
+- Idempotent reads may have a timeout, the attempt is run at a worker
+  thread and is abandoned (not interrupted) when it times out. Writes
+  have no timeout, an abandoned write could be applied after a newer one.
+- Small reads can be hedged, a second request is sent if the first did
+  not return after the p95 latency of the operation and the first
+  response is used.
+
+It must wrap the connector directly so each request is retried, storage
+layers (content addressing, compression) are added over it. Connectors
+wrapped by it are created with the SDK request retries disabled
+(`sdk_retries=False`), so attempts are not multiplied. Retries of the
+chunks of streamed transfers are kept on the SDK, a partially consumed
+stream can not be retried by the policy.
+"""
+import io
+import time
+import random
+import threading
+import collections
+from concurrent.futures import (
+    ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait,
+    FIRST_COMPLETED)
+from typing import Iterator, List
+from pumpwood_communication import exceptions
+
+
+TRANSIENT_ERROR_NAMES = {
+    # botocore / urllib3 / requests
+    'EndpointConnectionError', 'ConnectTimeoutError', 'ReadTimeoutError',
+    'ConnectionClosedError', 'ProtocolError', 'ChunkedEncodingError',
+    'ConnectTimeout', 'ReadTimeout',
+    # requests.exceptions.ConnectionError and Timeout subclass OSError,
+    # not the builtin ConnectionError
+    'ConnectionError', 'Timeout',
+    # google.auth (token refresh and transport of GCS requests)
+    'TransportError',
+    # azure.core
+    'ServiceRequestError', 'ServiceResponseError',
+}
+"""Name of exception classes of the SDKs that are transient, names are
+used so SDKs are not imported."""
+TRANSIENT_ERROR_CODES = {
+    'Throttling', 'ThrottlingException', 'SlowDown', 'RequestTimeout',
+    'RequestTimeTooSkewed', 'InternalError', 'ServiceUnavailable',
+    'ServerBusy', 'OperationTimedOut',
+}
+"""S3 and Azure error codes that are transient."""
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+"""HTTP status codes that are transient."""
+WRITE_OPERATIONS = {
+    'write_file', 'write_file_stream', 'delete_file', 'copy_file',
+    'complete_upload'}
+"""Operations that change the storage, they have no timeout."""
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """Check if error is transient and the request may be retried.
+
+    Args:
+        error (BaseException):
+            Error raised by a connector.
+
+    Returns:
+        True if error is a connection error, a timeout, throttling or a
+        server side error.
+    """
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    if any(x.__name__ in TRANSIENT_ERROR_NAMES
+           for x in type(error).__mro__):
+        return True
+
+    # botocore ClientError
+    response = getattr(error, 'response', None)
+    if isinstance(response, dict):
+        code = response.get('Error', {}).get('Code')
+        status = response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+        return code in TRANSIENT_ERROR_CODES or \
+            status in TRANSIENT_STATUS_CODES
+
+    # google.resumable_media InvalidResponse has a requests Response
+    status = getattr(response, 'status_code', None)
+    if isinstance(status, int):
+        return status in TRANSIENT_STATUS_CODES
+
+    # google.api_core (code) and azure.core (status_code, error_code)
+    if getattr(error, 'error_code', None) in TRANSIENT_ERROR_CODES:
+        return True
+    for attribute in ('status_code', 'code'):
+        status = getattr(error, attribute, None)
+        if isinstance(status, int) and status in TRANSIENT_STATUS_CODES:
+            return True
+    return False
+
+
+class LatencyTracker():
+    """Keep recent latencies of an operation to estimate percentiles."""
+
+    def __init__(self, window: int = 200):
+        """__init__.
+
+        Args:
+            window (int):
+                Number of recent latencies kept.
+        """
+        self._latencies = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, latency: float):
+        """Add the latency of a successful request."""
+        with self._lock:
+            self._latencies.append(latency)
+
+    def __len__(self):
+        return len(self._latencies)
+
+    def percentile(self, q: float) -> float:
+        """Return the q (0 to 1) percentile, None if there is no data."""
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if not latencies:
+            return None
+        index = min(int(q * len(latencies)), len(latencies) - 1)
+        return latencies[index]
+
+
+class StoragePolicy():
+    """Retry, timeout and hedging parameters of the storage requests."""
+
+    def __init__(self, max_attempts: int = 4, base_delay: float = 0.1,
+                 max_delay: float = 5.0, timeouts: dict = None,
+                 hedge: bool = False, hedge_quantile: float = 0.95,
+                 hedge_min_samples: int = 20, hedge_max_size: int = 1024 ** 2,
+                 max_workers: int = 32, seed: int = None):
+        """__init__.
+
+        Args:
+            max_attempts (int):
+                Maximum number of attempts of idempotent operations, 1
+                disables retries.
+            base_delay (float):
+                Backoff of the first retry in seconds, it doubles at each
+                attempt and the wait is a random value up to it.
+            max_delay (float):
+                Maximum backoff in seconds.
+            timeouts (dict):
+                Timeout in seconds of each attempt by operation (connector
+                method name), key 'default' is used for the others. Only
+                idempotent reads that do not use streams have timeout,
+                writes are never abandoned.
+            hedge (bool):
+                Hedge small reads (check_file_exists, get_file_metadata,
+                get_file_hash, read_file_range up to hedge_max_size).
+            hedge_quantile (float):
+                Latency quantile of the operation after which a second
+                request is sent.
+            hedge_min_samples (int):
+                Requests are not hedged until this number of latencies of
+                the operation were collected.
+            hedge_max_size (int):
+                Ranged reads larger than this are not hedged.
+            max_workers (int):
+                Threads used to run attempts with timeout or hedging.
+            seed (int):
+                Seed of the backoff jitter.
+        """
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeouts = timeouts or {}
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_max_size = hedge_max_size
+        self.max_workers = max_workers
+        self._random = random.Random(seed)
+
+    @classmethod
+    def from_value(cls, value):
+        """Build policy from a StoragePolicy, a dict of arguments or True.
+
+        Raises:
+            PumpWoodWrongParameters:
+                If value type is not accepted.
+        """
+        if isinstance(value, cls):
+            return value
+        if value is True:
+            return cls()
+        if isinstance(value, dict):
+            return cls(**value)
+        msg = "retry_policy must be a StoragePolicy, a dict or True"
+        raise exceptions.PumpWoodWrongParameters(msg)
+
+    def get_timeout(self, operation: str) -> float:
+        """Return the timeout of the operation, None if not set."""
+        return self.timeouts.get(operation, self.timeouts.get('default'))
+
+    def backoff(self, attempt: int) -> float:
+        """Return the wait before retry number attempt (starting at 1)."""
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return self._random.uniform(0, delay)
+
+
+class PolicyBucket():
+    """Wraps a storage connector applying a StoragePolicy to its calls."""
+
+    def __init__(self, storage_object, policy: StoragePolicy = None):
+        """__init__.
+
+        Args:
+            storage_object:
+                Storage connector.
+            policy (StoragePolicy):
+                Policy of the requests, default StoragePolicy().
+        """
+        self.storage_object = storage_object
+        self.policy = policy or StoragePolicy()
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._latencies = collections.defaultdict(LatencyTracker)
+
+        # Statistics of the policy
+        self.attempts = 0
+        self.retries = 0
+        self.timeouts = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.policy.max_workers,
+                    thread_name_prefix='pumpwood-storage-policy')
+            return self._executor
+
+    def _timed(self, operation: str, function, kwargs: dict):
+        """Run function and record its latency if it succeeds."""
+        start = time.monotonic()
+        self.attempts += 1
+        result = function(**kwargs)
+        self._latencies[operation].add(time.monotonic() - start)
+        return result
+
+    def _hedge_delay(self, operation: str) -> float:
+        tracker = self._latencies[operation]
+        if len(tracker) < self.policy.hedge_min_samples:
+            return None
+        return tracker.percentile(self.policy.hedge_quantile)
+
+    def _attempt(self, operation: str, function, kwargs: dict,
+                 hedge: bool, timeout: float):
+        """Run one attempt with timeout and hedging if configured."""
+        hedge_delay = self._hedge_delay(operation) if hedge else None
+        if timeout is None and hedge_delay is None:
+            return self._timed(operation, function, kwargs)
+
+        executor = self._get_executor()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        futures = [executor.submit(self._timed, operation, function, kwargs)]
+        if hedge_delay is not None:
+            done, _ = wait(futures, timeout=(
+                hedge_delay if timeout is None
+                else min(hedge_delay, timeout)))
+            if not done and (deadline is None or
+                             time.monotonic() < deadline):
+                self.hedges += 1
+                futures.append(executor.submit(
+                    self._timed, operation, function, kwargs))
+
+        pending = set(futures)
+        error = None
+        while pending:
+            remaining = None if deadline is None else \
+                max(0, deadline - time.monotonic())
+            done, pending = wait(
+                pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    if 1 < len(futures) and future is futures[1]:
+                        self.hedge_wins += 1
+                    return future.result()
+                error = future.exception()
+        if error is not None and not pending:
+            raise error
+        self.timeouts += 1
+        msg = "Storage operation {} timed out after {}s".format(
+            operation, timeout)
+        raise FutureTimeoutError(msg)
+
+    def _call(self, operation: str, kwargs: dict, idempotent: bool = True,
+              hedge: bool = False, rewind=None, function=None):
+        """Call connector operation applying the policy.
+
+        Args:
+            operation (str):
+                Name of the connector method.
+            kwargs (dict):
+                Arguments of the method.
+            idempotent (bool):
+                If operation can be retried.
+            hedge (bool):
+                If operation can be hedged.
+            rewind:
+                Function called before each retry, it must restore the
+                arguments state (ex.: seek streams). Operations with
+                rewind have no timeout, an abandoned attempt would still
+                be using the stream. Writes have no timeout either.
+            function:
+                Function called instead of the connector method.
+        """
+        if function is None:
+            function = getattr(self.storage_object, operation)
+        if not idempotent:
+            self.attempts += 1
+            return function(**kwargs)
+
+        timeout = None
+        if rewind is None and operation not in WRITE_OPERATIONS:
+            timeout = self.policy.get_timeout(operation)
+        attempt = 1
+        while True:
+            try:
+                return self._attempt(
+                    operation=operation, function=function, kwargs=kwargs,
+                    hedge=hedge and self.policy.hedge, timeout=timeout)
+            except Exception as e:
+                is_timeout = isinstance(
+                    e, (FutureTimeoutError, TimeoutError))
+                if attempt >= self.policy.max_attempts or \
+                        not (is_timeout or is_transient_error(e)):
+                    raise e
+            time.sleep(self.policy.backoff(attempt))
+            if rewind is not None:
+                rewind()
+            attempt += 1
+            self.retries += 1
+
+    @staticmethod
+    def _stream_rewind(stream):
+        """Return a function to rewind stream, None if not seekable."""
+        try:
+            if not stream.seekable():
+                return None
+            position = stream.tell()
+        except (AttributeError, OSError, ValueError):
+            return None
+
+        def rewind():
+            stream.seek(position)
+            if hasattr(stream, 'truncate') and \
+                    getattr(stream, 'writable', lambda: False)():
+                stream.truncate()
+        return rewind
+
+    def close(self):
+        """Stop the worker threads."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def check_file_exists(self, file_path: str) -> bool:
+        """Check if file exists at storage."""
+        return self._call(
+            'check_file_exists', {'file_path': file_path}, hedge=True)
+
+    def list_files(self, path: str = "") -> List[str]:
+        """List files at path."""
+        return self._call('list_files', {'path': path})
+
+    def write_file(self, file_path: str, data: bytes, if_exists: str = 'fail',
+                   content_type: str = 'application/octet-stream',
+                   metadata: dict = None) -> str:
+        """Write file, only overwrites are retried.
+
+        A retry of 'fail' or 'append' writes after a request that was
+        applied by storage but failed to respond would raise or append
+        data twice.
+        """
+        return self._call('write_file', {
+            'file_path': file_path, 'data': data, 'if_exists': if_exists,
+            'content_type': content_type, 'metadata': metadata},
+            idempotent=if_exists == 'overwrite')
+
+    def write_file_stream(self, file_path: str, data_stream: io.BytesIO,
+                          chunk_size: int = None, **kwargs) -> dict:
+        """Write stream, retried only if the stream is seekable."""
+        rewind = self._stream_rewind(data_stream)
+        return self._call('write_file_stream', {
+            'file_path': file_path, 'data_stream': data_stream,
+            'chunk_size': chunk_size, **kwargs},
+            idempotent=rewind is not None, rewind=rewind)
+
+    def get_read_file_iterator(self, file_path: str,
+                               **kwargs) -> Iterator[bytes]:
+        """Return an iterator over file content.
+
+        Only the request that opens the file is retried, errors while
+        iterating are raised.
+        """
+        return self._call('get_read_file_iterator', {
+            'file_path': file_path, **kwargs})
+
+    def read_file(self, file_path: str) -> dict:
+        """Read file content."""
+        return self._call('read_file', {'file_path': file_path})
+
+    def read_file_range(self, file_path: str, offset: int,
+                        length: int) -> bytes:
+        """Read length bytes of file starting at offset."""
+        return self._call('read_file_range', {
+            'file_path': file_path, 'offset': offset, 'length': length},
+            hedge=length <= self.policy.hedge_max_size)
+
+    def download_to_file(self, file_path: str, file_obj):
+        """Download file, retried only if file_obj is seekable."""
+        rewind = self._stream_rewind(file_obj)
+        return self._call('download_to_file', {
+            'file_path': file_path, 'file_obj': file_obj},
+            idempotent=rewind is not None, rewind=rewind)
+
+    def delete_file(self, file_path: str) -> bool:
+        """Delete file, a retry that does not find it succeeds."""
+        state = {'retry': False}
+
+        def delete_file(file_path: str):
+            try:
+                return self.storage_object.delete_file(file_path=file_path)
+            except exceptions.PumpWoodObjectDoesNotExist:
+                if state['retry']:
+                    return True
+                raise
+            finally:
+                state['retry'] = True
+        return self._call(
+            'delete_file', {'file_path': file_path}, function=delete_file)
+
+    def copy_file(self, source_file_path: str, destination_file_path: str,
+                  if_exists: str = 'fail') -> str:
+        """Copy file, only overwrites are retried."""
+        return self._call('copy_file', {
+            'source_file_path': source_file_path,
+            'destination_file_path': destination_file_path,
+            'if_exists': if_exists}, idempotent=if_exists == 'overwrite')
+
+    def get_file_metadata(self, file_path: str) -> dict:
+        """Return file metadata."""
+        return self._call(
+            'get_file_metadata', {'file_path': file_path}, hedge=True)
+
+    def get_file_hash(self, file_path: str, algorithm: str = 'md5') -> str:
+        """Return file hash."""
+        return self._call('get_file_hash', {
+            'file_path': file_path, 'algorithm': algorithm}, hedge=True)
+
+    def get_download_url(self, file_path: str, **kwargs) -> str:
+        """Return a presigned download URL."""
+        return self._call('get_download_url', {
+            'file_path': file_path, **kwargs})
+
+    def get_upload_url(self, file_path: str, **kwargs) -> dict:
+        """Return presigned upload URLs, multipart starts are not retried."""
+        return self._call('get_upload_url', {
+            'file_path': file_path, **kwargs},
+            idempotent=kwargs.get('parts') is None)
+
+    def complete_upload(self, file_path: str, **kwargs) -> str:
+        """Complete a multipart presigned upload."""
+        return self._call('complete_upload', {
+            'file_path': file_path, **kwargs})
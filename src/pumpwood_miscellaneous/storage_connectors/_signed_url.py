@@ -0,0 +1,174 @@
+"""Signed token URLs for storages without native presigned URLs.
+
+Local and memory storages do not have a provider to sign URLs, the
+`TokenUrlSigner` creates URLs with an HMAC signed token and the Flask
+blueprint from `create_signed_url_blueprint` validates the token and
+serves the file. Local files are sent with `os.sendfile` by the WSGI
+server, so the worker does not copy the data.
+
+Token format is `{base64url(json payload)}.{base64url(hmac sha256)}`, the
+payload has the file path, the allowed method, the expiration and the
+content type of uploads.
+"""
+import hmac
+import json
+import time
+import base64
+import hashlib
+from urllib.parse import quote
+from pumpwood_communication import exceptions
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+class TokenUrlSigner():
+    """Create and validate HMAC signed storage URLs."""
+
+    def __init__(self, secret_key: str, base_url: str):
+        """__init__.
+
+        Args:
+            secret_key (str):
+                Secret used to sign the tokens, it must be the same for
+                all workers serving the endpoint.
+            base_url (str):
+                URL of the signed URL endpoint, the token is added at its
+                end (ex.: 'https://app.example.com/storage-url/').
+        """
+        if not secret_key:
+            msg = "A secret key must be set to sign storage URLs"
+            raise exceptions.PumpWoodWrongParameters(msg)
+        if isinstance(secret_key, str):
+            secret_key = secret_key.encode('utf-8')
+        self._secret_key = secret_key
+        self.base_url = base_url.rstrip('/') + '/'
+
+    def _signature(self, payload: bytes) -> bytes:
+        return hmac.new(self._secret_key, payload, hashlib.sha256).digest()
+
+    def sign(self, file_path: str, method: str, expires_in: int,
+             content_type: str = None) -> str:
+        """Return a signed token for method on file_path."""
+        payload = json.dumps({
+            'path': file_path, 'method': method,
+            'exp': int(time.time() + expires_in),
+            'content_type': content_type},
+            separators=(',', ':'), sort_keys=True).encode('utf-8')
+        return "{}.{}".format(
+            _b64encode(payload), _b64encode(self._signature(payload)))
+
+    def verify(self, token: str, method: str) -> dict:
+        """Validate token and return its payload.
+
+        Args:
+            token (str):
+                Token of the URL.
+            method (str):
+                HTTP method of the request.
+
+        Raises:
+            PumpWoodUnauthorized:
+                If token signature is not valid, it has expired or it was
+                created for another method.
+        """
+        try:
+            payload_b64, signature_b64 = token.split('.')
+            payload = _b64decode(payload_b64)
+            signature = _b64decode(signature_b64)
+        except ValueError:
+            raise exceptions.PumpWoodUnauthorized("Malformed storage token")
+        if not hmac.compare_digest(self._signature(payload), signature):
+            raise exceptions.PumpWoodUnauthorized(
+                "Invalid storage token signature")
+
+        data = json.loads(payload)
+        if data['exp'] < time.time():
+            raise exceptions.PumpWoodUnauthorized("Storage token expired")
+        if data['method'] != method:
+            raise exceptions.PumpWoodUnauthorized(
+                "Storage token is not valid for method {}".format(method))
+        return data
+
+    def get_download_url(self, file_path: str, expires_in: int = 3600
+                         ) -> str:
+        """Return a signed URL to download file_path."""
+        token = self.sign(
+            file_path=file_path, method='GET', expires_in=expires_in)
+        return self.base_url + quote(token)
+
+    def get_upload_url(self, file_path: str, expires_in: int = 3600,
+                       content_type: str = 'application/octet-stream',
+                       **kwargs) -> dict:
+        """Return a signed URL to upload file_path with a PUT request.
+
+        Uploads are streamed to storage, multipart arguments are not
+        used.
+        """
+        token = self.sign(
+            file_path=file_path, method='PUT', expires_in=expires_in,
+            content_type=content_type)
+        return {
+            'file_path': file_path, 'upload_type': 'single',
+            'method': 'PUT', 'url': self.base_url + quote(token),
+            'headers': {'Content-Type': content_type}}
+
+
+def create_signed_url_blueprint(storage, signer: TokenUrlSigner,
+                                name: str = 'pumpwood_storage_url',
+                                chunk_size: int = 1024 * 1024):
+    """Create a Flask blueprint serving signed URLs of the storage.
+
+    The blueprint must be registered at the path of the signer base_url.
+
+    Args:
+        storage (PumpWoodStorage):
+            Storage used to read and write the files.
+        signer (TokenUrlSigner):
+            Signer used to create the URLs.
+        name (str):
+            Name of the blueprint.
+        chunk_size (int):
+            Size of the chunks of the streamed transfers.
+
+    Returns:
+        flask.Blueprint with GET and PUT `/<token>` routes.
+    """
+    from flask import Blueprint, Response, request, jsonify
+    from werkzeug.wsgi import wrap_file
+
+    blueprint = Blueprint(name, __name__)
+
+    @blueprint.errorhandler(exceptions.PumpWoodException)
+    def handle_error(error: exceptions.PumpWoodException):
+        return jsonify(error.to_dict()), error.status_code
+
+    @blueprint.route('/<path:token>', methods=['GET'])
+    def download(token: str):
+        file_path = signer.verify(token, method='GET')['path']
+        if not storage.check_file_exists(file_path):
+            raise exceptions.PumpWoodObjectDoesNotExist(
+                "File {} does not exist".format(file_path))
+        file_iterator = storage.storage_object.get_read_file_iterator(
+            file_path=file_path)
+        if hasattr(file_iterator, 'fileno'):
+            file_iterator = wrap_file(
+                request.environ, file_iterator, buffer_size=chunk_size)
+        return Response(
+            file_iterator, direct_passthrough=True,
+            mimetype='application/octet-stream')
+
+    @blueprint.route('/<path:token>', methods=['PUT'])
+    def upload(token: str):
+        payload = signer.verify(token, method='PUT')
+        result = storage.storage_object.write_file_stream(
+            file_path=payload['path'], data_stream=request.stream,
+            chunk_size=chunk_size, content_type=payload['content_type'])
+        return jsonify(result)
+
+    return blueprint
@@ -0,0 +1,395 @@
+"""Directory synchronization between local folders and storage prefixes.
+
+Each side is described by a manifest with the size, modification time
+and MD5 of its files. The storage prefix keeps the manifest of the last
+upload sync at `MANIFEST_FILE_NAME`, it has the size and hash of the
+original content, so storages with compression or content addressing are
+compared the same way. Manifest entries also have the storage metadata
+(size, updated_at and hash) of the object after the upload, entries that
+do not match the current metadata (files replaced by other clients) and
+files that are not on the manifest use the storage metadata and are
+added to the manifest on the next upload.
+
+Downloads are written only inside the local folder, keys with relative
+paths that leave it (ex.: `a/../../x`) are reported as errors.
+"""
+import os
+import json
+import base64
+import fnmatch
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from pumpwood_communication import exceptions
+from ._general import FlaskStreamUploadWrapper, StreamHasher
+from .local import create_temporary_file
+
+
+MANIFEST_FILE_NAME = '.pumpwood-sync-manifest.json'
+"""Name of the manifest file at the storage prefix."""
+TEMPORARY_FILE_PREFIX = '.pumpwood-sync-'
+"""Prefix of the temporary files of downloads."""
+SYNC_DIRECTIONS = ('upload', 'download')
+"""Directions of the sync."""
+SYNC_COMPARE = ('size_mtime', 'hash')
+"""Methods to compare files."""
+MTIME_TOLERANCE = 1.0
+"""Modification times closer than this (seconds) are equal."""
+
+
+def file_md5(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Return base64 MD5 of a local file."""
+    md5_hash = hashlib.md5()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            md5_hash.update(chunk)
+    return base64.b64encode(md5_hash.digest()).decode('utf-8')
+
+
+def local_manifest(local_dir: str, exclude: List[str] = None) -> dict:
+    """Return manifest of files at local_dir with size and mtime.
+
+    Args:
+        local_dir (str):
+            Local folder.
+        exclude (List[str]):
+            fnmatch patterns of relative paths to be ignored.
+
+    Returns:
+        Dictionary by relative path ('/' separated) with size and mtime.
+    """
+    manifest = {}
+    for root, _, files in os.walk(local_dir):
+        for file_name in files:
+            full_path = os.path.join(root, file_name)
+            relative_path = os.path.relpath(full_path, local_dir)\
+                .replace(os.sep, '/')
+            if _is_excluded(relative_path, exclude):
+                continue
+            file_stat = os.stat(full_path)
+            manifest[relative_path] = {
+                'size': file_stat.st_size, 'mtime': file_stat.st_mtime}
+    return manifest
+
+
+def _is_excluded(relative_path: str, exclude: List[str]) -> bool:
+    file_name = relative_path.rsplit('/', 1)[-1]
+    if relative_path == MANIFEST_FILE_NAME or \
+            file_name.startswith(TEMPORARY_FILE_PREFIX):
+        return True
+    return any(fnmatch.fnmatch(relative_path, x) for x in exclude or [])
+
+
+def _stored_metadata(file_metadata: dict) -> dict:
+    """Return metadata identifying the stored version of an object."""
+    updated_at = file_metadata.get('updated_at')
+    return {
+        'size': file_metadata['size'],
+        'updated_at': updated_at.timestamp()
+        if updated_at is not None else None,
+        'hash': file_metadata.get('hash')}
+
+
+class StorageSync():
+    """Synchronize a local folder and a storage prefix."""
+
+    def __init__(self, storage_object, local_dir: str, prefix: str,
+                 compare: str = 'size_mtime', delete: bool = False,
+                 exclude: List[str] = None, max_workers: int = 8,
+                 chunk_size: int = None, dry_run: bool = False):
+        """__init__.
+
+        Args:
+            storage_object:
+                Storage connector (with its layers).
+            local_dir (str):
+                Local folder.
+            prefix (str):
+                Storage prefix, files are stored at `{prefix}/{relative
+                path}`.
+            compare (str):
+                'size_mtime' transfers files with different size or a
+                newer source, 'hash' transfers files with different size
+                or MD5 (local files are hashed).
+            delete (bool):
+                Delete destination files that are not at source.
+            exclude (List[str]):
+                fnmatch patterns of relative paths to be ignored.
+            max_workers (int):
+                Number of parallel transfers.
+            chunk_size (int):
+                Chunk size of the transfers, default None adapts it to
+                the throughput.
+            dry_run (bool):
+                Only compute the changes, files are not transferred.
+
+        Raises:
+            PumpWoodWrongParameters:
+                If compare is not valid.
+        """
+        if compare not in SYNC_COMPARE:
+            msg = "compare must be in {}, not '{}'".format(
+                SYNC_COMPARE, compare)
+            raise exceptions.PumpWoodWrongParameters(msg)
+        self.storage_object = storage_object
+        self.local_dir = local_dir
+        self.prefix = prefix.rstrip('/') + '/' if prefix else ''
+        self.compare = compare
+        self.delete = delete
+        self.exclude = exclude
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.dry_run = dry_run
+        self._lock = threading.Lock()
+        self._excluded_entries = {}
+
+    def _remote_path(self, relative_path: str) -> str:
+        return self.prefix + relative_path
+
+    def _read_manifest(self) -> dict:
+        """Return manifest saved at the prefix, empty if there is none."""
+        manifest_path = self._remote_path(MANIFEST_FILE_NAME)
+        if not self.storage_object.check_file_exists(manifest_path):
+            return {}
+        data = self.storage_object.read_file(file_path=manifest_path)['data']
+        try:
+            return json.loads(bytes(data))['files']
+        except (ValueError, KeyError):
+            return {}
+
+    def remote_manifest(self) -> dict:
+        """Return manifest of the prefix files.
+
+        Entries of the saved manifest are used for listed files, other
+        files use storage metadata (size, updated_at and hash).
+        """
+        saved_manifest = self._read_manifest()
+        listed_paths = sorted(set(
+            file_path[len(self.prefix):]
+            for file_path in self.storage_object.list_files(path=self.prefix)
+            if file_path.startswith(self.prefix)))
+        relative_paths = [
+            x for x in listed_paths
+            if x and not _is_excluded(x, self.exclude)]
+        # Entries of excluded files are kept when manifest is saved
+        self._excluded_entries = {
+            x: saved_manifest[x] for x in listed_paths
+            if x in saved_manifest and x not in relative_paths}
+
+        def entry(relative_path: str) -> dict:
+            file_metadata = self.storage_object.get_file_metadata(
+                file_path=self._remote_path(relative_path))
+            stored = _stored_metadata(file_metadata)
+            saved = saved_manifest.get(relative_path)
+            # Object was replaced after the manifest was saved
+            if saved is not None and saved.get('stored') == stored:
+                return saved
+            updated_at = file_metadata.get('updated_at')
+            return {
+                'size': file_metadata['size'],
+                'mtime': updated_at.timestamp()
+                if updated_at is not None else None,
+                'md5': file_metadata.get('hashes', {}).get('md5'),
+                'stored': stored}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            entries = executor.map(entry, relative_paths)
+            return dict(zip(relative_paths, entries))
+
+    def _is_equal(self, relative_path: str, local: dict, remote: dict,
+                  direction: str) -> bool:
+        """Check if local and remote versions of the file are equal."""
+        if local['size'] != remote['size']:
+            return False
+        if self.compare == 'hash':
+            if remote.get('md5') is None:
+                return False
+            local['md5'] = file_md5(
+                os.path.join(self.local_dir, relative_path))
+            return local['md5'] == remote['md5']
+
+        if remote.get('mtime') is None:
+            return False
+        if abs(local['mtime'] - remote['mtime']) <= MTIME_TOLERANCE:
+            return True
+        # The destination was modified after the source
+        if direction == 'upload':
+            return local['mtime'] < remote['mtime']
+        return remote['mtime'] < local['mtime']
+
+    def _upload(self, relative_path: str, local: dict) -> dict:
+        full_path = os.path.join(self.local_dir, relative_path)
+        hasher = StreamHasher(algorithms=('md5', ))
+        with open(full_path, 'rb') as file:
+            stream = FlaskStreamUploadWrapper(file, hasher=hasher)
+            self.storage_object.write_file_stream(
+                file_path=self._remote_path(relative_path),
+                data_stream=stream, chunk_size=self.chunk_size)
+        file_metadata = self.storage_object.get_file_metadata(
+            file_path=self._remote_path(relative_path))
+        return {
+            'size': stream.bytes_position, 'mtime': local['mtime'],
+            'md5': hasher.digests()['md5'],
+            'stored': _stored_metadata(file_metadata)}
+
+    def _local_path(self, relative_path: str) -> str:
+        """Return local path of a relative path of the prefix.
+
+        Raises:
+            PumpWoodWrongParameters:
+                If the path is not inside the local folder.
+        """
+        local_dir = os.path.realpath(self.local_dir)
+        full_path = os.path.realpath(
+            os.path.join(local_dir, *relative_path.split('/')))
+        if full_path == local_dir or \
+                os.path.commonpath([local_dir, full_path]) != local_dir:
+            msg = "Path [{}] is outside of local folder".format(
+                relative_path)
+            raise exceptions.PumpWoodWrongParameters(msg)
+        return full_path
+
+    def _download(self, relative_path: str, remote: dict) -> int:
+        full_path = self._local_path(relative_path)
+        folder = os.path.dirname(full_path)
+        os.makedirs(folder, exist_ok=True)
+        temporary_file = create_temporary_file(
+            folder, prefix=TEMPORARY_FILE_PREFIX)
+        try:
+            self.storage_object.download_to_file(
+                file_path=self._remote_path(relative_path),
+                file_obj=temporary_file)
+            temporary_file.close()
+            if remote.get('mtime') is not None:
+                os.utime(
+                    temporary_file.name,
+                    (remote['mtime'], remote['mtime']))
+            os.replace(temporary_file.name, full_path)
+        except BaseException:
+            temporary_file.close()
+            os.remove(temporary_file.name)
+            raise
+        return os.path.getsize(full_path)
+
+    def _run_tasks(self, tasks: list, summary: dict):
+        """Run (action, relative_path, function) tasks at the pool."""
+        def run(task):
+            action, relative_path, function = task
+            try:
+                result = function()
+            except Exception as e:
+                with self._lock:
+                    summary['errors'][relative_path] = str(e)
+                return
+            with self._lock:
+                summary[action].append(relative_path)
+                if action in ('uploaded', 'downloaded'):
+                    size = result['size'] if isinstance(result, dict) \
+                        else result
+                    summary['bytes_transferred'] += size
+            return result
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(run, tasks))
+
+    def sync(self, direction: str) -> dict:
+        """Synchronize local folder and prefix.
+
+        Args:
+            direction (str):
+                'upload' to mirror local folder at the prefix or
+                'download' to mirror the prefix at the local folder.
+
+        Returns:
+            Summary dictionary with lists of relative paths uploaded,
+            downloaded and deleted, the number of unchanged files
+            (skipped), the bytes transferred and errors by relative path.
+            On dry_run lists have the files that would be changed.
+
+        Raises:
+            PumpWoodWrongParameters:
+                If direction is not valid.
+        """
+        if direction not in SYNC_DIRECTIONS:
+            msg = "direction must be in {}, not '{}'".format(
+                SYNC_DIRECTIONS, direction)
+            raise exceptions.PumpWoodWrongParameters(msg)
+        os.makedirs(self.local_dir, exist_ok=True)
+        local = local_manifest(self.local_dir, exclude=self.exclude)
+        remote = self.remote_manifest()
+        summary = {
+            'direction': direction, 'uploaded': [], 'downloaded': [],
+            'deleted': [], 'skipped': 0, 'bytes_transferred': 0,
+            'errors': {}}
+
+        source, destination = (local, remote) if direction == 'upload' \
+            else (remote, local)
+        tasks = []
+        for relative_path, source_entry in sorted(source.items()):
+            if direction == 'download':
+                try:
+                    self._local_path(relative_path)
+                except exceptions.PumpWoodWrongParameters as e:
+                    summary['errors'][relative_path] = str(e)
+                    continue
+            destination_entry = destination.get(relative_path)
+            is_equal = destination_entry is not None and self._is_equal(
+                relative_path=relative_path,
+                local=source_entry if direction == 'upload'
+                else destination_entry,
+                remote=destination_entry if direction == 'upload'
+                else source_entry, direction=direction)
+            if is_equal:
+                summary['skipped'] += 1
+                if direction == 'upload' and 'md5' in source_entry:
+                    # Keep hash calculated on comparison at manifest
+                    remote[relative_path] = dict(
+                        destination_entry, mtime=source_entry['mtime'])
+                continue
+            if direction == 'upload':
+                tasks.append((
+                    'uploaded', relative_path,
+                    lambda x=relative_path, y=source_entry:
+                        self._upload(x, y)))
+            else:
+                tasks.append((
+                    'downloaded', relative_path,
+                    lambda x=relative_path, y=source_entry:
+                        self._download(x, y)))
+
+        if self.delete:
+            for relative_path in sorted(set(destination) - set(source)):
+                if direction == 'upload':
+                    function = (
+                        lambda x=relative_path:
+                            self.storage_object.delete_file(
+                                file_path=self._remote_path(x)))
+                else:
+                    function = (
+                        lambda x=relative_path: os.remove(os.path.join(
+                            self.local_dir, *x.split('/'))))
+                tasks.append(('deleted', relative_path, function))
+
+        if self.dry_run:
+            for action, relative_path, _ in tasks:
+                summary[action].append(relative_path)
+            return summary
+
+        results = self._run_tasks(tasks, summary)
+        if direction == 'upload':
+            for (action, relative_path, _), result in zip(tasks, results):
+                if action == 'uploaded' and result is not None:
+                    remote[relative_path] = result
+                elif action == 'deleted' and \
+                        relative_path not in summary['errors']:
+                    remote.pop(relative_path, None)
+            self.storage_object.write_file(
+                file_path=self._remote_path(MANIFEST_FILE_NAME),
+                data=json.dumps({
+                    'files': {**self._excluded_entries, **remote}}
+                ).encode('utf-8'),
+                if_exists='overwrite', content_type='application/json')
+        for key in ('uploaded', 'downloaded', 'deleted'):
+            summary[key].sort()
+        return summary
@@ -1,16 +1,33 @@
 """Google Storage Cloud."""
 import io
 import os
+import base64
+import hashlib
 import boto3
 import botocore
-from typing import Callable
+from botocore.config import Config
+from boto3.s3.transfer import TransferConfig
+from typing import Callable, List
+from pumpwood_communication import exceptions
+from ._general import (
+    FlaskStreamUploadWrapper, StreamHasher, HASH_METADATA_KEYS,
+    hash_from_metadata)
+from ._checkpoint import UploadCheckpoint, read_exact, check_resumed_chunk
+from ._chunking import AdaptiveChunkSizer, stream_length
+
+
+S3_MIN_PART_SIZE = 5 * 1024 ** 2
+"""Minimum size of multipart upload parts, except the last one."""
+S3_MAX_CONCURRENCY = 10
+"""Maximum parts uploaded in parallel by managed uploads."""
 
 
 class PumpWoodAwsS3():
     """Class to make comunication with AWS S3 Storage."""
 
     def __init__(self, bucket_name: str, AWS_ACCESS_KEY_ID: str = None, # NOQA
-                 AWS_SECRET_ACCESS_KEY: str = None): # NOQA
+                 AWS_SECRET_ACCESS_KEY: str = None, # NOQA
+                 sdk_retries: bool = True):
         """__init__.
 
         AWS credentials must be passed as arguments or set as enviroment
@@ -23,6 +40,9 @@ class PumpWoodAwsS3():
                 Set Access key for AWS boto client.
             AWS_SECRET_ACCESS_KEY (str):
                 Set Secret Access key for AWS boto client.
+            sdk_retries (bool):
+                Use the retries of botocore, disabled when a
+                `PolicyBucket` retries the requests.
         """
         if AWS_ACCESS_KEY_ID is None:
             AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID") # NOQA
@@ -34,9 +54,22 @@ class PumpWoodAwsS3():
                 "Node role will be used to access S3")
             print(msg)
         self._bucket_name = bucket_name
+        config = None if sdk_retries else \
+            Config(retries={'total_max_attempts': 1})
         self._s3_resource = boto3.client(
             's3', aws_access_key_id=AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
+            aws_secret_access_key=AWS_SECRET_ACCESS_KEY, config=config)
+
+    def add_request_hook(self, callback):
+        """Call callback with the name of each S3 API call (ex.: HeadObject).
+
+        Args:
+            callback:
+                Function receiving the API call name.
+        """
+        def before_call(model, **kwargs):
+            callback(model.name)
+        self._s3_resource.meta.events.register('before-call.s3', before_call)
 
     def check_file_exists(self, file_path: str) -> bool:
         """Check if file exists.
@@ -66,14 +99,20 @@ class PumpWoodAwsS3():
                 Path of the storage to list files.
 
         Returns (list):
-            List of all files under path (sub-folders).
+            List of all files under path (sub-folders), empty if there is
+            no file.
         """
-        s3_files = self._s3_resource.list_objects(
-            Bucket=self._bucket_name, Prefix=path)
-        return [contents['Key'] for contents in s3_files['Contents']]
+        # Each request returns at most 1000 keys and no Contents key if
+        # there is no file
+        paginator = self._s3_resource.get_paginator('list_objects_v2')
+        file_list = []
+        for page in paginator.paginate(Bucket=self._bucket_name, Prefix=path):
+            file_list.extend(
+                contents['Key'] for contents in page.get('Contents', []))
+        return file_list
 
     def write_file(self, file_path: str, data: bytes, if_exists: str = 'fail',
-                   content_type='text/plain') -> str:
+                   content_type='text/plain', metadata: dict = None) -> str:
         """Write file on Google Bucket.
 
         Args:
@@ -89,35 +128,67 @@ class PumpWoodAwsS3():
                 (fail if file exists)]
             content_type (str):
                 Mime-type of the content.
+            metadata (dict):
+                User metadata to be stored with the object.
         """
         if_exists_opt = ['overwrite', 'append_breakline', 'append', 'fail']
         if if_exists not in if_exists_opt:
             msg = "if_exists must be in {}".format(if_exists_opt)
             raise Exception(msg)
 
-        if self.check_file_exists(file_path=file_path):
+        # Overwrites do not need a HEAD request
+        if if_exists != 'overwrite' and \
+                self.check_file_exists(file_path=file_path):
             if if_exists == "fail":
                 raise Exception('There is a file with same name on bucket')
 
-            old_data = self.read_file(file_path=file_path)
-            if if_exists == "append":
-                new_data = old_data + data
-                self._s3_resource.put_object(
-                    Body=new_data, Bucket=self._bucket_name,
-                    Key=file_path)
-            if if_exists == 'append_breakline':
-                new_data = old_data + b'\n' + data
-                self._s3_resource.put_object(
-                    Body=new_data, Bucket=self._bucket_name,
-                    Key=file_path)
-        else:
-            self._s3_resource.put_object(
-                Body=data, Bucket=self._bucket_name,
-                Key=file_path)
+            if if_exists in ['append', 'append_breakline']:
+                old_data = self.read_file(file_path=file_path)['data']
+                old_data = old_data + b'\n' \
+                    if if_exists == 'append_breakline' else old_data
+                data = old_data + data
+
+        self._put_object(
+            file_path=file_path, data=data,
+            hasher=StreamHasher.hash_bytes(data), metadata=metadata,
+            content_type=content_type)
         return file_path
 
+    def _put_object(self, file_path: str, data: bytes, hasher: StreamHasher,
+                    metadata: dict, content_type: str):
+        """Put object with its hashes at metadata.
+
+        Content-MD5 and SHA256 checksums are validated by S3 on upload.
+        """
+        digests = hasher.digests()
+        self._s3_resource.put_object(
+            Body=data, Bucket=self._bucket_name, Key=file_path,
+            ContentType=content_type, ContentMD5=digests['md5'],
+            ChecksumSHA256=digests['sha256'],
+            Metadata={**(metadata or {}), **hasher.metadata()})
+
+    def _tag_hashes(self, file_path: str, hasher: StreamHasher):
+        """Record hashes of a completed multipart upload as object tags.
+
+        Metadata of multipart uploads is set before data is read, tags
+        can be set after completion without copying the object.
+        """
+        try:
+            self._s3_resource.put_object_tagging(
+                Bucket=self._bucket_name, Key=file_path,
+                Tagging={'TagSet': [
+                    {'Key': key, 'Value': value}
+                    for key, value in hasher.metadata().items()]})
+        except botocore.exceptions.ClientError as e:
+            # Hashes are optional, credentials may not allow tagging
+            if e.response['Error']['Code'] != 'AccessDenied':
+                raise e
+
     def write_file_stream(self, file_path: str, data_stream: io.BytesIO,
-                          chunk_size: int = 1024 * 1024):
+                          chunk_size: int = None,
+                          metadata: dict = None,
+                          content_type: str = 'application/octet-stream',
+                          checkpoint: UploadCheckpoint = None):
         """Write file as stream to google cloud.
 
         Args:
@@ -126,24 +197,169 @@ class PumpWoodAwsS3():
             data_stream (io.BytesIO):
                 Data stream.
             chunk_size (int):
-                Size of the chuck to be transmited, default for
-                1024 * 1024 (1Mb).
+                Size of the multipart upload parts, at least 5Mb. Default
+                None sizes the parts by the content length and, on
+                checkpointed uploads, grows them with the throughput.
+                Parallel parts of managed uploads are limited by the
+                process memory budget.
+            metadata (dict):
+                User metadata to be stored with the object.
+            content_type (str):
+                Mime-type of the content.
+            checkpoint (UploadCheckpoint):
+                If set, the multipart upload id and completed parts are
+                saved after each part and an interrupted upload is
+                resumed. Parts have at least 5Mb.
 
         Returns (dict):
-            Return the file path used to save data ("file_path" key) and the
-            total of bytes that were transmited.
+            Return the file path used to save data ("file_path" key), the
+            total of bytes that were transmited and the base64 MD5 hash
+            of the data ("hash" key).
 
         Raises:
-            No particular raises at this function.
+            PumpWoodDataLoadingException:
+                If data stream differs from the one of the interrupted
+                upload.
         """
-        self._s3_resource.upload_fileobj(
-            Fileobj=data_stream, Bucket=self._bucket_name,
-            Key=file_path)
-        response = self._s3_resource.get_object(
-            Bucket=self._bucket_name, Key=file_path)
+        # Each part is validated by S3 using SHA256 checksum. Hashes are
+        # calculated while data is uploaded, streams of a single part are
+        # put with hashes at metadata and multipart uploads have them
+        # tagged on completion
+        sizer = AdaptiveChunkSizer.for_provider(
+            'aws_s3', chunk_size=chunk_size,
+            content_length=stream_length(data_stream))
+        hasher = StreamHasher()
+        stream = FlaskStreamUploadWrapper(data_stream, hasher=hasher)
+        if checkpoint is None:
+            first_part = read_exact(stream, sizer.size)
+            if len(first_part) < sizer.size:
+                self._put_object(
+                    file_path=file_path, data=first_part, hasher=hasher,
+                    metadata=metadata, content_type=content_type)
+            else:
+                self._managed_upload(
+                    file_path=file_path,
+                    stream=_PrefixedStream(first_part, stream),
+                    sizer=sizer, metadata=metadata,
+                    content_type=content_type)
+                self._tag_hashes(file_path=file_path, hasher=hasher)
+        else:
+            self._resumable_upload(
+                file_path=file_path, stream=stream, sizer=sizer,
+                metadata=metadata, content_type=content_type,
+                checkpoint=checkpoint)
         return {
             "file_path": file_path,
-            "bytes_uploaded": response["ContentLength"]}
+            "bytes_uploaded": stream.bytes_position,
+            "hash": hasher.digests()['md5']}
+
+    def _managed_upload(self, file_path: str, stream,
+                        sizer: AdaptiveChunkSizer, metadata: dict,
+                        content_type: str):
+        """Multipart upload of parts in parallel by boto3."""
+        # Managed uploads keep up to max_concurrency parts in memory
+        max_concurrency = sizer.reserve_concurrency(
+            sizer.size, S3_MAX_CONCURRENCY)
+        try:
+            self._s3_resource.upload_fileobj(
+                Fileobj=stream, Bucket=self._bucket_name,
+                Key=file_path, ExtraArgs={
+                    'ChecksumAlgorithm': 'SHA256',
+                    'Metadata': metadata or {},
+                    'ContentType': content_type},
+                Config=TransferConfig(
+                    multipart_threshold=sizer.size,
+                    multipart_chunksize=sizer.size,
+                    max_concurrency=max_concurrency))
+        finally:
+            sizer.release_concurrency()
+
+    def _resumable_upload(self, file_path: str, stream,
+                          sizer: AdaptiveChunkSizer, metadata: dict,
+                          content_type: str, checkpoint: UploadCheckpoint):
+        """Multipart upload saving upload id and parts at checkpoint."""
+        state = checkpoint.state
+        if state and state.get('file_path') != file_path:
+            self._abort_multipart_upload(
+                file_path=state['file_path'], upload_id=state['upload_id'])
+            state = {}
+        elif state:
+            try:
+                self._s3_resource.list_parts(
+                    Bucket=self._bucket_name, Key=file_path,
+                    UploadId=state['upload_id'], MaxParts=1)
+            except botocore.exceptions.ClientError as e:
+                if e.response['Error']['Code'] != 'NoSuchUpload':
+                    raise e
+                state = {}
+
+        # Parts of the interrupted upload are read from stream only to
+        # update hashes and check that data was not changed
+        for part in state.get('parts', []):
+            try:
+                check_resumed_chunk(
+                    checkpoint, read_exact(stream, part['size']),
+                    part['md5'])
+            except exceptions.PumpWoodDataLoadingException:
+                # Parts of a discarded upload are stored until aborted
+                self._abort_multipart_upload(
+                    file_path=file_path, upload_id=state['upload_id'])
+                raise
+
+        while True:
+            with sizer.chunk() as part_size:
+                data = read_exact(stream, part_size)
+                if not state and len(data) < part_size:
+                    # Upload is created only for streams of many parts
+                    self._put_object(
+                        file_path=file_path, data=data,
+                        hasher=stream.hasher, metadata=metadata,
+                        content_type=content_type)
+                    checkpoint.clear()
+                    return
+                if not data and state['parts']:
+                    break
+                if not state:
+                    response = self._s3_resource.create_multipart_upload(
+                        Bucket=self._bucket_name, Key=file_path,
+                        ContentType=content_type, Metadata=metadata or {})
+                    state = {
+                        'file_path': file_path,
+                        'upload_id': response['UploadId'], 'parts': []}
+                    checkpoint.state = state
+                    checkpoint.save()
+                part_md5 = hashlib.md5(data)
+                response = self._s3_resource.upload_part(
+                    Bucket=self._bucket_name, Key=file_path,
+                    UploadId=state['upload_id'],
+                    PartNumber=len(state['parts']) + 1, Body=data,
+                    ContentMD5=base64.b64encode(
+                        part_md5.digest()).decode('utf-8'))
+                state['parts'].append({
+                    'part_number': len(state['parts']) + 1,
+                    'etag': response['ETag'], 'size': len(data),
+                    'md5': part_md5.hexdigest()})
+                checkpoint.save()
+                if len(data) < part_size:
+                    break
+
+        self._s3_resource.complete_multipart_upload(
+            Bucket=self._bucket_name, Key=file_path,
+            UploadId=state['upload_id'],
+            MultipartUpload={'Parts': [
+                {'PartNumber': x['part_number'], 'ETag': x['etag']}
+                for x in state['parts']]})
+        self._tag_hashes(file_path=file_path, hasher=stream.hasher)
+        checkpoint.clear()
+
+    def _abort_multipart_upload(self, file_path: str, upload_id: str):
+        """Abort multipart upload of a discarded checkpoint."""
+        try:
+            self._s3_resource.abort_multipart_upload(
+                Bucket=self._bucket_name, Key=file_path, UploadId=upload_id)
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] != 'NoSuchUpload':
+                raise e
 
     def get_read_file_iterator(self, file_path: str, **kwargs) -> Callable:
         """Return an iterator to stream download data in flask.
@@ -217,6 +433,43 @@ class PumpWoodAwsS3():
             'data': file_stream.getvalue(),
             'content_type': head_data["ContentType"]}
 
+    def read_file_range(self, file_path: str, offset: int,
+                        length: int) -> bytes:
+        """Read a byte range of the file with a single request.
+
+        Args:
+            file_path (str):
+                Path of the file at the storage.
+            offset (int):
+                Position of the first byte.
+            length (int):
+                Number of bytes to read, less bytes are returned if the
+                range goes beyond the end of the file.
+
+        Returns:
+            Bytes of the range.
+
+        Raises:
+            PumpWoodObjectDoesNotExist:
+                'file_path {file_path} does not exist'. Raise error when file
+                is not found at the storage.
+        """
+        if length <= 0:
+            return b''
+        try:
+            response = self._s3_resource.get_object(
+                Bucket=self._bucket_name, Key=file_path,
+                Range='bytes={}-{}'.format(offset, offset + length - 1))
+        except botocore.exceptions.ClientError as e:
+            error_code = e.response['Error']['Code']
+            if error_code in ["404", "NoSuchKey"]:
+                msg = 'file_path %s does not exist' % file_path
+                raise exceptions.PumpWoodObjectDoesNotExist(msg)
+            elif error_code == "InvalidRange":
+                return b''
+            raise e
+        return response['Body'].read()
+
     def download_to_file(self, file_path: str, file_obj) -> None:
         """Download file from storage and save it in a local path.
 
@@ -234,19 +487,253 @@ class PumpWoodAwsS3():
             Fileobj=file_obj)
         file_obj.close()
 
-    def get_file_hash(self, file_path: str):
-        """Return file hash calculated at cloud storage provider.
+    def copy_file(self, source_file_path: str, destination_file_path: str,
+                  if_exists: str = 'fail') -> str:
+        """Copy a file inside the bucket using server side copy.
+
+        Args:
+            source_file_path (str):
+                Path of the file to be copied.
+            destination_file_path (str):
+                Path of the copy.
+            if_exists (str):
+                'fail' to raise error if destination exists or 'overwrite'.
+
+        Returns:
+            Destination file path.
+
+        Raises:
+            PumpWoodObjectDoesNotExist:
+                If source file is not found on s3.
+            Exception('There is a file with same name on bucket'):
+                If destination exists and `if_exists='fail'`.
+        """
+        source_metadata = self.get_file_metadata(file_path=source_file_path)
+        if if_exists == 'fail' and \
+                self.check_file_exists(file_path=destination_file_path):
+            raise Exception('There is a file with same name on bucket')
+
+        # Managed copy uses multipart copy for large files, which does not
+        # keep metadata and tags by default, hashes are set at metadata
+        hash_metadata = {
+            HASH_METADATA_KEYS[algorithm]: value
+            for algorithm, value in source_metadata['hashes'].items()
+            if value is not None}
+        self._s3_resource.copy(
+            CopySource={'Bucket': self._bucket_name, 'Key': source_file_path},
+            Bucket=self._bucket_name, Key=destination_file_path,
+            ExtraArgs={
+                'Metadata': {
+                    **source_metadata['metadata'], **hash_metadata},
+                'ContentType': source_metadata['content_type'],
+                'MetadataDirective': 'REPLACE'})
+        return destination_file_path
+
+    def get_download_url(self, file_path: str, expires_in: int = 3600,
+                         file_name: str = None) -> str:
+        """Return a presigned URL to download the file.
+
+        Args:
+            file_path (str):
+                Path of the file at the bucket.
+            expires_in (int):
+                Seconds until the URL expires.
+            file_name (str):
+                If set, the file is downloaded as attachment with this
+                name.
+
+        Returns:
+            Presigned GET URL.
+        """
+        params = {'Bucket': self._bucket_name, 'Key': file_path}
+        if file_name is not None:
+            params['ResponseContentDisposition'] = \
+                'attachment; filename="{}"'.format(file_name)
+        return self._s3_resource.generate_presigned_url(
+            'get_object', Params=params, ExpiresIn=expires_in)
+
+    def get_upload_url(self, file_path: str, expires_in: int = 3600,
+                       content_type: str = 'application/octet-stream',
+                       parts: int = None) -> dict:
+        """Return presigned URLs to upload the file.
+
+        Args:
+            file_path (str):
+                Path of the file at the bucket.
+            expires_in (int):
+                Seconds until the URLs expire.
+            content_type (str):
+                Mime-type of the content, it must be sent as Content-Type
+                header on single uploads.
+            parts (int):
+                If set, a multipart upload is started and a presigned URL
+                is returned for each part. Parts must have at least 5Mb,
+                except the last one. The upload must be finished with
+                `complete_upload` using the ETag of the parts.
+
+        Returns:
+            Dictionary with file_path, upload_type ('single' or
+            'multipart'), method, url (single) or part_urls and upload_id
+            (multipart) and the headers to be sent.
+        """
+        if parts is None:
+            url = self._s3_resource.generate_presigned_url(
+                'put_object', ExpiresIn=expires_in, Params={
+                    'Bucket': self._bucket_name, 'Key': file_path,
+                    'ContentType': content_type})
+            return {
+                'file_path': file_path, 'upload_type': 'single',
+                'method': 'PUT', 'url': url,
+                'headers': {'Content-Type': content_type}}
+
+        response = self._s3_resource.create_multipart_upload(
+            Bucket=self._bucket_name, Key=file_path,
+            ContentType=content_type)
+        upload_id = response['UploadId']
+        part_urls = [
+            self._s3_resource.generate_presigned_url(
+                'upload_part', ExpiresIn=expires_in, Params={
+                    'Bucket': self._bucket_name, 'Key': file_path,
+                    'UploadId': upload_id, 'PartNumber': part_number})
+            for part_number in range(1, parts + 1)]
+        return {
+            'file_path': file_path, 'upload_type': 'multipart',
+            'method': 'PUT', 'upload_id': upload_id,
+            'part_urls': part_urls, 'headers': {}}
+
+    def complete_upload(self, file_path: str, upload_id: str,
+                        parts: List[dict]) -> str:
+        """Complete a multipart upload made with presigned URLs.
+
+        Args:
+            file_path (str):
+                Path of the file at the bucket.
+            upload_id (str):
+                Upload id returned by `get_upload_url`.
+            parts (List[dict]):
+                List of dictionaries with part_number and etag (ETag
+                header of the part upload response).
+
+        Returns:
+            File path.
+        """
+        self._s3_resource.complete_multipart_upload(
+            Bucket=self._bucket_name, Key=file_path, UploadId=upload_id,
+            MultipartUpload={'Parts': [
+                {'PartNumber': int(x['part_number']), 'ETag': x['etag']}
+                for x in sorted(parts, key=lambda x: int(x['part_number']))]})
+        return file_path
+
+    def get_file_metadata(self, file_path: str) -> dict:
+        """Return file metadata with a single HEAD request.
+
+        Args:
+            file_path (str):
+                File path.
+
+        Returns:
+            A dictionary with keys.
+            - **size:** Size of the file in bytes.
+            - **content_type:** Content type of the file.
+            - **hash:** Base64 MD5 hash of the file, None if not available.
+            - **hashes:** Base64 hashes of the file by algorithm.
+            - **metadata:** User metadata of the object.
+            - **updated_at:** Last modification time.
+
+        Raises:
+            PumpWoodObjectDoesNotExist:
+                "file_path {file_path} does not exist", If file is not found
+                on storage.
+        """
+        try:
+            head_data = self._s3_resource.head_object(
+                Bucket=self._bucket_name, Key=file_path,
+                ChecksumMode='ENABLED')
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] == "404":
+                msg = 'file_path %s does not exist' % file_path
+                raise exceptions.PumpWoodObjectDoesNotExist(msg)
+            else:
+                raise e
+
+        metadata = head_data.get('Metadata', {})
+        md5_hash = hash_from_metadata(metadata, 'md5')
+        sha256_hash = hash_from_metadata(metadata, 'sha256')
+        etag = head_data.get('ETag', '').strip('"')
+        if '-' in etag:
+            # Hashes of multipart uploads are tagged on completion
+            if md5_hash is None or sha256_hash is None:
+                tags = self._get_object_tags(file_path=file_path)
+                md5_hash = md5_hash or hash_from_metadata(tags, 'md5')
+                sha256_hash = \
+                    sha256_hash or hash_from_metadata(tags, 'sha256')
+        elif etag:
+            # ETag and checksum of single part uploads are of the object
+            if md5_hash is None:
+                md5_hash = base64.b64encode(
+                    bytes.fromhex(etag)).decode('utf-8')
+            checksum = head_data.get('ChecksumSHA256')
+            if sha256_hash is None and checksum:
+                sha256_hash = checksum
+        return {
+            'size': head_data['ContentLength'],
+            'content_type': head_data.get('ContentType'),
+            'hash': md5_hash,
+            'hashes': {'md5': md5_hash, 'sha256': sha256_hash},
+            'metadata': metadata,
+            'updated_at': head_data.get('LastModified')}
+
+    def _get_object_tags(self, file_path: str) -> dict:
+        """Return object tags, empty if credentials do not allow it."""
+        try:
+            response = self._s3_resource.get_object_tagging(
+                Bucket=self._bucket_name, Key=file_path)
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] != 'AccessDenied':
+                raise e
+            return {}
+        return {x['Key']: x['Value'] for x in response['TagSet']}
+
+    def get_file_hash(self, file_path: str, algorithm: str = 'md5') -> str:
+        """Return file hash calculated at upload.
 
         Args:
             file_path (str):
                 File path.
+            algorithm (str):
+                Hash algorithm, 'md5' or 'sha256'.
 
         Returns:
-            str: Hash of the file.
+            str: Base64 hash of the file.
 
         Raises:
-            Exception("file_path {file_path} does not exist")
-                If file is not found on storage.
+            PumpWoodObjectDoesNotExist:
+                "file_path {file_path} does not exist", If file is not found
+                on storage.
+            PumpWoodNotImplementedError:
+                If hash is not available, multipart uploads do not have
+                hashes if credentials do not allow object tagging.
         """
-        msg = "File hash retrive is not implemented for AWS provider"
-        raise NotImplementedError(msg)
+        file_metadata = self.get_file_metadata(file_path=file_path)
+        file_hash = file_metadata['hashes'].get(algorithm)
+        if file_hash is None:
+            msg = "Hash {} is not available for file {}".format(
+                algorithm, file_path)
+            raise exceptions.PumpWoodNotImplementedError(msg)
+        return file_hash
+
+
+class _PrefixedStream():
+    """Stream that returns data already read before the rest of stream."""
+
+    def __init__(self, prefix: bytes, stream):
+        self._prefix = io.BytesIO(prefix)
+        self._stream = stream
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._prefix.read(size)
+        if size is None or size < 0:
+            return data + self._stream.read()
+        if len(data) < size:
+            data += self._stream.read(size - len(data))
+        return data
@@ -1,33 +1,73 @@
 """Google Storage Cloud."""
 import os
 import io
+import time
+import uuid
+import datetime
+import base64
+import hashlib
 from typing import Callable
-from azure.storage.blob import BlobServiceClient, BlobClient
-from ._general import FlaskStreamUploadWrapper
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
+from azure.storage.blob import (
+    BlobServiceClient, BlobClient, BlobBlock, BlobSasPermissions,
+    ContentSettings, generate_blob_sas)
+from pumpwood_communication import exceptions
+from ._general import (
+    FlaskStreamUploadWrapper, StreamHasher, hash_from_metadata)
+from ._checkpoint import UploadCheckpoint, read_exact, check_resumed_chunk
+from ._chunking import AdaptiveChunkSizer, iter_chunks, stream_length
 
 
 class PumpWoodAzureStorage():
     """Class to make communication with Azure Blob Storage."""
 
-    def __init__(self, bucket_name: str):
+    def __init__(self, bucket_name: str, sdk_retries: bool = True):
         """__init__.
 
         Args:
             bucket_name (str):
                 Name of the bucket.
+            sdk_retries (bool):
+                Use the retries of azure-core, disabled when a
+                `PolicyBucket` retries the requests.
         """
         # Collection AZURE_STORAGE_CONNECTION_STRING from environment
         # variables
         connect_str = os.getenv('AZURE_STORAGE_CONNECTION_STRING')
         if connect_str is None:
             raise Exception("AZURE_STORAGE_CONNECTION_STRING not set")
+        self._request_hooks = []
+        retry_kwargs = {} if sdk_retries else {'retry_total': 0}
         blob_service = BlobServiceClient.from_connection_string(
-            connect_str)
+            connect_str, raw_response_hook=self._response_hook,
+            **retry_kwargs)
         self._client = blob_service.get_container_client(container=bucket_name)
         if not self._client.exists():
             Exception("Container [%s] does not exists" % bucket_name)
         self._bucket_name = bucket_name
 
+    def _response_hook(self, response):
+        """Call request hooks with method and `comp` of the request."""
+        if not self._request_hooks:
+            return
+        request = response.http_request
+        comp = request.query.get('comp', 'blob')
+        api_call = '{} {}'.format(request.method, comp)
+        for callback in self._request_hooks:
+            callback(api_call)
+
+    def add_request_hook(self, callback):
+        """Call callback with method and operation of each request.
+
+        Operation is the `comp` parameter of the request or 'blob' (ex.:
+        'HEAD blob', 'PUT block', 'PUT blocklist', 'GET list').
+
+        Args:
+            callback:
+                Function receiving the API call name.
+        """
+        self._request_hooks.append(callback)
+
     def check_file_exists(self, file_path: str) -> bool:
         """Check if file exists.
 
@@ -56,7 +96,7 @@ class PumpWoodAzureStorage():
             for x in self._client.list_blobs(name_starts_with=path)]
 
     def write_file(self, file_path: str, data: bytes, if_exists: str = 'fail',
-                   content_type='text/plain') -> str:
+                   content_type='text/plain', metadata: dict = None) -> str:
         """Write file on Azure.
 
         Args:
@@ -72,6 +112,8 @@ class PumpWoodAzureStorage():
                 'fail' (fail if file exists)]
             content_type (str):
                 Mime-type of the content.
+            metadata (dict):
+                User metadata to be stored with the object.
         """
         if_exists_opt = [
             'overwrite', 'overwrite_streaming', 'append_breakline',
@@ -81,7 +123,8 @@ class PumpWoodAzureStorage():
             raise Exception(msg)
 
         blob = self._client.get_blob_client(blob=file_path)
-        blob_exists = blob.exists()
+        # Overwrites do not need a metadata request
+        blob_exists = if_exists != 'overwrite' and blob.exists()
         if blob_exists and if_exists == 'fail':
             raise Exception('There is a file with same name on bucket')
         elif if_exists in ['append_breakline', 'append']:
@@ -90,15 +133,21 @@ class PumpWoodAzureStorage():
                 if if_exists == 'append_breakline' else old_text
             data = old_text + data
 
-        # Removendo o blob caso tenha mesmo nome
-        if blob_exists:
-            blob.delete_blob()
-
-        blob.upload_blob(data)
+        # Content-MD5 is validated by Azure and stored as blob property
+        hasher = StreamHasher.hash_bytes(data)
+        content_md5 = base64.b64decode(hasher.digests()['md5'])
+        blob.upload_blob(
+            data, metadata={**(metadata or {}), **hasher.metadata()},
+            validate_content=True, overwrite=True,
+            content_settings=ContentSettings(
+                content_type=content_type,
+                content_md5=bytearray(content_md5)))
         return file_path
 
     def write_file_stream(self, file_path: str, data_stream: io.BytesIO,
-                          chunk_size: int = None):
+                          chunk_size: int = None, metadata: dict = None,
+                          content_type: str = 'application/octet-stream',
+                          checkpoint: UploadCheckpoint = None):
         """Write file as stream to google cloud.
 
         Args:
@@ -107,29 +156,42 @@ class PumpWoodAzureStorage():
             data_stream (io.BytesIO):
                 Data stream.
             chunk_size:
-                Just for compatibility, it will not be used.
+                Size of the staged blocks. Default None starts at 1Mb and
+                grows with the throughput.
+            metadata (dict):
+                User metadata to be stored with the object.
+            content_type (str):
+                Mime-type of the content.
+            checkpoint (UploadCheckpoint):
+                If set, blocks are staged and saved at the checkpoint, an
+                interrupted upload continues from the last staged block.
 
         Returns:
-            Return the file path used to save data ("file_path" key) and the
-            total of bytes that were transmited.
+            Return the file path used to save data ("file_path" key), the
+            total of bytes that were transmited and the base64 MD5 hash
+            of the data ("hash" key).
 
         Raises:
-            No particular raises at this function.
+            PumpWoodDataLoadingException:
+                If data stream differs from the one of the interrupted
+                upload.
         """
+        # Blocks are staged and committed with the hashes of the full
+        # blob, existing blob is kept until the block list is committed
         blob = self._client.get_blob_client(blob=file_path)
-        blob_exists = blob.exists()
-
-        # Removendo o blob caso tenha mesmo nome
-        if blob_exists:
-            blob.delete_blob()
-
-        file_stream_obj = AzureStorageUploadFileStream(
-            blob=blob, data_stream=data_stream)
-        file_stream_obj.write()
-
-        properties = blob.get_blob_properties()
+        if checkpoint is not None:
+            file_stream_obj = AzureStorageCheckpointUploadFileStream(
+                blob=blob, data_stream=data_stream, checkpoint=checkpoint,
+                chunk_size=chunk_size)
+        else:
+            file_stream_obj = AzureStorageUploadFileStream(
+                blob=blob, data_stream=data_stream, chunk_size=chunk_size)
+        hasher = file_stream_obj.write(
+            metadata=metadata, content_type=content_type)
         return {
-            "file_path": file_path, "bytes_uploaded": properties['size']}
+            "file_path": file_path,
+            "bytes_uploaded": file_stream_obj.get_bytes_uploaded(),
+            "hash": hasher.digests()['md5']}
 
     def get_read_file_iterator(self, file_path: str,
                                chunk_size: int = 1024 * 1024) -> Callable:
@@ -184,6 +246,40 @@ class PumpWoodAzureStorage():
         content_type = properties["content_settings"]["content_type"]
         return {'data': data, 'content_type': content_type}
 
+    def read_file_range(self, file_path: str, offset: int,
+                        length: int) -> bytes:
+        """Read a byte range of the file with a single request.
+
+        Args:
+            file_path (str):
+                Path of the file at the storage.
+            offset (int):
+                Position of the first byte.
+            length (int):
+                Number of bytes to read, less bytes are returned if the
+                range goes beyond the end of the file.
+
+        Returns:
+            Bytes of the range.
+
+        Raises:
+            PumpWoodObjectDoesNotExist:
+                'file_path {file_path} does not exist'. Raise error when file
+                is not found at the storage.
+        """
+        if length <= 0:
+            return b''
+        blob = self._client.get_blob_client(blob=file_path)
+        try:
+            return blob.download_blob(offset=offset, length=length).readall()
+        except ResourceNotFoundError:
+            msg = 'file_path %s does not exist' % file_path
+            raise exceptions.PumpWoodObjectDoesNotExist(msg)
+        except HttpResponseError as e:
+            if e.status_code == 416:
+                return b''
+            raise e
+
     def download_to_file(self, file_path: str, file_obj: any) -> bool:
         """Download file from storage and save it in a local path.
 
@@ -202,27 +298,194 @@ class PumpWoodAzureStorage():
         file_obj.close()
         return True
 
-    def get_file_hash(self, file_path: str):
-        """Return file hash calculated at cloud storage provider.
+    def copy_file(self, source_file_path: str, destination_file_path: str,
+                  if_exists: str = 'fail') -> str:
+        """Copy a file inside the container using server side copy.
+
+        Args:
+            source_file_path (str):
+                Path of the file to be copied.
+            destination_file_path (str):
+                Path of the copy.
+            if_exists (str):
+                'fail' to raise error if destination exists or 'overwrite'.
+
+        Returns:
+            Destination file path.
+
+        Raises:
+            Exception('file_path %s does not exist' % file_path):
+                If source file is not found.
+            Exception('There is a file with same name on bucket'):
+                If destination exists and `if_exists='fail'`.
+        """
+        source_blob = self._client.get_blob_client(blob=source_file_path)
+        if not source_blob.exists():
+            raise Exception('file_path %s does not exist' % source_file_path)
+        destination_blob = self._client.get_blob_client(
+            blob=destination_file_path)
+        if if_exists == 'fail' and destination_blob.exists():
+            raise Exception('There is a file with same name on bucket')
+
+        copy = destination_blob.start_copy_from_url(source_blob.url)
+        copy_status = copy['copy_status']
+        while copy_status == 'pending':
+            time.sleep(0.5)
+            copy_status = destination_blob.get_blob_properties().copy.status
+        if copy_status != 'success':
+            raise Exception(
+                "Copy of [%s] was not completed" % source_file_path)
+        return destination_file_path
+
+    def _get_sas_url(self, file_path: str, expires_in: int,
+                     permission: BlobSasPermissions, **kwargs) -> str:
+        """Return blob URL with a SAS token signed with the account key."""
+        blob = self._client.get_blob_client(blob=file_path)
+        sas_token = generate_blob_sas(
+            account_name=self._client.account_name,
+            container_name=self._bucket_name, blob_name=file_path,
+            account_key=self._client.credential.account_key,
+            permission=permission,
+            expiry=datetime.datetime.now(datetime.timezone.utc) +
+            datetime.timedelta(seconds=expires_in), **kwargs)
+        return blob.url + '?' + sas_token
+
+    def get_download_url(self, file_path: str, expires_in: int = 3600,
+                         file_name: str = None) -> str:
+        """Return a SAS URL to download the file.
+
+        Args:
+            file_path (str):
+                Path of the file at the container.
+            expires_in (int):
+                Seconds until the URL expires.
+            file_name (str):
+                If set, the file is downloaded as attachment with this
+                name.
+
+        Returns:
+            URL with a read only SAS token.
+        """
+        kwargs = {}
+        if file_name is not None:
+            kwargs['content_disposition'] = \
+                'attachment; filename="{}"'.format(file_name)
+        return self._get_sas_url(
+            file_path=file_path, expires_in=expires_in,
+            permission=BlobSasPermissions(read=True), **kwargs)
+
+    def get_upload_url(self, file_path: str, expires_in: int = 3600,
+                       content_type: str = 'application/octet-stream',
+                       parts: int = None) -> dict:
+        """Return a SAS URL to upload the file.
+
+        Args:
+            file_path (str):
+                Path of the file at the container.
+            expires_in (int):
+                Seconds until the URL expires.
+            content_type (str):
+                Mime-type of the content.
+            parts (int):
+                If set, the client uploads blocks with `comp=block` and
+                commits them with `comp=blocklist` requests on the same
+                URL, otherwise the file is sent with a single PUT.
+
+        Returns:
+            Dictionary with file_path, upload_type ('single' or 'block'),
+            method, url and the headers to be sent.
+        """
+        url = self._get_sas_url(
+            file_path=file_path, expires_in=expires_in,
+            permission=BlobSasPermissions(create=True, write=True))
+        if parts is None:
+            return {
+                'file_path': file_path, 'upload_type': 'single',
+                'method': 'PUT', 'url': url,
+                'headers': {
+                    'x-ms-blob-type': 'BlockBlob',
+                    'Content-Type': content_type}}
+        return {
+            'file_path': file_path, 'upload_type': 'block',
+            'method': 'PUT', 'url': url,
+            'headers': {'x-ms-blob-content-type': content_type}}
+
+    def get_file_metadata(self, file_path: str) -> dict:
+        """Return file metadata with a single request.
 
         Args:
             file_path (str):
                 File path at storage.
 
         Returns:
-            str: Hash of the file.
+            A dictionary with keys.
+            - **size:** Size of the file in bytes.
+            - **content_type:** Content type of the file.
+            - **hash:** Base64 MD5 hash of the file, None if not available.
+            - **hashes:** Base64 hashes of the file by algorithm.
+            - **metadata:** User metadata of the object.
+            - **updated_at:** Last modification time.
 
         Raises:
-            Exception("file_path {file_path} does not exist")
-                If file is not found on storage.
+            PumpWoodObjectDoesNotExist:
+                "file_path {file_path} does not exist", If file is not found
+                on storage.
         """
-        return "not implemented"
+        blob = self._client.get_blob_client(blob=file_path)
+        try:
+            properties = blob.get_blob_properties()
+        except ResourceNotFoundError:
+            msg = 'file_path %s does not exist' % file_path
+            raise exceptions.PumpWoodObjectDoesNotExist(msg)
+
+        metadata = properties.metadata or {}
+        content_md5 = properties.content_settings.content_md5
+        md5_hash = hash_from_metadata(metadata, 'md5')
+        if content_md5 is not None:
+            md5_hash = base64.b64encode(content_md5).decode('utf-8')
+        return {
+            'size': properties.size,
+            'content_type': properties.content_settings.content_type,
+            'hash': md5_hash,
+            'hashes': {
+                'md5': md5_hash,
+                'sha256': hash_from_metadata(metadata, 'sha256')},
+            'metadata': metadata,
+            'updated_at': properties.last_modified}
+
+    def get_file_hash(self, file_path: str, algorithm: str = 'md5') -> str:
+        """Return file hash calculated at upload.
+
+        Args:
+            file_path (str):
+                File path at storage.
+            algorithm (str):
+                Hash algorithm, 'md5' or 'sha256'.
+
+        Returns:
+            str: Base64 hash of the file.
+
+        Raises:
+            PumpWoodObjectDoesNotExist:
+                "file_path {file_path} does not exist", If file is not found
+                on storage.
+            PumpWoodNotImplementedError:
+                If hash is not available for the file.
+        """
+        file_metadata = self.get_file_metadata(file_path=file_path)
+        file_hash = file_metadata['hashes'].get(algorithm)
+        if file_hash is None:
+            msg = "Hash {} is not available for file {}".format(
+                algorithm, file_path)
+            raise exceptions.PumpWoodNotImplementedError(msg)
+        return file_hash
 
 
 class AzureStorageUploadFileStream:
-    """Create a upload file stream for Google Storage."""
+    """Upload stream as staged blocks committed with the blob hashes."""
 
-    def __init__(self, blob: BlobClient, data_stream: io.BytesIO, **kwargs):
+    def __init__(self, blob: BlobClient, data_stream: io.BytesIO,
+                 chunk_size: int = None, **kwargs):
         """__init__.
 
         Args:
@@ -230,6 +493,9 @@ class AzureStorageUploadFileStream:
                 Azure blob storage client
             data_stream (io.BytesIO):
                 Data strem as a BytesIO
+            chunk_size (int):
+                Size of the staged blocks, None to adapt it to the
+                throughput.
             **kwargs:
                 Other arguments.
 
@@ -237,12 +503,129 @@ class AzureStorageUploadFileStream:
             Azure Storage Upload FileStream
         """
         self._blob = blob
-        self._stream = FlaskStreamUploadWrapper(data_stream)
+        self._sizer = AdaptiveChunkSizer.for_provider(
+            'azure_storage', chunk_size=chunk_size,
+            content_length=stream_length(data_stream))
+        self._hasher = StreamHasher()
+        self._stream = FlaskStreamUploadWrapper(
+            data_stream, hasher=self._hasher)
+
+    def write(self, metadata: dict = None,
+              content_type: str = 'application/octet-stream'
+              ) -> StreamHasher:
+        """Stage the blocks and commit them, returns the hasher.
+
+        Each block is validated with MD5, the hash of the full blob is
+        known only at the end of the stream and is set on commit.
+        """
+        # Block ids of a blob must have the same length
+        block_prefix = uuid.uuid4().hex
+        block_list = []
+        for data in iter_chunks(self._stream, self._sizer):
+            block_id = '{}-{:06d}'.format(block_prefix, len(block_list))
+            self._blob.stage_block(block_id, data, validate_content=True)
+            block_list.append(BlobBlock(block_id=block_id))
+
+        content_md5 = base64.b64decode(self._hasher.digests()['md5'])
+        self._blob.commit_block_list(
+            block_list, content_settings=ContentSettings(
+                content_type=content_type,
+                content_md5=bytearray(content_md5)),
+            metadata={**(metadata or {}), **self._hasher.metadata()})
+        return self._hasher
 
-    def write(self):
-        """Write stream to cloud."""
-        self._blob.upload_blob(self._stream)
-        return True
+    def get_bytes_uploaded(self):
+        """Get the number of bytes that were uploaded for validation."""
+        return self._stream.bytes_position
+
+
+class AzureStorageCheckpointUploadFileStream:
+    """Upload stream as staged blocks saving them at a checkpoint.
+
+    Staged blocks are kept by Azure for 7 days, resumed uploads check the
+    uncommitted block list and stage only the missing blocks.
+    """
+
+    def __init__(self, blob: BlobClient, data_stream: io.BytesIO,
+                 checkpoint: UploadCheckpoint, chunk_size: int):
+        """__init__.
+
+        Args:
+            blob (BlobClient):
+                Azure blob storage client.
+            data_stream (io.BytesIO):
+                Data stream, from the beginning even if the upload is
+                resumed.
+            checkpoint (UploadCheckpoint):
+                Checkpoint to save staged blocks.
+            chunk_size (int):
+                Size of the staged blocks, None to adapt it to the
+                throughput.
+        """
+        self._blob = blob
+        self._checkpoint = checkpoint
+        self._sizer = AdaptiveChunkSizer.for_provider(
+            'azure_storage', chunk_size=chunk_size,
+            content_length=stream_length(data_stream))
+        self._hasher = StreamHasher()
+        self._stream = FlaskStreamUploadWrapper(
+            data_stream, hasher=self._hasher)
+
+    def _staged_blocks(self) -> list:
+        """Return blocks of the checkpoint that are still staged."""
+        state = self._checkpoint.state
+        if state.get('file_path') != self._blob.blob_name:
+            return []
+        try:
+            _, uncommitted = self._blob.get_block_list('uncommitted')
+        except ResourceNotFoundError:
+            return []
+        staged_ids = set(x.id for x in uncommitted)
+        blocks = []
+        for block in state['blocks']:
+            if block['id'] not in staged_ids:
+                break
+            blocks.append(block)
+        return blocks
+
+    def write(self, metadata: dict = None,
+              content_type: str = 'application/octet-stream'
+              ) -> StreamHasher:
+        """Stage the blocks and commit them, returns the hasher."""
+        blocks = self._staged_blocks()
+        if blocks:
+            block_prefix = self._checkpoint.state['block_prefix']
+        else:
+            block_prefix = uuid.uuid4().hex
+        self._checkpoint.state = {
+            'file_path': self._blob.blob_name,
+            'block_prefix': block_prefix, 'blocks': blocks}
+
+        for block in blocks:
+            check_resumed_chunk(
+                self._checkpoint, read_exact(self._stream, block['size']),
+                block['md5'])
+
+        for data in iter_chunks(self._stream, self._sizer):
+            # Block ids of a blob must have the same length
+            block_id = '{}-{:06d}'.format(
+                block_prefix, len(self._checkpoint.state['blocks']))
+            self._blob.stage_block(block_id, data, validate_content=True)
+            self._checkpoint.state['blocks'].append({
+                'id': block_id, 'size': len(data),
+                'md5': hashlib.md5(data).hexdigest()})
+            self._checkpoint.save()
+
+        content_md5 = base64.b64decode(self._hasher.digests()['md5'])
+        self._blob.commit_block_list(
+            [BlobBlock(block_id=x['id'])
+             for x in self._checkpoint.state['blocks']],
+            content_settings=ContentSettings(
+                content_type=content_type,
+                content_md5=bytearray(content_md5)),
+            metadata={**(metadata or {}), **self._hasher.metadata()})
+        self._checkpoint.clear()
+        return self._hasher
 
     def get_bytes_uploaded(self):
         """Get the number of bytes that were uploaded for validation."""
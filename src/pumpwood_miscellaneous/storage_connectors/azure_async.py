@@ -0,0 +1,199 @@
+"""Asyncio connector for Azure Blob Storage.
+
+Uses the native `azure.storage.blob.aio` clients, it requires `aiohttp`
+to be installed as the async transport.
+"""
+import os
+from typing import AsyncIterator
+from azure.core.exceptions import ResourceNotFoundError
+from azure.storage.blob import ContentSettings
+from azure.storage.blob.aio import BlobServiceClient
+from pumpwood_communication import exceptions
+
+
+class PumpWoodAzureStorageAsync():
+    """Class to make async communication with Azure Blob Storage."""
+
+    def __init__(self, bucket_name: str):
+        """__init__.
+
+        Args:
+            bucket_name (str):
+                Name of the bucket.
+        """
+        connect_str = os.getenv('AZURE_STORAGE_CONNECTION_STRING')
+        if connect_str is None:
+            raise Exception("AZURE_STORAGE_CONNECTION_STRING not set")
+        self._blob_service = BlobServiceClient.from_connection_string(
+            connect_str)
+        self._client = self._blob_service.get_container_client(
+            container=bucket_name)
+        self._bucket_name = bucket_name
+
+    async def close(self):
+        """Close the underlying aiohttp session."""
+        await self._client.close()
+        await self._blob_service.close()
+
+    async def check_file_exists(self, file_path: str) -> bool:
+        """Check if file exists.
+
+        Args:
+            file_path (str):
+                Path to file in storage.
+
+        Returns:
+            Return a boolean value checking if the file exists on storage.
+        """
+        blob = self._client.get_blob_client(blob=file_path)
+        return await blob.exists()
+
+    async def list_files(self, path: str = "") -> AsyncIterator[str]:
+        """List file at storage path.
+
+        Args:
+            path (str):
+                Path of the storage to list files.
+
+        Returns:
+            Async iterator over all files under path (sub-folders).
+        """
+        async for blob in self._client.list_blobs(name_starts_with=path):
+            yield blob['name']
+
+    async def write_file(self, file_path: str, data: bytes,
+                         if_exists: str = 'fail',
+                         content_type='text/plain') -> str:
+        """Write file on Azure.
+
+        Args:
+            file_path (str):
+                Path to save the file.
+            data (str):
+                File content in bytes.
+            if_exists (str):
+                If_exists must be in 'overwrite',
+                'overwrite_streaming' (stream file to overwrite if exists),
+                'append_breakline' (append content with a breakline between),
+                'append' (append content without break line),
+                'fail' (fail if file exists)]
+            content_type (str):
+                Mime-type of the content.
+        """
+        if_exists_opt = [
+            'overwrite', 'overwrite_streaming', 'append_breakline',
+            'append', 'fail']
+        if if_exists not in if_exists_opt:
+            msg = "if_exists must be in {}".format(if_exists_opt)
+            raise exceptions.PumpWoodNotImplementedError(msg)
+
+        blob = self._client.get_blob_client(blob=file_path)
+        blob_exists = await blob.exists()
+        if blob_exists and if_exists == 'fail':
+            msg = 'There is a file with same name on bucket'
+            raise exceptions.PumpWoodForbidden(msg)
+        elif blob_exists and if_exists in ['append_breakline', 'append']:
+            downloader = await blob.download_blob()
+            old_text = await downloader.readall()
+            old_text = old_text + b'\n' \
+                if if_exists == 'append_breakline' else old_text
+            data = old_text + data
+
+        await blob.upload_blob(
+            data, overwrite=True,
+            content_settings=ContentSettings(content_type=content_type))
+        return file_path
+
+    async def write_file_stream(self, file_path: str, data_stream,
+                                chunk_size: int = None) -> dict:
+        """Write file as stream to Azure.
+
+        Args:
+            file_path (str):
+                Path to save the stream in Azure container.
+            data_stream:
+                Data stream, a file like object, a bytes iterable or an
+                async bytes iterable.
+            chunk_size:
+                Just for compatibility, it will not be used.
+
+        Returns:
+            Return the file path used to save data ("file_path" key) and the
+            total of bytes that were transmited.
+        """
+        blob = self._client.get_blob_client(blob=file_path)
+        await blob.upload_blob(data_stream, overwrite=True)
+        properties = await blob.get_blob_properties()
+        return {
+            "file_path": file_path, "bytes_uploaded": properties['size']}
+
+    async def get_read_file_iterator(self, file_path: str,
+                                     chunk_size: int = 1024 * 1024
+                                     ) -> AsyncIterator[bytes]:
+        """Return an async iterator over file chunks.
+
+        Args:
+            file_path (str):
+                Storage path.
+            chunk_size (int):
+                Chunk size in bytes, default to 1Mb.
+
+        Raises:
+            PumpWoodObjectDoesNotExist:
+                'file_path %s does not exist' % file_path. Indicates that
+                file does not exists on storage.
+        """
+        blob = self._client.get_blob_client(blob=file_path)
+        try:
+            downloader = await blob.download_blob()
+        except ResourceNotFoundError:
+            msg = 'file_path %s does not exist' % file_path
+            raise exceptions.PumpWoodObjectDoesNotExist(msg)
+        async for chunk in downloader.chunks():
+            yield chunk
+
+    async def delete_file(self, file_path: str) -> bool:
+        """Delete file from storage.
+
+        Args:
+            file_path (str):
+                Storage path.
+
+        Raises:
+            PumpWoodObjectDoesNotExist:
+                'file_path %s does not exist' % file_path. Indicates that
+                file does not exists on storage.
+        """
+        blob = self._client.get_blob_client(blob=file_path)
+        try:
+            await blob.delete_blob()
+        except ResourceNotFoundError:
+            msg = 'file_path %s does not exist' % file_path
+            raise exceptions.PumpWoodObjectDoesNotExist(msg)
+        return True
+
+    async def read_file(self, file_path: str) -> dict:
+        """Read file from storage.
+
+        Args:
+            file_path (str):
+                File path that will be read from storage.
+
+        Returns:
+            Returns a dictionary with data containing the file
+            content and content_type retrieved from storage.
+
+        Raises:
+            PumpWoodObjectDoesNotExist:
+                'file_path %s does not exist' % file_path. Indicates that
+                file does not exists on storage.
+        """
+        blob = self._client.get_blob_client(blob=file_path)
+        try:
+            downloader = await blob.download_blob()
+        except ResourceNotFoundError:
+            msg = 'file_path %s does not exist' % file_path
+            raise exceptions.PumpWoodObjectDoesNotExist(msg)
+        data = await downloader.readall()
+        content_type = downloader.properties.content_settings.content_type
+        return {'data': data, 'content_type': content_type}
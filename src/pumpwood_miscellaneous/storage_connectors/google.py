@@ -1,29 +1,64 @@
 """Google Storage Cloud."""
 import io
+import hashlib
+import datetime
 from typing import Callable, List
 from google.cloud import storage
 from google.cloud.storage.blob import Blob
 from google.resumable_media import requests
 from google.resumable_media.requests import ChunkedDownload
 from google.auth.transport.requests import AuthorizedSession
+from google.auth.transport.requests import Request as GoogleAuthRequest
+from google.api_core.exceptions import NotFound, RequestRangeNotSatisfiable
 from ._general import (
-    FlaskStreamUploadWrapper, FlaskStreamDownloadWrapper)
+    FlaskStreamUploadWrapper, FlaskStreamDownloadWrapper, StreamHasher,
+    hash_from_metadata)
+from ._checkpoint import UploadCheckpoint, read_exact, check_resumed_chunk
+from ._chunking import AdaptiveChunkSizer, stream_length
 from pumpwood_communication import exceptions
 
 
 class PumpWoodGoogleBucket():
     """Class to make comunication with Google Cloud Storage."""
 
-    def __init__(self, bucket_name):
+    def __init__(self, bucket_name, sdk_retries: bool = True):
         """__init__.
 
         Args:
             bucket_name (str): Name of the bucket.
+            sdk_retries (bool): Use the retries of google-cloud-storage
+                requests, disabled when a `PolicyBucket` retries them.
+                Chunks of streamed uploads and downloads keep the
+                retries of google-resumable-media, the policy can not
+                retry a stream that was partially consumed.
         """
+        self._retry_kwargs = {} if sdk_retries else {'retry': None}
         self._client = storage.Client()
         self._bucket_name = bucket_name
         self._google_bucket = self._client.bucket(bucket_name)
 
+    def add_request_hook(self, callback):
+        """Call callback with the method and kind of each GCS request.
+
+        Kind is 'upload' for upload endpoints, 'media' for content
+        downloads and 'metadata' for other JSON API requests (ex.:
+        'GET metadata', 'PUT upload').
+
+        Args:
+            callback:
+                Function receiving the API call name.
+        """
+        def response_hook(response, *args, **kwargs):
+            url = response.request.url
+            if '/upload/' in url:
+                kind = 'upload'
+            elif 'alt=media' in url:
+                kind = 'media'
+            else:
+                kind = 'metadata'
+            callback('{} {}'.format(response.request.method, kind))
+        self._client._http.hooks['response'].append(response_hook)
+
     def check_file_exists(self, file_path: str) -> bool:
         """Check if file exists.
 
@@ -35,7 +70,7 @@ class PumpWoodGoogleBucket():
             Return a boolean value checking if the file exists on storage.
         """
         blob = self._google_bucket.blob(file_path)
-        return blob.exists()
+        return blob.exists(**self._retry_kwargs)
 
     def list_files(self, path: str = "") -> List[str]:
         """List file at storage path.
@@ -47,11 +82,12 @@ class PumpWoodGoogleBucket():
         Returns (List[str]):
             List of all files under path (sub-folders).
         """
-        blobs = self._google_bucket.list_blobs(prefix=path)
+        blobs = self._google_bucket.list_blobs(
+            prefix=path, **self._retry_kwargs)
         return [b.name for b in blobs]
 
     def write_file(self, file_path: str, data: bytes, if_exists: str = 'fail',
-                   content_type='text/plain') -> str:
+                   content_type='text/plain', metadata: dict = None) -> str:
         """Write file on Google Bucket.
 
         Args:
@@ -67,6 +103,8 @@ class PumpWoodGoogleBucket():
                 'fail' (fail if file exists)]
             content_type (str):
                 Mime-type of the content.
+            metadata (dict):
+                User metadata to be stored with the object.
 
         Returns:
             A string with bucket path.
@@ -88,21 +126,35 @@ class PumpWoodGoogleBucket():
             raise exceptions.PumpWoodNotImplementedError(msg)
 
         blob = self._google_bucket.blob(file_path)
-        if blob.exists() and if_exists == 'fail':
+        # Overwrites do not need a metadata request
+        blob_exists = if_exists != 'overwrite' and \
+            blob.exists(**self._retry_kwargs)
+        if blob_exists and if_exists == 'fail':
             msg = 'There is a file with same name on bucket'
             raise exceptions.PumpWoodForbidden(msg)
-        elif if_exists in ['append_breakline', 'append']:
-            old_text = self.read_file(file_path)
+        elif blob_exists and if_exists in ['append_breakline', 'append']:
+            old_text = self.read_file(file_path)['data']
             old_text = old_text + b'\n' \
                 if if_exists == 'append_breakline' else old_text
             data = old_text + data
 
+        # GCS validates md5 and crc32c hashes sent with the object
+        hasher = StreamHasher.hash_bytes(
+            data, algorithms=('md5', 'sha256', 'crc32c'))
+        digests = hasher.digests()
+        blob.md5_hash = digests['md5']
+        if 'crc32c' in digests:
+            blob.crc32c = digests['crc32c']
+        blob.metadata = {**(metadata or {}), **hasher.metadata()}
         blob.upload_from_string(
-            data, content_type=content_type)
+            data, content_type=content_type, **self._retry_kwargs)
         return file_path
 
     def write_file_stream(self, file_path: str, data_stream: io.BytesIO,
-                          chunk_size: int = 1024 * 1024):
+                          chunk_size: int = None,
+                          metadata: dict = None,
+                          content_type: str = 'application/octet-stream',
+                          checkpoint: UploadCheckpoint = None):
         """Write file as stream to google cloud.
 
         Args:
@@ -110,20 +162,44 @@ class PumpWoodGoogleBucket():
                 Path to save the stream in Google Storage Bucket.
             data_stream (io.BytesIO):
                 Data stream.
-            chunk_size(int): Size of the chuck to be transmited, default for
-                1024 * 1024 (1Mb).
+            chunk_size(int): Size of the chuck to be transmited, it is
+                rounded to a multiple of 256Kb. Default None starts at
+                256Kb and grows with the throughput.
+            metadata (dict):
+                User metadata to be stored with the object.
+            content_type (str):
+                Mime-type of the content.
+            checkpoint (UploadCheckpoint):
+                If set, the resumable session URI is saved and an
+                interrupted upload continues from the last byte persisted
+                by GCS.
 
         Returns:
-            Return the file path used to save data ("file_path" key) and the
-            total of bytes that were transmited.
+            Return the file path used to save data ("file_path" key), the
+            total of bytes that were transmited and the base64 MD5 hash
+            of the data ("hash" key).
 
         Raises:
-            No particular raises at this function.
+            DataCorruption:
+                If MD5 calculated by GCS does not match the one calculated
+                on upload.
+            PumpWoodDataLoadingException:
+                If MD5 does not match on checkpointed uploads or data
+                stream differs from the one of the interrupted upload.
         """
         blob = self._google_bucket.blob(file_path)
-        file_stream_obj = GoogleStorageUploadFileStream(
-            client=self._client, blob=blob, bucket_name=self._bucket_name,
-            chunk_size=chunk_size, data_stream=data_stream)
+        if checkpoint is None:
+            file_stream_obj = GoogleStorageUploadFileStream(
+                client=self._client, blob=blob,
+                bucket_name=self._bucket_name, chunk_size=chunk_size,
+                data_stream=data_stream, metadata=metadata,
+                content_type=content_type)
+        else:
+            file_stream_obj = GoogleStorageCheckpointUploadFileStream(
+                client=self._client, blob=blob,
+                bucket_name=self._bucket_name, chunk_size=chunk_size,
+                data_stream=data_stream, metadata=metadata,
+                content_type=content_type, checkpoint=checkpoint)
         while True:
             finished = file_stream_obj.write()
             if finished:
@@ -131,17 +207,19 @@ class PumpWoodGoogleBucket():
 
         bytes_uploaded = file_stream_obj.get_bytes_uploaded()
         return {
-            "file_path": file_path, "bytes_uploaded": bytes_uploaded}
+            "file_path": file_path, "bytes_uploaded": bytes_uploaded,
+            "hash": file_stream_obj.get_hash()}
 
     def get_read_file_iterator(self, file_path: str,
-                               chunk_size: int = 1024 * 1024) -> Callable:
+                               chunk_size: int = None) -> Callable:
         """Return an iterator to stream download data in flask.
 
         Args:
             file_path (str):
                 Storage path.
             chunk_size (int):
-                Chunk size in bytes, default to 1Mb.
+                Chunk size in bytes, default None starts at 256Kb and
+                grows with the throughput.
 
         Raises:
             No specific raises.
@@ -168,10 +246,10 @@ class PumpWoodGoogleBucket():
                 file does not exists on storage.
         """
         blob = self._google_bucket.blob(file_path)
-        if not blob.exists():
+        if not blob.exists(**self._retry_kwargs):
             msg = 'file_path %s does not exist' % file_path
             raise exceptions.PumpWoodObjectDoesNotExist(msg)
-        blob.delete()
+        blob.delete(**self._retry_kwargs)
         return True
 
     def read_file(self, file_path: str) -> dict:
@@ -193,14 +271,48 @@ class PumpWoodGoogleBucket():
                 is not found at the storage.
         """
         blob = self._google_bucket.blob(file_path)
-        if not blob.exists():
+        if not blob.exists(**self._retry_kwargs):
             msg = 'file_path %s does not exist' % file_path
             raise exceptions.PumpWoodObjectDoesNotExist(msg)
 
-        data = blob.download_as_string()
+        data = blob.download_as_string(**self._retry_kwargs)
         content_type = blob.content_type
         return {'data': data, 'content_type': content_type}
 
+    def read_file_range(self, file_path: str, offset: int,
+                        length: int) -> bytes:
+        """Read a byte range of the file with a single request.
+
+        Args:
+            file_path (str):
+                Path of the file at the storage.
+            offset (int):
+                Position of the first byte.
+            length (int):
+                Number of bytes to read, less bytes are returned if the
+                range goes beyond the end of the file.
+
+        Returns:
+            Bytes of the range.
+
+        Raises:
+            PumpWoodObjectDoesNotExist:
+                'file_path {file_path} does not exist'. Raise error when file
+                is not found at the storage.
+        """
+        if length <= 0:
+            return b''
+        blob = self._google_bucket.blob(file_path)
+        try:
+            return blob.download_as_bytes(
+                start=offset, end=offset + length - 1,
+                **self._retry_kwargs)
+        except NotFound:
+            msg = 'file_path %s does not exist' % file_path
+            raise exceptions.PumpWoodObjectDoesNotExist(msg)
+        except RequestRangeNotSatisfiable:
+            return b''
+
     def download_to_file(self, file_path: str, file_obj) -> None:
         """Download file from storage and save it in a local path.
 
@@ -218,42 +330,217 @@ class PumpWoodGoogleBucket():
                 is not found at the storage.
         """
         blob = self._google_bucket.blob(file_path)
-        if not blob.exists():
+        if not blob.exists(**self._retry_kwargs):
             msg = 'file_path %s does not exist' % file_path
             raise exceptions.PumpWoodObjectDoesNotExist(msg)
 
-        blob = self._google_bucket.blob(file_path, chunk_size=262144 * 5)
-        blob.download_to_file(file_obj)
+        for chunk in self.get_read_file_iterator(file_path=file_path):
+            file_obj.write(chunk)
         file_obj.close()
 
-    def get_file_hash(self, file_path: str) -> str:
-        """Return file hash calculated at cloud storage provider.
+    def copy_file(self, source_file_path: str, destination_file_path: str,
+                  if_exists: str = 'fail') -> str:
+        """Copy a file inside the bucket using server side copy.
 
         Args:
-            file_path (str): File path.
+            source_file_path (str):
+                Path of the file to be copied.
+            destination_file_path (str):
+                Path of the copy.
+            if_exists (str):
+                'fail' to raise error if destination exists or 'overwrite'.
 
         Returns:
-            str: Hash of the file.
+            Destination file path.
+
+        Raises:
+            PumpWoodObjectDoesNotExist:
+                If source file is not found.
+            PumpWoodForbidden:
+                If destination exists and `if_exists='fail'`.
+        """
+        source_blob = self._google_bucket.blob(source_file_path)
+        if not source_blob.exists(**self._retry_kwargs):
+            msg = 'file_path %s does not exist' % source_file_path
+            raise exceptions.PumpWoodObjectDoesNotExist(msg)
+        destination_blob = self._google_bucket.blob(destination_file_path)
+        if if_exists == 'fail' and \
+                destination_blob.exists(**self._retry_kwargs):
+            msg = 'There is a file with same name on bucket'
+            raise exceptions.PumpWoodForbidden(msg)
+
+        # Rewrite API handles large objects in many calls
+        token, _, _ = destination_blob.rewrite(
+            source_blob, **self._retry_kwargs)
+        while token is not None:
+            token, _, _ = destination_blob.rewrite(
+                source_blob, token=token, **self._retry_kwargs)
+        return destination_file_path
+
+    def _signing_kwargs(self) -> dict:
+        """Arguments to sign URLs with credentials without private key.
+
+        Compute engine and workload identity credentials sign using the
+        IAM signBlob API with the service account email and token.
+        """
+        credentials = self._client._credentials
+        if hasattr(credentials, 'signer_email'):
+            return {}
+        if not credentials.valid:
+            credentials.refresh(GoogleAuthRequest())
+        return {
+            'service_account_email': credentials.service_account_email,
+            'access_token': credentials.token}
+
+    def get_download_url(self, file_path: str, expires_in: int = 3600,
+                         file_name: str = None) -> str:
+        """Return a V4 signed URL to download the file.
+
+        Args:
+            file_path (str):
+                Path of the file at the bucket.
+            expires_in (int):
+                Seconds until the URL expires, at most 7 days.
+            file_name (str):
+                If set, the file is downloaded as attachment with this
+                name.
+
+        Returns:
+            Signed GET URL.
+        """
+        blob = self._google_bucket.blob(file_path)
+        response_disposition = None
+        if file_name is not None:
+            response_disposition = \
+                'attachment; filename="{}"'.format(file_name)
+        return blob.generate_signed_url(
+            version='v4', method='GET',
+            expiration=datetime.timedelta(seconds=expires_in),
+            response_disposition=response_disposition,
+            **self._signing_kwargs())
+
+    def get_upload_url(self, file_path: str, expires_in: int = 3600,
+                       content_type: str = 'application/octet-stream',
+                       parts: int = None) -> dict:
+        """Return a signed URL to upload the file.
+
+        Args:
+            file_path (str):
+                Path of the file at the bucket.
+            expires_in (int):
+                Seconds until the URL expires, at most 7 days.
+            content_type (str):
+                Mime-type of the content, it must be sent as Content-Type
+                header.
+            parts (int):
+                If set, a resumable upload session is started, the client
+                sends the chunks (multiple of 256Kb) with Content-Range
+                headers to the session URL. Sessions are valid for one
+                week and do not use expires_in.
+
+        Returns:
+            Dictionary with file_path, upload_type ('single' or
+            'resumable'), method, url and the headers to be sent.
+        """
+        blob = self._google_bucket.blob(file_path)
+        if parts is None:
+            url = blob.generate_signed_url(
+                version='v4', method='PUT', content_type=content_type,
+                expiration=datetime.timedelta(seconds=expires_in),
+                **self._signing_kwargs())
+            return {
+                'file_path': file_path, 'upload_type': 'single',
+                'method': 'PUT', 'url': url,
+                'headers': {'Content-Type': content_type}}
+
+        session_url = blob.create_resumable_upload_session(
+            content_type=content_type, **self._retry_kwargs)
+        return {
+            'file_path': file_path, 'upload_type': 'resumable',
+            'method': 'PUT', 'url': session_url, 'headers': {}}
+
+    def get_file_metadata(self, file_path: str) -> dict:
+        """Return file metadata with a single request.
+
+        Args:
+            file_path (str):
+                File path.
+
+        Returns:
+            A dictionary with keys.
+            - **size:** Size of the file in bytes.
+            - **content_type:** Content type of the file.
+            - **hash:** Base64 MD5 hash of the file, None for composite
+                objects.
+            - **hashes:** Base64 hashes of the file by algorithm.
+            - **metadata:** User metadata of the object.
+            - **updated_at:** Last modification time.
 
         Raises:
             PumpWoodObjectDoesNotExist:
                 "file_path {file_path} does not exist", If file is not found
                 on storage.
         """
-        blob = self._google_bucket.blob(file_path)
-        if not blob.exists():
+        blob = self._google_bucket.get_blob(
+            file_path, **self._retry_kwargs)
+        if blob is None:
             msg = 'file_path %s does not exist' % file_path
             raise exceptions.PumpWoodObjectDoesNotExist(msg)
 
-        blob.reload()
-        return blob.md5_hash
+        metadata = blob.metadata or {}
+        return {
+            'size': blob.size,
+            'content_type': blob.content_type,
+            'hash': blob.md5_hash,
+            'hashes': {
+                'md5': blob.md5_hash, 'crc32c': blob.crc32c,
+                'sha256': hash_from_metadata(metadata, 'sha256')},
+            'metadata': metadata,
+            'updated_at': blob.updated}
+
+    def get_file_hash(self, file_path: str, algorithm: str = 'md5') -> str:
+        """Return file hash calculated at cloud storage provider.
+
+        Args:
+            file_path (str):
+                File path.
+            algorithm (str):
+                Hash algorithm, 'md5', 'crc32c' or 'sha256'. SHA256 is
+                available only for files written with `write_file`.
+
+        Returns:
+            str: Base64 hash of the file.
+
+        Raises:
+            PumpWoodObjectDoesNotExist:
+                "file_path {file_path} does not exist", If file is not found
+                on storage.
+            PumpWoodNotImplementedError:
+                If hash is not available for the file.
+        """
+        file_metadata = self.get_file_metadata(file_path=file_path)
+        file_hash = file_metadata['hashes'].get(algorithm)
+        if file_hash is None:
+            msg = "Hash {} is not available for file {}".format(
+                algorithm, file_path)
+            raise exceptions.PumpWoodNotImplementedError(msg)
+        return file_hash
+
+
+def _new_session(client: storage.Client) -> AuthorizedSession:
+    """Create a session with the credentials and hooks of the client."""
+    session = AuthorizedSession(credentials=client._credentials)
+    session.hooks['response'] = list(client._http.hooks['response'])
+    return session
 
 
 class GoogleStorageUploadFileStream:
     """Create a upload file stream for Google Storage."""
 
     def __init__(self, client: storage.Client, blob: Blob,
-                 bucket_name: str, chunk_size: int, data_stream: io.BytesIO):
+                 bucket_name: str, chunk_size: int, data_stream: io.BytesIO,
+                 metadata: dict = None,
+                 content_type: str = 'application/octet-stream'):
         """__init__.
 
         Args:
@@ -264,39 +551,213 @@ class GoogleStorageUploadFileStream:
             bucket_name (str):
                 Name of the bucket that will be used to save data.
             chunk_size (int):
-                Size the the chunk used on interation.
+                Size the the chunk used on interation, None to adapt it
+                to the throughput.
             data_stream (io.BytesIO):
                 A stream of data that will be used to upload data to storage.
+            metadata (dict):
+                User metadata to be stored with the object.
+            content_type (str):
+                Mime-type of the content.
         """
         self._client = client
-        self._transport = AuthorizedSession(
-            credentials=self._client._credentials)
-        self._chunk_size = chunk_size
+        self._transport = _new_session(self._client)
+        self._sizer = AdaptiveChunkSizer.for_provider(
+            'google_bucket', chunk_size=chunk_size,
+            content_length=stream_length(data_stream))
         self._blob = blob
 
         url_template = 'https://www.googleapis.com/upload/storage/v1/b/' + \
             '{bucket_name}/o?uploadType=resumable'
         url = url_template.format(bucket_name=bucket_name)
 
+        # GCS MD5 is checked against the one calculated while streaming
         self._request = requests.ResumableUpload(
-            upload_url=url, chunk_size=self._chunk_size)
+            upload_url=url, chunk_size=self._sizer.size, checksum='md5')
 
-        stream = FlaskStreamUploadWrapper(data_stream)
+        self._hasher = StreamHasher(algorithms=('md5', ))
+        stream = FlaskStreamUploadWrapper(data_stream, hasher=self._hasher)
         self._request.initiate(
             transport=self._transport,
-            content_type='application/octet-stream',
+            content_type=content_type,
             stream=stream, stream_final=False,
-            metadata={'name': self._blob.name})
+            metadata={'name': self._blob.name, 'metadata': metadata or {}})
 
     def write(self):
         """Write function."""
-        self._request.transmit_next_chunk(self._transport)
+        with self._sizer.chunk() as chunk_size:
+            # Chunk size of the resumable upload is read on each chunk
+            self._request._chunk_size = chunk_size
+            self._request.transmit_next_chunk(self._transport)
         return self._request.finished
 
     def get_bytes_uploaded(self):
         """Get the number of bytes that was uploaded for validation."""
         return self._request.bytes_uploaded
 
+    def get_hash(self):
+        """Get base64 MD5 of the uploaded data."""
+        return self._hasher.digests()['md5']
+
+
+class GoogleStorageCheckpointUploadFileStream:
+    """Resumable upload to Google Storage saving session at a checkpoint.
+
+    It uses the JSON API resumable protocol, the session URI and the hashes
+    of the confirmed chunks are saved at the checkpoint. Resumed uploads
+    query GCS for the persisted offset and continue from it.
+    """
+
+    def __init__(self, client: storage.Client, blob: Blob,
+                 bucket_name: str, chunk_size: int, data_stream: io.BytesIO,
+                 checkpoint: UploadCheckpoint, metadata: dict = None,
+                 content_type: str = 'application/octet-stream'):
+        """__init__.
+
+        Args:
+            client (storage.Client):
+                Storage client of google cloud.
+            blob (Blob):
+                GCP blob storage object.
+            bucket_name (str):
+                Name of the bucket that will be used to save data.
+            chunk_size (int):
+                Size the the chunk, it is rounded to a multiple of 256Kb.
+                None to adapt it to the throughput.
+            data_stream (io.BytesIO):
+                A stream of data, from the beginning even if the upload is
+                resumed.
+            checkpoint (UploadCheckpoint):
+                Checkpoint to save the upload session.
+            metadata (dict):
+                User metadata to be stored with the object.
+            content_type (str):
+                Mime-type of the content.
+        """
+        self._transport = _new_session(client)
+        self._sizer = AdaptiveChunkSizer.for_provider(
+            'google_bucket', chunk_size=chunk_size,
+            content_length=stream_length(data_stream))
+        self._checkpoint = checkpoint
+        self._hasher = StreamHasher(algorithms=('md5', ))
+        self._stream = FlaskStreamUploadWrapper(
+            data_stream, hasher=self._hasher)
+        self._buffer = b''
+        self._finished = False
+
+        state = checkpoint.state
+        self._position = None
+        if state.get('file_path') == blob.name:
+            self._position = self._query_offset(state['session_uri'])
+        if self._position is None:
+            url_template = 'https://www.googleapis.com/upload/storage/v1/' + \
+                'b/{bucket_name}/o?uploadType=resumable'
+            response = self._transport.post(
+                url_template.format(bucket_name=bucket_name),
+                json={
+                    'name': blob.name, 'metadata': metadata or {},
+                    'contentType': content_type},
+                headers={'X-Upload-Content-Type': content_type})
+            response.raise_for_status()
+            checkpoint.state = {
+                'file_path': blob.name,
+                'session_uri': response.headers['Location'],
+                'chunks': []}
+            checkpoint.save()
+            self._position = 0
+        self._skip_uploaded()
+
+    def _query_offset(self, session_uri: str) -> int:
+        """Return bytes persisted by GCS, None if session is not valid."""
+        response = self._transport.put(
+            session_uri, headers={'Content-Range': 'bytes */*'})
+        if response.status_code != 308:
+            # Finished (200) sessions are uploaded again to check hashes
+            return None
+        return self._persisted_offset(response)
+
+    @staticmethod
+    def _persisted_offset(response) -> int:
+        range_header = response.headers.get('Range')
+        if range_header is None:
+            return 0
+        return int(range_header.split('-')[-1]) + 1
+
+    def _skip_uploaded(self):
+        """Read persisted data from stream checking confirmed chunks."""
+        skipped = 0
+        for chunk in self._checkpoint.state['chunks']:
+            if self._position < chunk['offset'] + chunk['size']:
+                break
+            check_resumed_chunk(
+                self._checkpoint, read_exact(self._stream, chunk['size']),
+                chunk['md5'])
+            skipped += chunk['size']
+        read_exact(self._stream, self._position - skipped)
+        self._checkpoint.state['chunks'] = [
+            x for x in self._checkpoint.state['chunks']
+            if x['offset'] + x['size'] <= self._position]
+
+    def write(self):
+        """Send next chunk, return True when upload is finished.
+
+        Raises:
+            PumpWoodDataLoadingException:
+                If MD5 calculated by GCS does not match the one calculated
+                on upload.
+        """
+        with self._sizer.chunk() as chunk_size:
+            return self._write_chunk(max(chunk_size, len(self._buffer)))
+
+    def _write_chunk(self, chunk_size: int) -> bool:
+        self._buffer += read_exact(
+            self._stream, chunk_size - len(self._buffer))
+        is_last = len(self._buffer) < chunk_size
+        end = self._position + len(self._buffer)
+        if is_last and not self._buffer:
+            content_range = 'bytes */{}'.format(end)
+        else:
+            content_range = 'bytes {}-{}/{}'.format(
+                self._position, end - 1, end if is_last else '*')
+        response = self._transport.put(
+            self._checkpoint.state['session_uri'], data=self._buffer,
+            headers={'Content-Range': content_range})
+
+        if response.status_code in (200, 201):
+            resource = response.json()
+            md5_hash = self._hasher.digests()['md5']
+            self._checkpoint.clear()
+            if resource.get('md5Hash') != md5_hash:
+                msg = (
+                    "MD5 calculated by GCS [{}] does not match the one "
+                    "calculated on upload [{}]").format(
+                        resource.get('md5Hash'), md5_hash)
+                raise exceptions.PumpWoodDataLoadingException(msg)
+            self._position = end
+            self._finished = True
+            return True
+        elif response.status_code != 308:
+            response.raise_for_status()
+
+        persisted = self._persisted_offset(response)
+        confirmed = persisted - self._position
+        if 0 < confirmed:
+            self._checkpoint.state['chunks'].append({
+                'offset': self._position, 'size': confirmed,
+                'md5': hashlib.md5(self._buffer[:confirmed]).hexdigest()})
+            self._checkpoint.save()
+        self._buffer = self._buffer[confirmed:]
+        self._position = persisted
+        return False
+
+    def get_bytes_uploaded(self):
+        """Get the number of bytes that was uploaded for validation."""
+        return self._position
+
+    def get_hash(self):
+        """Get base64 MD5 of the uploaded data."""
+        return self._hasher.digests()['md5']
+
 
 class GoogleStorageDownloadFileStream:
     """Create a download file stream for Google Storage."""
@@ -313,27 +774,28 @@ class GoogleStorageDownloadFileStream:
             bucket_name (str):
                 Name of the bucket that will be used to save data.
             chunk_size (int):
-                Size the the chunk used on interation.
-            data_stream (io.BytesIO):
-                A stream of data that will be used to upload data to storage.
+                Size the the chunk used on interation, None to adapt it
+                to the throughput.
         """
         self._client = client
-        self._transport = AuthorizedSession(
-            credentials=self._client._credentials)
-        self._chunk_size = chunk_size
+        self._transport = _new_session(self._client)
+        self._sizer = AdaptiveChunkSizer.for_provider(
+            'google_bucket', chunk_size=chunk_size)
         self._blob = blob
         self.bytes_position = 0
         url = self._blob._get_download_url(client=client)
 
         self._stream = FlaskStreamDownloadWrapper()
         self._request = ChunkedDownload(
-            url, chunk_size, self._stream)
+            url, self._sizer.size, self._stream)
 
     def read_iterator(self):
         """Create an interator to download data from Google Cloud."""
         while True:
-            self._request.consume_next_chunk(self._transport)
-            last_chunck = self._stream.get_last_chunk()
-            yield last_chunck
+            with self._sizer.chunk() as chunk_size:
+                self._request.chunk_size = chunk_size
+                self._request.consume_next_chunk(self._transport)
+                last_chunck = self._stream.get_last_chunk()
+                yield last_chunck
             if self._request.finished:
                 break
@@ -1,53 +1,777 @@
-"""Set storage connector for local files."""
+"""Set storage connector for local files.
+
+Reads can be memory mapped and streamed with `os.sendfile`, writes are
+atomic using a temporary file renamed over the destination and local
+copies use `os.copy_file_range`, so large files are served without being
+loaded in Python heap. Object metadata, with the hashes calculated on
+write, is stored as extended attributes of the file, or at a hidden JSON
+sidecar file where the file system does not support them.
+"""
+import io
 import os
+import json
+import uuid
+import errno
+import mmap
+import shutil
+import datetime
+from typing import List
+from pumpwood_communication import exceptions
+from ._general import (
+    FlaskStreamUploadWrapper, StreamHasher, HASH_METADATA_KEYS,
+    hash_from_metadata)
+from ._checkpoint import UploadCheckpoint, read_exact
+from ._chunking import AdaptiveChunkSizer, iter_chunks, stream_length
+
+
+TEMPORARY_FILE_PREFIX = '.pumpwood-tmp-'
+"""Prefix of temporary files used on atomic writes, they are not listed."""
+METADATA_XATTR_PREFIX = 'user.pumpwood.'
+"""Prefix of extended attributes used to store object metadata."""
+METADATA_SIDECAR_PREFIX = '.pumpwood-meta-'
+"""Prefix of sidecar files with object metadata of file systems without
+extended attributes, they are not listed."""
+XATTR_NOT_SUPPORTED = {errno.ENOTSUP, errno.EOPNOTSUPP}
+"""Errors of setxattr when the file system does not support them."""
+
+
+def create_temporary_file(folder: str,
+                          prefix: str = TEMPORARY_FILE_PREFIX):
+    """Create a temporary file at folder to be renamed over a file.
+
+    File is created with mode 0666 and the kernel applies the umask, the
+    same mode of files created by other tools. Reading the umask would
+    need to change it, which is process wide and not thread safe.
+    """
+    return open(os.path.join(folder, prefix + uuid.uuid4().hex), 'xb+')
+
+
+def copy_file_range(source, destination, n_bytes: int = None) -> int:
+    """Copy bytes between two open files using kernel copy.
+
+    Uses `os.copy_file_range` when available (Linux), which avoids moving
+    data to user space and can use reflinks on supported file systems.
+    Falls back to `shutil.copyfileobj`.
+
+    Args:
+        source:
+            File opened for reading, bytes are copied from its current
+            position.
+        destination:
+            File opened for writing, bytes are copied at its current
+            position.
+        n_bytes (int):
+            Number of bytes to copy, if None copy until end of source.
+
+    Returns:
+        Number of bytes copied.
+    """
+    destination.flush()
+    if n_bytes is None:
+        n_bytes = os.fstat(source.fileno()).st_size - source.tell()
+
+    copied = 0
+    if hasattr(os, 'copy_file_range'):
+        source_fd = source.fileno()
+        destination_fd = destination.fileno()
+        source_offset = source.tell()
+        destination_offset = destination.tell()
+        try:
+            while copied < n_bytes:
+                n_copied = os.copy_file_range(
+                    source_fd, destination_fd, n_bytes - copied,
+                    source_offset + copied, destination_offset + copied)
+                if n_copied == 0:
+                    break
+                copied += n_copied
+            source.seek(source_offset + copied)
+            destination.seek(destination_offset + copied)
+            return copied
+        except OSError:
+            # Cross file system copy is not supported on old kernels
+            source.seek(source_offset + copied)
+            destination.seek(destination_offset + copied)
+
+    remaining = n_bytes - copied
+    while 0 < remaining:
+        chunk = source.read(min(remaining, 1024 * 1024))
+        if not chunk:
+            break
+        destination.write(chunk)
+        remaining -= len(chunk)
+        copied += len(chunk)
+    return copied
+
+
+class LocalFileReadIterator():
+    """Iterator over a local file that can also be sent with sendfile.
+
+    It behaves as a file object with `fileno`, so it can be passed to
+    `werkzeug.wsgi.wrap_file` and WSGI servers (ex.: gunicorn) will
+    stream it using `os.sendfile` without copying data to Python.
+    """
+
+    def __init__(self, file_path: str, chunk_size: int = 1024 * 1024):
+        """__init__.
+
+        Args:
+            file_path (str):
+                Full path of the file.
+            chunk_size (int):
+                Chunk size in bytes used on iteration.
+        """
+        self._file = open(file_path, 'rb')
+        self._chunk_size = chunk_size
+        self.size = os.fstat(self._file.fileno()).st_size
+
+    def __iter__(self):
+        """Return the iterator."""
+        return self
+
+    def __next__(self) -> bytes:
+        """Read next chunk, closing the file at the end."""
+        chunk = self._file.read(self._chunk_size)
+        if not chunk:
+            self.close()
+            raise StopIteration
+        return chunk
+
+    def read(self, size: int = -1) -> bytes:
+        """Read bytes from file."""
+        return self._file.read(size)
+
+    def fileno(self) -> int:
+        """File descriptor, used by WSGI servers to call sendfile."""
+        return self._file.fileno()
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        """Move file position."""
+        return self._file.seek(offset, whence)
+
+    def tell(self) -> int:
+        """Return file position."""
+        return self._file.tell()
+
+    def close(self):
+        """Close the file."""
+        self._file.close()
+
+    def send_to(self, out_fd: int) -> int:
+        """Send the remaining of file to a socket/file descriptor.
+
+        Args:
+            out_fd (int):
+                Output file descriptor, usually a socket.
+
+        Returns:
+            Number of bytes sent.
+        """
+        offset = self._file.tell()
+        sent = 0
+        while offset + sent < self.size:
+            n_sent = os.sendfile(
+                out_fd, self._file.fileno(), offset + sent,
+                self.size - offset - sent)
+            if n_sent == 0:
+                break
+            sent += n_sent
+        self._file.seek(offset + sent)
+        return sent
 
 
 class PumpWoodLocalBucket():
-    def __init__(self, folder_path):
+    """Class to use a local folder as storage."""
+
+    def __init__(self, folder_path, use_mmap: bool = False):
+        """__init__.
+
+        Args:
+            folder_path (str):
+                Path of the folder that will be used as bucket.
+            use_mmap (bool):
+                If `read_file` should return a memoryview of a memory mapped
+                file instead of bytes. Data is loaded from disk on demand
+                by the OS page cache and not copied to Python heap.
+        """
         self.folder_path = folder_path
+        self.use_mmap = use_mmap
         if not os.path.isdir(folder_path):
             template = 'Local bucket folder "{folder_path}" does not exist.'
             raise Exception(template.format(folder_path=folder_path))
 
-    def write_file(self, file_path: str, data: bytes, if_exists: str = 'fail',
-                   content_type='text/plain') -> str:
-        if if_exists in ['overwrite', 'append_breakline', 'append', 'fail']:
-            template = "if_exists must be in ['overwrite', " + \
-                "'append_breakline', 'append', 'fail']"
-            Exception(template)
-
-        full_file_name = os.path.join(self.folder_path, file_path)
+    def _full_path(self, file_path: str) -> str:
+        return os.path.join(self.folder_path, file_path)
 
+    def _temporary_file(self, full_file_name: str):
+        """Create a temporary file on the same folder of full_file_name."""
         folder = os.path.dirname(full_file_name)
         if not os.path.exists(folder):
-            os.makedirs(folder)
-
-        if os.path.isfile(full_file_name) and if_exists == 'fail':
-            raise Exception('There is a file with same name on bucket')
-        elif if_exists == 'append_breakline':
-            with open(full_file_name, 'ab') as file:
-                file.write(b'\n')
-                file.write(data)
-        elif if_exists == 'append':
-            with open(full_file_name, 'ab') as file:
-                file.write(data)
-        else:
-            with open(full_file_name, 'wb') as file:
-                file.write(data)
-        return file_path
+            os.makedirs(folder, exist_ok=True)
+        return create_temporary_file(folder)
 
-    def delete_file(self, file_path: str):
-        full_file_name = os.path.join(self.folder_path, file_path)
+    def _atomic_replace(self, temporary_file, full_file_name: str,
+                        metadata: dict = None):
+        """Rename temporary file over full_file_name.
+
+        The temporary file gets the mode of the replaced file, new files
+        keep the mode of creation (0666 without umask bits). Metadata
+        replaces the one of the previous file.
+        """
+        try:
+            temporary_file.close()
+            in_xattrs = self._set_metadata(temporary_file.name, metadata)
+            try:
+                mode = os.stat(full_file_name).st_mode & 0o7777
+            except FileNotFoundError:
+                mode = None
+            if mode is not None:
+                os.chmod(temporary_file.name, mode)
+            os.replace(temporary_file.name, full_file_name)
+        except BaseException:
+            self._discard_temporary(temporary_file)
+            raise
+        self._write_sidecar(
+            full_file_name, None if in_xattrs else metadata)
+
+    def _discard_temporary(self, temporary_file):
+        """Remove temporary file of a failed write."""
+        temporary_file.close()
+        if os.path.exists(temporary_file.name):
+            os.remove(temporary_file.name)
+
+    def _sidecar_path(self, full_file_name: str) -> str:
+        folder, file_name = os.path.split(full_file_name)
+        return os.path.join(
+            folder, METADATA_SIDECAR_PREFIX + file_name + '.json')
+
+    def _set_metadata(self, full_file_name: str, metadata: dict) -> bool:
+        """Store metadata as extended attributes of the file.
+
+        Returns:
+            False if file system does not support extended attributes
+            and metadata must be stored at the sidecar file.
+
+        Raises:
+            PumpWoodNotImplementedError:
+                If extended attributes could not be set for other reason
+                (ex.: value larger than the file system limit).
+        """
+        if not metadata:
+            return True
+        try:
+            for key, value in metadata.items():
+                os.setxattr(
+                    full_file_name, METADATA_XATTR_PREFIX + key,
+                    str(value).encode('utf-8'))
+        except AttributeError:
+            return False
+        except OSError as e:
+            if e.errno in XATTR_NOT_SUPPORTED:
+                return False
+            msg = (
+                "Local storage could not store metadata as extended "
+                "attributes: {}").format(str(e))
+            raise exceptions.PumpWoodNotImplementedError(msg)
+        return True
 
+    def _write_sidecar(self, full_file_name: str, metadata: dict = None):
+        """Write metadata at the sidecar file, remove it if not set."""
+        sidecar_path = self._sidecar_path(full_file_name)
+        if not metadata:
+            if os.path.exists(sidecar_path):
+                os.remove(sidecar_path)
+            return
+        temporary_file = self._temporary_file(sidecar_path)
+        try:
+            temporary_file.write(json.dumps({
+                key: str(value) for key, value in metadata.items()
+            }).encode('utf-8'))
+            temporary_file.close()
+            os.replace(temporary_file.name, sidecar_path)
+        except BaseException:
+            self._discard_temporary(temporary_file)
+            raise
+
+    def _get_metadata(self, full_file_name: str) -> dict:
+        """Return metadata stored as extended attributes or at sidecar."""
+        try:
+            attributes = os.listxattr(full_file_name)
+        except (AttributeError, OSError):
+            attributes = []
+        metadata = {
+            name[len(METADATA_XATTR_PREFIX):]:
+                os.getxattr(full_file_name, name).decode('utf-8')
+            for name in attributes
+            if name.startswith(METADATA_XATTR_PREFIX)}
+        if metadata:
+            return metadata
+        try:
+            with open(self._sidecar_path(full_file_name), 'rb') as file:
+                return json.loads(file.read())
+        except FileNotFoundError:
+            return {}
+
+    def _check_exists(self, file_path: str) -> str:
+        """Return the full path of the file, raise error if not found."""
+        full_file_name = self._full_path(file_path)
         if not os.path.isfile(full_file_name):
-            Exception('file_path %s does not exist' % file_path)
+            msg = 'file_path %s does not exist' % file_path
+            raise exceptions.PumpWoodObjectDoesNotExist(msg)
+        return full_file_name
+
+    def check_file_exists(self, file_path: str) -> bool:
+        """Check if file exists.
+
+        Args:
+            file_path (str):
+                Path to file in storage.
+
+        Returns:
+            Return a boolean value checking if the file exists on storage.
+        """
+        return os.path.isfile(self._full_path(file_path))
+
+    def list_files(self, path: str = "") -> List[str]:
+        """List file at storage path.
+
+        Path is treated as a prefix, same as cloud storages.
+
+        Args:
+            path (str):
+                Path of the storage to list files.
+
+        Returns:
+            List of all files under path (sub-folders).
+        """
+        full_path = self._full_path(path)
+        walk_root = full_path if os.path.isdir(full_path) \
+            else os.path.dirname(full_path)
+
+        file_list = []
+        for root, _, files in os.walk(walk_root):
+            for file_name in files:
+                relative_path = os.path.relpath(
+                    os.path.join(root, file_name), self.folder_path)
+                relative_path = relative_path.replace(os.sep, '/')
+                if file_name.startswith(TEMPORARY_FILE_PREFIX) or \
+                        file_name.startswith(METADATA_SIDECAR_PREFIX):
+                    continue
+                if relative_path.startswith(path):
+                    file_list.append(relative_path)
+        return sorted(file_list)
+
+    def write_file(self, file_path: str, data: bytes, if_exists: str = 'fail',
+                   content_type='text/plain', metadata: dict = None) -> str:
+        """Write file on local folder.
+
+        Data is written on a temporary file that replaces the destination,
+        readers never see a partial file. Appends copy the old content to
+        the temporary file using `copy_file_range`.
+
+        Args:
+            file_path (str):
+                Path to save the file.
+            data (str):
+                File content in bytes.
+            if_exists (str):
+                if_exists must be in 'overwrite',
+                'overwrite_streaming' (stream file to overwrite if exists),
+                'append_breakline' (append content with a breakline between),
+                'append' (append content without break line),
+                'fail' (fail if file exists)]
+            content_type (str):
+                Just for compatibility, it will not be used.
+            metadata (dict):
+                User metadata stored as extended attributes.
+
+        Returns:
+            A string with bucket path.
+
+        Raises:
+            PumpWoodForbidden:
+                'There is a file with same name on bucket'. If
+                `if_exists='fail'`, it will raise error if bucket has a
+                file with same name.
+            PumpWoodNotImplementedError:
+                'if_exists must be in {if_exists}'. If `if_exists` is not
+                implemented.
+        """
+        if_exists_opt = [
+            'overwrite', 'overwrite_streaming', 'append_breakline',
+            'append', 'fail']
+        if if_exists not in if_exists_opt:
+            msg = "if_exists must be in {}".format(if_exists_opt)
+            raise exceptions.PumpWoodNotImplementedError(msg)
+
+        full_file_name = self._full_path(file_path)
+        file_exists = os.path.isfile(full_file_name)
+        if file_exists and if_exists == 'fail':
+            msg = 'There is a file with same name on bucket'
+            raise exceptions.PumpWoodForbidden(msg)
+
+        # Old content of appends is not read, their hashes are not stored
+        is_append = file_exists and \
+            if_exists in ['append_breakline', 'append']
+        if not is_append:
+            metadata = {
+                **(metadata or {}),
+                **StreamHasher.hash_bytes(data).metadata()}
+        temporary_file = self._temporary_file(full_file_name)
+        try:
+            if is_append:
+                with open(full_file_name, 'rb') as old_file:
+                    copy_file_range(old_file, temporary_file)
+                if if_exists == 'append_breakline':
+                    temporary_file.write(b'\n')
+            temporary_file.write(data)
+        except BaseException:
+            self._discard_temporary(temporary_file)
+            raise
+        self._atomic_replace(
+            temporary_file, full_file_name, metadata=metadata)
+        return file_path
+
+    def write_file_stream(self, file_path: str, data_stream: io.BytesIO,
+                          chunk_size: int = None,
+                          metadata: dict = None,
+                          content_type: str = None,
+                          checkpoint: UploadCheckpoint = None) -> dict:
+        """Write file as stream to local folder.
+
+        File is written atomically using a temporary file.
+
+        Args:
+            file_path (str):
+                Path to save the stream.
+            data_stream (io.BytesIO):
+                Data stream.
+            chunk_size (int):
+                Size of the chuck to be read from stream, default None
+                adapts chunk size to the throughput.
+            metadata (dict):
+                User metadata stored as extended attributes.
+            content_type (str):
+                Just for compatibility, it will not be used.
+            checkpoint (UploadCheckpoint):
+                If set, the temporary file is kept if the write is
+                interrupted and the next write with the checkpoint
+                continues it.
+
+        Returns:
+            Return the file path used to save data ("file_path" key), the
+            total of bytes that were transmited and the base64 MD5 hash
+            of the data ("hash" key).
+        """
+        full_file_name = self._full_path(file_path)
+        sizer = AdaptiveChunkSizer.for_provider(
+            'local', chunk_size=chunk_size,
+            content_length=stream_length(data_stream))
+        hasher = StreamHasher()
+        stream = FlaskStreamUploadWrapper(data_stream, hasher=hasher)
+        if checkpoint is not None:
+            temporary_file = self._resume_temporary(
+                file_path=file_path, full_file_name=full_file_name,
+                stream=stream, chunk_size=sizer.size, checkpoint=checkpoint)
+        else:
+            temporary_file = self._temporary_file(full_file_name)
+
+        try:
+            for chunk in iter_chunks(stream, sizer):
+                temporary_file.write(chunk)
+                if checkpoint is not None:
+                    temporary_file.flush()
+                    os.fsync(temporary_file.fileno())
+                    checkpoint.state['size'] = temporary_file.tell()
+                    checkpoint.save()
+        except BaseException:
+            if checkpoint is None:
+                self._discard_temporary(temporary_file)
+            else:
+                temporary_file.close()
+            raise
+        self._atomic_replace(
+            temporary_file, full_file_name,
+            metadata={**(metadata or {}), **hasher.metadata()})
+        if checkpoint is not None:
+            checkpoint.clear()
+        return {
+            "file_path": file_path, "bytes_uploaded": stream.bytes_position,
+            "hash": hasher.digests()['md5']}
+
+    def _resume_temporary(self, file_path: str, full_file_name: str, stream,
+                          chunk_size: int, checkpoint: UploadCheckpoint):
+        """Open temporary file of the checkpoint skipping written data.
+
+        Data read from stream is compared with the temporary file, it
+        is truncated at the first chunk that differs.
+        """
+        state = checkpoint.state
+        temporary_name = state.get('temporary_file')
+        is_valid = (
+            state.get('file_path') == file_path and
+            temporary_name is not None and
+            os.path.isfile(temporary_name) and
+            state['size'] <= os.path.getsize(temporary_name))
+        if not is_valid:
+            temporary_file = self._temporary_file(full_file_name)
+            checkpoint.state = {
+                'file_path': file_path,
+                'temporary_file': temporary_file.name, 'size': 0}
+            checkpoint.save()
+            return temporary_file
+
+        temporary_file = open(temporary_name, 'r+b')
+        temporary_file.truncate(state['size'])
+        while temporary_file.tell() < state['size']:
+            position = temporary_file.tell()
+            length = min(chunk_size, state['size'] - position)
+            written = temporary_file.read(length)
+            data = read_exact(stream, length)
+            if data != written:
+                temporary_file.seek(position)
+                temporary_file.truncate()
+                temporary_file.write(data)
+                break
+        return temporary_file
+
+    def get_read_file_iterator(self, file_path: str,
+                               chunk_size: int = 1024 * 1024
+                               ) -> LocalFileReadIterator:
+        """Return an iterator to stream download data in flask.
+
+        The returned object has `fileno`, use it with
+        `werkzeug.wsgi.wrap_file` to let the WSGI server send the file
+        using `os.sendfile`.
+
+        Args:
+            file_path (str):
+                Storage path.
+            chunk_size (int):
+                Chunk size in bytes, default to 1Mb.
+
+        Raises:
+            PumpWoodObjectDoesNotExist:
+                'file_path {file_path} does not exist'. Raise error when file
+                is not found at the storage.
+        """
+        full_file_name = self._check_exists(file_path)
+        return LocalFileReadIterator(
+            file_path=full_file_name, chunk_size=chunk_size)
+
+    def delete_file(self, file_path: str) -> bool:
+        """Delete file from storage.
+
+        Args:
+            file_path (str):
+                Path of the file that will be deleted
+
+        Returns:
+            Return True if file is deleted.
+
+        Raises:
+            PumpWoodObjectDoesNotExist:
+                'file_path %s does not exist' % file_path. Indicates that
+                file does not exists on storage.
+        """
+        full_file_name = self._check_exists(file_path)
         os.remove(full_file_name)
+        self._write_sidecar(full_file_name, None)
         return True
 
-    def read_file(self, file_path):
-        full_file_name = os.path.join(self.folder_path, file_path)
-        if not os.path.isfile(full_file_name):
-            Exception('file_path %s does not exist' % file_path)
+    def read_file(self, file_path: str) -> dict:
+        """Read file content from storage.
+
+        Args:
+            file_path (str):
+                Path of the file at the storage.
+
+        Returns:
+            A dictionary with keys.
+            - **data:** Binary data from the file, a read-only memoryview
+                of the memory mapped file if `use_mmap=True`.
+            - **content_type:** Always 'text/plain' for local files.
+
+        Raises:
+            PumpWoodObjectDoesNotExist:
+                'file_path {file_path} does not exist'. Raise error when file
+                is not found at the storage.
+        """
+        full_file_name = self._check_exists(file_path)
         with open(full_file_name, 'rb') as file:
-            data = file.read()
+            if not self.use_mmap:
+                data = file.read()
+            elif os.fstat(file.fileno()).st_size == 0:
+                # It is not possible to map empty files
+                data = memoryview(b'')
+            else:
+                # Memoryview keeps the map alive after file is closed
+                data = memoryview(mmap.mmap(
+                    file.fileno(), 0, access=mmap.ACCESS_READ))
         return {'data': data, 'content_type': 'text/plain'}
+
+    def read_file_range(self, file_path: str, offset: int,
+                        length: int) -> bytes:
+        """Read a byte range of the file.
+
+        Args:
+            file_path (str):
+                Path of the file at the storage.
+            offset (int):
+                Position of the first byte.
+            length (int):
+                Number of bytes to read, less bytes are returned if the
+                range goes beyond the end of the file.
+
+        Returns:
+            Bytes of the range.
+
+        Raises:
+            PumpWoodObjectDoesNotExist:
+                'file_path {file_path} does not exist'. Raise error when file
+                is not found at the storage.
+        """
+        full_file_name = self._check_exists(file_path)
+        if length <= 0:
+            return b''
+        with open(full_file_name, 'rb') as file:
+            return os.pread(file.fileno(), length, offset)
+
+    def download_to_file(self, file_path: str, file_obj) -> None:
+        """Copy file from storage to a file like object.
+
+        Args:
+            file_path (str):
+                Storage path.
+            file_obj (any):
+                A file like object.
+
+        Raises:
+            PumpWoodObjectDoesNotExist:
+                'file_path {file_path} does not exist'. Raise error when file
+                is not found at the storage.
+        """
+        full_file_name = self._check_exists(file_path)
+        with open(full_file_name, 'rb') as file:
+            try:
+                file_obj.fileno()
+                copy_file_range(file, file_obj)
+            except (AttributeError, OSError, io.UnsupportedOperation):
+                shutil.copyfileobj(file, file_obj)
+        file_obj.close()
+
+    def copy_file(self, source_file_path: str, destination_file_path: str,
+                  if_exists: str = 'fail') -> str:
+        """Copy a file inside the bucket.
+
+        Uses `copy_file_range`, data is not copied to user space.
+
+        Args:
+            source_file_path (str):
+                Path of the file to be copied.
+            destination_file_path (str):
+                Path of the copy.
+            if_exists (str):
+                'fail' to raise error if destination exists or 'overwrite'.
+
+        Returns:
+            Destination file path.
+
+        Raises:
+            PumpWoodObjectDoesNotExist:
+                If source file is not found.
+            PumpWoodForbidden:
+                If destination exists and `if_exists='fail'`.
+        """
+        full_source_name = self._check_exists(source_file_path)
+        full_destination_name = self._full_path(destination_file_path)
+        if if_exists == 'fail' and os.path.isfile(full_destination_name):
+            msg = 'There is a file with same name on bucket'
+            raise exceptions.PumpWoodForbidden(msg)
+
+        temporary_file = self._temporary_file(full_destination_name)
+        try:
+            with open(full_source_name, 'rb') as source:
+                copy_file_range(source, temporary_file)
+        except BaseException:
+            self._discard_temporary(temporary_file)
+            raise
+        self._atomic_replace(
+            temporary_file, full_destination_name,
+            metadata=self._get_metadata(full_source_name))
+        return destination_file_path
+
+    def get_file_metadata(self, file_path: str) -> dict:
+        """Return file metadata from file system.
+
+        Hashes are the ones stored on write, files appended or written
+        by other tools have no hashes, use `get_file_hash` to calculate
+        them.
+
+        Args:
+            file_path (str):
+                File path.
+
+        Returns:
+            A dictionary with keys.
+            - **size:** Size of the file in bytes.
+            - **content_type:** Always 'text/plain' for local files.
+            - **hash:** Base64 MD5 hash of the file, None if not stored.
+            - **hashes:** Base64 hashes of the file stored by algorithm.
+            - **metadata:** Metadata stored as extended attributes or at
+                the sidecar file.
+            - **updated_at:** Last modification time.
+
+        Raises:
+            PumpWoodObjectDoesNotExist:
+                "file_path {file_path} does not exist", If file is not found
+                on storage.
+        """
+        full_file_name = self._check_exists(file_path)
+        file_stat = os.stat(full_file_name)
+        metadata = self._get_metadata(full_file_name)
+        hashes = {
+            algorithm: hash_from_metadata(metadata, algorithm)
+            for algorithm in HASH_METADATA_KEYS}
+        hashes = {
+            algorithm: value for algorithm, value in hashes.items()
+            if value is not None}
+        return {
+            'size': file_stat.st_size,
+            'content_type': 'text/plain',
+            'hash': hashes.get('md5'),
+            'hashes': hashes,
+            'metadata': metadata,
+            'updated_at': datetime.datetime.fromtimestamp(
+                file_stat.st_mtime, tz=datetime.timezone.utc)}
+
+    def get_file_hash(self, file_path: str, algorithm: str = 'md5') -> str:
+        """Return base64 hash of the file, same format as GCS.
+
+        Hash stored on write is used, it is calculated reading the file
+        if not stored.
+
+        Args:
+            file_path (str):
+                File path.
+            algorithm (str):
+                Hash algorithm, 'md5', 'sha256' or 'crc32c'.
+
+        Returns:
+            str: Hash of the file.
+
+        Raises:
+            PumpWoodObjectDoesNotExist:
+                "file_path {file_path} does not exist", If file is not found
+                on storage.
+        """
+        full_file_name = self._check_exists(file_path)
+        if algorithm in HASH_METADATA_KEYS:
+            file_hash = hash_from_metadata(
+                self._get_metadata(full_file_name), algorithm)
+            if file_hash is not None:
+                return file_hash
+        hasher = StreamHasher(algorithms=(algorithm, ))
+        with open(full_file_name, 'rb') as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b''):
+                hasher.update(chunk)
+        return hasher.digests()[algorithm]
@@ -0,0 +1,515 @@
+"""In-memory storage connector.
+
+Implements the full storage contract keeping objects in process memory.
+It is used to test and benchmark storage code paths without network
+access, a `StorageLatencyProfile` can be injected to mimic the latency,
+bandwidth and transient errors of cloud providers.
+"""
+import io
+import time
+import random
+import datetime
+import threading
+from typing import Iterator, List
+from pumpwood_communication import exceptions
+from ._general import StreamHasher
+from ._chunking import AdaptiveChunkSizer, iter_chunks, stream_length
+
+
+class StorageLatencyProfile():
+    """Latency, bandwidth and error profile of a storage provider."""
+
+    PRESETS = {
+        'aws_s3': {
+            'request_latency': 0.020, 'bandwidth': 90 * 1024 * 1024,
+            'jitter': 0.005, 'error_rate': 0.0},
+        'google_bucket': {
+            'request_latency': 0.030, 'bandwidth': 100 * 1024 * 1024,
+            'jitter': 0.008, 'error_rate': 0.0},
+        'azure_storage': {
+            'request_latency': 0.025, 'bandwidth': 60 * 1024 * 1024,
+            'jitter': 0.006, 'error_rate': 0.0},
+    }
+    """Rough single-stream figures for each cloud provider, values can be
+    overwritten at `from_preset`."""
+
+    def __init__(self, request_latency: float = 0.0,
+                 bandwidth: float = None, jitter: float = 0.0,
+                 error_rate: float = 0.0, seed: int = None):
+        """__init__.
+
+        Args:
+            request_latency (float):
+                Time in seconds added to each provider request.
+            bandwidth (float):
+                Bytes per second of data transfer, if None transfer will
+                not be delayed.
+            jitter (float):
+                Maximum random time in seconds added to request latency.
+            error_rate (float):
+                Probability of a request to fail with ConnectionError.
+            seed (int):
+                Seed for random jitter and errors, used to make benchmarks
+                reproducible.
+        """
+        self.request_latency = request_latency
+        self.bandwidth = bandwidth
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.request_count = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_preset(cls, storage_type: str, **kwargs):
+        """Create a profile mimicking a cloud provider.
+
+        Args:
+            storage_type (str):
+                One of 'aws_s3', 'google_bucket', 'azure_storage'.
+            **kwargs:
+                Arguments to overwrite preset values.
+
+        Raises:
+            PumpWoodNotImplementedError:
+                If there is no preset for the storage_type.
+        """
+        if storage_type not in cls.PRESETS:
+            msg = "Latency preset must be in {}".format(
+                list(cls.PRESETS.keys()))
+            raise exceptions.PumpWoodNotImplementedError(msg)
+        parameters = dict(cls.PRESETS[storage_type])
+        parameters.update(kwargs)
+        return cls(**parameters)
+
+    def request(self, n_bytes: int = 0):
+        """Simulate a provider request transfering n_bytes.
+
+        Args:
+            n_bytes (int):
+                Number of bytes transfered on the request.
+
+        Raises:
+            ConnectionError:
+                With probability `error_rate`, simulating transient errors.
+        """
+        with self._lock:
+            self.request_count += 1
+            failed = self._random.random() < self.error_rate
+            jitter = self._random.uniform(0, self.jitter)
+        self.transfer(n_bytes=0, latency=self.request_latency + jitter)
+        if failed:
+            raise ConnectionError("Injected storage request error")
+        self.transfer(n_bytes=n_bytes)
+
+    def transfer(self, n_bytes: int, latency: float = 0.0):
+        """Simulate transfer of n_bytes of an ongoing request."""
+        wait = latency
+        if self.bandwidth is not None:
+            wait += n_bytes / self.bandwidth
+        if 0 < wait:
+            time.sleep(wait)
+
+
+class PumpWoodMemoryBucket():
+    """Class to store files on process memory."""
+
+    _buckets = {}
+    """Buckets shared by all objects of the process."""
+    _buckets_lock = threading.Lock()
+
+    def __init__(self, bucket_name: str = 'default',
+                 profile: StorageLatencyProfile = None):
+        """__init__.
+
+        Args:
+            bucket_name (str):
+                Name of the bucket, objects with same bucket_name share the
+                same files.
+            profile (StorageLatencyProfile):
+                Latency profile injected on each request, if None no
+                latency will be added.
+        """
+        self._bucket_name = bucket_name
+        self._profile = profile
+        self._request_hooks = []
+        with self._buckets_lock:
+            self._files = self._buckets.setdefault(bucket_name, {})
+        self._lock = threading.Lock()
+
+    @classmethod
+    def clear(cls, bucket_name: str = None):
+        """Remove all files from a bucket, or from all buckets if None."""
+        with cls._buckets_lock:
+            for name, files in cls._buckets.items():
+                if bucket_name is None or name == bucket_name:
+                    files.clear()
+
+    def add_request_hook(self, callback):
+        """Call callback with the S3 like name of each request.
+
+        Args:
+            callback:
+                Function receiving the API call name (ex.: HeadObject).
+        """
+        self._request_hooks.append(callback)
+
+    def _request(self, api_call: str, n_bytes: int = 0):
+        for callback in self._request_hooks:
+            callback(api_call)
+        if self._profile is not None:
+            self._profile.request(n_bytes=n_bytes)
+
+    def _transfer(self, n_bytes: int):
+        if self._profile is not None:
+            self._profile.transfer(n_bytes=n_bytes)
+
+    def _get_object(self, file_path: str) -> dict:
+        obj = self._files.get(file_path)
+        if obj is None:
+            msg = 'file_path %s does not exist' % file_path
+            raise exceptions.PumpWoodObjectDoesNotExist(msg)
+        return obj
+
+    def _put_object(self, file_path: str, data: bytes,
+                    content_type: str = 'text/plain', metadata: dict = None):
+        self._files[file_path] = {
+            'data': bytes(data), 'content_type': content_type,
+            'hashes': StreamHasher.hash_bytes(data).digests(),
+            'metadata': dict(metadata or {}),
+            'updated_at': datetime.datetime.now(datetime.timezone.utc)}
+
+    def check_file_exists(self, file_path: str) -> bool:
+        """Check if file exists.
+
+        Args:
+            file_path (str):
+                Path to file in storage.
+
+        Returns:
+            Return a boolean value checking if the file exists on storage.
+        """
+        self._request('HeadObject')
+        return file_path in self._files
+
+    def list_files(self, path: str = "") -> List[str]:
+        """List file at storage path.
+
+        Args:
+            path (str):
+                Path of the storage to list files.
+
+        Returns:
+            List of all files under path (sub-folders).
+        """
+        file_list = sorted(
+            x for x in list(self._files.keys()) if x.startswith(path))
+        # Providers return 1000 keys per page
+        for _ in range(max(1, -(-len(file_list) // 1000))):
+            self._request('ListObjects')
+        return file_list
+
+    def write_file(self, file_path: str, data: bytes, if_exists: str = 'fail',
+                   content_type='text/plain', metadata: dict = None) -> str:
+        """Write file on memory bucket.
+
+        Args:
+            file_path (str):
+                Path to save the file.
+            data (str):
+                File content in bytes.
+            if_exists (str):
+                if_exists must be in 'overwrite',
+                'overwrite_streaming' (stream file to overwrite if exists),
+                'append_breakline' (append content with a breakline between),
+                'append' (append content without break line),
+                'fail' (fail if file exists)]
+            content_type (str):
+                Mime-type of the content.
+            metadata (dict):
+                User metadata to be stored with the object.
+
+        Returns:
+            A string with bucket path.
+
+        Raises:
+            PumpWoodForbidden:
+                'There is a file with same name on bucket'. If
+                `if_exists='fail'`, it will raise error if bucket has a
+                file with same name.
+            PumpWoodNotImplementedError:
+                'if_exists must be in {if_exists}'. If `if_exists` is not
+                implemented.
+        """
+        if_exists_opt = [
+            'overwrite', 'overwrite_streaming', 'append_breakline',
+            'append', 'fail']
+        if if_exists not in if_exists_opt:
+            msg = "if_exists must be in {}".format(if_exists_opt)
+            raise exceptions.PumpWoodNotImplementedError(msg)
+
+        # Overwrites do not need a HEAD request, as object storages
+        file_exists = if_exists != 'overwrite' and \
+            self.check_file_exists(file_path=file_path)
+        if file_exists and if_exists == 'fail':
+            msg = 'There is a file with same name on bucket'
+            raise exceptions.PumpWoodForbidden(msg)
+        elif file_exists and if_exists in ['append_breakline', 'append']:
+            old_data = self.read_file(file_path=file_path)['data']
+            old_data = old_data + b'\n' \
+                if if_exists == 'append_breakline' else old_data
+            data = old_data + data
+
+        self._request('PutObject', n_bytes=len(data))
+        with self._lock:
+            self._put_object(
+                file_path=file_path, data=data, content_type=content_type,
+                metadata=metadata)
+        return file_path
+
+    def write_file_stream(self, file_path: str, data_stream: io.BytesIO,
+                          chunk_size: int = None,
+                          metadata: dict = None,
+                          content_type: str = 'application/octet-stream',
+                          checkpoint=None) -> dict:
+        """Write file as stream to memory bucket.
+
+        Each chunk is counted as one request, similar to a multipart
+        upload.
+
+        Args:
+            file_path (str):
+                Path to save the stream.
+            data_stream (io.BytesIO):
+                Data stream.
+            chunk_size (int):
+                Size of the chuck to be transmited, default None adapts
+                chunk size to the throughput.
+            metadata (dict):
+                User metadata to be stored with the object.
+            content_type (str):
+                Mime-type of the content.
+            checkpoint (UploadCheckpoint):
+                Just for compatibility, objects are stored only when the
+                stream is finished so there is nothing to resume.
+
+        Returns:
+            Return the file path used to save data ("file_path" key), the
+            total of bytes that were transmited and the base64 MD5 hash
+            of the data ("hash" key).
+        """
+        sizer = AdaptiveChunkSizer.for_provider(
+            'memory', chunk_size=chunk_size,
+            content_length=stream_length(data_stream))
+        buffer = bytearray()
+        for chunk in iter_chunks(data_stream, sizer):
+            self._request('UploadPart', n_bytes=len(chunk))
+            buffer.extend(chunk)
+
+        with self._lock:
+            self._put_object(
+                file_path=file_path, data=buffer,
+                content_type=content_type, metadata=metadata)
+            md5_hash = self._files[file_path]['hashes']['md5']
+        return {
+            "file_path": file_path, "bytes_uploaded": len(buffer),
+            "hash": md5_hash}
+
+    def get_read_file_iterator(self, file_path: str,
+                               chunk_size: int = 1024 * 1024
+                               ) -> Iterator[bytes]:
+        """Return an iterator to stream download data in flask.
+
+        Args:
+            file_path (str):
+                Storage path.
+            chunk_size (int):
+                Chunk size in bytes, default to 1Mb.
+
+        Raises:
+            PumpWoodObjectDoesNotExist:
+                'file_path {file_path} does not exist'. Raise error when file
+                is not found at the storage.
+        """
+        self._request('GetObject')
+        data = self._get_object(file_path)['data']
+
+        def read_iterator():
+            for start in range(0, len(data), chunk_size):
+                chunk = data[start:start + chunk_size]
+                self._transfer(n_bytes=len(chunk))
+                yield chunk
+        return read_iterator()
+
+    def delete_file(self, file_path: str) -> bool:
+        """Delete file from storage.
+
+        Args:
+            file_path (str):
+                Path of the file that will be deleted
+
+        Returns:
+            Return True if file is deleted.
+
+        Raises:
+            PumpWoodObjectDoesNotExist:
+                'file_path %s does not exist' % file_path. Indicates that
+                file does not exists on storage.
+        """
+        self._request('DeleteObject')
+        with self._lock:
+            self._get_object(file_path)
+            del self._files[file_path]
+        return True
+
+    def read_file(self, file_path: str) -> dict:
+        """Read file content from storage.
+
+        Args:
+            file_path (str):
+                Path of the file at the storage.
+
+        Returns:
+            A dictionary with keys.
+            - **data:** Binary data from the file.
+            - **content_type:** Content type set on write.
+
+        Raises:
+            PumpWoodObjectDoesNotExist:
+                'file_path {file_path} does not exist'. Raise error when file
+                is not found at the storage.
+        """
+        obj = self._get_object(file_path)
+        self._request('GetObject', n_bytes=len(obj['data']))
+        return {'data': obj['data'], 'content_type': obj['content_type']}
+
+    def read_file_range(self, file_path: str, offset: int,
+                        length: int) -> bytes:
+        """Read a byte range of the file.
+
+        Args:
+            file_path (str):
+                Path of the file at the storage.
+            offset (int):
+                Position of the first byte.
+            length (int):
+                Number of bytes to read, less bytes are returned if the
+                range goes beyond the end of the file.
+
+        Returns:
+            Bytes of the range.
+
+        Raises:
+            PumpWoodObjectDoesNotExist:
+                'file_path {file_path} does not exist'. Raise error when file
+                is not found at the storage.
+        """
+        obj = self._get_object(file_path)
+        data = obj['data'][offset:offset + max(length, 0)]
+        self._request('GetObject', n_bytes=len(data))
+        return data
+
+    def download_to_file(self, file_path: str, file_obj) -> None:
+        """Download file from storage to a file like object.
+
+        Args:
+            file_path (str):
+                Storage path.
+            file_obj (any):
+                A file like object.
+
+        Raises:
+            PumpWoodObjectDoesNotExist:
+                'file_path {file_path} does not exist'. Raise error when file
+                is not found at the storage.
+        """
+        for chunk in self.get_read_file_iterator(file_path=file_path):
+            file_obj.write(chunk)
+        file_obj.close()
+
+    def copy_file(self, source_file_path: str, destination_file_path: str,
+                  if_exists: str = 'fail') -> str:
+        """Copy a file inside the bucket.
+
+        Args:
+            source_file_path (str):
+                Path of the file to be copied.
+            destination_file_path (str):
+                Path of the copy.
+            if_exists (str):
+                'fail' to raise error if destination exists or 'overwrite'.
+
+        Returns:
+            Destination file path.
+
+        Raises:
+            PumpWoodObjectDoesNotExist:
+                If source file is not found.
+            PumpWoodForbidden:
+                If destination exists and `if_exists='fail'`.
+        """
+        self._request('CopyObject')
+        with self._lock:
+            source = self._get_object(source_file_path)
+            if if_exists == 'fail' and destination_file_path in self._files:
+                msg = 'There is a file with same name on bucket'
+                raise exceptions.PumpWoodForbidden(msg)
+            self._files[destination_file_path] = dict(source)
+        return destination_file_path
+
+    def get_file_metadata(self, file_path: str) -> dict:
+        """Return file metadata with a single request.
+
+        Args:
+            file_path (str):
+                File path.
+
+        Returns:
+            A dictionary with keys.
+            - **size:** Size of the file in bytes.
+            - **content_type:** Content type of the file.
+            - **hash:** Base64 MD5 hash of the file.
+            - **hashes:** Base64 hashes of the file by algorithm.
+            - **metadata:** User metadata of the object.
+            - **updated_at:** Last modification time.
+
+        Raises:
+            PumpWoodObjectDoesNotExist:
+                "file_path {file_path} does not exist", If file is not found
+                on storage.
+        """
+        self._request('HeadObject')
+        obj = self._get_object(file_path)
+        return {
+            'size': len(obj['data']),
+            'content_type': obj['content_type'],
+            'hash': obj['hashes']['md5'],
+            'hashes': dict(obj['hashes']),
+            'metadata': dict(obj['metadata']),
+            'updated_at': obj['updated_at']}
+
+    def get_file_hash(self, file_path: str, algorithm: str = 'md5') -> str:
+        """Return base64 hash of the file, same format as GCS.
+
+        Args:
+            file_path (str):
+                File path.
+            algorithm (str):
+                Hash algorithm, 'md5' or 'sha256'.
+
+        Returns:
+            str: Hash of the file.
+
+        Raises:
+            PumpWoodObjectDoesNotExist:
+                "file_path {file_path} does not exist", If file is not found
+                on storage.
+            PumpWoodNotImplementedError:
+                If hash is not available for the file.
+        """
+        file_hash = self.get_file_metadata(file_path)['hashes'].get(algorithm)
+        if file_hash is None:
+            msg = "Hash {} is not available for file {}".format(
+                algorithm, file_path)
+            raise exceptions.PumpWoodNotImplementedError(msg)
+        return file_hash